@@ -482,42 +482,41 @@ class Andor:
         error = self.dll.IsTriggerModeAvailable(ciTriggerMode)
         self.verbose(error, sys._getframe().f_code.co_name)
 
-    def GetAcquiredData(self, dimx, dimy):
+    def image_buffer(self, dim, out=None):
+        """Return a C int array with dim elements for the camera to write 
+        an image into: out if it fits (e.g. a frame from framepool), 
+        otherwise a new array."""
+        if (out is None or out.size != dim or out.dtype != np.intc 
+                or not out.flags.c_contiguous or not out.flags.writeable):
+            out = np.empty(dim, dtype=np.intc)
+        return out
+
+    def GetAcquiredData(self, dimx, dimy, out=None):
         """Retrieve the image at the end of a camera acquisition.
         Parameters: 
             - width of ROI (pixels)
             - height of ROI (pixels)
-            - number of kinetic scans in acquisition (kinetic mode only)"""
+            - number of kinetic scans in acquisition (kinetic mode only)
+            - out: array to write the image into, see image_buffer()"""
         dim = int(dimx*dimy *  self.kscans) 
-        cimage = (c_int * dim)()
-        error = self.dll.GetAcquiredData(pointer(cimage),dim)
+        imageArray = self.image_buffer(dim, out)
+        error = self.dll.GetAcquiredData(imageArray.ctypes.data_as(POINTER(c_int)),dim)
         self.verbose(error, sys._getframe().f_code.co_name)
+        return imageArray.reshape((self.kscans, dimx, dimy))
 
-        imageArray = []        
-        for i in range(len(cimage)):
-            imageArray.append(cimage[i])
-        imageArray = imageArray[:]
-        imageArray = np.reshape(imageArray, (self.kscans, dimx, dimy))
-        return imageArray
-
-    def GetOldestImage(self, dimx, dimy, numKinScans=1):
+    def GetOldestImage(self, dimx, dimy, numKinScans=1, out=None):
         """Retrieve the oldest stored image in the camera buffer 
         during a camera acquisition.
         Parameters: 
             - width of ROI (pixels)
             - height of ROI (pixels)
-            - number of kinetic scans in acquisition (kinetic mode only)"""
+            - number of kinetic scans in acquisition (kinetic mode only)
+            - out: array to write the image into, see image_buffer()"""
         dim = int(dimx*dimy *  self.kscans) 
-        cimage = (c_int * dim)()
-        error = self.dll.GetOldestImage(cimage, dim)
+        imageArray = self.image_buffer(dim, out)
+        error = self.dll.GetOldestImage(imageArray.ctypes.data_as(POINTER(c_int)), dim)
         self.verbose(error, sys._getframe().f_code.co_name)
-
-        imageArray = []        
-        for i in range(len(cimage)):
-            imageArray.append(cimage[i])
-        imageArray = imageArray[:]
-        imageArray = np.reshape(imageArray, (self.kscans, dimx, dimy))
-        return imageArray
+        return imageArray.reshape((self.kscans, dimx, dimy))
 
     def GetImages(self, first, last, dimx, dimy):
         """Update the data array with the specified series of images from the 
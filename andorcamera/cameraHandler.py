@@ -15,6 +15,8 @@ import sys
 if '.' not in sys.path: sys.path.append('.')
 if '..' not in sys.path: sys.path.append('..')
 from strtypes import error, warning, info
+from shottrace import TRACE
+from framepool import FRAMES
 from AndorFunctions import Andor, ERROR_CODE, Sensitivity, ReadNoise
 
 try:
@@ -358,13 +360,19 @@ class camera(QThread):
         the camera."""
         if self.AF.GetStatus() == 'DRV_IDLE':
             im = self.AF.GetAcquiredData(
-                    self.AF.ROIwidth, self.AF.ROIheight)
+                    self.AF.ROIwidth, self.AF.ROIheight, out=self.next_frame())
             self.lastImage = im
+            TRACE.mark('acquire') # the controller tags it with the file ID
             self.AcquireEnd.emit(im[0]) 
             self.ind += 1
             if self.AF.verbosity:
                 self.PlotAcquisition(im)
                 
+    def next_frame(self):
+        """A frame from the pool for the camera to read the next image into,
+        so the controller can subtract the bias in place."""
+        return FRAMES.acquire((self.AF.ROIwidth*self.AF.ROIheight*self.AF.kscans,), np.intc)
+
     def TakeAcquisitions(self, n=1):
         """Taking a series of n single acquisitions sequentially.
         Assuming external mode, the camera will wait for an external trigger
@@ -403,9 +411,10 @@ class camera(QThread):
                             self.AcquisitionEvent, win32event.INFINITE)
             if result == win32event.WAIT_OBJECT_0: # get image
                 self.lastImage = self.AF.GetOldestImage(
-                        self.AF.ROIwidth, self.AF.ROIheight)
+                        self.AF.ROIwidth, self.AF.ROIheight, out=self.next_frame())
                 self.t1 = time.time() 
                 if self.lastImage.any(): # sometimes last image is empty
+                    TRACE.mark('acquire') # the controller tags it with the file ID
                     self.AcquireEnd.emit(self.lastImage[0]) # emit signals
                     # print(self.ind, ' ', np.sum(self.lastImage), end=' ')
                     self.ind += 1
@@ -1,5 +1,6 @@
 import serial
 import time
+import ast
 import json
 import sys
 import os
@@ -10,27 +11,19 @@ import numpy as np
 import matplotlib.pyplot as plt
 from collections import OrderedDict
 from PyQt5 import QtWidgets
-
-# power calibration accounting for AOM nonlinearity
-from scipy.interpolate import interp1d
-
-def load_calibration(dds_index):
-    global cal, cals, alim
-    try:
-        print('loading DDS calibration: '+'dds/dds{}_power_calibration.csv'.format(dds_index))
-        cal = np.loadtxt('dds/dds{}_power_calibration.csv'.format(dds_index), delimiter=',').T
-        cals = [interp1d(cal[i+1], cal[0], fill_value='extrapolate') for i in range(len(cal)-1)]
-        # cals = [interp1d(np.linspace(0,1,10), np.linspace(0,1,10), fill_value='extrapolate')
-        #         for i in range(5)]
-        alim = 1.0
-    except OSError as e:
-        print('\033[31m' + '####\tERROR\t' + time.strftime('%d.%m.%Y\t%H:%M:%S'))
-        print('\tCould not load power calibration file:\n' + str(e) + '\n', '\033[m')
-        cals = [interp1d(np.linspace(0,1,10), np.linspace(0,1,10), fill_value='extrapolate')
-                for i in range(5)]
-        alim = 0.5
+from psocSerial import frame, from_hex, pack_bits
+from ddsService import ddsService, load_calibration
 
 class PSoC(object):
+    """The GUI side of the DDS control. The stored data and the serial link
+    belong to the ddsService, which programmes the DDS in its own thread.
+    The attributes in ddsService.state_keys are shared with the service."""
+    def __init__(self):
+        self.service = ddsService()
+        self.service.textout.connect(self.Display_Message_DDS)
+        self.service.updated.connect(self.redisplay_profiles)
+        self.service.gui_command.connect(self.respond)
+
     def Pydex_tcp_reset(self, force=False):
         if self.tcp.isRunning():
             if force:
@@ -69,31 +62,15 @@ class PSoC(object):
         """
         Port configurations. Note these are kept behind the scenes. Do not change the serial values - these must match those of the PSoC
         """
-        self.port = str(self.COM_no.currentText()) #'COM4'
-        if self.port == '--':
+        port = str(self.COM_no.currentText()) #'COM4'
+        if port == '--':
             self.Display_Message_DDS('Please set the COM port number.')
+        elif not(self.connected):
+            self.service.add_command('connect', port)
+            self.service.add_command('handshake', self.Module_address.currentText())
+            self.set_window_title(self.Module_address.currentText())
         else:
-            if not(self.connected):
-                try:
-
-                    self.ser = serial.Serial(
-                        port=self.port,
-                        baudrate=115200,
-                        parity=serial.PARITY_NONE,
-                        stopbits=serial.STOPBITS_ONE,
-                        bytesize= serial.EIGHTBITS)
-
-                    #self.Display_Message_DDS('Opened port sucessfully')
-                    time.sleep(0.05)
-                    self.connected = True
-                    self.PSoC_PC_handshake()
-                    self.set_window_title(self.Module_address.currentText())
-                    self.Display_Message_DDS('Connected to ' + self.port + 
-                        ' / %s: '%self.ind+self.COMlabels[self.ind])
-                except:
-                    self.Display_Message_DDS('Failed opening port, check port properties and COM name.')
-            else:
-                self.Get_message_from_DDS()
+            self.Get_message_from_DDS()
 
     def Display_Message_DDS(self, x):
         """
@@ -109,44 +86,23 @@ class PSoC(object):
         Disconnect from the serial port.
         """
         if self.connected:
-            self.connected = False
-
-            self.ser.close()
-            self.Display_Message_DDS('Disconnected from ' + self.port)
+            self.service.add_command('disconnect')
             self.MainWindow.setWindowTitle('DDS'+self.DDSName+' GUI -- disconnected')
         else:
             self.Display_Message_DDS("Disconnected. But from what? Make sure you're connected to a device first.")
 
     def Send_data_to_DDS(self, CMDStr):
         """
-        Sends the command string to the DDS.
+        Queue the command frame to send to the DDS. CMDStr is the frame
+        as bytes or a list of hex strings.
         """
-        if self.enable_print:
-            print(CMDStr)
-
-        # self.Display_Message_DDS(CMDStr)
-        time.sleep(0.1)
-        for ic in range(len(CMDStr)):
-            time.sleep(0.001)
-            self.ser.write(bytearray.fromhex(CMDStr[ic]))
-            #print(bytearray.fromhex(CMDStr[ic]))
-
-        self.Get_message_from_DDS()
-
-    def Get_message_from_DDS(self):
-
-        out = ''
-        if self.connected:
-            time.sleep(0.01)
-            try:
-                while self.ser.inWaiting() > 0:
-                    out += self.ser.read(1).decode('utf-8')
-            except:
-                self.Display_Message_DDS('Values sent from driver did not make sense.')
-            if out != '':
-                self.Display_Message_DDS(out)
-
+        if not isinstance(CMDStr, bytes):
+            CMDStr = from_hex(CMDStr)
+        self.service.add_command('send', CMDStr)
 
+    def Get_message_from_DDS(self, timeout=None):
+        """Display any messages the DDS sends within the timeout."""
+        self.service.add_command('read_message', timeout)
 
     def Format_array_transmission(self, command_ID, Data_array, N_Bytes):
         """
@@ -158,61 +114,35 @@ class PSoC(object):
         Byte 5 =  Data length2
         Others = data
 
-        Converts a binary array into a series of bytes.
+        Converts a binary array into a series of bytes. The data can
+        also be given as bytes already.
         """
-
-        DDS_Address = '{0:02x}'.format(int(self.Module_address.currentText()))
-        Data_length2 = '{0:02x}'.format(1)
-        Data_length1 = '{0:02x}'.format(N_Bytes)
-
-        if N_Bytes == 0:
-            Data_length2 = '{0:02x}'.format(0)
-            Data_length1 = '{0:02x}'.format(0)
-
-        pack = [DDS_Address, '{0:02x}'.format(command_ID), '0', Data_length1, Data_length2] # Second element is for the check sum
-        Sum = 0
-
-        for ic in range(len(pack)):
-            Sum += int(pack[ic], 16)
-
-        if int(N_Bytes) > 0:
-            for ic in range(int(N_Bytes)):
-                a = np.packbits(Data_array[8*ic: 8*(ic+1)])[0]
-                pack.append('{0:02x}'.format(a))
-                Sum += int(pack[ic + 5], 16)
-
-        sum_check = '{:0{width}x}'.format(int(np.binary_repr(np.invert(np.array([Sum], dtype = np.uint8))[0] + 1),2), width=2)
-
-        if sum_check == '100':
-            sum_check = 0
-            sum_check = '{0:02x}'.format(sum_check)
-        pack[2] = sum_check
-
-        if self.connected:
-            self.Send_data_to_DDS(pack)
-
+        if isinstance(Data_array, bytes):
+            data = Data_array[:int(N_Bytes)]
+        else:
+            data = pack_bits(Data_array, int(N_Bytes))
+        module = int(self.Module_address.currentText())
+        self.service.add_command('write', module, command_ID, data)
+        return frame(module, command_ID, data)
 
     def PSoC_PC_handshake(self):
         """Requests the PSoC to say hello on start-up. Displays version number."""
-
-        self.Format_array_transmission(24, None, 0)
-
         if self.connected:
-            time.sleep(0.1)
-            self.Get_message_from_DDS()
+            self.service.add_command('handshake', self.Module_address.currentText())
         else:
             self.Display_Message_DDS('Nothing to greet yet (not connected to anything)')
 
     def Register_debugger(self):
         """Requests the PSoC to debug the DDS registers"""
-        self.Format_array_transmission(23, None, 0)
-
         if self.connected:
-            time.sleep(0.1)
-            self.Get_message_from_DDS()
+            self.service.add_command('debug_registers', self.Module_address.currentText())
         else:
             self.Display_Message_DDS('Nothing to debug yet (not connected to anything)')
 
+    def verify_registers(self):
+        """Read back the DDS registers and compare them with the data
+        that was last written."""
+        self.service.add_command('verify_registers', self.Module_address.currentText())
 
     def Amplitude_Control_STP(self):
         """Toggle between STP amplitude options:
@@ -388,11 +318,8 @@ class PSoC(object):
         """
         Update playback info for the RAM mode
         """
-        try:
-            self.RAM_playback_dest = self.RAM_data_type.get(str(self.RAM_data.currentText()))
-            self.Int_profile_cntrl = self.RAM_controls.get(str(self.Int_ctrl.currentText()))
-        except:
-            self.Display_Message_DDS('Error setting additional playback information.')
+        self.RAM_type = str(self.RAM_data.currentText())
+        self.Int_control = str(self.Int_ctrl.currentText())
 
     def update_DRG_Limit_values(self):
         """
@@ -417,519 +344,26 @@ class PSoC(object):
         if not name:
             name, _ = QtWidgets.QFileDialog.getOpenFileName(
                 self.centralwidget, 'Open RAM data file', '', 'csv(*.csv);;all (*)')
-
-        try:
-            self.RAM_modulation_data[self.ind] = np.loadtxt(name, delimiter = ',') #file = open(name,'r')
-            self.RAM_data_filename[self.ind] = os.path.basename(name)
-            self.RAM_fname.setText(self.RAM_data_filename[self.ind])
-            self.Display_Message_DDS("DSS RAM data loaded from > \t " + name )
-            self.load_DDS_ram = True
-        except:
-            self.Display_Message_DDS("Data load failed")
-            self.load_DDS_ram = False
-
-
+        self.service.load_RAM_data(name, self.ind)
 
     def Load_SingleToneProfiles(self):
         """
-        Format all the registers ready for UART transmission.
+        Take the ramp generator values from the GUI, then queue the
+        single tone profiles to be sent to the DDS.
         """
-        self.Display_Message_DDS('\n --------------------------------- \n')
-        self.RAM_enable = 0
-        #Get the values in the text boxes
-        # self.update_values_STP()
         if self.DGR_params[0] == 1:
             self.update_DRG_Limit_values()
-            self.Load_DGR()
-
-
-        #Send any changes to the registers to the DDS
-        self.CFR1_register_loader()
-        self.CFR2_register_loader()
-
-        #Update the control registers if there has been a chnage
-
-        self.Format_array_transmission(0, self.CFR1, 4)
-        self.Format_array_transmission(1, self.CFR2, 4)
-
-        #Encode the parameters and send to the PSoC
-        self.Format_profile_register_data()
-        
+        self.service.add_command('load_single_tone', self.ind)
 
     def Load_RAM_playback(self):
         """
-        Format all the registers ready for UART transmission.
+        Take the RAM playback and ramp generator values from the GUI, then
+        queue the RAM data and profiles to be sent to the DDS.
         """
-        self.RAM_enable = 0
-        # Make sure that RAM mode is disabled
-        cfr1_old = self.CFR1.copy()
-        #Send any changes to the registers to the DDS
-        self.CFR1_register_loader()
-
-
-        #Update the control registers if there has been a chnage
-        self.Format_array_transmission(0, self.CFR1, 4)
-        #Get the values in the text boxes
         self.update_values_RAM()
-
         if self.DGR_params[0] == 1:
             self.update_DRG_Limit_values()
-            self.Load_DGR()
-
-        #Encode the parameters and send to the PSoC
-        self.Format_RAM_register_data(False) # False means set profile 0 only
-
-        #FTW load
-        data = int(np.around((2**32 *(abs(self.FTW[self.ind])/1000)), decimals = 0)) #Note AD9910 has a clock frequency of 1 GHz or 1000 MHz
-        if data >= 2**31:
-            data = 2**31
-        FTW = self.bin_array(data, 32)
-        # print(FTW)
-
-        self.Format_array_transmission(7, FTW, 4)
-
-        # POW load, not necessary for an AOM but included for completeness
-        data = int(np.around((2**16 *(abs(self.POW[self.ind])/360)), decimals = 0)) #Note AD9910 has a clock frequency of 1 GHz or 1000 MHz
-        if data >= 2**16:
-            data = 2**16-1
-        POW = self.bin_array(data, 16)
-        # print(POW)
-
-        self.Format_array_transmission(8, POW, 2)
-
-        #Send the RAM data. Note this is sent backwards. Because reasons
-        try:
-            # Make sure that wwe have RAM data loaded
-            RAM_data_reg = np.zeros((1024, 32), dtype = np.bool_())
-            
-            if len(self.RAM_modulation_data[self.ind][0,:]) >= 1024:
-               self.Display_Message_DDS('Data is too long and will be truncated')
-               end = 1024
-            else:
-                end = len(self.RAM_modulation_data[self.ind][0,:])
-
-
-            NTS = self.RAM_data_type.get(str(self.RAM_data.currentText())) # Do not allow this state
-            ID =  2*(NTS[0]) + NTS[1]
-            
-            if ID == 0: # If the ramp generator is modulating frequency
-                data = np.around((2**32 *(np.absolute(self.RAM_modulation_data[self.ind][0,:])/1000)), decimals = 0) #Note AD9910 has a clock frequency of 1 GHz or 1000 MHz
-                ind_high = np.where(data >= 2**31)[0]
-                data[ind_high] = 2**31
-                ind = 32
-
-            elif ID == 1: # If the ramp generator is modulating phase
-                data = np.around((2**16 *(np.absolute(self.RAM_modulation_data[self.ind][0,:])/360)), decimals = 0)
-                ind_high = np.where(data >= 2**16)[0]
-                data[ind_high] = 2**16 - 1
-                ind = 16
-
-            elif ID == 2:
-                data = np.around(2**14 *self.powercal(np.absolute(self.RAM_modulation_data[self.ind][0,:]
-                        )/ np.amax(self.RAM_modulation_data[self.ind][0, :])*self.AMW[self.ind]), decimals = 0)
-                ind_high = np.where(data >= 2**14)[0]
-                data[ind_high] = 2**14- 1
-                ind = 14
-            else:
-                data = np.around((2**16 *(np.absolute(self.RAM_modulation_data[self.ind][0,:])/360)), decimals = 0)
-                ind_high = np.where(data >= 2**16)[0]
-                data[ind_high] = 2**16- 1
-                ind = 16
-
-                data2 = np.around((2**14 *(np.absolute(self.RAM_modulation_data[self.ind][1,:])/ np.amax(self.RAM_modulation_data[self.ind][1, :]))), decimals = 0)
-                ind_high = np.where(data >= 2**14)[0]
-                data[ind_high] = 2**14- 1
-                end *= end
-
-            DDS_Address = '{0:02x}'.format(int(self.Module_address.currentText()))
-            command_ID = 22 #### i think this is right based off the old code
-            # pack: 3rd element is for the check sum, data length is 4*5
-            pack = [DDS_Address, '{0:02x}'.format(command_ID), '0','{0:02x}'.format(32),'{0:02x}'.format(128)] 
-            Sum = 0
-
-            for ic in range(len(pack)):
-                Sum += int(pack[ic], 16)
-
-            for ic in range(end):
-                RAM_data_reg[ic, 0: ind] = self.bin_array(int(data[ic]), ind)
-                if ID ==3:
-                    RAM_data_reg[ic, ind: 32] = self.bin_array(int(data2[ic]), 14)
-
-            #np.savetxt('debug.csv', RAM_data_reg, delimiter = ',')
-            if self.load_DDS_ram:
-                for ic in range(1024):
-                    for jc in range(4):
-
-                        a = np.packbits(RAM_data_reg[-1-ic, 8*jc: 8*(jc+1) ])[0]
-                        pack.append('{0:02x}'.format(a))
-                        Sum += int(pack[ic + 5], 16)
-
-                sum_check = '{:0{width}x}'.format(int(np.binary_repr(np.invert(np.array([Sum], dtype = np.uint8))[0] + 1),2), width=2)
-
-                if sum_check == '100':
-                    sum_check = 0
-                    sum_check = '{0:02x}'.format(sum_check)
-                pack[2] = sum_check
-
-                if self.connected:
-                    # time.sleep(0.5)
-                    self.Send_data_to_DDS(pack)
-                    
-                self.load_DDS_ram = False
-        except Exception as e:
-            self.Display_Message_DDS("Make sure the RAM data has been loaded.\n"+str(e))
-            self.Display_Message_DDS("RAM data shape: "+str(np.shape(self.RAM_modulation_data[self.ind])))
-
-        # time.sleep(5)
-        self.Format_RAM_register_data(True)
-
-        self.RAM_enable = 1
-
-        #Send any changes to the registers to the DDS
-        self.CFR1_register_loader()
-        self.CFR2_register_loader()
-
-        self.Format_array_transmission(0, self.CFR1, 4)
-
-        ### CFR2
-
-        self.Format_array_transmission(1, self.CFR2, 4)
-
-        #self.Display_Message_DDS("RAM data sent")
-
-
-    def CFR1_register_loader(self):
-        """
-        Rewrites register 1 on the DDS. This is rather invloved. Look at the AD9910 datasheet.
-        """
-        #self.RAM_enable = 0## disables RAM functionality (default). 1 = enables RAM functionality (required for both load/retrieve and playback operation).
-        #RAM_playback_dest = np.array([0,0]) #RAM Playback CFR1[30:29] | Destination Bits Control Parameter | Bits Assigned
-        #Manual_OSK = 0 #Ineffective unless CFR1[9:8] = 10b. 0 = OSK pin inoperative (default). 1 = OSK pin enabled for manual OSK control 22 Inverse sinc filter enable 0 = inverse sinc filter bypassed (default).
-
-        sinc_filter = 0 #inverse sinc filter active.
-
-        #Int_profile_cntrl = np.array([0,0,0,0]) #Ineffective unless CFR1[31] = 1. These bits are effective without the need for an I/O update. See Table 14 for details. Default is 0000b.
-
-        Sine_output =  0 # Cosine  = 0 output of the DDS is selected (default). Sine = 1 output of the DDS is selected.
-        Autoclear_phase = 0 # 0 = normal operation of the DDS phase accumulator (default). 1 = synchronously resets the DDS phase accumulator anytime I/O_UPDATE is asserted or a profile change occurs.
-
-        Clear_phase_acc = 0 # 0 = normal operation of the DDS phase accumulator (default). 1 = asynchronous, static reset of the DDS phase accumulator.
-        Load_ARR = 0 #@ I/O update Ineffective unless CFR1[9:8] = 11b. 0 = normal operation of the OSK amplitude ramp rate timer (default). 1 = OSK amplitude ramp rate timer reloaded anytime I/O_UPDATE is asserted or a PROFILE[2:0] change occurs.
-#        OSK_enable = 0 #The output shift keying enable bit. 0 = OSK disabled (default). 1 = OSK enabled.
-        Auto_OSK = 0 #Ineffective unless CFR1[9] = 1. 0 = manual OSK enabled (default).1 = automatic OSK enabled.
-        Dgtl_power_down = 0 #This bit is effective without the need for an I/O update. 0 = clock signals to the digital core are active (default). 1 = clock signals to the digital core are disabled.
-        DAC_power_down = 0 #0 = DAC clock signals and bias circuits are active (default). 1 = DAC clock signals and bias circuits are disabled.
-        REFCLK = 0 #input power-down This bit is effective without the need for an I/O update. 0 = REFCLK input circuits and PLL are active (default). 1 = REFCLK input circuits and PLL are disabled.
-        Aux_DAC_power_down = 0 #0 = auxiliary DAC clock signals and bias circuits are active (default). 1 = auxiliary DAC clock signals and bias circuits are disabled.
-        Ext_power_down = 0 #0 = assertion of the EXT_PWR_DWN pin affects full power-down (default). 1 = assertion of the EXT_PWR_DWN pin affects fast recovery power-down.
-        SDIO = 0 #input only 0 = configures the SDIO pin for bidirectional operation; 2-wire serial programming mode (default). 1 = configures the serial data I/O pin (SDIO) as an input only pin; 3-wire serial programming mode.
-        LSB  = 0#first 0 = configures the serial I/O port for MSB-first format (
-
-        #############################################################################################
-        self.CFR1[0] = self.RAM_enable
-        self.CFR1[1:3] = self.RAM_playback_dest
-        self.CFR1[8] = self.Manual_OSK
-        self.CFR1[9] = sinc_filter
-        self.CFR1[11:15] = self.Int_profile_cntrl
-        self.CFR1[15] = Sine_output
-        self.CFR1[16] = self.DGR_params[3]
-        self.CFR1[17] = self.DGR_params[1]
-        self.CFR1[18] = Autoclear_phase
-        self.CFR1[19] = self.DGR_params[2]
-        self.CFR1[20] = Clear_phase_acc
-        self.CFR1[21] = Load_ARR
-        self.CFR1[22] = self.OSK_enable
-        self.CFR1[23] = Auto_OSK
-        self.CFR1[24] = Dgtl_power_down
-        self.CFR1[25] = DAC_power_down
-        self.CFR1[26] = REFCLK
-
-        self.CFR1[27] = Aux_DAC_power_down
-        self.CFR1[28] = Ext_power_down
-        self.CFR1[30] = SDIO
-        self.CFR1[31] = LSB
-
-    def CFR2_register_loader(self):
-        """
-        Rewrites register 2 on the DDS. This is rather invloved. Look at the AD9910 datasheet.
-        """
-        #AMP_scale = 0 #Enable amplitude scale from single tone profiles Ineffective if CFR2[19 ] = 1 or CFR1[31] = 1 or CFR1[9] = 1. 0 = the amplitude scaler is bypassed and shut down for power conservation (default). 1 = the amplitude is scaled by the ASF from the active profile.
-        Internal_I_O = 0 #update active This bit is effective without the need for an I/O update.
-        SYNC_CLK_en = 0 # 0 = the SYNC_CLK pin is disabled; static Logic 0 output. 1 = the SYNC_CLK pin generates a clock signal at 0.25 fSYSCLK; used for synchronization of the serial I/O port (default).
-        DGT_ramp_des = np.array([0,0]) # See Table 11 for details. Default is 00b. See the Digital Ramp Generator (DRG) section for details.
-
-        Rd_eff_FTW = 0 #a serial I/O port read operation of the FTW register reports the contents of the FTW register (default). 1 = a serial I/O port read operation of the FTW register reports the actual 32-bit word appearing at the input to the DDS phase accumulator.
-        I_O_update_rate = np.array([0,0]) #Ineffective unless CFR2[23] = 1. Sets the prescale ratio of the divider that clocks the auto I/O update timer as follows:
-
-        PDCLK_en = 1 #0 = the PDCLK pin is disabled and forced to a static Logic 0 state; the internal clock signal continues to operate and provide timing to the data assembler. 1 = the internal PDCLK signal appears at the PDCLK pin (default).
-        PDCLK_inv = 0 # 0 = normal PDCLK polarity; Q-data associated with Logic 1, I-data with Logic 0 (default). 1 = inverted PDCLK polarity.
-        TxEnable_inv = 0 # 0 = no inversion. 1 = inversion.
-
-        #Matched_latency_en = 0# 0 = simultaneous application of amplitude, phase, and frequency changes to the DDS arrive at the output in the order listed (default). 1 = simultaneous application of amplitude, phase, and frequency changes to the DDS arrive at the output simultaneously.
-        #Data_assembler_hold = 1 #hold last value Ineffective unless CFR2[4] = 1. 0 = the data assembler of the parallel data port internally forces zeros on the data path and ignores the signals on the D[15:0] and F[1:0] pins while the TxENABLE pin is Logic 0 (default). This implies that the destination of the data at the parallel data port is amplitude when TxENABLE is Logic 0. 1 = the data assembler of the parallel data port internally forces the last value received on the D[15:0] and F[1:0] pins while the TxENABLE pin is Logic 1.
-        Sync_val_dsbl = 0 #0 = enables the SYNC_SMP_ERR pin to indicate (active high) detection of a synchronization pulse sampling error. 1 = the SYNC_SMP_ERR pin is forced to a static Logic 0 condition (default).
-        #Parallel_en = 1  #See the Parallel Data Port Modulation Mode section for more details. 0 = disables parallel data port modulation functionality (default). 1 = enables parallel data port modulation functionality.
-        #FM_gain = np.array([1,0,1,1]) #See the Parallel Data Port Modulation Mode section for more details. Default is 0000b.
-
-        #############################################################################################
-        self.CFR2[7] = self.AMP_scale
-        self.CFR2[8] = Internal_I_O
-        self.CFR2[9] = SYNC_CLK_en
-        self.CFR2[10:12] = self.DGR_destination
-        self.CFR2[12] = self.DGR_params[0]
-        self.CFR2[13] = self.DGR_params[4]
-        self.CFR2[14] = self.DGR_params[5]
-        self.CFR2[15] = Rd_eff_FTW
-        self.CFR2[16:18] = I_O_update_rate
-        self.CFR2[20] = PDCLK_en
-        self.CFR2[21] = PDCLK_inv
-        self.CFR2[22] = TxEnable_inv
-
-        self.CFR2[24] = self.FPGA_params[2]
-        self.CFR2[25] = self.FPGA_params[1]
-        self.CFR2[26] = Sync_val_dsbl
-        self.CFR2[27] = self.FPGA_params[0]
-        self.CFR2[28:32] = self.FM_gain_value
-
-    def Format_profile_register_data(self):
-        """
-        Convert decimal values into hex strings
-        """
-        fout, amp, tht = self.fout[self.ind], self.amp[self.ind], self.tht[self.ind]
-        for ic in range(8):
-            profile = np.zeros(64, dtype = np.bool_())
-            if fout[ic] != 0.0:
-                f = int(np.around((2**32 *(fout[ic]/1000)), decimals = 0)) #Note AD9910 has a clock frequency of 1 GHz or 1000 MHz
-                if f > 2**31:
-                    self.Display_Message_DDS("Aliasing is likely to occur. Limiting frequency to 400 MHz.")
-                    f = 2**31
-
-                # a = int(np.around(2**14 * abs(amp[ic]), decimals = 0))
-                a = int(np.around(2**14 * abs(self.powercal(amp[ic])), decimals = 0)) # power calibration
-                if a == 2**14:
-                    a =2**14 -1
-                if a > 2**14:
-                    self.Display_Message_DDS("Amplitude overflow")
-                    a =2**14 -1
-
-                p = int(np.around((2**16 *(tht[ic]/360)), decimals = 0))
-                if p >= 2**16:
-                    self.Display_Message_DDS("Phase overflow")
-                    p =2**16 -1
-
-                profile[2:16] = self.bin_array(a, 14)
-                profile[16:32] = self.bin_array(p, 16)
-                profile[32:64] = self.bin_array(f, 32)
-
-
-                self.Format_array_transmission((ic + 14), profile, 8)
-            else:
-                continue
-
-    def Format_RAM_register_data(self, switch):
-        """
-        Convert the RAM profile data into the format required by the DDS
-
-        The switch is used to write the concatenated wavefroms to the DDS, i.e. profile 0 is the write profile
-        The correct profile data is set after the RAM is programmed.
-        """
-        Start_Address = self.Start_Address[self.ind]
-        End_Address = self.End_Address[self.ind]
-        Rate = self.Rate[self.ind]
-        RAM_playback_mode = self.RAM_playback_mode[self.ind]
-        Zero_crossing = self.Zero_crossing[self.ind]
-        No_dwell = self.No_dwell[self.ind]
-        for ic in range(8):
-            if not(switch):
-                if ic != 0:
-                    break
-
-            RAM_profile = np.zeros(64, dtype = np.bool_())
-            #Prevent negative addresses
-            if Start_Address[ic] < 0:
-                self.Display_Message_DDS("Adjusting start address of profile " + str(ic))
-                Start_Address[ic] = 0
-
-            if End_Address[ic] < 0:
-                self.Display_Message_DDS("Adjusting end address of profile " + str(ic))
-                Start_Address[ic] = Start_Address[ic] + 1
-
-            #Prevent addresses over 1024
-
-            if Start_Address[ic] >= 1023:
-                self.Display_Message_DDS("Adjusting start address of profile " + str(ic))
-                Start_Address[ic] = 1022
-
-            if End_Address[ic] >= 1024:
-                self.Display_Message_DDS("Adjusting start address of profile " + str(ic))
-                End_Address[ic] = 1023
-
-            #Prevent start > end address
-            if switch:
-                if End_Address[ic] <= Start_Address[ic]:
-                    #self.Display_Message_DDS("Error in start and end addresses of profile " + str(ic) + " skipping")
-                    continue
-                if End_Address[ic] == Start_Address[ic]:
-                    #self.Display_Message_DDS("Error in start and end addresses of profile " + str(ic) + " skipping")
-                    continue
-
-            #Prevent negative or zero step rates
-
-            if Rate[ic] <= 0:
-                self.Display_Message_DDS("Adjusting step rate of profile " + str(ic))
-                Rate[ic] = 0.004
-            if Rate[ic] > 262.14:
-                self.Display_Message_DDS("Adjusting step rate of profile " + str(ic))
-                Rate[ic] = 262.14
-
-
-            RAM_profile[61:64] = RAM_playback_mode[ic, :]
-            RAM_profile[60] = Zero_crossing[ic]
-            RAM_profile[58] = No_dwell[ic]
-
-            RAM_profile[8:24] = self.bin_array(int(np.around((Rate[ic]*250), decimals = 0)), 16) #Refresh rate is given by f_clk/4 = 250 MHz
-            if switch:
-                RAM_profile[24:34] = self.bin_array(int(np.around((End_Address[ic]))), 10)
-                RAM_profile[40:50] = self.bin_array(int(np.around((Start_Address[ic]))), 10)
-            else:
-                RAM_profile[24:34] = self.bin_array(int(1023), 10)
-                RAM_profile[40:50] = self.bin_array(int(0), 10)
-
-
-            self.Format_array_transmission((ic + 14), RAM_profile, 8)
-
-
-    def Load_DGR(self):
-        """
-        Convert the DRG data into the format required by the DDS
-        """
-        try:
-            ID =  int(2*self.DGR_destination[0] + self.DGR_destination[1])
-
-            if self.DRG_Start < 0:
-                self.Display_Message_DDS("Adjusting lower limit of ramp")
-                self.DRG_Start = 0
-
-            if self.DRG_Start >= self.DRG_End:
-                self.Display_Message_DDS("Check the limits of the ramp generator")
-
-            if ID == 0: # If the ramp generator is modulating frequency
-                lower = int(np.around((2**32 *(self.DRG_Start/1000)), decimals = 0)) #Note AD9910 has a clock frequency of 1 GHz or 1000 MHz
-                if lower >= 2**31:
-                    self.Display_Message_DDS("Ramp generator - aliasing is likely to occur. Limiting frequency to 400 MHz.")
-                    lower = 2**31
-                upper = int(np.around((2**32 *(self.DRG_End/1000)), decimals = 0)) #Note AD9910 has a clock frequency of 1 GHz or 1000 MHz
-                if upper >= 2**31:
-                    self.Display_Message_DDS("Ramp generator - aliasing is likely to occur. Limiting frequency to 400 MHz.")
-                    upper = 2**31
-
-                pos_step = int(np.around((2**32 *(abs(self.DRG_P_stp_Size) /1000)), decimals = 0)) #Note AD9910 has a clock frequency of 1 GHz or 1000 MHz
-                neg_step = int(np.around((2**32 *(abs(self.DRG_N_stpSize  /1000))), decimals = 0)) #Note AD9910 has a clock frequency of 1 GHz or 1000 MHz
-
-                if pos_step <= 0:
-                    pos_step = 1
-                if neg_step <= 0:
-                    neg_step = 1
-
-                if pos_step >= 2**32:
-                    pos_step = 2**32 - 1
-                if neg_step == 2**32:
-                    neg_step = 2**32 - 1
-
-                ind = 32
-
-            elif ID == 1: # If the ramp generator is modulating phase
-                lower = int(np.around((2**16 *(self.DRG_Start/360)), decimals = 0))
-                if lower >= 2**16:
-                    self.Display_Message_DDS("Phase overflow")
-                    lower = 2**16 - 1
-                upper = int(np.around((2**16 *(self.DRG_End/360)), decimals = 0))
-                if upper >= 2**16:
-                    self.Display_Message_DDS("Phase overflow")
-                    upper = 2**16 - 1
-
-                pos_step = int(np.around((2**16 *(abs(self.DRG_P_stp_Size) /360)), decimals = 0))
-                neg_step = int(np.around((2**16 *(abs(self.DRG_N_stpSize  /360))), decimals = 0))
-
-                if pos_step <= 0:
-                    pos_step = 1
-                if neg_step <= 0:
-                    neg_step = 1
-
-                if pos_step >= 2**16:
-                    pos_step = 2**16 - 1
-                if neg_step == 2**16:
-                    neg_step = 2**16 - 1
-
-                ind = 16
-
-            else:
-
-                self.AMP_scale = 0
-                lower = int(np.around((2**14 * abs(self.DRG_Start)), decimals = 0))
-                if lower >= 2**14:
-                    self.Display_Message_DDS("Amplitude overflow")
-                    lower = 2**14 - 1
-                upper = int(np.around((2**14 * abs(self.DRG_End)), decimals = 0))
-                if upper >= 2**14:
-                    self.Display_Message_DDS("Amplitude overflow")
-                    upper = 2**14 - 1
-                pos_step = int(np.around((2**14 *(abs(self.DRG_P_stp_Size))), decimals = 0))
-                neg_step = int(np.around((2**14 *(abs(self.DRG_N_stpSize))), decimals = 0))
-
-                if pos_step <= 0:
-                    pos_step = 1
-                if neg_step <= 0:
-                    neg_step = 1
-
-                if pos_step >= 2**14:
-                    pos_step = 2**14 - 1
-                if neg_step == 2**14:
-                    neg_step = 2**14 - 1
-
-                ind = 14
-
-            #Prevent negative or zero step rates
-
-            if self.DRG_P_stp_Rate <= 0:
-                self.Display_Message_DDS("Adjusting positive step rate of ramp")
-                self.DRG_P_stp_Rate = (4/1000)
-            if self.DRG_P_stp_Rate > (4*(2**16-1)/1000):
-                self.Display_Message_DDS("Adjusting positive step rate of ramp")
-                self.DRG_P_stp_Rate = (4*(2**16-1)/1000)
-
-            if self.DRG_N_stp_Rate <= 0:
-                self.Display_Message_DDS("Adjusting negative step rate of ramp")
-                self.DRG_N_stp_Rate = (4/1000)
-            if self.DRG_N_stp_Rate > (4*(2**16-1)/1000):
-                self.Display_Message_DDS("Adjusting negative step rate of ramp")
-                self.DRG_N_stp_Rate = (4*(2**16-1)/1000)
-
-        except:
-            self.Display_Message_DDS("Ensure all values of the ramp generator are correctly set")
-
-        try:
-
-            DRG_reg1 = np.zeros(64, dtype = np.bool_())
-            DRG_reg2 = np.zeros(64, dtype = np.bool_())
-            DRG_reg3 = np.zeros(32, dtype = np.bool_())
-
-
-            # Make sure that the phase and amplitude binary reps are MSB aligned
-            DRG_reg1[0: ind] = self.bin_array(upper, ind)
-            DRG_reg1[32: 32 + ind] = self.bin_array(lower, ind)
-
-            DRG_reg2[0: ind] = self.bin_array(neg_step, ind)
-            DRG_reg2[32: 32 + ind] = self.bin_array(pos_step, ind)
-
-            DRG_reg3[0:16] = self.bin_array(int(np.around((self.DRG_N_stp_Rate*250), decimals = 0)), 16) #Refresh rate is given by f_clk/4 = 250 MHz
-            DRG_reg3[16:32] = self.bin_array(int(np.around((self.DRG_P_stp_Rate*250), decimals = 0)), 16) #Refresh rate is given by f_clk/4 = 250 MHz
-
-            self.Format_array_transmission(11, DRG_reg1, 8)
-            self.Format_array_transmission(12, DRG_reg2, 8)
-            self.Format_array_transmission(13, DRG_reg3, 4)
-        except:
-            self.Display_Message_DDS("Failed to write DGR")
+        self.service.add_command('load_RAM_playback', self.ind)
 
     def launch_help_file(self):
         """ Open the user guide."""
@@ -955,136 +389,80 @@ class PSoC(object):
         else: return txt
 
     def respond(self, cmd=None):
-        """Respond to the command sent by TCP message to the client.
+        """Carry out the commands from the DDS service that change the GUI.
         The syntax is:  option=value
-        If setting new data, the value syntax is: 
-            [[port1,profile1,key1,val1],[port2,profile2,key2,val2],...]"""
+        Parameters for the ramp generator are set in the GUI, the value
+        syntax is: [stored, [[port1,profile1,key1,val1],[port2,profile2,key2,val2],...]]
+        where stored is the list of parameters that the service has already
+        set. The modules for both lists are programmed.
+        set_module=address selects the module before it's programmed."""
         try:
-            value = cmd.split('=')[1] 
-        except: 
+            key, value = str(cmd).split('=', 1)
+        except ValueError:
             self.Display_Message_DDS('Command not understood: '+str(cmd))
-            return 0                
+            return 0
 
-        if any(x in cmd for x in['Freq', 'Phase', 'Amp']) and 'aux' not in cmd:
-            self.mode = 'single tone'
-        elif any(x in cmd for x in['Start_add', 'End_add', 'Step_rate', 'aux']):
-            self.mode = 'RAM'
-                
-        if 'set_data' in cmd:
+        if key == 'set_data':
             try:
-                value_list = eval(value) # nested list of parameters to change
-            except Exception as e: 
+                stored, value_list = ast.literal_eval(value) # nested lists of parameters to change
+            except Exception as e:
                 self.Display_Message_DDS('Failed to evaluate command: '+cmd)
                 return 0
-            prv_module = '' # keep track of which port we're communicating on
-            success = [0 for i in range(len(value_list))]
-            for i, (module, profile, key, val) in enumerate(value_list):
-                # Set parameters. 
-                try:
-                    if 'Freq' in key and 'aux' not in profile:
-                        self.fout[int(module), int(profile[1])] = float(val)
-                    elif 'Phase' in key and 'aux' not in profile:
-                        self.tht[int(module), int(profile[1])] = float(val)
-                    elif 'Amp' in key and 'aux' not in profile:
-                        self.amp[int(module), int(profile[1])] = float(val)
-                    elif 'Start_add' in key:
-                        self.Start_Address[int(module), int(profile[1])] = float(val)
-                    elif 'End_add' in key:
-                        self.End_Address[int(module), int(profile[1])] = float(val)
-                    elif 'Step_rate' in key:
-                        self.Rate[int(module), int(profile[1])] = float(val)
-                    elif 'Freq' in key and 'aux' in profile:
-                        self.FTW[int(module)] = float(val)
-                    elif 'Phase' in key and 'aux' in profile:
-                        self.POW[int(module)] = float(val)
-                    elif 'Amp' in key and 'aux' in profile:
-                        self.AMW[int(module)] = float(val)
-                        self.load_DDS_ram = True
-                    else: raise Exception('Tried to set invalid parameter')
-                    success[i] = 1
-                except Exception as e: print(e) # pass # key could be for ramp
-                    
-                if 'ramp' in self.mode:
+            success = []
+            if 'ramp' in self.mode:
+                for module, profile, key, val in value_list:
                     try:
                         label = self.centralwidget.findChild(QtWidgets.QLineEdit, key)
                         label.setText('%s'%val)
-                        success[i] = 1
-                    except Exception as e: print(e) #pass # key could be for ST or RAM
-            modules_to_program = list(set([x[0] for x in value_list]))
-            for module in modules_to_program:
-                # quick hack to make DDS send message only after all GUI elements have been updated
-                # if we need to change port
-                print('have waited programming module {}',format(module))
-                if not self.connected or (module != self.Module_address.currentText() and 
-                        module in [self.Module_address.itemText(i) for i in range(self.Module_address.count())]):
-                    self.Disconnect_serial_port()
-                    self.Module_address.setCurrentText(module)
-                    self.Configure_serial_port()
-                self.applyAmpValidators()
-                # programme the DDS with the current data
-                if module != prv_module:
-                    if 'ramp' in self.mode:
-                        self.checkBox.setChecked(True)
-                    if 'single tone' in self.mode:
-                        self.Load_SingleToneProfiles()
-                    elif 'RAM' in self.mode:
-                        self.Load_RAM_playback()
-                    prv_module = module
-            self.redisplay_profiles()
-            self.Display_Message_DDS('Set parameters %s'%str([val for i, val in enumerate(value_list) if success[i]]))
-        elif 'set_mode' in cmd:
-            if value in self.mode_options:
-                self.mode = value
-            else: 
-                self.mode = 'single tone'
-            self.Display_Message_DDS('Changed to '+self.mode+' mode.')
-        elif 'set_manual_on/off' in cmd:
+                        success.append([module, profile, key, val])
+                    except Exception as e: print(e) # key could be for ST or RAM
+                self.checkBox.setChecked(True)
+            else:
+                self.Display_Message_DDS('Tried to set invalid parameters %s'%value_list)
+            self.applyAmpValidators()
+            self.update_values_RAM()
+            if self.DGR_params[0] == 1:
+                self.update_DRG_Limit_values()
+            if not self.connected:
+                self.service.add_command('connect', str(self.COM_no.currentText()))
+            self.service.add_command('programme', list(OrderedDict.fromkeys(str(x[0]) for x in stored + value_list)))
+            self.Display_Message_DDS('Set parameters %s'%success)
+        elif key == 'set_module':
+            if value in [self.Module_address.itemText(i) for i in range(self.Module_address.count())]:
+                self.Module_address.setCurrentText(value) # triggers set_window_title
+            else:
+                self.Display_Message_DDS('Invalid module address: '+value)
+        elif key == 'set_manual_on/off':
             if value in self.amp_options:
                 item = self.centralwidget.findChild(QtWidgets.QRadioButton, value)
                 item.setChecked(True) # triggers OSK_func
                 if value == 'manual on/off' and 'RAM' in self.mode:
                     self.OSK_man.setChecked(True)
-                elif 'RAM' in self.mode: 
+                elif 'RAM' in self.mode:
                     self.OSK_man.setChecked(False)
-                self.Display_Message_DDS('Changed to %s.'%value)
-        elif 'load_RAM_playback' in cmd:
-            self.Open_RAM_playback_file(value)
-        elif 'set_RAM_data_type' in cmd:
+        elif key == 'set_RAM_data_type':
             if value in self.RAM_data_type.keys():
                 self.RAM_data.setCurrentText(value) # triggers disable_modes_DRG_func
-                self.Display_Message_DDS('Changed RAM data type to %s.'%value)
-        elif 'set_internal_control' in cmd:
+        elif key == 'set_internal_control':
             if value in self.RAM_controls.keys():
                 self.Int_ctrl.setCurrentText(value)
-                self.Display_Message_DDS('Changed RAM internal control to %s.'%value)
-        elif 'set_ramp_mode' in cmd:
+        elif key == 'set_ramp_mode':
             if value in self.DRG_modes:
                 item = self.centralwidget.findChild(QtWidgets.QRadioButton, value)
-                item.setChecked(True) # requires 
+                item.setChecked(True) # requires
                 self.Display_Message_DDS('Changed DRG mode to %s.'%value if item.isChecked() else 'none')
-        elif 'save_STP' in cmd:
-            self.save_STP(value)
-        elif 'load_STP' in cmd:
-            self.load_STP(value)
-        elif 'save_all' in cmd:
-            self.save_all(value)
-        elif 'load_all' in cmd:
-            self.load_all(value)
-        elif 'programme' in cmd:
-            if 'single tone' in self.mode:
-                self.Load_SingleToneProfiles()
-            elif 'RAM' in self.mode:
-                self.Load_RAM_playback()
-                
+        else:
+            self.Display_Message_DDS('Command not understood: '+str(cmd))
+
     def set_window_title(self, text='1'):
         """Every time the module is updated, redisplay the profiles"""
-        self.port = str(self.COM_no.currentText())
+        port = str(self.COM_no.currentText())
         try: 
             self.ind = int(text)
         except ValueError:
             self.ind = 1
         self.MainWindow.setWindowTitle(
-            'DDS'+self.DDSName+' GUI -- '+self.port+': '+self.COMlabels[self.ind])
+            'DDS'+self.DDSName+' GUI -- '+port+': '+self.COMlabels[self.ind])
         self.redisplay_profiles()
         # self.reload_RAM() # removed so that the DDS doesn't resend RAM data unnecessarily
                 
@@ -1096,8 +474,8 @@ class PSoC(object):
     
     def powercal(self, amp):
         """Recalibrate the amplitude to account for AOM nonlinearity"""
-        return cals[self.ind](amp)
-    
+        return self.service.powercal(self.ind, amp)
+
     def plot_RAM_playback_data(self):
         """pop-up plot of RAM playback data to check that it's right"""
         for i in range(len(self.AMW)):
@@ -1111,6 +489,10 @@ class PSoC(object):
                     
     def redisplay_profiles(self):
         """Set the stored STP and RAM profile data into the text labels."""
+        if (self.Module_address.currentText() != str(self.ind) and 
+                self.Module_address.findText(str(self.ind)) >= 0):
+            self.Module_address.setCurrentText(str(self.ind)) # triggers set_window_title
+            return
         for i in range(8):
             try: 
                 self.centralwidget.findChild(QtWidgets.QLineEdit, 'Freq_P%s'%i).setText('%s'%self.fout[self.ind,i])
@@ -1130,101 +512,42 @@ class PSoC(object):
             self.RAM_fname.setText(self.RAM_data_filename[self.ind])
         except Exception as e: self.Display_Message_DDS("Couldn't display stored parameter:\n"+str(e))
         
+    def get_fname(self, title='Open File', save=False):
+        """Ask the user for a file name. Returns '' if they cancel."""
+        if save:
+            fname, _ = QtWidgets.QFileDialog.getSaveFileName(
+                self.centralwidget, title, '', 'txt(*.txt);;all (*)')
+        else:
+            fname, _ = QtWidgets.QFileDialog.getOpenFileName(
+                self.centralwidget, title, '', 'txt(*.txt);;all (*)')
+        return fname
+
     def load_STP(self, fname=''):
         """Input the values from the STP file into the stored data and line edits."""
-        try:
-            if not fname:
-                fname, _ = QtWidgets.QFileDialog.getOpenFileName(
-                    self.centralwidget, 'Open STP File', '', 'txt(*.txt);;all (*)')
-            if os.path.exists(fname): # if user cancels then fname is empty str
-                data = np.loadtxt(fname, delimiter=',')
-                self.fout = data[:5,:]
-                self.tht = data[5:10,:]
-                self.amp = data[10:15,:]
-                self.redisplay_profiles()
-                self.applyAmpValidators()
-        except Exception as e:
-            self.Display_Message_DDS('Could not load STP from %s\n'%fname+str(e))
-            
+        self.service.load_STP(fname or self.get_fname('Open STP File'))
+        self.applyAmpValidators()
+
     def load_RAMprofile(self, fname=''):
         """Input the values from the RAM file into the stored data and line edits."""
-        try:
-            if not fname:
-                fname, _ = QtWidgets.QFileDialog.getOpenFileName(
-                    self.centralwidget, 'Open RAM Profile', '', 'txt(*.txt);;all (*)')
-            if os.path.exists(fname): # if user cancels then fname is empty str
-                data = np.loadtxt(fname, delimiter=',')
-                self.Start_Address    = data[:5,:]
-                self.End_Address      = data[5:10,:]
-                self.Rate             = data[10:15,:]
-                self.No_dwell         = data[15:20,:]
-                self.Zero_crossing    = data[20:25,:]
-                self.RAM_playback_mode = data[25:,:].reshape(5,8,3)
-                self.redisplay_profiles()
-        except Exception as e:
-            self.Display_Message_DDS('Could not load RAM profiles from %s\n'%fname+str(e))
+        self.service.load_RAMprofile(fname or self.get_fname('Open RAM Profile'))
 
     def load_all(self, fname=''):
         """Take STP, RAM and auxiliary parameters from a file."""
-        try:
-            if not fname:
-                fname, _ = QtWidgets.QFileDialog.getOpenFileName(
-                    self.centralwidget, 'Open File', '', 'txt(*.txt);;all (*)')
-            if os.path.exists(fname): # if user cancels then fname is empty str
-                with open(fname) as f:
-                    data = json.load(f)
-                for key, val in data.items():
-                    if 'RAM_data_filename' in key:
-                        self.Display_Message_DDS('RAM data files were: %s'%val)
-#                        self.RAM_data_filename = val
-                    else:
-                        setattr(self, key, np.array(val, dtype=float))
-                self.redisplay_profiles()
-                self.applyAmpValidators()
-                self.Display_Message_DDS('Loaded parameters from %s'%fname)
-        except Exception as e:
-            self.Display_Message_DDS('Could not load params from %s\n'%fname+str(e))
-            
-    def save_data(self, data, fname='', mode='STP'):
-        """Save data to a file."""
-        try:
-            if not fname:
-                fname, _ = QtWidgets.QFileDialog.getSaveFileName(
-                    self.centralwidget, 'Save File', '', 'txt(*.txt);;all (*)')
-            if 'all params' in mode:
-                with open(fname, 'w') as f:
-                    json.dump(data, f)
-            else: np.savetxt(fname, data, delimiter = ',')
-            self.Display_Message_DDS(mode+' saved to %s'%fname)
-        except (OSError, FileNotFoundError, IndexError) as e:
-            self.Display_Message_DDS('Could not save '+mode+' to %s\n'%fname+str(e))
+        self.service.load_all(fname or self.get_fname())
+        self.applyAmpValidators()
 
     def save_STP(self, fname=''):
         """Save all the single tone profile parameters to a text file."""
-        data = np.array([self.fout, self.tht, self.amp]).reshape(15,8)
-        self.save_data(data, fname, mode='STP')
-            
+        self.service.save_STP(fname or self.get_fname('Save File', save=True))
+
     def save_RAMprofile(self, fname=''):
         """Save the RAM playback parameters to a text file."""
-        data = np.append(np.array([self.Start_Address, self.End_Address, 
-                    self.Rate, self.No_dwell, self.Zero_crossing]).reshape(25,8), 
-                    self.RAM_playback_mode.reshape(15,8), axis=0)
-        self.save_data(data, fname, mode='RAM profiles')
+        self.service.save_RAMprofile(fname or self.get_fname('Save File', save=True))
 
     def save_all(self, fname=''):
         """Save STP, RAM, and auxiliary parameters to a text file."""
-        try:
-            data = OrderedDict()
-            for key in ['FTW', 'POW', 'AMW']:
-                data[key] = list(getattr(self, key).astype(str))
-            for key in ['fout', 'tht', 'amp', 'Start_Address', 
-                    'End_Address', 'Rate', 'No_dwell', 'Zero_crossing']:
-                data[key] = [list(x) for x in getattr(self, key).astype(str)]
-            data['RAM_playback_mode'] = [[list(y) for y in x] for x in self.RAM_playback_mode.astype(str)]
-            data['RAM_data_filename'] = self.RAM_data_filename
-        except ValueError as e: self.Display_Message_DDS("Failed to save parameters:\n"+str(e))
-        self.save_data(data, fname, mode='all params')
-       
+        self.service.save_all(fname or self.get_fname('Save File', save=True))
+
     def enter_ramp_mode(self):
         """When ramp mode checkbox is checked, let pydex know it's in ramp mode"""
         if self.checkBox.isChecked() and not 'ramp' in self.mode:
@@ -1296,16 +619,8 @@ class PSoC(object):
         ## Change the DDS parameters
         self.FM_gain_value = self.bin_array(int(self.FM_gain.currentText()), 4)
 
-
         #Send any changes to the registers to the DDS
-        self.CFR1_register_loader()
-        self.CFR2_register_loader()
-
-
-        self.Format_array_transmission(0, self.CFR1, 4)
-
-        ### CFR2
-        self.Format_array_transmission(1, self.CFR2, 4)
+        self.service.add_command('load_control_registers', self.Module_address.currentText())
 
     def file_open_FPGA_file_func(self):
         """
@@ -1556,3 +871,18 @@ class PSoC(object):
         # dd/mm/YY H:M:S
         dt_string = now.strftime("%d/%m/%Y %H:%M:%S")
         self.fpga_PROGRAMMER_dia.append(dt_string + '>> \t ' + str(x))
+
+
+def _shared(key):
+    """A property that gets and sets the attribute of the DDS service,
+    waiting for the command that the service is carrying out to finish."""
+    def get(self):
+        with self.service.state_lock:
+            return getattr(self.service, key)
+    def set(self, value):
+        with self.service.state_lock:
+            setattr(self.service, key, value)
+    return property(get, set)
+
+for key in ddsService.state_keys:
+    setattr(PSoC, key, _shared(key))
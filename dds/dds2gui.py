@@ -85,10 +85,10 @@ class Ui_MainWindow(PSoC):
         
         self.mode = 'single tone'  # so PyDex knows which mode we're using.
 
-        # TCP server for communication with PyDex
+        # TCP server for communication with PyDex. Commands go to the DDS service
         self.tcp = PyClient(host=host, port=port)
         # reset_slot(self.tcp.dxnum, self.set_n, True)
-        reset_slot(self.tcp.textin, self.respond, True)
+        reset_slot(self.tcp.textin, self.service.respond, True)
         self.tcp.start()
 
         # store profiles for each COM port
@@ -1237,6 +1237,7 @@ class Ui_MainWindow(PSoC):
         for keys in self.RAM_data_type.keys():
             self.RAM_data.addItem(keys)
         self.RAM_data.currentIndexChanged.connect(self.disable_modulation_type_DRG)
+        self.RAM_data.currentIndexChanged.connect(lambda i: self.update_values_RAM())
 
         self.label_145 = QtWidgets.QLabel(self.GB_ProgRAM)
         self.label_145.setGeometry(QtCore.QRect(10, 20, 61, 16))
@@ -1252,6 +1253,7 @@ class Ui_MainWindow(PSoC):
 
         for keys in self.RAM_controls.keys():
             self.Int_ctrl.addItem(keys)
+        self.Int_ctrl.currentIndexChanged.connect(lambda i: self.update_values_RAM())
 
         #self.RAM_blocks = QtWidgets.QLCDNumber(self.GB_ProgRAM)
         #self.RAM_blocks.setGeometry(QtCore.QRect(30, 100, 64, 23))
@@ -1864,6 +1866,8 @@ if __name__ == "__main__":
     def closeEvent(event):
         """actions to carry out before closing the window"""
         ui.save_all('dds/defaultDDS2.txt')
+        ui.tcp.close()
+        ui.service.close() # waits for the service thread, then closes the serial port
         event.accept()
     MainWindow.closeEvent = closeEvent
 
@@ -0,0 +1,173 @@
+"""PyDex - DDS register encoder
+
+ - Convert arrays of frequency, phase and amplitude into AD9910 register
+   words with numpy, instead of building a bit array for each value
+ - Pack the words into big-endian bytes ready to frame for the PSoC
+ - The __main__ block checks the encoding against the original bit
+   array functions over the RAM data files and random profiles
+"""
+import os
+import time
+import numpy as np
+
+FCLK = 1000     # AD9910 system clock frequency in MHz
+RAM_SIZE = 1024 # number of 32-bit words in the DDS RAM
+
+def to_words(values, scale, top):
+    """Round scale*values to integers, limited to top.
+    Return the words and the rounded values before they were limited.
+    Raises ValueError for values that can't be encoded, like the
+    original bit arrays did."""
+    rounded = np.around(scale * np.asarray(values, dtype=float), decimals=0)
+    if not np.all(np.isfinite(rounded)) or np.any(rounded < 0):
+        raise ValueError('Cannot encode values: ' + str(values))
+    return np.minimum(rounded, top).astype(np.uint64), rounded
+
+def freq_words(f):
+    """Frequency tuning words for frequencies f in MHz, limited to 2**31."""
+    return to_words(np.asarray(f, dtype=float)/FCLK, 2**32, 2**31)[0]
+
+def phase_words(theta):
+    """Phase offset words for phases theta in degrees."""
+    return to_words(np.asarray(theta, dtype=float)/360, 2**16, 2**16-1)[0]
+
+def amp_words(amp):
+    """Amplitude scale factors for fractional amplitudes."""
+    return to_words(amp, 2**14, 2**14-1)[0]
+
+def profile_words(f, amp, theta):
+    """Single tone profile registers from the words for frequency,
+    amplitude and phase: ASF[61:48] | POW[47:32] | FTW[31:0]"""
+    return amp << np.uint64(48) | theta << np.uint64(32) | f
+
+def ram_profile_words(rate, start, end, mode, zero_crossing, no_dwell):
+    """RAM profile registers: step rate[55:40] | end address[39:30] |
+    start address[23:14] | no dwell[5] | zero crossing[3] | mode[2:0]
+    rate  -- step rate in us, refreshed at f_clk/4 = 250 MHz
+    mode  -- array (n, 3) of the playback mode bits, MSB first"""
+    u = lambda x: np.asarray(x).astype(np.uint64)
+    mode = u(mode)
+    return (u(np.around(np.asarray(rate)*250, decimals=0)) << u(40)
+        | u(np.around(end, decimals=0)) << u(30) | u(np.around(start, decimals=0)) << u(14)
+        | u(no_dwell) << u(5) | u(zero_crossing) << u(3)
+        | mode[:,0] << u(2) | mode[:,1] << u(1) | mode[:,2])
+
+def register_bytes(words, nbytes=8):
+    """Pack the register words as big-endian bytes, nbytes per word.
+    Return a list of bytes, or bytes if a single word was given."""
+    words = np.asarray(words, dtype=np.uint64)
+    b = words.astype('>u%s'%nbytes).tobytes()
+    if words.ndim == 0:
+        return b
+    return [b[i:i+nbytes] for i in range(0, len(b), nbytes)]
+
+def ram_block(words, nbits, words2=None, nbits2=14):
+    """Return the 4096 bytes of DDS RAM for up to 1024 words.
+    Each word is MSB aligned in 32 bits, with words2 following it (used
+    for polar data: phase then amplitude). Unused addresses are 0.
+    The RAM data is sent starting from the last address."""
+    reg = np.zeros(RAM_SIZE, dtype=np.uint64)
+    n = min(len(words), RAM_SIZE)
+    reg[:n] = np.asarray(words[:n], dtype=np.uint64) << np.uint64(32 - nbits)
+    if words2 is not None:
+        reg[:n] |= np.asarray(words2[:n], dtype=np.uint64) << np.uint64(32 - nbits - nbits2)
+    return reg[::-1].astype('>u4').tobytes()
+
+#### #### reference: the original bit array encoding #### ####
+
+def bin_array(num, m):
+    """Convert a positive integer num into an m-bit bit vector"""
+    return np.array(list(np.binary_repr(num).zfill(m))).astype(np.int8)
+
+def bitwise_ram_frame(address, data, ind):
+    """The RAM data frame as Load_RAM_playback built it."""
+    RAM_data_reg = np.zeros((1024, 32), dtype = np.bool_())
+    end = min(len(data), 1024)
+    for ic in range(end):
+        RAM_data_reg[ic, 0: ind] = bin_array(int(data[ic]), ind)
+    pack = [address, 22, 0, 32, 128]
+    Sum = sum(pack)
+    for ic in range(1024):
+        for jc in range(4):
+            a = np.packbits(RAM_data_reg[-1-ic, 8*jc: 8*(jc+1) ])[0]
+            pack.append(int(a))
+            Sum += pack[ic + 5]
+    pack[2] = -Sum % 256
+    return bytes(pack)
+
+def bitwise_profile(f, a, p):
+    """A single tone profile as Format_profile_register_data built it."""
+    profile = np.zeros(64, dtype = np.bool_())
+    profile[2:16] = bin_array(a, 14)
+    profile[16:32] = bin_array(p, 16)
+    profile[32:64] = bin_array(f, 32)
+    return np.packbits(profile).tobytes()
+
+def bitwise_ram_profile(rate, start, end, mode, zero_crossing, no_dwell):
+    """A RAM profile as Format_RAM_register_data built it."""
+    RAM_profile = np.zeros(64, dtype = np.bool_())
+    RAM_profile[61:64] = mode
+    RAM_profile[60] = zero_crossing
+    RAM_profile[58] = no_dwell
+    RAM_profile[8:24] = bin_array(int(np.around((rate*250), decimals = 0)), 16)
+    RAM_profile[24:34] = bin_array(int(np.around((end))), 10)
+    RAM_profile[40:50] = bin_array(int(np.around((start))), 10)
+    return np.packbits(RAM_profile).tobytes()
+
+if __name__ == "__main__":
+    from psocSerial import frame, RAM_ID
+    datadir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dds', 'Data_Files')
+    corpus = {f: np.loadtxt(os.path.join(datadir, f), delimiter=',', ndmin=2)[0]
+        for f in sorted(os.listdir(datadir)) if f.endswith('.csv')}
+    rng = np.random.default_rng(1)
+    corpus.update({'random %s'%n: rng.uniform(0, 500, n) for n in [1, 100, 1024, 2000]})
+    t_bits, t_arr, match = 0, 0, True
+    for name, x in corpus.items():
+        for ID, nbits, words in [[0, 32, lambda x: freq_words(np.absolute(x))],
+                [1, 16, lambda x: phase_words(np.absolute(x))],
+                [2, 14, lambda x: amp_words(np.absolute(x)/np.amax(x))]]:
+            t0 = time.perf_counter()
+            if ID == 0: # the original scaling
+                data = np.around((2**32 *(np.absolute(x)/1000)), decimals = 0)
+                data[np.where(data >= 2**31)[0]] = 2**31
+            elif ID == 1:
+                data = np.around((2**16 *(np.absolute(x)/360)), decimals = 0)
+                data[np.where(data >= 2**16)[0]] = 2**16 - 1
+            else:
+                data = np.around(2**14 *(np.absolute(x)/np.amax(x)), decimals = 0)
+                data[np.where(data >= 2**14)[0]] = 2**14 - 1
+            ref = bitwise_ram_frame(3, data, nbits)
+            t1 = time.perf_counter()
+            new = frame(3, RAM_ID, ram_block(words(x), nbits), (32, 128))
+            t2 = time.perf_counter()
+            t_bits += t1 - t0
+            t_arr += t2 - t1
+            if new != ref:
+                match = False
+                print('RAM data mismatch: %s, type %s'%(name, ID))
+    print('RAM frames for %s files x 3 types: bit arrays %.3g s, numpy %.3g s, identical: %s'%(
+        len(corpus), t_bits, t_arr, match))
+    # single tone and RAM profiles
+    n = 1000
+    f, a, p = rng.uniform(0, 500, n), rng.uniform(0, 1.1, n), rng.uniform(0, 400, n)
+    t0 = time.perf_counter()
+    ref = []
+    for i in range(n):
+        fi = min(int(np.around((2**32 *(f[i]/1000)), decimals = 0)), 2**31)
+        ai = min(int(np.around(2**14 * abs(a[i]), decimals = 0)), 2**14-1)
+        pi = min(int(np.around((2**16 *(p[i]/360)), decimals = 0)), 2**16-1)
+        ref.append(bitwise_profile(fi, ai, pi))
+    t1 = time.perf_counter()
+    new = register_bytes(profile_words(freq_words(f), amp_words(np.absolute(a)), phase_words(p)))
+    t2 = time.perf_counter()
+    print('%s single tone profiles: bit arrays %.3g s, numpy %.3g s, identical: %s'%(n, t1-t0, t2-t1, new == ref))
+    rate = np.around(rng.uniform(0.004, 262.14, n), 3)
+    start = rng.integers(0, 1022, n)
+    end = np.minimum(start + rng.integers(1, 500, n), 1023)
+    mode, zc, nd = rng.integers(0, 2, (n, 3)), rng.integers(0, 2, n), rng.integers(0, 2, n)
+    t0 = time.perf_counter()
+    ref = [bitwise_ram_profile(rate[i], start[i], end[i], mode[i], zc[i], nd[i]) for i in range(n)]
+    t1 = time.perf_counter()
+    new = register_bytes(ram_profile_words(rate, start, end, mode, zc, nd))
+    t2 = time.perf_counter()
+    print('%s RAM profiles: bit arrays %.3g s, numpy %.3g s, identical: %s'%(n, t1-t0, t2-t1, new == ref))
@@ -0,0 +1,995 @@
+"""PyDex - DDS service
+
+ - Headless control of the DDS: owns the serial link to the PSoC, the
+   stored profile data, and the encoding of the DDS registers
+ - Commands are queued and carried out in the service's own thread, so
+   that programming the DDS doesn't wait on the GUI and vice versa
+ - Commands can be given in-process with add_command, or as text
+   messages 'option=value' over TCP with respond
+ - The GUIs are clients: they edit the service's data and display its
+   messages. Commands that only change the GUI are passed on with the
+   gui_command signal.
+ - The service thread holds state_lock while it carries out a command,
+   and the GUIs take it to read or change the stored data, so the data
+   doesn't change while a module is being programmed.
+ - Run this file to control the DDS without a GUI
+"""
+import os
+import sys
+import ast
+import json
+import time
+import datetime
+import threading
+import numpy as np
+import serial
+from collections import OrderedDict, namedtuple
+from PyQt5.QtCore import QThread, pyqtSignal
+from psocSerial import (PSoCTransport, registerMirror, frame, pack_bits,
+    parse_register_dump, RAM_ID, DEBUG_ID)
+from ddsEncoder import (to_words, freq_words, phase_words, amp_words, profile_words,
+    ram_profile_words, register_bytes, ram_block, bin_array, RAM_SIZE)
+
+# power calibration accounting for AOM nonlinearity
+from scipy.interpolate import interp1d
+
+def load_calibration(dds_index):
+    global cal, cals, alim
+    try:
+        print('loading DDS calibration: '+'dds/dds{}_power_calibration.csv'.format(dds_index))
+        cal = np.loadtxt('dds/dds{}_power_calibration.csv'.format(dds_index), delimiter=',').T
+        cals = [interp1d(cal[i+1], cal[0], fill_value='extrapolate') for i in range(len(cal)-1)]
+        # cals = [interp1d(np.linspace(0,1,10), np.linspace(0,1,10), fill_value='extrapolate')
+        #         for i in range(5)]
+        alim = 1.0
+    except OSError as e:
+        print('\033[31m' + '####\tERROR\t' + time.strftime('%d.%m.%Y\t%H:%M:%S'))
+        print('\tCould not load power calibration file:\n' + str(e) + '\n', '\033[m')
+        cals = [interp1d(np.linspace(0,1,10), np.linspace(0,1,10), fill_value='extrapolate')
+                for i in range(5)]
+        alim = 0.5
+
+# a parameter to set: module address, profile ('P0'-'P7' or 'aux'), key, value
+ddsParam = namedtuple('ddsParam', ['module', 'profile', 'key', 'value'])
+
+class ddsService(QThread):
+    """Programme the DDS modules on a serial port from the stored data.
+    The data for each module is stored in arrays indexed by the module
+    address. Commands are carried out in order in the service thread.
+    port         -- serial port that the PSoC is connected to
+    enable_print -- print the frames sent to the PSoC"""
+    textout = pyqtSignal(str)     # message to display
+    updated = pyqtSignal()        # the stored data changed
+    gui_command = pyqtSignal(str) # command for the GUI to handle
+
+    mode_options = ['single tone', 'RAM', 'single tone + ramp', 'RAM + ramp', 'FPGA'] # allowed modes of operation
+    amp_options = ['fixed amp', 'manual on/off', 'amp scaling']
+    RAM_data_type = {'Frequency' : np.array([0,0]),
+                        'Phase' : np.array([0,1]),
+                        'Amplitude' : np.array([1,0]),
+                        'Polar' : np.array([1,1])}
+    RAM_controls = OrderedDict([("Disable" , np.array([0,0,0,0])),
+                    ("Burst. Profiles 0 - 1" , np.array([0,0,0,1])),
+                    ("Burst. Profiles 0 - 2" , np.array([0,0,1,0])),
+                    ("Burst. Profiles 0 - 3", np.array([0,0,1,1])),
+                    ("Burst. Profiles 0 - 4", np.array([0,1,0,0])),
+                    ("Burst. Profiles 0 - 5", np.array([0,1,0,1])),
+                    ("Burst. Profiles 0 - 6", np.array([0,1,1,0])),
+                    ("Burst. Profiles 0 - 7", np.array([0,1,1,1])),
+                    ("Continuous. Profiles 0 - 1", np.array([1,0,0,0])),
+                    ("Continuous. Profiles 0 - 2", np.array([1,0,0,1])),
+                    ("Continuous. Profiles 0 - 3", np.array([1,0,1,0])),
+                    ("Continuous. Profiles 0 - 4", np.array([1,0,1,1])),
+                    ("Continuous. Profiles 0 - 5", np.array([1,1,0,0])),
+                    ("Continuous. Profiles 0 - 6", np.array([1,1,0,1])),
+                    ("Continuous. Profiles 0 - 7", np.array([1,1,1,1]))])
+
+    # commands that the service carries out: TCP option -> method
+    commands = OrderedDict([('set_data', 'set_data'), ('programme', 'programme'),
+        ('set_mode', 'set_mode'), ('set_manual_on/off', 'set_amp_option'),
+        ('set_RAM_data_type', 'set_RAM_type'), ('set_internal_control', 'set_internal_control'),
+        ('load_RAM_playback', 'load_RAM_data'), ('save_STP', 'save_STP'), ('load_STP', 'load_STP'),
+        ('save_all', 'save_all'), ('load_all', 'load_all'), ('resend_all', 'resend_all'),
+        ('set_verify', 'set_verify'), ('set_diff_writes', 'set_diff_writes')])
+    # these commands also change the GUI
+    gui_commands = ['set_manual_on/off', 'set_RAM_data_type', 'set_internal_control']
+    # parameters of the ramp generator that set_data passes to the GUI to set
+    ramp_keys = ['Sweep_start', 'Sweep_end', 'Pos_step', 'Neg_step', 'Pos_step_rate', 'Neg_step_rate']
+
+    # attributes that are stored on the service and shared with the GUI
+    state_keys = ['fout', 'amp', 'tht', 'Start_Address', 'End_Address', 'Rate', 'No_dwell',
+        'Zero_crossing', 'RAM_playback_mode', 'FTW', 'POW', 'AMW', 'RAM_modulation_data',
+        'RAM_data_filename', 'load_DDS_ram', 'RAM_type', 'Int_control', 'mode', 'ind', 'port',
+        'ser', 'transport', 'connected', 'mirror', 'diff_writes', 'verify_writes', 'enable_print',
+        'OSK_enable', 'Manual_OSK', 'AMP_scale', 'FM_gain_value', 'RAM_enable', 'RAM_playback_dest',
+        'Int_profile_cntrl', 'CFR1', 'CFR2', 'DGR_params', 'FPGA_params', 'DGR_destination',
+        'DRG_Start', 'DRG_End', 'DRG_P_stp_Size', 'DRG_N_stpSize', 'DRG_P_stp_Rate', 'DRG_N_stp_Rate']
+
+    def __init__(self, port='', enable_print=False):
+        super().__init__()
+        self.port = port
+        self.enable_print = enable_print
+        self.ser = None
+        self.transport = None
+        self.connected = False
+        self.mirror = registerMirror() # data last written to each register
+        self.diff_writes = False   # only send registers that changed since they were last written,
+                                   # set by set_diff_writes if the registers can be read back
+        self.verify_writes = False # read back the registers after programming the DDS
+        self.mode = 'single tone'  # so PyDex knows which mode we're using.
+        self.ind = 1               # the module address that was last selected
+        self._queue = []           # commands waiting to be carried out
+        self._lock = threading.Lock() # for the command queue
+        self._wake = threading.Event()
+        self.state_lock = threading.RLock() # for the stored data, held while a command runs
+        self.stop = False
+
+        # For the single tone profiles, stored for each module address
+        self.fout = np.zeros((5,8))
+        self.amp = np.zeros((5,8))
+        self.tht = np.zeros((5,8))
+
+        # For the RAM profiles
+        self.Start_Address = np.zeros((5,8))
+        self.End_Address = np.zeros((5,8))
+        self.Rate = np.zeros((5,8))
+        self.No_dwell = np.zeros((5,8))
+        self.Zero_crossing = np.zeros((5,8))
+        self.RAM_playback_mode = np.zeros((5, 8, 3))
+
+        #Amplitude control
+        self.OSK_enable = 0
+        self.Manual_OSK = 0
+        self.AMP_scale = 1
+        self.FM_gain_value = np.array([0,0,0,0])
+
+        # Auxillary control parameters
+        self.FTW = np.ones(5)*110
+        self.POW = np.zeros(5)
+        self.AMW = np.ones(5)
+
+        #RAM playblack options
+        self.RAM_enable = 0
+        self.RAM_playback_dest = np.array([0,0])
+        self.Int_profile_cntrl = np.array([0,0,0,0])
+        self.RAM_type = 'Frequency'  # which parameter the RAM data modulates
+        self.Int_control = 'Disable' # RAM internal profile control
+        self.RAM_modulation_data = [[]]*5
+        self.RAM_data_filename = ['']*5
+        self.load_DDS_ram = False
+
+        #Register arrays
+        self.CFR1 = np.zeros(32, dtype = np.bool_())
+        self.CFR2 = np.zeros(32, dtype = np.bool_())
+
+        # digital ramp generator
+        self.DGR_params = np.zeros(6)
+        self.DGR_destination = np.array([1,1])
+        self.DRG_Start, self.DRG_End = 0, 0
+        self.DRG_P_stp_Size, self.DRG_N_stpSize = 0, 0
+        self.DRG_P_stp_Rate, self.DRG_N_stp_Rate = 0, 0
+        self.FPGA_params = np.array([0,0,1])
+
+    #### #### command queue #### ####
+
+    def message(self, x):
+        """Send a message to display."""
+        self.textout.emit(str(x))
+
+    def add_command(self, name, *args):
+        """Queue a call of method name(*args) to be carried out in the
+        service thread, starting the thread if it isn't running."""
+        with self._lock:
+            self._queue.append((name, args))
+            if not self.isRunning():
+                self.stop = False
+                self.start()
+        self._wake.set()
+
+    def run(self):
+        """Carry out the queued commands in order until stopped."""
+        while not self.stop:
+            self._wake.wait(0.1)
+            self._wake.clear()
+            while self._queue and not self.stop:
+                with self._lock:
+                    name, args = self._queue.pop(0)
+                try:
+                    with self.state_lock:
+                        getattr(self, name)(*args)
+                except Exception as e:
+                    self.message('DDS command %s failed: %s'%(name, e))
+
+    def close(self):
+        """Stop the service thread and disconnect."""
+        self.stop = True
+        self._wake.set()
+        self.wait()
+        self.disconnect()
+
+    def respond(self, cmd=None):
+        """Respond to the command sent by TCP message to the client.
+        The syntax is:  option=value
+        If setting new data, the value syntax is:
+            [[port1,profile1,key1,val1],[port2,profile2,key2,val2],...]
+        Commands that the service doesn't handle are passed to the GUI."""
+        try:
+            key, value = str(cmd).split('=', 1)
+        except ValueError:
+            self.message('Command not understood: '+str(cmd))
+            return
+        if key in self.commands:
+            if key == 'set_data':
+                try:
+                    value = ast.literal_eval(value) # nested list of parameters to change
+                except Exception as e:
+                    self.message('Failed to evaluate command: '+str(cmd))
+                    return
+            self.add_command(self.commands[key], value)
+        if key not in self.commands or key in self.gui_commands:
+            self.gui_command.emit(cmd)
+
+    #### #### serial link #### ####
+
+    def connect(self, port=''):
+        """Open the serial port to the PSoC and say hello."""
+        if port:
+            self.port = port
+        if self.connected:
+            return True
+        elif not self.port or self.port == '--':
+            self.message('Please set the COM port number.')
+            return False
+        try:
+            self.ser = serial.Serial(
+                port=self.port,
+                baudrate=115200,
+                parity=serial.PARITY_NONE,
+                stopbits=serial.STOPBITS_ONE,
+                bytesize= serial.EIGHTBITS)
+            self.transport = PSoCTransport(self.ser)
+            self.mirror.forget(self.port) # DDS state unknown after reconnecting
+            time.sleep(0.05)
+            self.connected = True
+            self.message('Connected to ' + self.port)
+        except (OSError, serial.SerialException, ValueError) as e:
+            self.message('Failed opening port, check port properties and COM name.\n'+str(e))
+        return self.connected
+
+    def disconnect(self):
+        """Close the serial port."""
+        if self.connected:
+            self.connected = False
+            self.mirror.forget(self.port) # the DDS could be reset before reconnecting
+            self.ser.close()
+            self.message('Disconnected from ' + self.port)
+
+    def send(self, pack):
+        """Sends the command frame to the DDS in a single write and displays
+        the reply. If diff_writes, registers that are unchanged are not
+        sent again. Returns the reply."""
+        if self.enable_print:
+            print(pack)
+        if self.diff_writes and self.mirror.unchanged(self.port, pack):
+            self.mirror.skip(pack)
+            return ''
+        try:
+            out = self.transport.send(pack)
+        except (OSError, serial.SerialException):
+            self.mirror.forget(self.port)
+            self.message('COM port is no longer connected. Could not send message.')
+            return ''
+        self.mirror.update(self.port, pack, out)
+        if out != '':
+            self.message(out)
+        return out
+
+    def write(self, module, command_ID, data=b'', lengths=None):
+        """Frame the data for a DDS module and send it if connected.
+        Returns the frame."""
+        pack = frame(int(module), command_ID, data, lengths)
+        if self.connected:
+            self.send(pack)
+        return pack
+
+    def read_message(self, timeout=None):
+        """Display any messages the DDS sends within the timeout."""
+        if self.connected:
+            out = self.transport.read_reply(timeout)
+            if out != '':
+                self.message(out)
+
+    def handshake(self, module):
+        """Requests the PSoC to say hello on start-up. Displays version number."""
+        self.write(module, 24)
+        self.read_message()
+
+    def debug_registers(self, module):
+        """Requests the PSoC to debug the DDS registers"""
+        self.write(module, DEBUG_ID)
+        self.read_message()
+
+    def verify_registers(self, module):
+        """Request the register contents from the PSoC and compare them with
+        the data that was last written. Registers that differ are sent again
+        the next time the DDS is programmed. Returns True if all match."""
+        if not self.connected:
+            return False
+        regs = parse_register_dump(self.send(frame(int(module), DEBUG_ID)))
+        if not regs:
+            self.message('Could not read back the registers to verify them.')
+            return False
+        wrong = self.mirror.compare(self.port, int(module), regs)
+        if wrong:
+            self.message('Registers %s did not match the data written.'%wrong)
+        else:
+            self.message('Verified %s registers.'%len(regs))
+        return not wrong
+
+    def resend_all(self, value=''):
+        """Forget the register mirror so that all registers are sent."""
+        self.mirror.forget()
+        self.message('All registers will be sent the next time the DDS is programmed.')
+
+    def set_diff_writes(self, value='True'):
+        """Turn on skipping registers that are unchanged since they were last
+        written. The mirror of the registers can drift from the DDS, e.g. if
+        it's power cycled, so this is only turned on if the registers of the
+        current module can be read back from the connected device."""
+        on = str(value) in ['True', 'true', '1']
+        if on and not self.verify_registers(self.ind):
+            on = False
+            self.message('Registers could not be read back, so all registers will be sent.')
+        self.diff_writes = on
+        self.message('Skipping unchanged registers is %s.'%('on' if on else 'off'))
+
+    def set_verify(self, value='True'):
+        """Turn register readback after programming on or off."""
+        self.verify_writes = str(value) in ['True', 'true', '1']
+        self.message('Register readback after programming is %s.'%(
+            'on' if self.verify_writes else 'off'))
+
+    #### #### set the stored data #### ####
+
+    def set_data(self, value_list):
+        """Set the stored parameters, then select each module in the GUI and
+        programme it. Parameters that aren't recognised are rejected.
+        value_list -- list of ddsParam, or [module, profile, key, value]
+        In a ramp mode, the ramp generator settings are passed on to the 
+        GUI with the stored ones, and the GUI programmes the DDS modules 
+        for both after it has updated."""
+        keys = ' '.join(str(x[2]) + str(x[1]) for x in value_list)
+        if any(x in keys for x in['Freq', 'Phase', 'Amp']) and 'aux' not in keys:
+            self.mode = 'single tone'
+        elif any(x in keys for x in['Start_add', 'End_add', 'Step_rate', 'aux']):
+            self.mode = 'RAM'
+        success, ramp = [], []
+        for p in map(lambda x: ddsParam(*x), value_list):
+            try:
+                i, profile, key, val = int(p.module), str(p.profile), p.key, float(p.value)
+                if 'Freq' in key and 'aux' not in profile:
+                    self.fout[i, int(profile[1])] = val
+                elif 'Phase' in key and 'aux' not in profile:
+                    self.tht[i, int(profile[1])] = val
+                elif 'Amp' in key and 'aux' not in profile:
+                    self.amp[i, int(profile[1])] = val
+                elif 'Start_add' in key:
+                    self.Start_Address[i, int(profile[1])] = val
+                elif 'End_add' in key:
+                    self.End_Address[i, int(profile[1])] = val
+                elif 'Step_rate' in key:
+                    self.Rate[i, int(profile[1])] = val
+                elif 'Freq' in key and 'aux' in profile:
+                    self.FTW[i] = val
+                elif 'Phase' in key and 'aux' in profile:
+                    self.POW[i] = val
+                elif 'Amp' in key and 'aux' in profile:
+                    self.AMW[i] = val
+                    self.load_DDS_ram = True
+                elif key in self.ramp_keys and 'ramp' in self.mode:
+                    ramp.append(list(p))
+                    continue
+                else:
+                    raise ValueError('not a parameter of the %s mode'%self.mode)
+                success.append(list(p))
+            except Exception as e:
+                self.message('Invalid DDS parameter %s: %s'%(list(p), e))
+        self.updated.emit()
+        if success:
+            self.message('Set parameters %s'%success)
+        modules = list(OrderedDict.fromkeys(str(p[0]) for p in success + ramp))
+        for module in modules:
+            self.gui_command.emit('set_module=%s'%module)
+        if ramp: # the GUI sets these, then programmes all of the modules
+            self.gui_command.emit('set_data=%s'%[success, ramp])
+        elif modules:
+            if not self.connected:
+                self.connect()
+            self.programme(modules)
+
+    def set_mode(self, value):
+        """Choose which registers are programmed."""
+        self.mode = value if value in self.mode_options else 'single tone'
+        self.message('Changed to '+self.mode+' mode.')
+
+    def set_amp_option(self, value):
+        """Toggle between amplitude options:
+        0 = fixed, 1 = manual on/off, 2 = amp scaling"""
+        if value in self.amp_options:
+            i = self.amp_options.index(value)
+            self.AMP_scale = 1 if 'RAM' in self.mode else i//2
+            self.OSK_enable = i%2
+            self.Manual_OSK = i%2
+            self.message('Changed to %s.'%value)
+
+    def set_RAM_type(self, value):
+        """Set which parameter the RAM data modulates."""
+        if value in self.RAM_data_type:
+            self.RAM_type = value
+            self.message('Changed RAM data type to %s.'%value)
+
+    def set_internal_control(self, value):
+        """Set the RAM internal profile control."""
+        if value in self.RAM_controls:
+            self.Int_control = value
+            self.message('Changed RAM internal control to %s.'%value)
+
+    def load_RAM_data(self, fname, module=None):
+        """Load the RAM playback data for a module from a csv file.
+        By default the module is the one last programmed."""
+        i = int(module) if module is not None else self.ind
+        try:
+            self.RAM_modulation_data[i] = np.loadtxt(fname, delimiter = ',')
+            self.RAM_data_filename[i] = os.path.basename(fname)
+            self.message("DSS RAM data loaded from > \t " + fname)
+            self.load_DDS_ram = True
+            self.updated.emit()
+        except (OSError, ValueError) as e:
+            self.message("Data load failed\n"+str(e))
+            self.load_DDS_ram = False
+
+    #### #### programme the DDS #### ####
+
+    def programme(self, modules=None):
+        """Programme the DDS modules with the stored data for the current mode."""
+        if modules is None or modules == '':
+            modules = [self.ind]
+        elif isinstance(modules, (str, int)):
+            modules = [modules]
+        for module in modules:
+            self.ind = int(module)
+            if 'single tone' in self.mode:
+                self.load_single_tone(module)
+            elif 'RAM' in self.mode:
+                self.load_RAM_playback(module)
+            if self.verify_writes:
+                self.verify_registers(module)
+        self.updated.emit()
+        self.message(self.mirror.stats())
+
+    def load_single_tone(self, module):
+        """Format all the registers ready for UART transmission."""
+        self.message('\n --------------------------------- \n')
+        self.RAM_enable = 0
+        if self.DGR_params[0] == 1:
+            self.Load_DGR(module)
+
+        #Send any changes to the registers to the DDS
+        self.CFR1_register_loader()
+        self.CFR2_register_loader()
+
+        #Update the control registers if there has been a chnage
+        self.write(module, 0, pack_bits(self.CFR1, 4))
+        self.write(module, 1, pack_bits(self.CFR2, 4))
+
+        #Encode the parameters and send to the PSoC
+        self.Format_profile_register_data(module)
+
+    def load_RAM_playback(self, module):
+        """Format all the registers ready for UART transmission."""
+        ind = int(module)
+        self.RAM_enable = 0
+        # Make sure that RAM mode is disabled
+        self.CFR1_register_loader()
+        self.write(module, 0, pack_bits(self.CFR1, 4))
+        # playback info for the RAM mode
+        self.RAM_playback_dest = self.RAM_data_type.get(self.RAM_type)
+        self.Int_profile_cntrl = self.RAM_controls.get(self.Int_control)
+
+        if self.DGR_params[0] == 1:
+            self.Load_DGR(module)
+
+        #Encode the parameters and send to the PSoC
+        self.Format_RAM_register_data(module, False) # False means set profile 0 only
+
+        #FTW load. Note AD9910 has a clock frequency of 1 GHz or 1000 MHz
+        self.write(module, 7, register_bytes(freq_words(abs(self.FTW[ind])), 4))
+
+        # POW load, not necessary for an AOM but included for completeness
+        self.write(module, 8, register_bytes(phase_words(abs(self.POW[ind])), 2))
+
+        #Send the RAM data. Note this is sent backwards. Because reasons
+        try:
+            # Make sure that wwe have RAM data loaded
+            RAM_data = self.RAM_modulation_data[ind]
+            if len(RAM_data[0,:]) >= RAM_SIZE:
+               self.message('Data is too long and will be truncated')
+
+            NTS = self.RAM_data_type.get(self.RAM_type) # Do not allow this state
+            ID =  2*(NTS[0]) + NTS[1]
+            data2 = None
+
+            if ID == 0: # If the ramp generator is modulating frequency
+                data, nbits = freq_words(np.absolute(RAM_data[0,:])), 32
+
+            elif ID == 1: # If the ramp generator is modulating phase
+                data, nbits = phase_words(np.absolute(RAM_data[0,:])), 16
+
+            elif ID == 2:
+                data, nbits = amp_words(self.powercal(ind, np.absolute(RAM_data[0,:]
+                        )/ np.amax(RAM_data[0, :])*self.AMW[ind])), 14
+            else: # polar: phase followed by amplitude
+                data, nbits = phase_words(np.absolute(RAM_data[0,:])), 16
+                data2 = amp_words(np.absolute(RAM_data[1,:])/ np.amax(RAM_data[1, :]))
+
+            if self.load_DDS_ram:
+                # data length is 32*128 = 4096 bytes
+                self.write(module, RAM_ID, ram_block(data, nbits, data2), (32, 128))
+                self.load_DDS_ram = False
+        except Exception as e:
+            self.message("Make sure the RAM data has been loaded.\n"+str(e))
+            self.message("RAM data shape: "+str(np.shape(self.RAM_modulation_data[ind])))
+
+        self.Format_RAM_register_data(module, True)
+
+        self.RAM_enable = 1
+
+        #Send any changes to the registers to the DDS
+        self.CFR1_register_loader()
+        self.CFR2_register_loader()
+
+        self.write(module, 0, pack_bits(self.CFR1, 4))
+
+        ### CFR2
+        self.write(module, 1, pack_bits(self.CFR2, 4))
+
+    def load_control_registers(self, module):
+        """Send the control function registers CFR1 and CFR2."""
+        self.CFR1_register_loader()
+        self.CFR2_register_loader()
+        self.write(module, 0, pack_bits(self.CFR1, 4))
+        self.write(module, 1, pack_bits(self.CFR2, 4))
+
+    def powercal(self, ind, amp):
+        """Recalibrate the amplitude to account for AOM nonlinearity"""
+        return cals[ind](amp)
+
+    def CFR1_register_loader(self):
+        """
+        Rewrites register 1 on the DDS. This is rather invloved. Look at the AD9910 datasheet.
+        """
+        #self.RAM_enable = 0## disables RAM functionality (default). 1 = enables RAM functionality (required for both load/retrieve and playback operation).
+        #RAM_playback_dest = np.array([0,0]) #RAM Playback CFR1[30:29] | Destination Bits Control Parameter | Bits Assigned
+        #Manual_OSK = 0 #Ineffective unless CFR1[9:8] = 10b. 0 = OSK pin inoperative (default). 1 = OSK pin enabled for manual OSK control 22 Inverse sinc filter enable 0 = inverse sinc filter bypassed (default).
+
+        sinc_filter = 0 #inverse sinc filter active.
+
+        #Int_profile_cntrl = np.array([0,0,0,0]) #Ineffective unless CFR1[31] = 1. These bits are effective without the need for an I/O update. See Table 14 for details. Default is 0000b.
+
+        Sine_output =  0 # Cosine  = 0 output of the DDS is selected (default). Sine = 1 output of the DDS is selected.
+        Autoclear_phase = 0 # 0 = normal operation of the DDS phase accumulator (default). 1 = synchronously resets the DDS phase accumulator anytime I/O_UPDATE is asserted or a profile change occurs.
+
+        Clear_phase_acc = 0 # 0 = normal operation of the DDS phase accumulator (default). 1 = asynchronous, static reset of the DDS phase accumulator.
+        Load_ARR = 0 #@ I/O update Ineffective unless CFR1[9:8] = 11b. 0 = normal operation of the OSK amplitude ramp rate timer (default). 1 = OSK amplitude ramp rate timer reloaded anytime I/O_UPDATE is asserted or a PROFILE[2:0] change occurs.
+#        OSK_enable = 0 #The output shift keying enable bit. 0 = OSK disabled (default). 1 = OSK enabled.
+        Auto_OSK = 0 #Ineffective unless CFR1[9] = 1. 0 = manual OSK enabled (default).1 = automatic OSK enabled.
+        Dgtl_power_down = 0 #This bit is effective without the need for an I/O update. 0 = clock signals to the digital core are active (default). 1 = clock signals to the digital core are disabled.
+        DAC_power_down = 0 #0 = DAC clock signals and bias circuits are active (default). 1 = DAC clock signals and bias circuits are disabled.
+        REFCLK = 0 #input power-down This bit is effective without the need for an I/O update. 0 = REFCLK input circuits and PLL are active (default). 1 = REFCLK input circuits and PLL are disabled.
+        Aux_DAC_power_down = 0 #0 = auxiliary DAC clock signals and bias circuits are active (default). 1 = auxiliary DAC clock signals and bias circuits are disabled.
+        Ext_power_down = 0 #0 = assertion of the EXT_PWR_DWN pin affects full power-down (default). 1 = assertion of the EXT_PWR_DWN pin affects fast recovery power-down.
+        SDIO = 0 #input only 0 = configures the SDIO pin for bidirectional operation; 2-wire serial programming mode (default). 1 = configures the serial data I/O pin (SDIO) as an input only pin; 3-wire serial programming mode.
+        LSB  = 0#first 0 = configures the serial I/O port for MSB-first format (
+
+        #############################################################################################
+        self.CFR1[0] = self.RAM_enable
+        self.CFR1[1:3] = self.RAM_playback_dest
+        self.CFR1[8] = self.Manual_OSK
+        self.CFR1[9] = sinc_filter
+        self.CFR1[11:15] = self.Int_profile_cntrl
+        self.CFR1[15] = Sine_output
+        self.CFR1[16] = self.DGR_params[3]
+        self.CFR1[17] = self.DGR_params[1]
+        self.CFR1[18] = Autoclear_phase
+        self.CFR1[19] = self.DGR_params[2]
+        self.CFR1[20] = Clear_phase_acc
+        self.CFR1[21] = Load_ARR
+        self.CFR1[22] = self.OSK_enable
+        self.CFR1[23] = Auto_OSK
+        self.CFR1[24] = Dgtl_power_down
+        self.CFR1[25] = DAC_power_down
+        self.CFR1[26] = REFCLK
+
+        self.CFR1[27] = Aux_DAC_power_down
+        self.CFR1[28] = Ext_power_down
+        self.CFR1[30] = SDIO
+        self.CFR1[31] = LSB
+
+    def CFR2_register_loader(self):
+        """
+        Rewrites register 2 on the DDS. This is rather invloved. Look at the AD9910 datasheet.
+        """
+        #AMP_scale = 0 #Enable amplitude scale from single tone profiles Ineffective if CFR2[19 ] = 1 or CFR1[31] = 1 or CFR1[9] = 1. 0 = the amplitude scaler is bypassed and shut down for power conservation (default). 1 = the amplitude is scaled by the ASF from the active profile.
+        Internal_I_O = 0 #update active This bit is effective without the need for an I/O update.
+        SYNC_CLK_en = 0 # 0 = the SYNC_CLK pin is disabled; static Logic 0 output. 1 = the SYNC_CLK pin generates a clock signal at 0.25 fSYSCLK; used for synchronization of the serial I/O port (default).
+        DGT_ramp_des = np.array([0,0]) # See Table 11 for details. Default is 00b. See the Digital Ramp Generator (DRG) section for details.
+
+        Rd_eff_FTW = 0 #a serial I/O port read operation of the FTW register reports the contents of the FTW register (default). 1 = a serial I/O port read operation of the FTW register reports the actual 32-bit word appearing at the input to the DDS phase accumulator.
+        I_O_update_rate = np.array([0,0]) #Ineffective unless CFR2[23] = 1. Sets the prescale ratio of the divider that clocks the auto I/O update timer as follows:
+
+        PDCLK_en = 1 #0 = the PDCLK pin is disabled and forced to a static Logic 0 state; the internal clock signal continues to operate and provide timing to the data assembler. 1 = the internal PDCLK signal appears at the PDCLK pin (default).
+        PDCLK_inv = 0 # 0 = normal PDCLK polarity; Q-data associated with Logic 1, I-data with Logic 0 (default). 1 = inverted PDCLK polarity.
+        TxEnable_inv = 0 # 0 = no inversion. 1 = inversion.
+
+        #Matched_latency_en = 0# 0 = simultaneous application of amplitude, phase, and frequency changes to the DDS arrive at the output in the order listed (default). 1 = simultaneous application of amplitude, phase, and frequency changes to the DDS arrive at the output simultaneously.
+        #Data_assembler_hold = 1 #hold last value Ineffective unless CFR2[4] = 1. 0 = the data assembler of the parallel data port internally forces zeros on the data path and ignores the signals on the D[15:0] and F[1:0] pins while the TxENABLE pin is Logic 0 (default). This implies that the destination of the data at the parallel data port is amplitude when TxENABLE is Logic 0. 1 = the data assembler of the parallel data port internally forces the last value received on the D[15:0] and F[1:0] pins while the TxENABLE pin is Logic 1.
+        Sync_val_dsbl = 0 #0 = enables the SYNC_SMP_ERR pin to indicate (active high) detection of a synchronization pulse sampling error. 1 = the SYNC_SMP_ERR pin is forced to a static Logic 0 condition (default).
+        #Parallel_en = 1  #See the Parallel Data Port Modulation Mode section for more details. 0 = disables parallel data port modulation functionality (default). 1 = enables parallel data port modulation functionality.
+        #FM_gain = np.array([1,0,1,1]) #See the Parallel Data Port Modulation Mode section for more details. Default is 0000b.
+
+        #############################################################################################
+        self.CFR2[7] = self.AMP_scale
+        self.CFR2[8] = Internal_I_O
+        self.CFR2[9] = SYNC_CLK_en
+        self.CFR2[10:12] = self.DGR_destination
+        self.CFR2[12] = self.DGR_params[0]
+        self.CFR2[13] = self.DGR_params[4]
+        self.CFR2[14] = self.DGR_params[5]
+        self.CFR2[15] = Rd_eff_FTW
+        self.CFR2[16:18] = I_O_update_rate
+        self.CFR2[20] = PDCLK_en
+        self.CFR2[21] = PDCLK_inv
+        self.CFR2[22] = TxEnable_inv
+
+        self.CFR2[24] = self.FPGA_params[2]
+        self.CFR2[25] = self.FPGA_params[1]
+        self.CFR2[26] = Sync_val_dsbl
+        self.CFR2[27] = self.FPGA_params[0]
+        self.CFR2[28:32] = self.FM_gain_value
+
+    def Format_profile_register_data(self, module):
+        """
+        Convert decimal values into hex strings
+        """
+        ind = int(module)
+        fout, amp, tht = self.fout[ind], self.amp[ind], self.tht[ind]
+        on = np.flatnonzero(fout != 0.0) # profiles with 0 frequency are not sent
+        if not len(on):
+            return
+        #Note AD9910 has a clock frequency of 1 GHz or 1000 MHz
+        f, f_raw = to_words(fout[on]/1000, 2**32, 2**31)
+        if np.any(f_raw > 2**31):
+            self.message("Aliasing is likely to occur. Limiting frequency to 400 MHz.")
+        a, a_raw = to_words(np.absolute(self.powercal(ind, amp[on])), 2**14, 2**14 - 1) # power calibration
+        if np.any(a_raw > 2**14):
+            self.message("Amplitude overflow")
+        p, p_raw = to_words(tht[on]/360, 2**16, 2**16 - 1)
+        if np.any(p_raw >= 2**16):
+            self.message("Phase overflow")
+
+        for ic, profile in zip(on, register_bytes(profile_words(f, a, p))):
+            self.write(module, ic + 14, profile)
+
+    def Format_RAM_register_data(self, module, switch):
+        """
+        Convert the RAM profile data into the format required by the DDS
+
+        The switch is used to write the concatenated wavefroms to the DDS, i.e. profile 0 is the write profile
+        The correct profile data is set after the RAM is programmed.
+        """
+        ind = int(module)
+        Start_Address = self.Start_Address[ind]
+        End_Address = self.End_Address[ind]
+        Rate = self.Rate[ind]
+        RAM_playback_mode = self.RAM_playback_mode[ind]
+        Zero_crossing = self.Zero_crossing[ind]
+        No_dwell = self.No_dwell[ind]
+        profiles = [] # indices of the profiles to send
+        for ic in range(8):
+            if not(switch):
+                if ic != 0:
+                    break
+
+            #Prevent negative addresses
+            if Start_Address[ic] < 0:
+                self.message("Adjusting start address of profile " + str(ic))
+                Start_Address[ic] = 0
+
+            if End_Address[ic] < 0:
+                self.message("Adjusting end address of profile " + str(ic))
+                Start_Address[ic] = Start_Address[ic] + 1
+
+            #Prevent addresses over 1024
+
+            if Start_Address[ic] >= 1023:
+                self.message("Adjusting start address of profile " + str(ic))
+                Start_Address[ic] = 1022
+
+            if End_Address[ic] >= 1024:
+                self.message("Adjusting start address of profile " + str(ic))
+                End_Address[ic] = 1023
+
+            #Prevent start > end address
+            if switch:
+                if End_Address[ic] <= Start_Address[ic]:
+                    continue
+
+            #Prevent negative or zero step rates
+
+            if Rate[ic] <= 0:
+                self.message("Adjusting step rate of profile " + str(ic))
+                Rate[ic] = 0.004
+            if Rate[ic] > 262.14:
+                self.message("Adjusting step rate of profile " + str(ic))
+                Rate[ic] = 262.14
+
+            profiles.append(ic)
+
+        if not profiles:
+            return
+        if switch:
+            start, end = Start_Address[profiles], End_Address[profiles]
+        else:
+            start, end = np.zeros(len(profiles)), np.full(len(profiles), 1023)
+        words = ram_profile_words(Rate[profiles], start, end, RAM_playback_mode[profiles],
+            Zero_crossing[profiles], No_dwell[profiles]) #Refresh rate is given by f_clk/4 = 250 MHz
+        for ic, RAM_profile in zip(profiles, register_bytes(words)):
+            self.write(module, ic + 14, RAM_profile)
+
+    def Load_DGR(self, module):
+        """
+        Convert the DRG data into the format required by the DDS
+        """
+        try:
+            ID =  int(2*self.DGR_destination[0] + self.DGR_destination[1])
+
+            if self.DRG_Start < 0:
+                self.message("Adjusting lower limit of ramp")
+                self.DRG_Start = 0
+
+            if self.DRG_Start >= self.DRG_End:
+                self.message("Check the limits of the ramp generator")
+
+            if ID == 0: # If the ramp generator is modulating frequency
+                lower = int(np.around((2**32 *(self.DRG_Start/1000)), decimals = 0)) #Note AD9910 has a clock frequency of 1 GHz or 1000 MHz
+                if lower >= 2**31:
+                    self.message("Ramp generator - aliasing is likely to occur. Limiting frequency to 400 MHz.")
+                    lower = 2**31
+                upper = int(np.around((2**32 *(self.DRG_End/1000)), decimals = 0)) #Note AD9910 has a clock frequency of 1 GHz or 1000 MHz
+                if upper >= 2**31:
+                    self.message("Ramp generator - aliasing is likely to occur. Limiting frequency to 400 MHz.")
+                    upper = 2**31
+
+                pos_step = int(np.around((2**32 *(abs(self.DRG_P_stp_Size) /1000)), decimals = 0)) #Note AD9910 has a clock frequency of 1 GHz or 1000 MHz
+                neg_step = int(np.around((2**32 *(abs(self.DRG_N_stpSize  /1000))), decimals = 0)) #Note AD9910 has a clock frequency of 1 GHz or 1000 MHz
+
+                if pos_step <= 0:
+                    pos_step = 1
+                if neg_step <= 0:
+                    neg_step = 1
+
+                if pos_step >= 2**32:
+                    pos_step = 2**32 - 1
+                if neg_step == 2**32:
+                    neg_step = 2**32 - 1
+
+                ind = 32
+
+            elif ID == 1: # If the ramp generator is modulating phase
+                lower = int(np.around((2**16 *(self.DRG_Start/360)), decimals = 0))
+                if lower >= 2**16:
+                    self.message("Phase overflow")
+                    lower = 2**16 - 1
+                upper = int(np.around((2**16 *(self.DRG_End/360)), decimals = 0))
+                if upper >= 2**16:
+                    self.message("Phase overflow")
+                    upper = 2**16 - 1
+
+                pos_step = int(np.around((2**16 *(abs(self.DRG_P_stp_Size) /360)), decimals = 0))
+                neg_step = int(np.around((2**16 *(abs(self.DRG_N_stpSize  /360))), decimals = 0))
+
+                if pos_step <= 0:
+                    pos_step = 1
+                if neg_step <= 0:
+                    neg_step = 1
+
+                if pos_step >= 2**16:
+                    pos_step = 2**16 - 1
+                if neg_step == 2**16:
+                    neg_step = 2**16 - 1
+
+                ind = 16
+
+            else:
+
+                self.AMP_scale = 0
+                lower = int(np.around((2**14 * abs(self.DRG_Start)), decimals = 0))
+                if lower >= 2**14:
+                    self.message("Amplitude overflow")
+                    lower = 2**14 - 1
+                upper = int(np.around((2**14 * abs(self.DRG_End)), decimals = 0))
+                if upper >= 2**14:
+                    self.message("Amplitude overflow")
+                    upper = 2**14 - 1
+                pos_step = int(np.around((2**14 *(abs(self.DRG_P_stp_Size))), decimals = 0))
+                neg_step = int(np.around((2**14 *(abs(self.DRG_N_stpSize))), decimals = 0))
+
+                if pos_step <= 0:
+                    pos_step = 1
+                if neg_step <= 0:
+                    neg_step = 1
+
+                if pos_step >= 2**14:
+                    pos_step = 2**14 - 1
+                if neg_step == 2**14:
+                    neg_step = 2**14 - 1
+
+                ind = 14
+
+            #Prevent negative or zero step rates
+
+            if self.DRG_P_stp_Rate <= 0:
+                self.message("Adjusting positive step rate of ramp")
+                self.DRG_P_stp_Rate = (4/1000)
+            if self.DRG_P_stp_Rate > (4*(2**16-1)/1000):
+                self.message("Adjusting positive step rate of ramp")
+                self.DRG_P_stp_Rate = (4*(2**16-1)/1000)
+
+            if self.DRG_N_stp_Rate <= 0:
+                self.message("Adjusting negative step rate of ramp")
+                self.DRG_N_stp_Rate = (4/1000)
+            if self.DRG_N_stp_Rate > (4*(2**16-1)/1000):
+                self.message("Adjusting negative step rate of ramp")
+                self.DRG_N_stp_Rate = (4*(2**16-1)/1000)
+
+        except Exception:
+            self.message("Ensure all values of the ramp generator are correctly set")
+
+        try:
+
+            DRG_reg1 = np.zeros(64, dtype = np.bool_())
+            DRG_reg2 = np.zeros(64, dtype = np.bool_())
+            DRG_reg3 = np.zeros(32, dtype = np.bool_())
+
+
+            # Make sure that the phase and amplitude binary reps are MSB aligned
+            DRG_reg1[0: ind] = bin_array(upper, ind)
+            DRG_reg1[32: 32 + ind] = bin_array(lower, ind)
+
+            DRG_reg2[0: ind] = bin_array(neg_step, ind)
+            DRG_reg2[32: 32 + ind] = bin_array(pos_step, ind)
+
+            DRG_reg3[0:16] = bin_array(int(np.around((self.DRG_N_stp_Rate*250), decimals = 0)), 16) #Refresh rate is given by f_clk/4 = 250 MHz
+            DRG_reg3[16:32] = bin_array(int(np.around((self.DRG_P_stp_Rate*250), decimals = 0)), 16) #Refresh rate is given by f_clk/4 = 250 MHz
+
+            self.write(module, 11, pack_bits(DRG_reg1, 8))
+            self.write(module, 12, pack_bits(DRG_reg2, 8))
+            self.write(module, 13, pack_bits(DRG_reg3, 4))
+        except Exception:
+            self.message("Failed to write DGR")
+
+    #### #### save and load the stored data #### ####
+
+    def save_data(self, data, fname, mode='STP'):
+        """Save data to a file."""
+        try:
+            if 'all params' in mode:
+                with open(fname, 'w') as f:
+                    json.dump(data, f)
+            else: np.savetxt(fname, data, delimiter = ',')
+            self.message(mode+' saved to %s'%fname)
+        except (OSError, FileNotFoundError, IndexError) as e:
+            self.message('Could not save '+mode+' to %s\n'%fname+str(e))
+
+    def save_STP(self, fname):
+        """Save all the single tone profile parameters to a text file."""
+        data = np.array([self.fout, self.tht, self.amp]).reshape(15,8)
+        self.save_data(data, fname, mode='STP')
+
+    def save_RAMprofile(self, fname):
+        """Save the RAM playback parameters to a text file."""
+        data = np.append(np.array([self.Start_Address, self.End_Address,
+                    self.Rate, self.No_dwell, self.Zero_crossing]).reshape(25,8),
+                    self.RAM_playback_mode.reshape(15,8), axis=0)
+        self.save_data(data, fname, mode='RAM profiles')
+
+    def save_all(self, fname):
+        """Save STP, RAM, and auxiliary parameters to a text file."""
+        try:
+            data = OrderedDict()
+            for key in ['FTW', 'POW', 'AMW']:
+                data[key] = list(getattr(self, key).astype(str))
+            for key in ['fout', 'tht', 'amp', 'Start_Address',
+                    'End_Address', 'Rate', 'No_dwell', 'Zero_crossing']:
+                data[key] = [list(x) for x in getattr(self, key).astype(str)]
+            data['RAM_playback_mode'] = [[list(y) for y in x] for x in self.RAM_playback_mode.astype(str)]
+            data['RAM_data_filename'] = self.RAM_data_filename
+        except ValueError as e:
+            self.message("Failed to save parameters:\n"+str(e))
+            return
+        self.save_data(data, fname, mode='all params')
+
+    def load_STP(self, fname):
+        """Input the values from the STP file into the stored data."""
+        try:
+            if os.path.exists(fname):
+                data = np.loadtxt(fname, delimiter=',')
+                self.fout = data[:5,:]
+                self.tht = data[5:10,:]
+                self.amp = data[10:15,:]
+                self.updated.emit()
+        except Exception as e:
+            self.message('Could not load STP from %s\n'%fname+str(e))
+
+    def load_RAMprofile(self, fname):
+        """Input the values from the RAM file into the stored data."""
+        try:
+            if os.path.exists(fname):
+                data = np.loadtxt(fname, delimiter=',')
+                self.Start_Address    = data[:5,:]
+                self.End_Address      = data[5:10,:]
+                self.Rate             = data[10:15,:]
+                self.No_dwell         = data[15:20,:]
+                self.Zero_crossing    = data[20:25,:]
+                self.RAM_playback_mode = data[25:,:].reshape(5,8,3)
+                self.updated.emit()
+        except Exception as e:
+            self.message('Could not load RAM profiles from %s\n'%fname+str(e))
+
+    def load_all(self, fname):
+        """Take STP, RAM and auxiliary parameters from a file."""
+        try:
+            if os.path.exists(fname):
+                with open(fname) as f:
+                    data = json.load(f)
+                for key, val in data.items():
+                    if 'RAM_data_filename' in key:
+                        self.message('RAM data files were: %s'%val)
+                    else:
+                        setattr(self, key, np.array(val, dtype=float))
+                self.updated.emit()
+                self.message('Loaded parameters from %s'%fname)
+        except Exception as e:
+            self.message('Could not load params from %s\n'%fname+str(e))
+
+
+if __name__ == "__main__":
+    # control the DDS from PyDex without the GUI
+    import argparse
+    from PyQt5.QtCore import QCoreApplication
+    if '..' not in sys.path: sys.path.append('..')
+    if '.' not in sys.path: sys.path.append('.')
+    from networking.client import PyClient
+    parser = argparse.ArgumentParser(description='Headless DDS control')
+    parser.add_argument('-c', '--com', default='', help='serial port of the PSoC')
+    parser.add_argument('-d', '--dds', default=2, type=int, help='DDS index for the power calibration')
+    parser.add_argument('-p', '--port', default=8630, type=int, help='TCP port of the PyDex server')
+    parser.add_argument('--host', default='localhost', help='TCP host of the PyDex server')
+    parser.add_argument('-f', '--params', default='', help='file of parameters to load')
+    args = parser.parse_args()
+
+    app = QCoreApplication(sys.argv)
+    load_calibration(args.dds)
+    service = ddsService(port=args.com)
+    service.textout.connect(lambda x: print(
+        datetime.datetime.now().strftime("%d/%m/%Y %H:%M:%S") + '>> \t ' + x))
+    service.gui_command.connect(lambda x: print('Command needs the GUI: ' + x))
+    if args.params:
+        service.load_all(args.params)
+    if args.com:
+        service.add_command('connect')
+        service.add_command('handshake', service.ind)
+    tcp = PyClient(host=args.host, port=args.port)
+    tcp.textin.connect(service.respond)
+    tcp.start()
+    sys.exit(app.exec_())
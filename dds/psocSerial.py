@@ -0,0 +1,304 @@
+"""PyDex - DDS serial transport
+
+ - Frame DDS commands in the UART structure that the PSoC expects:
+   [module address, command, checksum, data length1, data length2, data...]
+   where the checksum makes the frame sum to 0 mod 256 and the
+   number of data bytes is length1 * length2.
+ - Send each frame with a single write, then wait for the PSoC to reply
+   rather than sleeping for a fixed time before and after every byte.
+ - registerMirror remembers what was last written to each register so
+   that unchanged registers are not sent again.
+ - PSoCEmulator stands in for the PSoC on a pseudo-terminal so that
+   uploads can be checked and timed without hardware.
+"""
+import os
+import sys
+import time
+import select
+import threading
+import numpy as np
+import serial
+
+RAM_ID = 22   # command to write the RAM data
+DEBUG_ID = 23 # command for the PSoC to report the DDS registers
+
+def frame_sum(pack):
+    """Return the sum of the frame that the checksum cancels. RAM frames
+    have always counted the first 1024 data bytes four times each instead
+    of summing all 4096 data bytes, so keep that for the PSoC."""
+    if pack[1] == RAM_ID and len(pack) > 5:
+        return sum(pack[:5]) + 4*sum(pack[5:1029])
+    return sum(pack)
+
+def checksum(pack):
+    """Return the checksum byte for a frame with its checksum set to 0:
+    the two's complement of the frame sum, so that it sums to 0 mod 256."""
+    return -frame_sum(pack) & 0xFF
+
+def pack_bits(bits, nbytes):
+    """Pack an MSB-first array of bits into nbytes bytes."""
+    if not nbytes:
+        return b''
+    return np.packbits(np.asarray(bits[:8*nbytes], dtype=np.uint8)).tobytes()
+
+def frame(address, command_ID, data=b'', lengths=None):
+    """Build a command frame for the PSoC.
+    address    -- DDS module address
+    command_ID -- the register or command to address
+    data       -- bytes to send
+    lengths    -- (length1, length2) header values giving the data length
+        as length1 * length2. Default (len(data), 1), or (0, 0) without data.
+        For data longer than 255 bytes the lengths must be given."""
+    if lengths is None:
+        lengths = (len(data), 1) if len(data) else (0, 0)
+    head = [address, command_ID, 0, lengths[0], lengths[1]]
+    pack = bytearray(head) + bytes(data)
+    pack[2] = checksum(pack)
+    return bytes(pack)
+
+def from_hex(pack):
+    """Convert a list of hex strings, as used by the old GUIs, into bytes."""
+    return bytes(int(x, 16) for x in pack)
+
+def parse_frame(buf):
+    """Split the first complete frame from the start of buf.
+    Return (frame dict or None if incomplete, remaining bytes).
+    The frame dict has keys address, command, lengths, data, valid."""
+    if len(buf) < 5:
+        return None, buf
+    n = buf[3] * buf[4] + 5
+    if len(buf) < n:
+        return None, buf
+    pack = buf[:n]
+    return {'address': pack[0], 'command': pack[1], 'lengths': (pack[3], pack[4]),
+        'data': bytes(pack[5:]), 'valid': frame_sum(pack) & 0xFF == 0}, buf[n:]
+
+class PSoCTransport:
+    """Send frames to the PSoC over an open serial port and collect the
+    messages that it sends back.
+    ser     -- an open serial.Serial instance
+    timeout -- max time in seconds to wait for the reply to a frame, on
+        top of the time the UART takes to transmit it
+    idle    -- a reply is complete when no more bytes arrive for this time"""
+    def __init__(self, ser, timeout=0.1, idle=0.005):
+        self.ser = ser
+        self.timeout = timeout
+        self.idle = idle
+        self.frames = 0    # number of frames sent
+        self.nbytes = 0    # number of bytes sent
+        self.t_send = 0.0  # total time spent sending and waiting for replies
+
+    def send(self, pack, wait=True):
+        """Write a frame in one go. If wait, return the PSoC's reply."""
+        t0 = time.perf_counter()
+        self.ser.write(pack)
+        self.ser.flush() # block until the frame has left the output buffer
+        reply = self.read_reply(self.timeout + len(pack)*10/self.ser.baudrate) if wait else ''
+        self.frames += 1
+        self.nbytes += len(pack)
+        self.t_send += time.perf_counter() - t0
+        return reply
+
+    def read_reply(self, timeout=None):
+        """Wait up to timeout for the PSoC to reply, then read until the
+        line goes quiet. Return the decoded message."""
+        end = time.perf_counter() + (self.timeout if timeout is None else timeout)
+        while not self.ser.in_waiting and time.perf_counter() < end:
+            time.sleep(0.0005)
+        out = b''
+        while self.ser.in_waiting:
+            out += self.ser.read(self.ser.in_waiting)
+            quiet = time.perf_counter() + self.idle
+            while not self.ser.in_waiting and time.perf_counter() < quiet:
+                time.sleep(0.0005)
+        return out.decode('utf-8', errors='replace')
+
+    def stats(self):
+        """Return a message summarising the upload rate."""
+        return '%s frames, %s bytes in %.3g s (%.3g kB/s)'%(self.frames, self.nbytes,
+            self.t_send, self.nbytes / self.t_send / 1e3 if self.t_send else 0)
+
+#### #### cache of the register contents #### ####
+
+def parse_register_dump(text):
+    """Read the register contents from the PSoC's reply to the register
+    debug command, given as lines of 'register <command>: <hex data>'.
+    Return a dictionary {command: data bytes}."""
+    regs = {}
+    for line in text.splitlines():
+        try:
+            key, val = line.split(':')
+            if key.strip().startswith('register'):
+                regs[int(key.split()[-1])] = bytes.fromhex(val.strip())
+        except ValueError: pass # not a register
+    return regs
+
+class registerMirror:
+    """Remember the data last written to each register of each DDS.
+    Registers are keyed by (serial port, module address, command).
+    Frames without data, like the handshake, are not registers.
+    sent    -- number of bytes sent
+    saved   -- number of bytes not sent because the register was unchanged
+    skipped -- number of frames not sent"""
+    def __init__(self):
+        self.regs = {}
+        self.sent = 0
+        self.saved = 0
+        self.skipped = 0
+
+    def unchanged(self, port, pack):
+        """Whether the frame would write the data already in the register."""
+        return len(pack) > 5 and self.regs.get((port, pack[0], pack[1])) == pack[5:]
+
+    def skip(self, pack):
+        """Record that the frame was not sent."""
+        self.saved += len(pack)
+        self.skipped += 1
+
+    def update(self, port, pack, reply=''):
+        """Record that the frame was sent. If the PSoC replied with an
+        error then the state of the register is unknown."""
+        self.sent += len(pack)
+        if len(pack) > 5:
+            if 'error' in reply.lower():
+                self.regs.pop((port, pack[0], pack[1]), None)
+            else:
+                self.regs[(port, pack[0], pack[1])] = pack[5:]
+
+    def forget(self, port=None, address=None, command=None):
+        """Forget the registers matching the given port, address, and command,
+        so that they will be sent again. With no arguments, forget all."""
+        for key in list(self.regs.keys()):
+            if all(x is None or x == k for x, k in zip([port, address, command], key)):
+                self.regs.pop(key)
+
+    def compare(self, port, address, regs):
+        """Compare the registers read back from a DDS with the mirror.
+        Forget registers that don't match so that they are sent again.
+        Return a list of the commands that don't match."""
+        wrong = []
+        for (p, a, c), data in list(self.regs.items()):
+            if p == port and a == address and c in regs and regs[c] != data:
+                wrong.append(c)
+                self.regs.pop((p, a, c))
+        return wrong
+
+    def stats(self):
+        """Return a message summarising the bytes saved."""
+        total = self.sent + self.saved
+        return 'sent %s bytes, skipped %s unchanged registers saving %s bytes (%.0f%%)'%(
+            self.sent, self.skipped, self.saved, 100*self.saved/total if total else 0)
+
+#### #### emulator for testing without hardware #### ####
+
+class PSoCEmulator:
+    """Pretend to be the PSoC on a pseudo-terminal (not available on Windows).
+    Frames are validated and stored, and each one gets a reply message.
+    port     -- the device name to open with serial.Serial
+    frames   -- list of received frame dicts
+    registers -- {(address, command): data} last valid data for each register
+    errors   -- number of frames with a bad checksum
+    baudrate -- if set, simulate the transmission time of the UART"""
+    def __init__(self, baudrate=None):
+        if sys.platform.startswith('win'):
+            raise EnvironmentError('The PSoC emulator needs a pseudo-terminal.')
+        import tty
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.baudrate = baudrate
+        self.frames = []
+        self.registers = {}
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def reply(self, f):
+        """The message that the emulated PSoC sends back for a frame."""
+        if not f['valid']:
+            return 'Checksum error on command %s\n'%f['command']
+        elif f['command'] == 24:
+            return 'Hello from the PSoC emulator\n'
+        elif f['command'] == DEBUG_ID:
+            return ''.join('register %s: %s\n'%(c, data.hex()) for (a, c), data in 
+                sorted(self.registers.items()) if a == f['address'])
+        return 'Command %s: %s bytes\n'%(f['command'], len(f['data']))
+
+    def run(self):
+        buf = b''
+        while not self._stop.is_set():
+            r, _, _ = select.select([self.master], [], [], 0.05)
+            if not r:
+                continue
+            try:
+                buf += os.read(self.master, 65536)
+            except OSError: break # closed
+            f, buf = parse_frame(buf)
+            while f is not None:
+                if self.baudrate: # bytes take 10 bits each with start and stop bits
+                    time.sleep((len(f['data']) + 5) * 10 / self.baudrate)
+                self.frames.append(f)
+                if not f['valid']:
+                    self.errors += 1
+                elif f['data']:
+                    self.registers[(f['address'], f['command'])] = f['data']
+                os.write(self.master, self.reply(f).encode('utf-8'))
+                f, buf = parse_frame(buf)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+def bytewise_send(ser, pack):
+    """Reference: the old transmission, one byte at a time with sleeps,
+    then reading the reply one byte at a time."""
+    time.sleep(0.1)
+    for b in pack:
+        time.sleep(0.001)
+        ser.write(bytes([b]))
+    time.sleep(0.01)
+    out = ''
+    while ser.in_waiting > 0:
+        out += ser.read(1).decode('utf-8')
+    return out
+
+if __name__ == "__main__":
+    # time a RAM upload and the single tone profiles, the old way and in bulk
+    emu = PSoCEmulator(baudrate=115200)
+    ser = serial.Serial(emu.port, baudrate=115200, timeout=1)
+    rng = np.random.default_rng(0)
+    packs = [frame(1, 14 + i, rng.integers(0, 256, 8, dtype=np.uint8).tobytes()) for i in range(8)]
+    packs.append(frame(1, RAM_ID, rng.integers(0, 256, 4096, dtype=np.uint8).tobytes(), (32, 128)))
+    t0 = time.perf_counter()
+    for pack in packs:
+        bytewise_send(ser, pack)
+    t1 = time.perf_counter()
+    transport = PSoCTransport(ser)
+    replies = [transport.send(pack) for pack in packs]
+    t2 = time.perf_counter()
+    bad = frame(1, 7, b'\x01\x02\x03\x04')
+    bad = bad[:2] + bytes([bad[2] ^ 1]) + bad[3:]
+    print('bad frame:', transport.send(bad).strip())
+    print('byte by byte: %.2f s, bulk: %.3f s'%(t1-t0, t2-t1))
+    print(transport.stats())
+    print('frames received: %s, checksum errors: %s, last reply: %s'%(
+        len(emu.frames), emu.errors, replies[-1].strip()))
+    print('RAM stored correctly:', emu.registers[(1, RAM_ID)] == packs[-1][5:])
+    # a multirun that changes one single tone profile per step
+    mirror = registerMirror()
+    t0 = time.perf_counter()
+    for step in range(10):
+        packs[step%8] = frame(1, 14 + step%8, rng.integers(0, 256, 8, dtype=np.uint8).tobytes())
+        for pack in packs:
+            if mirror.unchanged(emu.port, pack):
+                mirror.skip(pack)
+            else:
+                mirror.update(emu.port, pack, transport.send(pack))
+    print('multirun of 10 steps in %.3f s: %s'%(time.perf_counter() - t0, mirror.stats()))
+    dump = parse_register_dump(transport.send(frame(1, DEBUG_ID)))
+    print('registers read back: %s, mismatched: %s'%(len(dump), mirror.compare(emu.port, 1, dump)))
+    ser.close()
+    emu.close()
@@ -0,0 +1,131 @@
+"""PyDex - shared image frames
+
+ - Reuse image buffers instead of allocating a new full frame for each
+   image. The camera can read straight into a frame, and the controller
+   subtracts the bias in place in the frame's dtype (int32 for the camera's
+   counts, so half the memory of the int64 arrays made before)
+ - The saver, MAIA, ALEX and the displays are given read-only views of the
+   frame. A view keeps a reference to its frame (view.base), so the frame's
+   reference count is the number of users: it's reused once all of them have
+   let go of it. Nothing needs to be released by hand
+ - If every frame is in use a new one is made, up to the pool size. After
+   that frames are allocated as before and counted in the metrics
+
+Use the module-level FRAMES:
+    from framepool import FRAMES
+    im = FRAMES.correct(im, bias) # read-only view of im - bias
+"""
+import sys
+import threading
+import numpy as np
+from metrics import METRICS
+
+def _refs(frames, i):
+    """Reference count of frames[i], measured the same way for a free frame."""
+    return sys.getrefcount(frames[i])
+
+class framePool:
+    """Pool of reusable image arrays, kept in lists by (shape, dtype).
+    size -- maximum number of frames of each shape and dtype to keep"""
+    def __init__(self, size=32):
+        self.size = size
+        self.frames = {} # (shape, dtype): list of frames
+        self.lock = threading.Lock() # the camera and controller threads both take frames
+        self._free = _refs([np.empty(1)], 0) # reference count of a frame that no one is using
+        self.n_new = METRICS.counter('frames allocated')
+        self.n_unpooled = METRICS.counter('frames unpooled') # allocated because the pool was full
+        METRICS.gauge('frames in use', fn=self.in_use)
+
+    @staticmethod
+    def dtype_for(dtype):
+        """The dtype to store an image in: int32 for integer counts,
+        otherwise the image's dtype."""
+        return np.dtype(np.int32) if np.dtype(dtype).kind in 'iub' else np.dtype(dtype)
+
+    def acquire(self, shape, dtype=np.int32):
+        """Return a frame that isn't in use. Its contents are undefined."""
+        key = (tuple(shape), np.dtype(dtype))
+        with self.lock:
+            frames = self.frames.setdefault(key, [])
+            for i in range(len(frames)):
+                if _refs(frames, i) <= self._free:
+                    return frames[i]
+            frame = np.empty(*key)
+            if len(frames) < self.size:
+                frames.append(frame)
+                self.n_new.inc()
+            else:
+                self.n_unpooled.inc()
+            return frame
+
+    def owner(self, im):
+        """Return the pooled frame that im is the whole of, or None."""
+        base = im if im.base is None else im.base
+        if base.size == im.size:
+            with self.lock:
+                for frame in self.frames.get((base.shape, base.dtype), []):
+                    if frame is base:
+                        return frame
+        return None
+
+    def correct(self, im, bias=0):
+        """Return a read-only view of im - bias. If im is a writeable pooled
+        frame (e.g. the camera read into it) the bias is subtracted in place,
+        otherwise the result is put in a frame from the pool."""
+        im = np.asarray(im)
+        if im.flags.writeable and self.owner(im) is not None and (
+                np.can_cast(np.min_scalar_type(bias), im.dtype)):
+            out = im
+        else:
+            out = self.acquire(im.shape, self.dtype_for(np.result_type(im.dtype, np.min_scalar_type(bias))))
+        np.subtract(im, bias, out=out, casting='unsafe')
+        return self.view(out)
+
+    @staticmethod
+    def view(frame):
+        """Return a read-only view of the frame, which keeps it in use."""
+        v = frame.view()
+        v.flags.writeable = False
+        return v
+
+    def in_use(self):
+        """Number of pooled frames that are in use."""
+        with self.lock:
+            return sum(_refs(frames, i) > self._free for frames in list(self.frames.values())
+                       for i in range(len(frames)))
+
+FRAMES = framePool() # shared by all of the modules in this process
+
+if __name__ == "__main__":
+    # bias subtraction per frame: the camera reads into a new buffer that is
+    # turned into int64 and then im - bias is allocated, vs reading into a
+    # pooled frame and subtracting the bias in place
+    import time
+    n, shape, bias = 2000, (512, 512), 1000
+    camera = np.random.default_rng(0).poisson(1100, shape).astype(np.int32) # what the camera gives
+    pool = framePool(size=8)
+    held = [] # frames in use by the saver, MAIA etc.
+    t0 = time.perf_counter()
+    for i in range(n):
+        im = camera.copy().astype(np.int64)
+        held.append(im - bias)
+        held = held[-4:]
+    t1 = time.perf_counter()
+    held = []
+    for i in range(n):
+        frame = pool.acquire(shape)
+        frame[:] = camera
+        held.append(pool.correct(frame.reshape((1,)+shape)[0], bias))
+        held = held[-4:]
+    t2 = time.perf_counter()
+    print('new arrays: %.1f us per frame, pool: %.1f us per frame, %s frames allocated'%(
+        (t1-t0)/n*1e6, (t2-t1)/n*1e6, pool.n_new.value))
+    same = np.array_equal(held[-1], camera - bias) and held[-1].base is frame
+    try:
+        held[-1][0,0] = 0
+        read_only = False
+    except ValueError:
+        read_only = True
+    print('correct values in place: %s, read-only: %s, in use: %s'%(same, read_only, pool.in_use()))
+    del held, frame
+    print('in use after release: %s'%pool.in_use())
@@ -289,8 +289,8 @@ class alex(QMainWindow):
             return
         if file_id is None:
             file_id = self.file_id
-        logging.debug('Recieved image for handler {} with file ID {}'.format(
-                      ih_num,file_id))
+        logging.debug('Recieved image for handler %s with file ID %s',
+                      ih_num,file_id)
         self.get_occupancies_from_image(image,ih_num)
         self.store_counts_in_rois(image,ih_num,file_id)
 
@@ -312,8 +312,8 @@ class alex(QMainWindow):
                 if invert:
                     occupancy_bit = not occupancy_bit
                 group_occupancy += str(int(occupancy_bit))
-            logging.debug('{} occupancy {}'.format(ih.roi_labels[group_i],
-                                                   group_occupancy))
+            logging.debug('%s occupancy %s',ih.roi_labels[group_i],
+                                                   group_occupancy)
             group_occupancy += 'RH'+str(ih_num)
             occupancies.append(group_occupancy)
         self.signal_rearr_strings.emit(occupancies)
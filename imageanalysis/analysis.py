@@ -15,6 +15,7 @@ from PyQt5.QtCore import QThread
 if '.' not in sys.path: sys.path.append('.')
 if '..' not in sys.path: sys.path.append('..')
 from strtypes import BOOL, error, warning, info
+from statsStore import column
 
 ####    ####    ####    ####
         
@@ -63,11 +64,14 @@ class Analysis(QThread):
         self.ind += 1
             
     def load(self, file_name, *args, **kwargs):
-        """Load back data stored in csv. 
+        """Load back data stored in csv, or in a binary npz file if the
+        file name ends in .npz. 
         First row is metadata column headings
         Second row is metadata values
         Third row is data column headings
         Then data follows."""
+        if file_name.endswith('.npz'):
+            return self.load_npz(file_name)
         head = [[],[],[]]
         with open(file_name, 'r') as f:
             for i in range(3):
@@ -93,13 +97,34 @@ class Analysis(QThread):
         self.ind = np.size(self.stats[key]) # length of last array
         return head # success
 
+    def load_npz(self, file_name):
+        """Load back data stored in binary columns by save(). The header
+        has the same three rows as in the csv file."""
+        with np.load(file_name) as f:
+            head = [list(map(str, f[key])) for key in ['meta_head', 'meta_vals', 'keys']]
+            data = {key: f[key] for key in head[2] if key in f.files}
+        n = max(map(len, data.values()), default=0)
+        if not n:
+            return 0 # insufficient data to load
+        for key in self.stats.keys():
+            vals = data.get(key, np.zeros(n)) # keep lists the same size: fill with zeros.
+            if isinstance(self.stats[key], column):
+                self.stats[key] += vals
+            else: self.stats[key] += list(map(self.types[key], vals))
+        self.ind = np.size(self.stats[key]) # length of last array
+        return head # success
+
     def save(self, file_name, meta_head=[], meta_vals=[], *args, **kwargs):
-        """Save the processed data to csv. 
+        """Save the processed data to csv, or to binary columns in an npz 
+        file if the file name ends in .npz, which is much quicker for long
+        histograms and keeps the types.
         First row is metadata column headings as list
         Second row is metadata values as list
         Third row is data column headings
         Then data follows.
         """
+        if file_name.endswith('.npz'):
+            return self.save_npz(file_name, meta_head, meta_vals)
         # data converted to the correct type
         try:
             out_arr = np.array([list(map(self.types[key], val))
@@ -116,3 +141,19 @@ class Analysis(QThread):
             np.savetxt(file_name, out_arr, fmt='%s', delimiter=',', header=header)
         except PermissionError as e:
             error('Analysis denied permission to save file: \n'+str(e))
+
+    def save_npz(self, file_name, meta_head=[], meta_vals=[]):
+        """Save the processed data as a binary array for each key of the
+        stats in an npz file, with the metadata and keys as in the csv header."""
+        try:
+            cols = {key: np.asarray(val) if isinstance(val, column) else 
+                np.array(list(map(self.types[key], val))) for key, val in self.stats.items()}
+        except ValueError as e:
+            error('Could not convert data: \n' + str(self.stats) + '\n'+str(e))
+            return 0
+        try:
+            np.savez(file_name, meta_head=np.array(list(meta_head), dtype=str), 
+                meta_vals=np.array(list(meta_vals), dtype=str), 
+                keys=np.array(list(self.stats.keys())), **cols)
+        except (PermissionError, FileNotFoundError) as e:
+            error('Analysis denied permission to save file: \n'+str(e))
@@ -0,0 +1,120 @@
+"""Criteria
+Compile post-selection and condition criteria strings into boolean NumPy
+operations on an occupancy array with shape (shots, groups, rois, images).
+
+Criteria are given as in the STEFANs: '[1xx1],[0x1x]' has an entry for each
+image and a character for each ROI in a group, where '1' requires an atom,
+'0' requires no atom, and any other character accepts either. An image can
+instead give a set of alternatives '{[1x][x1]}', which are met if any one
+is met.
+
+As in the Analyser, criteria that refer to an ROI or image that doesn't
+exist in a group are ignored for that group, and empty criteria are always
+met.
+"""
+import re
+import itertools
+import numpy as np
+
+def parse_criteria(criteria_string):
+    """Split a criteria string into its alternatives: a list of lists with
+    the criteria string for each image, e.g. '{[1x][x1]},[11]' ->
+    [['1x','11'], ['x1','11']]."""
+    images = []
+    for split in criteria_string.split(','):
+        res = re.findall(r'\{.*?\}', split)
+        if len(res) > 1:
+            raise ValueError('Maximum 1 {} per image: '+split)
+        elif res:
+            images.append([x.replace('[','').replace(']','') for x in res[0][1:-1].split('][')])
+        else:
+            images.append([split.replace('[','').replace(']','')])
+    return [list(x) for x in itertools.product(*images)]
+
+class compiledCriteria:
+    """Criteria compiled for an occupancy array with num_rois ROIs per group
+    and num_images images. For each alternative,
+    mask   -- bool array (rois, images) of the occupancies that are tested
+    wanted -- bool array (rois, images) of the occupancy that is required
+    Use evaluate() to find which shots meet the criteria."""
+    def __init__(self, criteria_string, num_rois, num_images):
+        self.criteria_string = criteria_string
+        self.num_rois = num_rois
+        self.num_images = num_images
+        self.alternatives = parse_criteria(criteria_string)
+        self.masks = np.zeros((len(self.alternatives), num_rois, num_images), dtype=bool)
+        self.wanted = np.zeros((len(self.alternatives), num_rois, num_images), dtype=bool)
+        self.valid = np.ones(len(self.alternatives), dtype=bool) # refers only to ROIs that exist
+        for a, alternative in enumerate(self.alternatives):
+            for image, image_criteria in enumerate(alternative):
+                for roi, char in enumerate(image_criteria):
+                    if char in '01':
+                        if roi >= num_rois or image >= num_images:
+                            self.valid[a] = False
+                        else:
+                            self.masks[a, roi, image] = True
+                            self.wanted[a, roi, image] = char == '1'
+
+    def evaluate(self, occupancy, present=None):
+        """Return a bool array (shots, groups) of whether the criteria are met.
+        occupancy -- bool array (shots, groups, rois, images)
+        present   -- bool array (groups, rois, images) of the occupancies
+            that were measured. Alternatives that test missing occupancies
+            are ignored for that group. Default all present."""
+        shots, groups = occupancy.shape[:2]
+        met = np.zeros((shots, groups), dtype=bool)
+        for mask, wanted, valid in zip(self.masks, self.wanted, self.valid):
+            if not valid or not mask.any(): # no criteria, so always met
+                return np.ones((shots, groups), dtype=bool)
+            alt_met = (occupancy[:, :, mask] == wanted[mask]).all(axis=2)
+            if present is not None:
+                alt_met[:, ~present[:, mask].all(axis=1)] = True
+            met |= alt_met
+        return met
+
+if __name__ == '__main__':
+    # compare with the per-column criteria of the Analyser on a large multirun
+    import time
+    import contextlib
+    from dataanalysis import Analyser
+    rng = np.random.default_rng(0)
+    groups, rois, images, shots = 8, 16, 2, 20000
+    counts = [[[list(rng.poisson(rng.choice([50,500],shots))) for i in range(images)]
+               for r in range(rois)] for g in range(groups)]
+    thresholds = [[[[250]] * images for r in range(rois)] for g in range(groups)]
+    coords = [[[0,0,1,1] for r in range(rois)] for g in range(groups)]
+    analyser = Analyser([counts,thresholds,coords])
+    cases = [('[1xxxxxxxxxxxxxx1]','[1],[x1]'), ('[11x0],[xx1]','[x1x1],[1]'), ('','[0x],[1x]'),
+             ('[1x],[x1x1x1x1x1x1x1x1x1]','[xxxxxxxxxxxxxxxxx1]'), ('[1],[1],[1]','')]
+    t_old, t_new, t_eval_old, t_eval_new, same = 0, 0, 0, 0, True
+    for ps, cm in cases:
+        with contextlib.redirect_stdout(None): # don't print invalid criteria
+            start = time.perf_counter()
+            keys = analyser.convert_criteria_list_to_column_keys(analyser.convert_criteria_string_to_list(ps))
+            old_ps = [analyser.get_post_selected_dataframe(x,keys,g) for g, x in enumerate(analyser.counts_df_split_by_roi_group)]
+            keys = analyser.convert_criteria_list_to_column_keys(analyser.convert_criteria_string_to_list(cm))
+            [analyser.calculate_condition_met(x,keys,g) for g, x in enumerate(old_ps)]
+            t_old += time.perf_counter() - start
+            start = time.perf_counter()
+            [analyser.apply_criteria_to_df(x,keys,g) for g, x in enumerate(analyser.counts_df_split_by_roi_group)]
+            t_eval_old += time.perf_counter() - start
+            start = time.perf_counter()
+            analyser.apply_post_selection_criteria(ps)
+            analyser.apply_condition_criteria(cm)
+            t_new += time.perf_counter() - start
+            start = time.perf_counter()
+            analyser.evaluate_criteria(cm)
+            t_eval_new += time.perf_counter() - start
+        for x, y in zip(old_ps,analyser.ps_counts_df_split_by_roi_group):
+            same &= x.equals(y)
+    print('{} shots, {} groups of {} ROIs, {} images, same results: {}'.format(shots,groups,rois,images,same))
+    print('evaluating criteria: per-column {:.2f} ms, compiled {:.2f} ms ({:.0f}x faster)'.format(
+        t_eval_old/len(cases)*1e3,t_eval_new/len(cases)*1e3,t_eval_old/t_eval_new))
+    print('post-selection and condition including DataFrames: per-column {:.1f} ms, compiled {:.1f} ms'.format(
+        t_old/len(cases)*1e3,t_new/len(cases)*1e3))
+    # a set of alternatives is the union of its permutations
+    occupancy, present = analyser.occupancy, analyser.occupancy_present
+    union = compiledCriteria('{[1x][x1]},[1]',rois,images).evaluate(occupancy,present)
+    print('alternatives are the union of permutations:', np.array_equal(union, 
+        compiledCriteria('[1x],[1]',rois,images).evaluate(occupancy,present) | 
+        compiledCriteria('[x1],[1]',rois,images).evaluate(occupancy,present)))
@@ -8,6 +8,11 @@ PyDex to analyse MAIA DataFrames.
 Data can either be provided in the form of MAIA data (i.e. a list of lists as 
 outputted by MAIAs mid-run) or a string linking to a pre-processed DataFrame 
 csv that will be read in.
+
+A measure folder is loaded by parsing its csv files in a process pool. The
+parsed data is cached beside the csv files in maia_cache.npz so that the 
+measure can be reopened without parsing the files again. The cache entry 
+for a file is used while the file's modification time and size are unchanged.
 """
 
 import numpy as np
@@ -16,30 +21,172 @@ from itertools import chain
 from copy import deepcopy
 from astropy.stats import binom_conf_interval
 from math import floor, log10
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import functools
+import io
 import os
 
 import sys
 if '.' not in sys.path: sys.path.append('.')
 from helpers import calculate_threshold
+from criteria import compiledCriteria
+
+CACHE_NAME = 'maia_cache.npz' # parsed csv files, saved in the measure folder
+
+def df_to_arrays(df,name):
+    """Convert a DataFrame of numeric and boolean columns into arrays that
+    can be saved in an npz file. Columns are grouped by dtype so that they
+    are restored with the same dtype. Returns None for other dtypes.
+    
+    Returns
+    -------
+    dict : '<name>_index', '<name>_columns', '<name>_groups' which block of
+        values each column is in, and the blocks '<name>_vals0', ...
+    """
+    dtypes = list(dict.fromkeys(df.dtypes))
+    if not all(x.kind in 'biuf' for x in dtypes + [df.index.dtype]):
+        return None
+    groups = np.array([dtypes.index(x) for x in df.dtypes],dtype=int)
+    arrays = {name+'_index':df.index.to_numpy(), name+'_columns':np.array(df.columns,dtype=str),
+              name+'_groups':groups}
+    for i, dtype in enumerate(dtypes):
+        arrays['{}_vals{}'.format(name,i)] = df.loc[:,groups == i].to_numpy(dtype=dtype)
+    return arrays
+
+def arrays_to_df(arrays,name,index_name=None):
+    """Rebuild a DataFrame from the arrays made by df_to_arrays."""
+    columns, groups = arrays[name+'_columns'], arrays[name+'_groups']
+    index = pd.Index(arrays[name+'_index'],name=index_name)
+    blocks = [pd.DataFrame(arrays['{}_vals{}'.format(name,i)],index=index,columns=columns[groups == i])
+              for i in range(groups.max()+1 if len(groups) else 0)]
+    return pd.concat(blocks,axis=1)[list(columns)] if blocks else pd.DataFrame(index=index)
+
+def read_maia_csv(filename):
+    """Parse a csv saved by the MAIA into arrays that can be cached and
+    sent between processes, see df_to_arrays. If the aux row isn't numeric,
+    its text is kept instead. Returns None if the counts aren't numeric."""
+    aux_df = pd.read_csv(filename,nrows=1)
+    counts_df = pd.read_csv(filename,skiprows=2,index_col='File ID')
+    entry = df_to_arrays(counts_df,'counts')
+    if entry is None:
+        return None
+    aux = df_to_arrays(aux_df,'aux')
+    if aux is None:
+        with open(filename) as f:
+            aux = {'aux':np.array(f.readline() + f.readline())}
+    entry.update(aux)
+    return entry
+
+def maia_entry_to_dfs(entry):
+    """Rebuild the aux_df and counts_df from the arrays made by read_maia_csv."""
+    if 'aux' in entry:
+        aux_df = pd.read_csv(io.StringIO(str(entry['aux'])))
+    else:
+        aux_df = arrays_to_df(entry,'aux')
+    return aux_df, arrays_to_df(entry,'counts','File ID')
+
+def load_maia_files(directory,files,processes=None,use_cache=True):
+    """Load the MAIA csv files from a measure folder. Files that aren't in
+    the cache are parsed in a process pool, then the cache is updated.
+    
+    Parameters
+    ----------
+    directory : str
+        The measure folder containing the files.
+    files : list of str
+        Names of the files to load.
+    processes : int or None
+        Number of processes to parse with. The default is the number of 
+        cores. Files are parsed serially if processes is 1.
+    use_cache : bool
+        Whether to read and update the cache in the measure folder.
+    
+    Returns
+    -------
+    list : an (aux_df, counts_df) tuple for each file, or the file path if 
+        it couldn't be parsed into arrays, which the Analyser can load.
+    """
+    cache_file = os.path.join(directory,CACHE_NAME)
+    stats = {x: os.stat(os.path.join(directory,x)) for x in files}
+    entries = {}
+    others = {} # cached files that weren't requested, e.g. ignored IDs, kept in the cache
+    if use_cache and os.path.exists(cache_file):
+        try:
+            with np.load(cache_file) as cache:
+                keys = {}
+                for key in cache.files: # keys of each entry are '<file number>_<key>'
+                    i, _, k = key.partition('_')
+                    keys.setdefault(i,[]).append(k)
+                for i, (name, mtime, size) in enumerate(zip(cache['files'],cache['mtimes'],cache['sizes'])):
+                    name = str(name)
+                    st = stats.get(name)
+                    if st is None:
+                        try: st = os.stat(os.path.join(directory,name))
+                        except OSError: continue # the file was removed
+                    if st.st_mtime == mtime and st.st_size == size:
+                        entry = {k: cache['{}_{}'.format(i,k)] for k in keys[str(i)]}
+                        if name in stats:
+                            entries[name] = entry
+                        else: others[name] = (st,entry)
+        except (OSError, ValueError, KeyError) as e:
+            print('Could not read MAIA cache {}: {}'.format(cache_file,e))
+            entries, others = {}, {}
+    todo = [x for x in files if x not in entries]
+    paths = [os.path.join(directory,x) for x in todo]
+    if len(todo) > 1 and (processes or os.cpu_count() or 1) > 1:
+        try:
+            with ProcessPoolExecutor(processes) as pool:
+                parsed = list(pool.map(read_maia_csv,paths,chunksize=max(len(paths)//(4*(os.cpu_count() or 1)),1)))
+        except (OSError, BrokenProcessPool) as e:
+            print('Parallel loading failed, loading serially: {}'.format(e))
+            parsed = [read_maia_csv(x) for x in paths]
+    else:
+        parsed = [read_maia_csv(x) for x in paths]
+    entries.update({name: entry for name, entry in zip(todo,parsed) if entry is not None})
+    if use_cache and todo:
+        others.update({x: (stats[x],entries[x]) for x in files if x in entries})
+        save_maia_cache(cache_file,others)
+    return [maia_entry_to_dfs(entries[x]) if x in entries else os.path.join(directory,x) for x in files]
+
+def save_maia_cache(cache_file,entries):
+    """Write the cache of parsed files, keyed by file name, modification
+    time, and size. entries is a dict of {name: (os.stat_result, entry)}."""
+    names = list(entries.keys())
+    arrays = {'files':np.array(names,dtype=str),
+              'mtimes':np.array([entries[x][0].st_mtime for x in names],dtype=float),
+              'sizes':np.array([entries[x][0].st_size for x in names],dtype=np.int64)}
+    for i, name in enumerate(names):
+        for key, val in entries[name][1].items():
+            arrays['{}_{}'.format(i,key)] = val
+    tmp = cache_file + '.tmp'
+    try:
+        with open(tmp,'wb') as f:
+            np.savez(f,**arrays)
+        os.replace(tmp,cache_file) # so that a partly written cache is never read
+    except OSError as e:
+        print('Could not save MAIA cache {}: {}'.format(cache_file,e))
 
 class MeasureAnalyser():
     """Class to analyse the results of an entire measurement. Makes different
     instances of the Analyser class and then goes through a measure folder to
     extract relevant information."""
-    def __init__(self, directory=None,ignore_ids=[]):
+    def __init__(self, directory=None,ignore_ids=[],processes=None,use_cache=True):
         if directory is not None:
-            self.load_from_directory(directory,ignore_ids)
+            self.load_from_directory(directory,ignore_ids,processes,use_cache)
     
-    def load_from_directory(self,directory,ignore_ids=[]):
+    def load_from_directory(self,directory,ignore_ids=[],processes=None,use_cache=True):
+        """Make an Analyser for each MAIA csv in the measure folder. The
+        files are parsed in parallel and cached, see load_maia_files."""
         maia_files = [x for x in os.listdir(directory) if x.split('.')[0] == 'MAIA']
         print(maia_files)
         
+        maia_files = [x for x in maia_files if not int(x.split('.')[1]) in ignore_ids]
+        loaded = load_maia_files(directory,maia_files,processes,use_cache)
         self.analysers = {}
-        for file in maia_files:
+        for file, data in zip(maia_files,loaded):
             hist_id = int(file.split('.')[1])
-            if not hist_id in ignore_ids:
-                self.analysers[hist_id] = Analyser(directory+'\\'+file)
+            self.analysers[hist_id] = Analyser(data)
             
     def apply_post_selection_criteria(self,post_selection_string):
         [x.apply_post_selection_criteria(post_selection_string) for x in self.analysers.values()]
@@ -109,6 +256,8 @@ class Analyser():
     def __init__(self, maia_data):
         if type(maia_data) == list: # data comes directly from MAIA
             self.convert_maia_data_to_df(maia_data)
+        elif type(maia_data) == tuple: # tuple with aux_df and counts_df to populate with
+            self.load_dfs_manually(*maia_data)
         else: # maia_data is a string with a dataframe format
             self.load_dfs_from_file(maia_data)
         self.split_counts_df_by_roi_group()
@@ -176,6 +325,14 @@ class Analyser():
         self.aux_df = pd.read_csv(filename,nrows=1)
         # print(self.aux_df)
         self.counts_df = pd.read_csv(filename,skiprows=2,index_col='File ID')
+        self.populate_values_from_dfs()
+    
+    def load_dfs_manually(self,aux_df,counts_df):
+        self.aux_df = aux_df
+        self.counts_df = counts_df
+        self.populate_values_from_dfs()
+    
+    def populate_values_from_dfs(self):
         roi_names = [x[:-7] for x in self.counts_df.columns if ' counts' in x]
         
         roi_groups = set([int(x.split(':')[0].split('ROI')[1]) for x in roi_names])
@@ -225,6 +382,29 @@ class Analyser():
             col_names = [x for x in self.counts_df if 'ROI{}'.format(roi_group) in x]
             group_df = self.counts_df[col_names]
             self.counts_df_split_by_roi_group.append(group_df)
+        self.calculate_occupancy_array()
+    
+    def calculate_occupancy_array(self):
+        """Arrange the occupancy columns into a boolean array with shape
+        (shots, groups, rois, images) that criteria are evaluated on. 
+        occupancy_present records which of the columns exist."""
+        names = ['ROI{}:{} Im{} occupancy'.format(group,roi,image) for group in range(self.num_roi_groups)
+                 for roi in range(self.num_rois_per_group) for image in range(self.num_images)]
+        present = np.array([x in self.counts_df.columns for x in names],dtype=bool)
+        occupancy = np.zeros((len(self.counts_df),len(names)),dtype=bool)
+        if present.any():
+            occupancy[:,present] = self.counts_df[[x for x, p in zip(names,present) if p]].to_numpy(dtype=bool)
+        shape = (self.num_roi_groups,self.num_rois_per_group,self.num_images)
+        self.occupancy = occupancy.reshape((len(self.counts_df),)+shape)
+        self.occupancy_present = present.reshape(shape)
+    
+    def evaluate_criteria(self,criteria_string):
+        """Return a boolean array (shots, groups) of whether each shot meets 
+        the criteria in each ROI group, see criteria.compiledCriteria."""
+        criteria = compiledCriteria(criteria_string,self.num_rois_per_group,self.num_images)
+        if not criteria.valid.all():
+            print('Invalid ROI or image in criteria: {}'.format(criteria_string))
+        return criteria.evaluate(self.occupancy,self.occupancy_present)
     
     def apply_post_selection_criteria(self,post_selection_string):
         """
@@ -233,10 +413,9 @@ class Analyser():
         each entry in the brakets specifies a given image and the entries 
         within the brakets specify the ROIs in a given group.
         """
-        post_selection_criteria = self.convert_criteria_string_to_list(post_selection_string)
-        post_selection_column_keys = self.convert_criteria_list_to_column_keys(post_selection_criteria)
-        
-        self.ps_counts_df_split_by_roi_group = [self.get_post_selected_dataframe(x,post_selection_column_keys,group_num) for group_num, x in enumerate(self.counts_df_split_by_roi_group)]
+        self.ps_mask = self.evaluate_criteria(post_selection_string)
+        # take() makes a new DataFrame rather than a view, so it doesn't need copying
+        self.ps_counts_df_split_by_roi_group = [x.take(np.flatnonzero(self.ps_mask[:,group_num])) for group_num, x in enumerate(self.counts_df_split_by_roi_group)]
         post_select_probs_errs = self.get_post_selection_probs()
         return post_select_probs_errs
     
@@ -246,17 +425,12 @@ class Analyser():
         return [self.binomial_confidence_interval(len(x),len(y)) for x,y in zip(self.ps_counts_df_split_by_roi_group,self.counts_df_split_by_roi_group)]
         
     def apply_condition_criteria(self,condition_criteria_string):
-        condition_criteria = self.convert_criteria_string_to_list(condition_criteria_string)
-        condition_column_keys = self.convert_criteria_list_to_column_keys(condition_criteria)
-        
-        try:
-            [self.calculate_condition_met(x,condition_column_keys,group_num) for group_num, x in enumerate(self.ps_counts_df_split_by_roi_group)]
-        except AttributeError: # post-selection criteria has not been applied
+        if not hasattr(self,'ps_mask'): # post-selection criteria has not been applied
             self.apply_post_selection_criteria('') # apply no post-selection criteria
-            [self.calculate_condition_met(x,condition_column_keys,group_num) for group_num, x in enumerate(self.ps_counts_df_split_by_roi_group)]
         
-        # print(self.ps_counts_df_split_by_roi_group[0].columns)
-        # print(self.ps_counts_df_split_by_roi_group[0].head())
+        condition_met = self.evaluate_criteria(condition_criteria_string)
+        for group_num, x in enumerate(self.ps_counts_df_split_by_roi_group):
+            x['condition met'] = condition_met[self.ps_mask[:,group_num],group_num]
         
         return self.get_condition_met_probs()
     
@@ -431,9 +605,261 @@ class Analyser():
             separation_data[name] = roi_data
         return separation_data
 
+class IncrementalAnalyser():
+    """Analyses MAIA data as it arrives, for the STEFANs. Each update only
+    adds the images that the MAIA has processed since the last update, and
+    running totals are kept of the loading, survival, post-selection 
+    and condition statistics, so that the cost of an update
+    doesn't grow with the length of the run. The totals are recalculated 
+    from the stored counts in one vectorised pass when the thresholds or
+    criteria change.
+    
+    A shot is counted in the post-selection, condition and survival 
+    statistics once all of its images have arrived. Loading
+    probabilities use every image that has arrived.
+    
+    Data is given by the MAIA in the format [counts, thresholds, roi_coords,
+    new_images, cursor], where counts is the full MAIA data to start again
+    from, or None if new_images lists the [file ID, image, counts] of each
+    image processed since the last update. cursor = [epoch, position] 
+    should be sent with the next request so that the MAIA knows what data
+    has already been received.
+    """
+    binomial_confidence_interval = Analyser.binomial_confidence_interval
+    uncert_to_str = Analyser.uncert_to_str
+    
+    def __init__(self,capacity=1024):
+        self.capacity = capacity # initial number of shots to store. Doubles when full.
+        self.cursor = [-1,0] # epoch and position in the MAIA counts log
+        self.post_selection = ''
+        self.condition = ''
+        self.set_shape((0,0,0))
+    
+    def set_shape(self,shape):
+        """Remove all data and set the number of (groups, rois per group, images)."""
+        self.shape = tuple(shape)
+        self.num_roi_groups, self.num_rois_per_group, self.num_images = self.shape
+        self.counts = np.full((self.capacity,)+self.shape,np.nan) # NaN until the image arrives
+        self.file_ids = np.zeros(self.capacity,dtype=int)
+        self.rows = {} # the row in the arrays for each file ID
+        self.n = 0 # number of rows used
+        self.counted = np.zeros(self.capacity,dtype=bool) # whether the shot is in the totals
+        self.ps_met = np.zeros((self.capacity,self.num_roi_groups),dtype=bool)
+        self.cm_met = np.zeros((self.capacity,self.num_roi_groups),dtype=bool)
+        self.thresholds = np.full(self.shape,np.inf)
+        self.set_criteria(self.post_selection,self.condition,force=True)
+        self.stale = False # whether the totals need recalculating
+        self.zero_totals()
+    
+    def zero_totals(self):
+        k = self.num_rois_per_group*self.num_images
+        self.n_images = np.zeros(self.num_images,dtype=int) # number of shots received for each image
+        self.n_loaded = np.zeros(self.shape,dtype=int) # number above threshold for each ROI and image
+        self.n_complete = 0 # number of shots with all images
+        self.n_pairs = np.zeros((self.num_roi_groups,k,k),dtype=int) # complete shots with both ROI/images occupied
+        self.n_ps = np.zeros(self.num_roi_groups,dtype=int) # complete shots meeting the post-selection
+        self.n_cm = np.zeros(self.num_roi_groups,dtype=int) # and meeting the condition
+    
+    def set_criteria(self,post_selection,condition,force=False):
+        """Set the post-selection and condition criteria strings. The totals 
+        will be recalculated if they have changed."""
+        post_selection, condition = post_selection or '', condition or ''
+        if force or post_selection != self.post_selection or condition != self.condition:
+            self.post_selection, self.condition = post_selection, condition
+            self.ps_criteria = compiledCriteria(post_selection,self.num_rois_per_group,self.num_images)
+            self.cm_criteria = compiledCriteria(condition,self.num_rois_per_group,self.num_images)
+            self.stale = True
+    
+    def set_thresholds(self,thresholds_and_autothreshs):
+        """Set the thresholds from the MAIA threshold data. The totals will be 
+        recalculated if they have changed."""
+        thresholds = np.array([[[image[0] for image in roi] for roi in group] 
+                               for group in thresholds_and_autothreshs],dtype=float)
+        if thresholds.shape == self.shape and not np.array_equal(thresholds,self.thresholds):
+            self.thresholds = thresholds
+            self.stale = True
+    
+    def grow(self):
+        """Double the number of shots that can be stored."""
+        for name in ['counts','file_ids','counted','ps_met','cm_met']:
+            arr = getattr(self,name)
+            new = np.full((2*len(arr),)+arr.shape[1:],np.nan) if name == 'counts' else np.zeros(
+                (2*len(arr),)+arr.shape[1:],dtype=arr.dtype)
+            new[:len(arr)] = arr
+            setattr(self,name,new)
+    
+    def update(self,maia_data):
+        """Add the data sent by the MAIA, see the class docstring. Data in the
+        Analyser format [counts, thresholds, roi_coords] replaces all data."""
+        counts, thresholds, roi_coords, new_images, cursor = (list(maia_data) + [[],[-1,0]])[:5]
+        if counts is not None: # start again from the full data
+            shape = (len(counts),len(counts[0]) if counts else 0,len(counts[0][0]) if counts and counts[0] else 0)
+            self.set_shape(shape)
+            self.set_thresholds(thresholds)
+            self.add_full_data(counts)
+        else:
+            self.set_thresholds(thresholds)
+            self.add_images(new_images)
+        self.cursor = cursor
+        if self.stale:
+            self.recalculate()
+    
+    def add_full_data(self,counts):
+        """Store the MAIA counts [group][roi][image] = {file ID: counts}."""
+        dicts = [(g,r,i,d) for g, group in enumerate(counts) for r, roi in enumerate(group) for i, d in enumerate(roi)]
+        ids = [np.fromiter(d.keys(),dtype=int,count=len(d)) for g, r, i, d in dicts]
+        all_ids = np.concatenate(ids) if ids else np.zeros(0,dtype=int)
+        unique, first = np.unique(all_ids,return_index=True)
+        unique = unique[np.argsort(first)] # in the order they arrived
+        while len(unique) > len(self.file_ids):
+            self.grow()
+        self.n = len(unique)
+        self.file_ids[:self.n] = unique
+        self.rows = dict(zip(unique.tolist(),range(self.n)))
+        order = np.argsort(unique)
+        for (g, r, i, d), x in zip(dicts,ids):
+            rows = order[np.searchsorted(unique[order],x)]
+            self.counts[rows,g,r,i] = np.fromiter(d.values(),dtype=float,count=len(d))
+        self.stale = True
+    
+    def add_images(self,new_images):
+        """Add a list of [file ID, image number, counts[group][roi]] and 
+        update the totals."""
+        for file_id, image, counts in new_images:
+            row = self.rows.get(file_id)
+            if row is None:
+                if self.n == len(self.file_ids):
+                    self.grow()
+                row = self.rows[file_id] = self.n
+                self.file_ids[row] = file_id
+                self.n += 1
+            elif not np.isnan(self.counts[row,0,0,image]): # the image was replaced
+                self.stale = True
+            self.counts[row,:,:,image] = counts
+            if not self.stale:
+                self.n_images[image] += 1
+                self.n_loaded[:,:,image] += self.counts[row,:,:,image] > self.thresholds[:,:,image]
+                if not np.isnan(self.counts[row]).any():
+                    self.count_shot(row)
+    
+    def count_shot(self,row):
+        """Add a complete shot to the totals."""
+        occupancy = self.counts[row] > self.thresholds
+        flat = occupancy.reshape(self.num_roi_groups,-1)
+        self.n_pairs += flat[:,:,None] & flat[:,None,:]
+        self.ps_met[row] = self.ps_criteria.evaluate(occupancy[None])[0]
+        self.cm_met[row] = self.cm_criteria.evaluate(occupancy[None])[0]
+        self.n_ps += self.ps_met[row]
+        self.n_cm += self.ps_met[row] & self.cm_met[row]
+        self.n_complete += 1
+        self.counted[row] = True
+    
+    def recalculate(self):
+        """Recalculate all of the totals from the stored counts."""
+        self.zero_totals()
+        self.stale = False
+        if not all(self.shape):
+            return
+        counts = self.counts[:self.n]
+        received = ~np.isnan(counts[:,0,0,:]) # (shots, images)
+        occupancy = counts > self.thresholds
+        complete = received.all(axis=1)
+        self.n_images = received.sum(axis=0)
+        self.n_loaded = occupancy.sum(axis=0)
+        self.n_complete = complete.sum()
+        flat = occupancy[complete].reshape(self.n_complete,self.num_roi_groups,-1).astype(int)
+        self.n_pairs = np.einsum('sgk,sgl->gkl',flat,flat)
+        self.counted[:self.n] = complete
+        self.ps_met[:self.n] = self.ps_criteria.evaluate(occupancy) & complete[:,None]
+        self.cm_met[:self.n] = self.cm_criteria.evaluate(occupancy) & complete[:,None]
+        self.n_ps = self.ps_met[:self.n].sum(axis=0)
+        self.n_cm = (self.ps_met[:self.n] & self.cm_met[:self.n]).sum(axis=0)
+    
+    def get_counts_data(self,roi,image):
+        """Return [file IDs, counts] for each group for a ROI and image."""
+        rows = np.flatnonzero(~np.isnan(self.counts[:self.n,0,0,image]))
+        return [[self.file_ids[rows],self.counts[rows,g,roi,image]] for g in range(self.num_roi_groups)]
+    
+    def get_loading_probs(self,image=0):
+        """Calculate the probability that each ROI was loaded in an image, 
+        as a list for each group of a list for each ROI."""
+        return [[self.binomial_confidence_interval(n,self.n_images[image]) for n in group]
+                for group in self.n_loaded[:,:,image]]
+    
+    def get_survival_probs(self,image0=0,image1=1):
+        """Calculate the probability that each ROI was occupied in image1 
+        given that it was occupied in image0, as a list for each group of a 
+        list for each ROI."""
+        k0 = np.arange(self.num_rois_per_group)*self.num_images + image0
+        k1 = np.arange(self.num_rois_per_group)*self.num_images + image1
+        return [[self.binomial_confidence_interval(group[a,b],group[a,a]) for a, b in zip(k0,k1)]
+                for group in self.n_pairs]
+    
+    def get_post_selection_probs(self):
+        """Calculate the probability that post-selection criteria were met for
+        each ROI group."""
+        return [self.binomial_confidence_interval(n,self.n_complete) for n in self.n_ps]
+    
+    def get_condition_met_probs(self):
+        """Calculate the probability that condition met criteria were met for
+        each ROI group."""
+        return [self.binomial_confidence_interval(n,total) for n, total in zip(self.n_cm,self.n_ps)]
+    
+    def get_avg_condition_met_prob(self,groups_to_use=None):
+        """Calculate the average condition met prob across all ROI groups."""
+        groups = range(self.num_roi_groups) if groups_to_use is None else groups_to_use
+        return self.binomial_confidence_interval(sum(self.n_cm[g] for g in groups),sum(self.n_ps[g] for g in groups))
+    
+    def get_condition_met_plotting_data(self):
+        """Returns [File IDs, condition met] for the post-selected shots in
+        each ROI group, as Analyser.get_condition_met_plotting_data."""
+        return [[self.file_ids[:self.n][ps],self.cm_met[:self.n,g][ps].astype(int)] 
+                for g, ps in enumerate(self.ps_met[:self.n].T)]
+
 if __name__ == '__main__':
     import time
     import pickle
+    import tempfile
+    import contextlib
+    
+    # time loading a synthetic measure: serially, in parallel, and cached
+    directory = os.path.join(tempfile.gettempdir(),'maia_measure_test')
+    os.makedirs(directory,exist_ok=True)
+    rng = np.random.default_rng(0)
+    names = ['ROI{}:{} Im{}'.format(g,r,i) for g in range(4) for r in range(4) for i in range(2)]
+    for hist_id in range(40):
+        counts_df = pd.DataFrame(rng.poisson(rng.choice([50,500],(2000,len(names)))),
+                                 columns=[x+' counts' for x in names])
+        for x in names:
+            counts_df[x+' occupancy'] = counts_df[x+' counts'] > 250
+        counts_df.index = pd.Index(np.arange(hist_id*2000,(hist_id+1)*2000),name='File ID')
+        aux_df = pd.DataFrame({**{'User variable 0':[hist_id]},**{x+' threshold':[250] for x in names}})
+        with open(os.path.join(directory,'MAIA.{}.csv'.format(hist_id)),'w') as f:
+            aux_df.to_csv(f,index=False)
+            counts_df.to_csv(f)
+    if os.path.exists(os.path.join(directory,CACHE_NAME)):
+        os.remove(os.path.join(directory,CACHE_NAME))
+    with contextlib.redirect_stdout(None): # don't print file names
+        start = time.perf_counter()
+        serial = MeasureAnalyser(directory,processes=1,use_cache=False)
+        t_serial = time.perf_counter() - start
+        start = time.perf_counter()
+        parallel = MeasureAnalyser(directory)
+        t_parallel = time.perf_counter() - start
+        start = time.perf_counter()
+        cached = MeasureAnalyser(directory)
+        t_cached = time.perf_counter() - start
+    same = all(serial.analysers[x].counts_df.equals(cached.analysers[x].counts_df) and 
+               serial.analysers[x].aux_df.equals(cached.analysers[x].aux_df) for x in serial.analysers)
+    print('{} cores: serial {:.2f} s, parallel {:.2f} s, cached {:.2f} s, same data: {}'.format(
+        os.cpu_count(),t_serial,t_parallel,t_cached,same))
+    # rewriting the cache while ignoring some IDs keeps their entries
+    os.utime(os.path.join(directory,'MAIA.0.csv')) # so the cache is rewritten
+    with contextlib.redirect_stdout(None):
+        MeasureAnalyser(directory,ignore_ids=[1,2])
+    with np.load(os.path.join(directory,CACHE_NAME)) as cache:
+        print('ignored files still cached:', {'MAIA.1.csv','MAIA.2.csv'} <= set(map(str,cache['files'])))
+    
     import matplotlib.pyplot as plt
     
     """
@@ -24,6 +24,7 @@ import itertools
 import sys
 if '.' not in sys.path: sys.path.append('.')
 from helpers import calculate_threshold
+from criteria import compiledCriteria
 
 class MeasureAnalyser():
     """Class to analyse the results of an entire measurement. Makes different
@@ -260,28 +261,42 @@ class Analyser():
             col_names = [x for x in self.counts_df if 'ROI{}'.format(roi_group) in x]
             group_df = self.counts_df[col_names]
             self.counts_df_split_by_roi_group.append(group_df)
+        self.calculate_occupancy_array()
+    
+    def calculate_occupancy_array(self):
+        """Arrange the occupancy columns into a boolean array with shape
+        (shots, groups, rois, images) that criteria are evaluated on. 
+        occupancy_present records which of the columns exist."""
+        names = ['ROI{}:{} Im{} occupancy'.format(group,roi,image) for group in range(self.num_roi_groups)
+                 for roi in range(self.num_rois_per_group) for image in range(self.num_images)]
+        present = np.array([x in self.counts_df.columns for x in names],dtype=bool)
+        occupancy = np.zeros((len(self.counts_df),len(names)),dtype=bool)
+        if present.any():
+            occupancy[:,present] = self.counts_df[[x for x, p in zip(names,present) if p]].to_numpy(dtype=bool)
+        shape = (self.num_roi_groups,self.num_rois_per_group,self.num_images)
+        self.occupancy = occupancy.reshape((len(self.counts_df),)+shape)
+        self.occupancy_present = present.reshape(shape)
+    
+    def evaluate_criteria(self,criteria_string):
+        """Return a boolean array (shots, groups) of whether each shot meets 
+        the criteria in each ROI group. A set of alternatives '{[1x][x1]}' is
+        met if any of its permutations is met, see criteria.compiledCriteria."""
+        criteria = compiledCriteria(criteria_string,self.num_rois_per_group,self.num_images)
+        if not criteria.valid.all():
+            print('Invalid ROI or image in criteria: {}'.format(criteria_string))
+        return criteria.evaluate(self.occupancy,self.occupancy_present)
     
     def apply_post_selection_criteria(self,post_selection_string):
         """
         Applies the post-selection criteria for this analyser. Post-selection
         criteria specified in a string in the form '[1xx1],[0x1x]' etc where
         each entry in the brakets specifies a given image and the entries 
-        within the brakets specify the ROIs in a given group.
+        within the brakets specify the ROIs in a given group. Shots that 
+        meet any permutation of the criteria are kept, in order of File ID.
         """
-        post_selection_permutations = self.get_criteria_permutations(post_selection_string)
-
-        ps_counts_df_split_by_roi_groups = []
-
-        for permutation in post_selection_permutations:
-            post_selection_criteria = self.convert_criteria_string_to_list(permutation)
-            post_selection_column_keys = self.convert_criteria_list_to_column_keys(post_selection_criteria)
-            
-            ps_counts_df_split_by_roi_groups.append([self.get_post_selected_dataframe(x,post_selection_column_keys,group_num) for group_num, x in enumerate(self.counts_df_split_by_roi_group)])
-            
-            # print(post_select_probs_errs)
-        ps_counts_df_split_by_roi_groups = list(map(list, zip(*ps_counts_df_split_by_roi_groups))) # now each entry is list of permutations for each ROI
-
-        self.ps_counts_df_split_by_roi_group = [pd.concat(x).drop_duplicates().reset_index(drop=True) for x in ps_counts_df_split_by_roi_groups]
+        self.ps_mask = self.evaluate_criteria(post_selection_string)
+        # take() makes a new DataFrame rather than a view, so it doesn't need copying
+        self.ps_counts_df_split_by_roi_group = [x.take(np.flatnonzero(self.ps_mask[:,group_num])) for group_num, x in enumerate(self.counts_df_split_by_roi_group)]
         post_select_probs_errs = self.get_post_selection_probs()
         return post_select_probs_errs
     
@@ -291,26 +306,12 @@ class Analyser():
         return [self.binomial_confidence_interval(len(x),len(y)) for x,y in zip(self.ps_counts_df_split_by_roi_group,self.counts_df_split_by_roi_group)]
         
     def apply_condition_criteria(self,condition_criteria_string):
-        condition_permutations = self.get_criteria_permutations(condition_criteria_string)
-
-        conditions_met_all_permutations = []
-
-        for permutation in condition_permutations:
-            condition_criteria = self.convert_criteria_string_to_list(permutation)
-            condition_column_keys = self.convert_criteria_list_to_column_keys(condition_criteria)
-            
-            try:
-                [self.calculate_condition_met(x,condition_column_keys,group_num) for group_num, x in enumerate(self.ps_counts_df_split_by_roi_group)]
-                conditions_met_all_permutations.append([list(x['condition met']) for x in self.ps_counts_df_split_by_roi_group])
-            except AttributeError: # post-selection criteria has not been applied
-                self.apply_post_selection_criteria('') # apply no post-selection criteria
-                [self.calculate_condition_met(x,condition_column_keys,group_num) for group_num, x in enumerate(self.ps_counts_df_split_by_roi_group)]
-                conditions_met_all_permutations.append([list(x['condition met']) for x in self.ps_counts_df_split_by_roi_group])
+        if not hasattr(self,'ps_mask'): # post-selection criteria has not been applied
+            self.apply_post_selection_criteria('') # apply no post-selection criteria
         
-        conditions_met_all_permutations = list(map(list, zip(*conditions_met_all_permutations))) # transpose so each entry is list of condition met for each ROI group
-        # print(len(conditions_met_all_permutations[0]))
-        for df, conditions_met in zip(self.ps_counts_df_split_by_roi_group,conditions_met_all_permutations):
-            df['condition met'] = np.sum(conditions_met,axis=0).astype(bool)       
+        condition_met = self.evaluate_criteria(condition_criteria_string) # met if any permutation is met
+        for group_num, x in enumerate(self.ps_counts_df_split_by_roi_group):
+            x['condition met'] = condition_met[self.ps_mask[:,group_num],group_num]
         return self.get_condition_met_probs()
     
     def get_condition_met_probs(self):
@@ -2,8 +2,9 @@
 
 Display histograms using PyDex:
 load histogram results from a log file, then plot the histograms using the appropriate 
-histogram csv file
+histogram file (npz, or csv from older multiruns)
 """
+import os
 import numpy as np
 import matplotlib.pyplot as plt
 plt.rcParams.update({'font.size': 12})
@@ -12,6 +13,7 @@ sys.path.append(r'Z:\Tweezer\People\Stefan\general-python')
 sys.path.append(r'Z:\Tweezer\Code\Python 3.5\PyDex')
 from fitandgraph import fit, graph
 from imageanalysis.histoHandler import histo_handler
+from imageanalysis.imageHandler import image_handler
 from scipy.optimize import curve_fit
 
 # choose all of the options to plot
@@ -19,7 +21,7 @@ fdir = r'Z:\Tweezer\Experimental Results\2022\March\17\Measure11' # directory fi
 hh = histo_handler()
 hh.load(fdir+r'\ROI2.Im0.Measure11.dat') # load the log/measure file containing histogram statistics to plot
 # hh.sort_dict() # sort the histograms in ascending order of user_var measured
-prestring = r'\ROI2.Im0.' # prestring at the start of the histogram csv files
+prestring = r'\ROI2.Im0.' # prestring at the start of the histogram files
 num_bins = 25   # number of bins to make the histograms with
 var_unit = 'MHz' # units for the user variable
 def conv(x): 
@@ -27,6 +29,15 @@ def conv(x):
     return x#-2*(16.41*x + 65.04-95.12) 
 # I = 2*power *(convert from measured power to total MOT power) / np.pi / beamwaist**2 / Isat
 
+def load_counts(file_name):
+    """Load the counts from a histogram saved by a multirun: binary columns
+    in file_name.npz, or else file_name.csv"""
+    if os.path.isfile(file_name + '.npz'):
+        ih = image_handler()
+        ih.load(file_name + '.npz')
+        return np.array(ih.stats['Counts'])
+    return np.genfromtxt(file_name + '.csv', delimiter=',')[:,1]
+
 # calculate the contrast to noise ratio
 sep = np.array(hh.stats['Separation']) # atomic fluorescence signal
 bg_width = np.array(hh.stats['Background peak width']) # standard deviation of fit to background peak
@@ -47,12 +58,12 @@ ax[-1].set_ylabel('Occurrence')
 xlim = np.array((hh.stats['Background mean'][0],hh.stats['Signal mean'][0]))
 # add the histograms to the respective subplots
 for i in range(8):#len(hh.stats['File ID'])):    
-    # load the histogram data from the csv file
-    histdata = np.genfromtxt(fdir+prestring+str(int(hh.stats['File ID'][i]))+'.csv', delimiter=',')
+    # load the histogram data from the npz or csv file
+    counts = load_counts(fdir+prestring+str(int(hh.stats['File ID'][i])))
     # replot the histogram
-    occ, bins, patches = ax[i].hist(histdata[:,1], bins=num_bins)
+    occ, bins, patches = ax[i].hist(counts, bins=num_bins)
     # plt.figure()
-    # plt.hist(histdata[:,1], bins=num_bins)
+    # plt.hist(counts, bins=num_bins)
     # plot threshold
     ax[i].plot([hh.stats['Threshold'][i]]*2, ax[i].get_ylim(), 'k:')
     # add a title with histogram statistics
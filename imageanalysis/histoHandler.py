@@ -165,9 +165,9 @@ class histo_handler(Analysis):
                 ih.fidelity, ih.err_fidelity = 1, 0 
 
             # update atom statistics
-            counts = np.array(ih.stats['Counts'])
+            counts = np.asarray(ih.stats['Counts'])
             atom = np.where(counts > ih.thresh, 1, 0)
-            ih.stats['Atom detected'] = list(atom)
+            ih.stats['Atom detected'] = atom
 
             above_idxs = np.where(atom == 1)[0] # index of images with counts above threshold
             atom_count = np.size(above_idxs)  # number of images with counts above threshold
@@ -177,7 +177,7 @@ class histo_handler(Analysis):
             below = counts[below_idxs] # counts below threshold
             # use the binomial distribution to get 1 sigma confidence intervals:
             conf = binom_conf_interval(atom_count, atom_count + empty_count, interval='jeffreys')
-            loading_prob = atom_count/ih.ind # fraction of images above threshold
+            loading_prob = atom_count/np.size(counts) # fraction of images above threshold
             uplperr = conf[1] - loading_prob # 1 sigma confidence above mean
             lolperr = loading_prob - conf[0] # 1 sigma confidence below mean
 
@@ -13,12 +13,15 @@ from collections import OrderedDict
 import time
 from scipy.signal import find_peaks
 from scipy.stats import norm
-from skimage.filters import threshold_minimum
+from scipy.ndimage import uniform_filter1d
 from astropy.stats import binom_conf_interval
 from analysis import Analysis, BOOL
+from sparseROI import sparse_rois
+from statsStore import stats_dict, running_histogram
 if '.' not in sys.path: sys.path.append('.')
 if '..' not in sys.path: sys.path.append('..')
 from strtypes import error, warning, info
+from saveimages.imwriter import load_image, EXT
 
 def est_param(h):
     """Generator function to estimate the parameters for a Guassian fit. 
@@ -36,6 +39,29 @@ def est_param(h):
 
     return peak_inds, properties['prominences'], properties['widths']
 
+def local_maxima(h):
+    """Return the indexes where h stops rising and starts falling, taking 
+    the last index of a plateau. A fall at the start counts as a maximum."""
+    d = np.diff(h)
+    i = np.flatnonzero(d) # ignore flat steps
+    rise = d[i] > 0
+    return i[~rise & np.concatenate(([True], rise[:-1]))]
+
+def hist_minimum(occ, centres, max_iter=10000):
+    """Return the bin centre at the minimum between the two peaks of the
+    histogram, as in skimage.filters.threshold_minimum but from the 
+    histogram rather than the values. Smooth the occupancies until there
+    are fewer than 3 maxima, raise RuntimeError if there aren't 2."""
+    h = np.asarray(occ, dtype=float)
+    for i in range(max_iter):
+        h = uniform_filter1d(h, 3)
+        peaks = local_maxima(h)
+        if len(peaks) < 3:
+            break
+    if len(peaks) != 2:
+        raise RuntimeError('Unable to find two maxima in histogram')
+    return centres[peaks[0] + np.argmin(h[peaks[0]:peaks[1]+1])]
+
 ####    ####    ####    ####
         
 # convert an image into its pixel counts to put into a histogram
@@ -45,7 +71,9 @@ class image_handler(Analysis):
     Load an ROI image centred on the atom, integrate the counts,
     then compare to the threshold.
     Inherits the types and stats dictionaries, and reset_arrays, 
-    load, and save methods from Analysis."""
+    load, and save methods from Analysis. The stats are stored in 
+    growable numpy columns and the counts are added to a running 
+    histogram, so the cost per image doesn't grow with the number of images."""
     def __init__(self):
         super().__init__()
         self.types = OrderedDict([('File ID', int), # number ID of image
@@ -57,7 +85,11 @@ class image_handler(Analysis):
             ('Mean bg count', float), # mean counts outside ROI - estimate bg
             ('Bg s.d.', float),# standard deviation outside of ROI
             ('Include', BOOL)])# whether to include in further analysis
-        self.stats = OrderedDict([(key, []) for key in self.types.keys()]) # standard deviation of counts outside ROI
+        self.window = 0 # number of images to keep the stats of, 0 keeps all
+        self.stats = stats_dict(self.types, self.window) # columns of stats for each image
+        self.hist = running_histogram() # fine bins of the counts
+        self.hist_counts = self.stats['Counts'] # the column that the histogram was made from
+        self.hist_len = 0 # number of counts in the column when the histogram was updated
         
         self.delim = ' '                # delimieter to use when opening image files
         self.bias = 697                 # bias offset from EMCCD
@@ -68,6 +100,7 @@ class image_handler(Analysis):
         self.fidelity     = 0           # fidelity of detecting atom presence
         self.err_fidelity = 0           # error in fidelity
         self.mask      = np.zeros((1,1))# normalised mask to apply to image for ROI
+        self.rois      = sparse_rois()  # bounding box and weights of the mask
         self.xc        = 1              # ROI centre x position 
         self.yc        = 1              # ROI centre y position
         self.roi_size  = 1              # ROI length in pixels. default 1 takes top left pixel
@@ -76,17 +109,33 @@ class image_handler(Analysis):
         self.thresh    = 1              # initial threshold for atom detection
         self.fid       = 0              # file ID number for the next image
         self.ind       = 0              # number of images processed
-        self.im_vals   = np.array([])   # the data from the last image is accessible to an image_handler instance
+        self.im_vals   = np.array([])   # the last image processed is accessible to an image_handler instance
         self.bin_array = []             # if bins for the histogram are supplied, plotting can be faster
         self.bins = []                  # store histogram for quicker updating
         self.occs = []
-        self.redo = True                # whether to recalculate histogram
+        self.redo = True                # whether to choose new bins for the histogram
 
     def reset_arrays(self):
         """Reset arrays and the stored histogram"""
         super().reset_arrays()
+        self.hist.reset()
+        self.hist_counts, self.hist_len = self.stats['Counts'], 0
         self.bins = self.bin_array
-        self.occs = np.zeros(len(self.bins),dtype=int) if np.size(self.bins) else []
+        self.occs = np.zeros(len(self.bins)-1,dtype=int) if np.size(self.bins) else []
+
+    def set_window(self, n=0):
+        """Only keep the stats of the last n images, or all of them if n = 0."""
+        self.window = n
+        self.stats.window = n
+
+    def sync_hist(self):
+        """Remake the running histogram if the counts have been replaced 
+        or added to without it, e.g. when they're loaded from a file."""
+        counts = self.stats['Counts']
+        if counts is not self.hist_counts or len(counts) != self.hist_len:
+            self.hist.reset()
+            self.hist.update(counts)
+            self.hist_counts, self.hist_len = counts, len(counts)
     
     def process(self, im, include=True):
         """Fill in the next index of counts by integrating over
@@ -95,45 +144,43 @@ class image_handler(Analysis):
         im      -- image array to be processed
         include -- whether to include the image in further analysis
         """
-        full_im = im - self.bias # remove the bias offset, it's arbitrary
-        try:
-            self.im_vals = full_im * self.mask # get the ROI
-            not_roi = full_im * (1-self.mask)
+        self.im_vals = im
+        try: # counts in the ROI and the background outside it, without full image products
+            counts, mean, sd = self.rois.update([self.mask], np.shape(im)).stats(im, self.bias)
+            if self.rois.bad: raise ValueError
+            counts, mean, sd = counts[0], mean[0], sd[0]
         except ValueError as e:
-            s0 = np.shape(self.mask)
-            self.im_vals = np.zeros(s0)
-            not_roi = np.zeros(s0)
+            counts, mean, sd = 0, 0, 0
             include = False
-            s1 = np.shape(im)
+            s0, s1 = np.shape(self.mask), np.shape(im)
             error("Received image was wrong shape (%s,%s) for analyser's ROI (%s,%s)"%(
                 s1[0],s1[1],s0[0],s0[1]))
         # background statistics: mean count and standard deviation across image
-        N = np.sum(1-self.mask)
-        self.stats['Mean bg count'].append(np.sum(not_roi) / N)
-        self.stats['Bg s.d.'].append(
-            np.sqrt(np.sum((not_roi - self.stats['Mean bg count'][-1])**2) / (N - 1)))
+        self.stats['Mean bg count'].append(mean)
+        self.stats['Bg s.d.'].append(sd)
         # sum of counts in the ROI of the image gives the signal
-        self.stats['Counts'].append(np.sum(self.im_vals)) 
+        c = self.stats['Counts']
+        synced = c is self.hist_counts and len(c) == self.hist_len
+        dropped = c.append(counts) # values that fell out of the window
+        if synced: # update the histogram with this image
+            self.hist.add(counts)
+            for x in dropped:
+                self.hist.remove(x)
+            self.hist_len = len(c)
         # file ID number should be updated externally before each event
         self.stats['File ID'].append(self.fid)
         # the pixel value at the centre of the ROI
         try:
-            self.stats['ROI centre count'].append(full_im[self.xc, self.yc])
+            self.stats['ROI centre count'].append(im[self.xc, self.yc] - self.bias)
         except IndexError as e:
             error('ROI centre (%s, %s) outside of image size (%s, %s)'%(
                 self.xc, self.yc, self.pic_width, self.pic_height))
             self.stats['ROI centre count'].append(0)
         # position of the (first) max intensity pixel
-        xmax, ymax = np.unravel_index(np.argmax(full_im), full_im.shape)
+        xmax, ymax = np.unravel_index(np.argmax(im), np.shape(im))
         self.stats['Max xpos'].append(xmax)
         self.stats['Max ypos'].append(ymax)
         self.stats['Include'].append(include)
-        if np.size(self.bins):
-            index = np.where(self.bins > self.stats['Counts'][-1])
-            try:
-                self.occs[index[0]] += 1
-            except IndexError:
-                self.occs[-1] += 1
         self.ind += 1
             
     def get_fidelity(self, thresh=None):
@@ -191,34 +238,52 @@ class image_handler(Analysis):
         # if np.size(self.peak_indexes) == 2: # est_param will only find one peak if the number of bins is small
         #     # set the threshold where the fidelity is max
         #     self.search_fidelity(self.peak_centre[0], self.peak_widths[0] ,self.peak_centre[1])
-        try: 
-            thresh = threshold_minimum(np.array(self.stats['Counts']), len(bins))
+        try: # minimum between peaks, from the running histogram in len(bins) bins
+            edges = np.linspace(*self.hist.range(), len(bins)+1)
+            occ_t, _ = self.hist.histogram(edges)
+            thresh = hist_minimum(occ_t, 0.5*(edges[1:] + edges[:-1]))
             int(np.log(thresh)) # if thresh <= 0 this gives ValueError
             self.thresh = thresh
-        except (ValueError, RuntimeError, OverflowError): pass
+        except (ValueError, RuntimeError, OverflowError, TypeError): pass
         try:
             # atom is present if the counts are above threshold
-            self.stats['Atom detected'] = [x // self.thresh for x in self.stats['Counts']]
+            self.atoms_above(self.thresh)
             # self.fidelity, self. err_fidelity = np.around(self.get_fidelity(), 4) # this is a relatively slow operation
         except (ValueError, OverflowError): pass
         return bins, occ, self.thresh
 
+    def atoms_above(self, thresh):
+        """Set 'Atom detected' to counts // thresh for each image, in place
+        in the column so that there's no new array or list for each image."""
+        counts = self.stats['Counts']
+        if len(self.stats['Atom detected']) > len(counts):
+            self.stats['Atom detected'] = [] # stored as a new column
+        atoms = self.stats['Atom detected']
+        atoms.extend(np.zeros(len(counts) - len(atoms)))
+        x = counts.view() / thresh
+        atoms.view()[:] = np.floor(x, out=x) # much quicker than floor_divide for floats
+
     def histogram(self):
-        """Make a histogram of the photon counts but don't update the threshold
-        [Bool] redo: whether to use stored histogram or recalculate"""
+        """Make a histogram of the photon counts but don't update the threshold.
+        The histogram is rebinned from the running histogram, so its cost
+        doesn't depend on the number of images.
+        [Bool] redo: whether to choose new bins or use the stored ones"""
         if np.size(self.stats['Counts']): # don't do anything to an empty list
-            if np.size(self.bins) and not self.redo:
-                return self.bins, self.occs, self.thresh
-            elif np.size(self.bin_array) > 0: 
-                self.occs, self.bins = np.histogram(self.stats['Counts'], self.bin_array) # fixed bins. 
+            self.sync_hist()
+            if np.size(self.bins) > 1 and not self.redo:
+                edges = self.bins
+            elif np.size(self.bin_array) > 1: 
+                edges = self.bin_array # fixed bins. 
             else:
-                try:
-                    lo, hi = min(self.stats['Counts'])*0.97, max(self.stats['Counts'])*1.02
-                    # scale number of bins with number of files in histogram and with separation of peaks
+                lo, hi = self.hist.range()
+                lo, hi = lo*0.97, hi*1.02
+                try: # scale number of bins with number of files in histogram and with separation of peaks
                     num_bins = int(15 + self.ind//100 + (abs(hi - abs(lo))/hi)**2*15) 
-                    self.occs, self.bins = np.histogram(self.stats['Counts'], bins=np.linspace(lo, hi, num_bins+1)) # no bins provided by user
-                except: 
-                    self.occs, self.bins = np.histogram(self.stats['Counts'])
+                    num_bins = min(num_bins, self.hist.max_bins//4) # can't be finer than the running histogram
+                    edges = np.linspace(lo, hi, num_bins+1) # no bins provided by user
+                except (ValueError, OverflowError, ZeroDivisionError):
+                    edges = np.linspace(lo, hi, 11)
+            self.occs, self.bins = self.hist.histogram(edges)
         else: self.occs, self.bins = np.zeros(10), np.arange(0,1.1,0.1)
         return self.bins, self.occs, self.thresh
 
@@ -236,19 +301,20 @@ class image_handler(Analysis):
             self.peak_heights = [1, 1]
             self.peak_centre = [0.25, 0.75]
             self.peak_widths = [0.1, 0.1]
-        else: 
-            cs = np.sort(self.stats['Counts']) 
-            mid = len(cs) // 2 # index of the middle of the counts array
+        else: # split the counts at the median
+            mid = len(self.stats['Counts']) // 2 # index of the middle of the counts array
+            cs = np.partition(self.stats['Counts'].view(), mid) # only needs the split, not a full sort
             self.peak_heights = [np.max(occ), np.max(occ)]
             self.peak_centre = [np.mean(cs[:mid]), np.mean(cs[mid:])]
-            self.peak_widths = [np.std(cs[:mid]), np.std(cs[mid:])]  
+            self.peak_widths = [np.std(cs[:mid]), np.std(cs[mid:])]
         
     def peaks_and_thresh(self):
         """Get an estimate of the peak positions and standard deviations given a set threshold
         Then set the threshold as 5 standard deviations above background.
-        Sort the counts in ascending order, then split at the threshold, take means and widths."""
+        Split the counts at the threshold, take means and widths. The split is
+        exact from the counts, not from the running histogram's bins."""
         # split histograms at threshold then get mean and stdev:
-        counts = np.array(self.stats['Counts'])
+        counts = self.stats['Counts'].view()
         bg = counts[counts < self.thresh]     # background
         signal = counts[counts > self.thresh] # signal above threshold
         try:
@@ -269,17 +335,22 @@ class image_handler(Analysis):
                 self.xc - self.roi_size//2 >= 0 and 
                 self.yc + self.roi_size//2 < self.pic_height and 
                 self.yc - self.roi_size//2 >= 0):
-            self.mask = np.zeros((self.pic_width, self.pic_height))
-            self.mask[self.xc - self.roi_size//2 : (
+            mask = np.zeros((self.pic_width, self.pic_height)) # fill in before replacing, the analysis could be using it
+            mask[self.xc - self.roi_size//2 : (
                 self.xc + self.roi_size//2 + self.roi_size%2),
                 self.yc - self.roi_size//2 : (
                 self.yc + self.roi_size//2 + self.roi_size%2)
                 ] = np.ones((self.roi_size, self.roi_size))
+            self.mask = mask
 
     def set_pic_size(self, im_name):
         """Set the pic size by looking at the number of columns in a file
         Keyword arguments:
         im_name    -- absolute path to the image file to load"""
+        if im_name.endswith(EXT): # compressed image doesn't have row numbers
+            self.pic_height, self.pic_width = load_image(im_name).shape
+            self.create_rect_mask()
+            return self.pic_width, self.pic_height
         im_vals = np.genfromtxt(im_name, delimiter=self.delim)
         self.pic_width = int(np.size(im_vals[0]) - 1) # the first column of ASCII image is row number
         try: self.pic_height = int(np.size(im_vals[:,0])) 
@@ -318,6 +389,8 @@ class image_handler(Analysis):
         im_name    -- absolute path to the image file to load"""
         # return np.genfromtxt(im_name, delimiter=self.delim)#[:,1:] # first column gives column number
         try: 
+            if im_name.endswith(EXT):
+                return load_image(im_name)
             return np.loadtxt(im_name, delimiter=self.delim,
                               usecols=range(1,self.pic_width+1))
         except IndexError as e:
@@ -12,6 +12,7 @@ __version__ = '1.3'
 import os
 import sys
 import time
+import logging
 import numpy as np
 import pyqtgraph as pg    # not as flexible as matplotlib but works a lot better with qt
 from PyQt5.QtCore import pyqtSignal, QThread, pyqtSlot, Qt, QEvent, QRegularExpression
@@ -25,6 +26,7 @@ from PyQt5.QtWidgets import (QActionGroup, QVBoxLayout, QMenu,
         QSizePolicy,QAbstractScrollArea,QFileDialog)
 if '..' not in sys.path: sys.path.append('..')
 from strtypes import error, warning, info
+logger = logging.getLogger(__name__)
 import imageHandler as ih # process images to build up a histogram
 import histoHandler as hh # collect data from histograms together
 import fitCurve as fc   # custom class to get best fit parameters using curve_fit
@@ -92,7 +94,8 @@ class ImagerGUI(QMainWindow):
     signal_send_emccd_bias =pyqtSignal(object) # send EMCCD bias to the controller and MAIA
     signal_set_num_roi_groups = pyqtSignal(object) # used to set the number of ROI groups
     signal_set_num_rois_per_group = pyqtSignal(object) # used to set the number of ROIs per group
-    signal_request_maia_data = pyqtSignal(int) # request all data from MAIA for use in STEFANs
+    signal_request_maia_data = pyqtSignal(int,list) # request new data from MAIA for use in STEFANs (stefan_index,cursor)
+    signal_stefans_destroyed = pyqtSignal() # lets MAIA drop the data it was keeping for the STEFANs
     signal_tv_data_refresh = pyqtSignal() # requests an information update for the Threshold Viewer from MAIA
     signal_tv_data_to_maia = pyqtSignal(list) # sends updated threshold data from the TV back to MAIA
     signal_send_results_path = pyqtSignal(str) # sends results path to MAIA
@@ -167,6 +170,7 @@ class ImagerGUI(QMainWindow):
         self.signal_set_num_rois_per_group.connect(self.maia.update_num_rois_per_group)
         self.signal_send_emccd_bias.connect(self.maia.update_emccd_bias)
         self.signal_request_maia_data.connect(self.maia.recieve_data_request)
+        self.signal_stefans_destroyed.connect(self.maia.forget_stefan_cursors)
         self.signal_tv_data_refresh.connect(self.maia.recieve_tv_data_request)
         self.signal_tv_data_to_maia.connect(self.maia.recieve_tv_threshold_data)
         self.signal_send_new_num_images.connect(self.maia.update_num_images)
@@ -418,14 +422,14 @@ class ImagerGUI(QMainWindow):
         self.status_bar.setStyleSheet('background-color : pink')
         time_str = datetime.now().strftime('%H:%M:%S')
         self.status_bar.showMessage('MAIA @ {}: {}'.format(time_str,message))
-        print('MAIA @ {}: {}'.format(time_str,message))
+        logger.error('MAIA: %s',message)
 
     @pyqtSlot(str)
     def status_bar_message(self,message):
         self.status_bar.setStyleSheet('background-color : #BBCCEE')
         time_str = datetime.now().strftime('%H:%M:%S')
         self.status_bar.showMessage('MAIA @ {}: {}'.format(time_str,message))
-        print('MAIA @ {}: {}'.format(time_str,message))
+        logger.debug('MAIA: %s',message) # several per image so not shown on the console by default
 
     def generate_test_image(self):
         atom_xs = [1,10,20,30]
@@ -467,7 +471,7 @@ class ImagerGUI(QMainWindow):
         MAIA. The file ID and image number can be manually specified 
         or can just be left as None to let the MAIA assign the file ID 
         and image number."""
-        print('iGUI recieved image: file_id, image_num =',file_id,image_num)
+        logger.debug('iGUI recieved image: file_id, image_num = %s %s',file_id,image_num)
         self.signal_send_maia_image.emit(image,file_id,image_num)
 
     def get_draw_image_num(self):
@@ -705,7 +709,7 @@ class ImagerGUI(QMainWindow):
         self.status_bar.setStyleSheet('background-color : #CCDDAA')
         time_str = datetime.now().strftime('%H:%M:%S')
         self.status_bar.showMessage('STEFAN {} @ {}: {}'.format(stefan_index,time_str,message))
-        print('STEFAN {} @ {}: {}'.format(stefan_index,time_str,message))
+        logger.debug('STEFAN %s: %s',stefan_index,message)
 
     def launch_new_stefan(self):
         """Creates a new STEFAN"""
@@ -716,8 +720,8 @@ class ImagerGUI(QMainWindow):
     def update_all_stefans(self):
         """Forces all STEFANs (shown or hidden) to request an update."""
         # [stefan.request_update() for stefan in self.stefans]
-        for stefan_index,_ in enumerate(self.stefans):
-            self.signal_request_maia_data.emit(stefan_index)
+        for stefan_index,stefan in enumerate(self.stefans):
+            self.signal_request_maia_data.emit(stefan_index,stefan.analyser.cursor)
 
     def show_all_stefans(self):
         """Forces all STEFANs to redisplay on the GUI."""
@@ -726,11 +730,12 @@ class ImagerGUI(QMainWindow):
     def destroy_all_stefans(self):
         """Destroys all open STEFANs."""
         self.stefans = []
+        self.signal_stefans_destroyed.emit()
     
     def recieve_stefan_data_request(self,stefan):
         stefan_index = self.stefans.index(stefan)
         # self.status_bar_stefan_message('Requested MAIA data.',stefan_index)
-        self.signal_request_maia_data.emit(stefan_index)
+        self.signal_request_maia_data.emit(stefan_index,stefan.analyser.cursor)
 
     @pyqtSlot(list,int)
     def recieve_maia_data_for_stefan(self,counts,stefan_index):
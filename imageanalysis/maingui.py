@@ -21,6 +21,7 @@ from PyQt5.QtWidgets import (QActionGroup, QVBoxLayout, QMenu,
         QLabel, QTabWidget, QInputDialog)
 if '..' not in sys.path: sys.path.append('..')
 from strtypes import error, warning, info
+from saveimages.imwriter import EXT
 import imageHandler as ih # process images to build up a histogram
 import histoHandler as hh # collect data from histograms together
 import fitCurve as fc   # custom class to get best fit parameters using curve_fit
@@ -823,7 +824,7 @@ class main_window(QMainWindow):
 
     def load_im_size(self):
         """Get the user to select an image file and then use this to get the image size"""
-        file_name = self.try_browse(file_type='Images (*.asc);;all (*)', default_path=self.image_storage_path)
+        file_name = self.try_browse(file_type='Images (*.asc *.pdi);;all (*)', default_path=self.image_storage_path)
         if file_name:
             width, height = self.image_handler.set_pic_size(file_name) # sets image handler's pic size
             self.pic_width_edit.setText(str(width)) # update loaded value
@@ -833,7 +834,7 @@ class main_window(QMainWindow):
     def save_hist_data(self, trigger=None, save_file_name='', confirm=True):
         """Prompt the user to give a directory to save the histogram data, then save"""
         if not save_file_name:
-            save_file_name = self.try_browse(title='Save File', file_type='csv(*.csv);;all (*)', 
+            save_file_name = self.try_browse(title='Save File', file_type='csv(*.csv);;npz(*.npz);;all (*)', 
                         open_func=QFileDialog.getSaveFileName)
         if save_file_name:
             # don't update the threshold  - trust the user to have already set it
@@ -918,7 +919,7 @@ class main_window(QMainWindow):
         im_list = []
         if self.check_reset():
             file_list = self.try_browse(title='Select Files', 
-                    file_type='Images(*.asc);;all (*)', 
+                    file_type='Images(*.asc *.pdi);;all (*)', 
                     open_func=QFileDialog.getOpenFileNames, 
                     default_path=self.image_storage_path)
             self.recent_label.setText('Processing files...') # comes first otherwise not executed
@@ -968,12 +969,13 @@ class main_window(QMainWindow):
                 if np.size(minmax) == 1: # only entered one file number
                     file_list = [
                         os.path.join(image_storage_path, label) + '_' + date + '_' + 
-                        minmax[0].replace(' ','') + '_' + imid + '.asc']
+                        minmax[0].replace(' ','') + '_' + imid]
                 if np.size(minmax) == 2:
                     file_list = [
                         os.path.join(image_storage_path, label) + '_' + date + '_' + 
-                        dfn + '_' + imid + '.asc' for dfn in list(map(str, 
+                        dfn + '_' + imid for dfn in list(map(str, 
                             range(int(minmax[0]), int(minmax[1]))))] 
+                file_list = [f + EXT if os.path.isfile(f + EXT) else f + '.asc' for f in file_list] # compressed or ASCII
             for file_name in file_list:
                 try:
                     im_vals = self.image_handler.load_full_im(file_name)
@@ -992,10 +994,10 @@ class main_window(QMainWindow):
         return im_list
 
     def load_from_csv(self, trigger=None):
-        """Prompt the user to select a csv file to load histogram data from.
+        """Prompt the user to select a csv or npz file to load histogram data from.
         It must have the specific layout that the image_handler saves in."""
         if self.check_reset():
-            file_name = self.try_browse(file_type='csv(*.csv);;all (*)')
+            file_name = self.try_browse(file_type='histogram(*.npz *.csv);;all (*)')
             if file_name:
                 header = self.image_handler.load(file_name)
                 if self.image_handler.ind > 0:
@@ -1003,7 +1005,7 @@ class main_window(QMainWindow):
                     
     def load_image(self, trigger=None):
         """Prompt the user to select an image file to display"""
-        file_name = self.try_browse(file_type='Images (*.asc);;all (*)', 
+        file_name = self.try_browse(file_type='Images (*.asc *.pdi);;all (*)', 
                 default_path=self.image_storage_path)
         if file_name:  # avoid crash if the user cancelled
             im_vals = self.image_handler.load_full_im(file_name)
@@ -20,7 +20,10 @@ from dataanalysis import Analyser
 
 import sys
 if '.' not in sys.path: sys.path.append('.')
+if '..' not in sys.path: sys.path.append('..')
 from helpers import calculate_threshold
+from shottrace import TRACE
+from metrics import METRICS
 
 class MultiAtomImageAnalyser(QObject):
     """Multi Atom Image Analyser (MAIA).
@@ -73,9 +76,18 @@ class MultiAtomImageAnalyser(QObject):
         self.file_id = 3000 # the file ID to start on. This is iterated once every image cycle.
         self.should_save = False # whether MAIA should save the data on the next iteration of the event loop
         self.emccd_bias = 0 # this is now taken off in the controller but left here for state saving
+        self.n_analysed = METRICS.counter('images analysed')
+        self.analysis_time = METRICS.histogram('analysis time')
+        METRICS.gauge('MAIA queue', fn=lambda: len(self.queue))
 
         self.roi_groups = []
         self.num_images = num_images
+        self.counts_log = [] # [file ID, image number, counts[group][roi]] for each processed image, read by STEFANs
+        self.counts_log_epoch = 0 # incremented when the log is reset so that STEFANs know to get all of the data
+        self.counts_log_shape = None # (groups, rois per group, images) of the counts in the log
+        self.counts_log_start = 0 # position of counts_log[0] in the log, once the images before it are dropped
+        self.counts_log_max = 20000 # most images to keep in the log, STEFANs further behind are sent all of the data
+        self.stefan_cursors = {} # the position in the log that each STEFAN has been sent data up to
 
         self.copy_im_threshs = [None for _ in range(num_images)]
         print('copy_im_threads',self.copy_im_threshs)
@@ -290,18 +302,28 @@ class MultiAtomImageAnalyser(QObject):
                     self.clear()
                 return
             [image,file_id,image_num] = next_queue_item
+            t0 = time.perf_counter()
             self.signal_status_message.emit('Started processing ID {} Im {}'.format(file_id,image_num))
             image_num_too_big = False
+            counts = []
             for group in self.roi_groups:
+                group_counts = []
                 for roi in group.rois:
                     try:
                         roi.counts[image_num][file_id] = image[roi.x:roi.x+roi.w,roi.y:roi.y+roi.h].sum()
+                        group_counts.append(roi.counts[image_num][file_id])
                     except IndexError: # image_num was not valid for the number of images that MAIA is expecting
                         image_num_too_big = True
+                counts.append(group_counts)
+            if not image_num_too_big:
+                self.log_counts(file_id,image_num,counts)
+                TRACE.stamp('maia',file_id,image_num)
             if image_num_too_big:
                 self.signal_status_message.emit('Image number {} is greater than max expected images, so this image has been ignored (most likely cause is rearrangement toggle).')
             self.signal_status_message.emit('Finished processing ID {} Im {}'.format(file_id,image_num))
             self.calculate_thresholds()
+            self.n_analysed.inc()
+            self.analysis_time.observe(time.perf_counter() - t0)
 
     def get_roi_counts(self):
         """Extracts the ROI counts lists from the ROI objects contained within
@@ -337,19 +359,70 @@ class MultiAtomImageAnalyser(QObject):
                         roi.autothreshs[image] = False
                         roi.thresholds[image] = roi.thresholds[im_copy]
 
-    @pyqtSlot(int)
-    def recieve_data_request(self,stefan_index):
+    def get_counts_log_shape(self):
+        """The (groups, rois per group, images) of the counts being processed."""
+        return (len(self.roi_groups),self.roi_groups[0].get_num_rois() if self.roi_groups else 0,self.num_images)
+
+    def reset_counts_log(self):
+        """Empty the log of processed counts. STEFANs will then be sent all of
+        the data on their next request."""
+        self.counts_log = []
+        self.counts_log_start = 0
+        self.counts_log_epoch += 1
+        self.counts_log_shape = self.get_counts_log_shape()
+        self.stefan_cursors = {}
+
+    def trim_counts_log(self,position):
+        """Drop the images before the given position from the log."""
+        n = position - self.counts_log_start
+        if n > 0:
+            del self.counts_log[:n]
+            self.counts_log_start = position
+
+    @pyqtSlot()
+    def forget_stefan_cursors(self):
+        """The STEFANs were closed, so don't keep images in the log for them."""
+        self.stefan_cursors = {}
+        self.trim_counts_log(self.counts_log_start + len(self.counts_log))
+
+    def log_counts(self,file_id,image_num,counts):
+        """Append the counts from a processed image to the log that the 
+        STEFANs are sent updates from."""
+        if self.get_counts_log_shape() != self.counts_log_shape: # the ROIs or images changed
+            self.reset_counts_log()
+        self.counts_log.append([file_id,image_num,counts])
+        if len(self.counts_log) > self.counts_log_max: # a STEFAN hasn't asked for data in a long time
+            self.trim_counts_log(self.counts_log_start + len(self.counts_log) - self.counts_log_max)
+
+    @pyqtSlot(int,list)
+    def recieve_data_request(self,stefan_index,cursor=[-1,0]):
         """Recieves a data request from the iGUI for data to be passed to the
-        STEFANs.
+        STEFANs. Only the images processed since the STEFAN's last request 
+        are sent, unless the log has been reset since then or those images
+        were dropped from the log. Images that every STEFAN has been sent
+        are dropped from the log.
         
         Parameters
         ----------
         stefan_index : int
             The index of the STEFAN that the data should be sent to when it is 
             returned.
+        cursor : list
+            [epoch, position] in the counts log that the STEFAN has data up to,
+            as returned with the last data sent to it.
         """
         self.signal_status_message.emit('Recieved data request for STEFAN {}'.format(stefan_index))
-        data = self.get_analyser_data()
+        if self.get_counts_log_shape() != self.counts_log_shape:
+            self.reset_counts_log()
+        end = self.counts_log_start + len(self.counts_log)
+        new_cursor = [self.counts_log_epoch,end]
+        if cursor[0] != self.counts_log_epoch or not self.counts_log_start <= cursor[1] <= end: # send all of the data
+            data = self.get_analyser_data() + [[],new_cursor]
+        else:
+            data = [None,self.get_roi_thresholds(),self.get_roi_coords(),
+                    self.counts_log[cursor[1]-self.counts_log_start:],new_cursor]
+        self.stefan_cursors[stefan_index] = end
+        self.trim_counts_log(min(self.stefan_cursors.values()))
         self.signal_data_for_stefan.emit(data,stefan_index)
         self.signal_status_message.emit('Forwarded all data for STEFAN {} to SIMON'.format(stefan_index))
     
@@ -503,6 +576,7 @@ class MultiAtomImageAnalyser(QObject):
     def clear(self):
         """Clears the counts data stored in the ROIs."""
         [group.clear() for group in self.roi_groups]
+        self.reset_counts_log()
         self.signal_status_message.emit('Cleared data')
 
     @pyqtSlot()
@@ -201,8 +201,8 @@ class reim_window(main_window):
         """Prompt the user to select a csv file to load histogram data from.
         It must have the specific layout that the image_handler saves in."""
         if self.check_reset():
-            before_fn = self.try_browse(title='Select first histogram', file_type='csv(*.csv);;all (*)')
-            after_fn = self.try_browse(title='Select second histogram', file_type='csv(*.csv);;all (*)')
+            before_fn = self.try_browse(title='Select first histogram', file_type='histogram(*.npz *.csv);;all (*)')
+            after_fn = self.try_browse(title='Select second histogram', file_type='histogram(*.npz *.csv);;all (*)')
             if before_fn and after_fn:
                 header = self.ih1.load(before_fn)
                 header = self.ih2.load(after_fn)
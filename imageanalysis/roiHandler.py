@@ -17,8 +17,11 @@ from PyQt5.QtWidgets import QWidget, QLineEdit, QCheckBox
 if '.' not in sys.path: sys.path.append('.')
 if '..' not in sys.path: sys.path.append('..')
 from strtypes import error, warning, info
+from saveimages.imwriter import load_image, EXT
 from maingui import int_validator, nat_validator
 from fitCurve import fit
+from sparseROI import sparse_rois
+from statsStore import column
 
 ####    ####    ####    ####
 
@@ -26,8 +29,8 @@ class ROI(QWidget):
     """The properties of a ROI: imshape ((width, height) of image) 
     xc (centre pixel x-coordinate), yc (centre pixel y-coordinate), 
     width (in pixels), height (in pixels), threhsold (for 
-    determining atom presence), counts (array of integrated 
-    counts within the ROI), ID (number to identify this ROI),
+    determining atom presence), counts (number of integrated 
+    counts within the ROI to keep), ID (number to identify this ROI),
     autothresh (boolean toggle for automatically updating threshold)."""
     def __init__(self, imshape, xc, yc, width, height, threshold=1, 
             counts=1000, ID=0, autothresh=False, label=''):
@@ -37,7 +40,7 @@ class ROI(QWidget):
         self.w = width
         self.h = height
         self.t = threshold
-        self.c = np.zeros(counts)
+        self.c = column(dtype=float, window=counts, size=counts) # the last integrated counts
         self.i = 0 # number of images processed
         self.id = ID
         self.label = pg.TextItem(label+'ROI'+str(ID), pg.intColor(ID), anchor=(0,1))
@@ -71,10 +74,11 @@ class ROI(QWidget):
                 self.y + self.h//2 < self.s[1] and 
                 self.y - self.h//2 >= 0):
             self.roi.maxBounds = QRect(0, 0, self.s[0]+1, self.s[1]+1)
-            self.mask = np.zeros(self.s)
-            self.mask[self.x - self.w//2 : (self.x + self.w//2 + self.w%2),
+            mask = np.zeros(self.s) # fill in before replacing, the analysis could be using it
+            mask[self.x - self.w//2 : (self.x + self.w//2 + self.w%2),
                 self.y - self.h//2 : (self.y + self.h//2 + self.h%2)
                 ] = np.ones((self.w, self.h))
+            self.mask = mask
             self.mask_type = 'rect'
         else: warning('ROI tried to create invalid mask.\n' + 
             'shape %s, x %s, y %s, w %s, h %s'%(self.s, self.x, self.y, self.w, self.h))
@@ -85,7 +89,7 @@ class ROI(QWidget):
         try:
             if np.size(np.shape(im)) == 2:
                 self.s = np.shape(im)
-                self.mask = np.zeros(np.shape(im))
+                mask = np.zeros(np.shape(im)) # fill in before replacing, the analysis could be using it
                 xc, yc = np.unravel_index(np.argmax(im), im.shape)
                 if self.autothresh:
                     self.t = int(0.5*(np.max(im) + np.min(im))) # threshold in middle of histogram
@@ -103,9 +107,10 @@ class ROI(QWidget):
                     f.getBestFit(f.offGauss) # only interested in the width
                     self.ps[2*i], self.ps[2*i+1] = f.ps[1], abs(f.ps[2]) # centre, width
                 xy = np.meshgrid(range(d+xc-l0), range(d+yc-l1))
-                self.mask[l0:xc+d, l1:yc+d] = np.exp( # fill in 2D Gaussian
+                mask[l0:xc+d, l1:yc+d] = np.exp( # fill in 2D Gaussian
                     -2*(xy[0]-self.ps[0])**2 / self.ps[1]**2 -2*(xy[1]-self.ps[2])**2 / self.ps[3]**2) 
-                self.mask /= np.sum(self.mask) # normalise (we care about integrated counts)
+                mask /= np.sum(mask) # normalise (we care about integrated counts)
+                self.mask = mask
                 y, h, x, w = map(int, map(round, self.ps)) # ROI coordinates must be int
                 self.mask_type = 'gauss'
                 if not np.isfinite(self.mask).all(): # need mask to have only finite values
@@ -123,10 +128,11 @@ class ROI(QWidget):
             l1 = yc - self.d if yc-self.d>0 else 0
             xy = np.meshgrid(range(l0, self.d+xc), range(l1, self.d+yc))
             try:
-                self.mask = np.zeros(self.s)
-                self.mask[l0:xc+self.d, l1:yc+self.d] = np.exp( # fill in 2D Gaussian
+                mask = np.zeros(self.s) # fill in before replacing, the analysis could be using it
+                mask[l0:xc+self.d, l1:yc+self.d] = np.exp( # fill in 2D Gaussian
                         -2*(xy[0]-xc)**2 / self.ps[1]**2 -2*(xy[1]-yc)**2 / self.ps[3]**2) 
-                self.mask /= np.sum(self.mask) # normalise (we care about integrated counts)
+                mask /= np.sum(mask) # normalise (we care about integrated counts)
+                self.mask = mask
             except Exception as e: error('ROI %s failed to set Gaussian mask\n'%self.id+str(e))
         
     
@@ -142,21 +148,21 @@ class ROI(QWidget):
 
     def atom(self):
         """A list of whether the counts are above threshold"""
-        return [x // self.t for x in self.c[:self.i]]
+        return list(self.c.view() // self.t)
 
     def LP(self):
         """Calculate the loading probability from images above threshold"""
-        return np.size(self.c[self.c > self.t]) / np.size(self.c[:self.i]) if self.i>0 else 0
+        return np.mean(self.c.view() > self.t) if len(self.c) else 0
 
     def thresh(self):
         """Automatically choose a threshold based on the counts"""
         try: 
-            thresh = threshold_minimum(np.array(self.c[:self.i]), 25)
+            thresh = threshold_minimum(self.c.view(), 25)
             int(np.log(thresh)) # ValueError if thresh <= 0 
             self.t = int(thresh)
         except (ValueError, RuntimeError, OverflowError): 
             try:
-                self.t = int(0.5*(max(self.c) + min(self.c[:self.i])))
+                self.t = int(0.5*(max(self.c) + min(self.c)))
                 int(np.log(self.t)) # ValueError if thresh <= 0 
             except (ValueError, TypeError, OverflowError):
                 self.t = 1
@@ -190,6 +196,7 @@ class roi_handler(QWidget):
         self.shape = im_shape # image dimensions in pixels
         self.bias  = 697      # bias offset to subtract from image counts
         self.delim = ' '      # delimiter used to save/load files
+        self.rois  = sparse_rois() # bounding boxes and weights of the ROI masks
         
     def create_rois(self, n, label=''):
         """Change the list of ROIs to have length n"""
@@ -220,7 +227,7 @@ class roi_handler(QWidget):
         """Empty the lists of counts in the ROIs with the gives IDs"""
         for i in ids:
             try: 
-                self.ROIs[i].c = np.zeros(1000)
+                self.ROIs[i].c = column(dtype=float, window=1000, size=1000)
                 self.ROIs[i].i = 0
             except IndexError: pass
 
@@ -230,16 +237,18 @@ class roi_handler(QWidget):
         emit a string of which ROIs are occupied, e.g. '0110'"""
         success = 1
         atomstring = ''
-        for r in self.ROIs:
-            try:
-                counts = np.sum(im * r.mask) - self.bias * r.w * r.h
-                success = 1 if abs(counts) // r.t and success else 0
-                atomstring += str(int(abs(counts) > r.t))
-                r.c[r.i%1000] = counts
-                r.i += 1
-            except ValueError as e:
+        rois = self.rois.update([r.mask for r in self.ROIs], np.shape(im))
+        allcounts = rois.counts(im) # gather the pixels of all the ROIs at once
+        for i, r in enumerate(self.ROIs):
+            if i in rois.bad:
                 error("Image was wrong shape %s for atom checker's ROI%s %s"%(
-                    np.shape(im), r.id, r.s) + str(e))
+                    np.shape(im), r.id, r.s))
+                continue
+            counts = allcounts[i] - self.bias * r.w * r.h
+            success = 1 if abs(counts) // r.t and success else 0
+            atomstring += str(int(abs(counts) > r.t))
+            r.c.append(counts)
+            r.i += 1
         try:
             1 // (1 - success) # ZeroDivisionError if success = 1
         except ZeroDivisionError: 
@@ -251,6 +260,9 @@ class roi_handler(QWidget):
         First column is just the index of the row.
         Keyword arguments:
         im_name    -- absolute path to the image file to load"""
+        if im_name.endswith(EXT): # compressed image doesn't have row numbers
+            shape = load_image(im_name).shape
+            return self.cam_pic_size_changed(shape[1], shape[0])
         shape = np.genfromtxt(im_name, delimiter=self.delim).shape
         try: self.cam_pic_size_changed(shape[1]-1, shape[0])
         except IndexError: self.cam_pic_size_changed(shape[0]-1, 1)
@@ -273,6 +285,8 @@ class roi_handler(QWidget):
         Keyword arguments:
         im_name    -- absolute path to the image file to load"""
         try: 
+            if im_name.endswith(EXT):
+                return load_image(im_name).reshape(self.shape)
             return np.loadtxt(im_name, delimiter=self.delim,
                               usecols=range(1,self.shape[0]+1)).reshape(self.shape)
         except IndexError as e:
@@ -21,6 +21,7 @@ from PyQt5.QtWidgets import (QActionGroup, QVBoxLayout, QMenu,
 if '.' not in sys.path: sys.path.append('.')
 if '..' not in sys.path: sys.path.append('..')
 from strtypes import intstrlist, listlist, error, warning, info
+from saveimages.imwriter import load_image, EXT
 from maingui import main_window, reset_slot, int_validator, double_validator, nat_validator
 from reimage import reim_window # analysis for survival probability
 from compimage import compim_window
@@ -48,11 +49,12 @@ class settings_window(QMainWindow):
         self.types = OrderedDict([('pic_width',int), ('pic_height',int), ('ROIs',listlist), 
             ('bias', int), ('image_path', str), ('results_path', str), ('last_image', str),
             ('window_pos',intstrlist), ('num_images',int), ('num_saia',int), ('num_reim',int),
-            ('num_coim', int)])
+            ('num_coim', int), ('hist_format', str)])
         self.stats = OrderedDict([('pic_width',512), ('pic_height',512), ('ROIs',[[1,1,1,1,1]]), 
             ('bias',697), ('image_path', im_store_path), ('results_path', results_path),
             ('last_image', ''), ('window_pos', [550, 20, 10, 200, 600, 400]),
-            ('num_images',2), ('num_saia',2), ('num_reim',1), ('num_coim', 0)])
+            ('num_images',2), ('num_saia',2), ('num_reim',1), ('num_coim', 0),
+            ('hist_format', 'csv')]) # 'npz' saves multirun histograms in binary columns
         self.send_data = False
         self.load_settings(stats=config_settings) # load default
         self.date = time.strftime("%d %b %B %Y", time.localtime()).split(" ") # day short_month long_month year
@@ -620,10 +622,11 @@ class settings_window(QMainWindow):
                 error("Multirun couldn't save histogram statistics to file %s.\n"%os.path.join(results_path, measure_prefix, 
                         mw.objectName() + measure_prefix + '.dat') + str(e))
         # save and reset the histograms, make sure to do reimage windows first!
+        ext = '.npz' if self.stats.get('hist_format', 'csv') == 'npz' else '.csv'
         for mw in self.rw[:len(self.rw_inds)] + self.mw[:self._a]: 
             if self.send_data: self.send_results(measure_prefix, hist_id, mw)
             mw.save_hist_data(save_file_name=os.path.join(results_path, measure_prefix, 
-                    mw.objectName() + str(hist_id) + '.csv'), confirm=False) # save histogram
+                    mw.objectName() + str(hist_id) + ext), confirm=False) # save histogram
             mw.image_handler.reset_arrays() # clear histogram
         for mw in self.cw:
             if self.send_data: self.send_results(measure_prefix, hist_id, mw)
@@ -694,7 +697,7 @@ class settings_window(QMainWindow):
 
     def load_image(self, trigger=None):
         """Prompt the user to select an image file to display."""
-        fname = self.try_browse(file_type='Images (*.asc);;all (*)')
+        fname = self.try_browse(file_type='Images (*.asc *.pdi);;all (*)')
         if fname:  # avoid crash if the user cancelled
             pic_width, pic_height = self.stats['pic_width'], self.stats['pic_height']
             try:
@@ -712,7 +715,7 @@ class settings_window(QMainWindow):
         """Prompt the user to choose a selection of image files."""
         im_list = []
         file_list = self.try_browse(title='Select Files', 
-                file_type='Images(*.asc);;all (*)', 
+                file_type='Images(*.asc *.pdi);;all (*)', 
                 open_func=QFileDialog.getOpenFileNames,
                 defaultpath=self.image_storage_path)
         for fname in file_list:
@@ -783,7 +786,7 @@ class settings_window(QMainWindow):
             action = self.sender().text()
         if 'Save' in action:
             fpath = fname if fname else self.try_browse(title='Select a File Suffix', 
-                    file_type='CSV (*.csv);;all (*)',
+                    file_type='CSV (*.csv);;npz (*.npz);;all (*)',
                     open_func=QFileDialog.getSaveFileName)
         else: fpath = 'notsaving'
         if fpath: # don't do anything if the user cancels
@@ -817,9 +820,11 @@ class settings_window(QMainWindow):
 
     def load_im_size(self):
         """Get the user to select an image file and then use this to get the image size"""
-        file_name = self.try_browse(file_type='Images (*.asc);;all (*)', defaultpath=self.image_storage_path)
+        file_name = self.try_browse(file_type='Images (*.asc *.pdi);;all (*)', defaultpath=self.image_storage_path)
         if file_name:
-            shape = np.genfromtxt(file_name, delimiter=' ').shape
+            if file_name.endswith(EXT): # compressed images don't have row numbers
+                shape = np.add(load_image(file_name).shape, (0, 1))
+            else: shape = np.genfromtxt(file_name, delimiter=' ').shape
             # update loaded value - changing the text edit triggers pic_size_text_edit()
             try: 
                 self.pic_width_edit.setText(str(shape[1] - 1))
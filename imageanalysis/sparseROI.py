@@ -0,0 +1,164 @@
+"""Single Atom Image Analysis - sparse ROIs
+
+ - Store each ROI as the bounding box of its mask and the weights inside
+   the box, instead of multiplying the full image by a full image mask.
+   Gaussian masks from ROI.create_gauss_mask keep their weights
+ - The pixels of all of the ROIs are gathered from the image in one go
+   and summed per ROI with np.add.reduceat, so the cost of the ROI counts
+   is the number of pixels in the ROIs, not the image size x the ROIs
+ - The background outside each ROI is found from the sum and the sum of
+   squares over the whole image minus those inside the ROI, which gives
+   the same values as im*(1-mask) without making a new image
+ - The bias is subtracted from the sums rather than from the image
+"""
+import numpy as np
+
+def bounding_box(mask):
+    """Return the (row slice, column slice) of the smallest box containing
+    the nonzero values of the 2D mask, or None if it's all zero."""
+    rows = np.flatnonzero(np.any(mask, axis=1))
+    if not rows.size:
+        return None
+    cols = np.flatnonzero(np.any(mask, axis=0))
+    return slice(rows[0], rows[-1]+1), slice(cols[0], cols[-1]+1)
+
+class sparse_rois:
+    """The weighted pixels of several ROIs, gathered from an image together.
+    Use update() with the full image masks (e.g. ROI.mask) before each image:
+    the sparse ROIs are only remade when one of the masks is replaced, so
+    a new mask must be filled in before it's assigned, not changed in place."""
+    def __init__(self):
+        self.masks = []   # the full image masks that the ROIs were made from
+        self.shape = None # shape of the image the ROIs apply to
+        self.boxes = []   # (row slice, column slice) of each ROI, or None if empty
+        self.weights = [] # the mask values inside each box
+        self.bad = []     # indexes of masks that don't fit the image shape
+        self.idx = np.zeros(0, dtype=np.intp) # flat image index of every ROI pixel
+        self.w = np.zeros(0)      # weight of every ROI pixel
+        self.w2 = np.zeros(0)     # 2w - w^2: weight of each pixel's square in the ROI
+        self.starts = np.zeros(0, dtype=np.intp) # index in idx where each ROI starts
+        self.empty = np.zeros(0, dtype=bool)     # ROIs with no pixels
+        self.wsum = np.zeros(0)   # sum of the weights of each ROI
+
+    def update(self, masks, shape):
+        """Remake the ROIs if the masks or the image shape have changed.
+        A mask is applied as if it were multiplied by the image, so it must
+        broadcast to the image shape, otherwise its index is added to bad."""
+        shape = tuple(shape)
+        if shape != self.shape or len(masks) != len(self.masks) or any(
+                m is not old for m, old in zip(masks, self.masks)):
+            self.set_masks(masks, shape)
+        return self
+
+    def set_masks(self, masks, shape):
+        """Store the bounding box and weights of each mask for images of the
+        given shape."""
+        self.masks, self.shape = list(masks), tuple(shape)
+        self.boxes, self.weights, self.bad = [], [], []
+        idx, w = [], []
+        for i, mask in enumerate(self.masks):
+            try:
+                if len(self.shape) != 2:
+                    raise ValueError('images must be 2D')
+                mask = np.broadcast_to(np.asarray(mask, dtype=float), self.shape)
+                box = bounding_box(mask)
+            except ValueError:
+                self.bad.append(i)
+                box = None
+            self.boxes.append(box)
+            if box is None:
+                self.weights.append(np.zeros((0,0)))
+                idx.append(np.zeros(0, dtype=np.intp))
+            else:
+                self.weights.append(np.array(mask[box]))
+                rows, cols = np.arange(box[0].start, box[0].stop), np.arange(box[1].start, box[1].stop)
+                idx.append((rows[:,None]*self.shape[1] + cols).ravel())
+            w.append(self.weights[-1].ravel())
+        sizes = np.array([len(x) for x in idx], dtype=np.intp)
+        self.idx = np.concatenate(idx) if idx else np.zeros(0, dtype=np.intp)
+        self.w = np.concatenate(w) if w else np.zeros(0)
+        self.w2 = 2*self.w - self.w**2
+        self.starts = np.cumsum(sizes) - sizes
+        self.empty = sizes == 0
+        self.wsum = self._reduce(self.w)
+
+    def _reduce(self, x):
+        """Sum x over the pixels of each ROI."""
+        if not self.idx.size:
+            return np.zeros(len(self.starts))
+        out = np.add.reduceat(x, np.minimum(self.starts, self.idx.size-1))
+        out[self.empty] = 0 # reduceat gives the next value for an empty segment
+        return out
+
+    def _gather(self, im, bias=0):
+        """Return the values of im - bias at all of the ROI pixels."""
+        im = np.asarray(im)
+        if im.shape != self.shape:
+            raise ValueError('image shape %s does not match ROI shape %s'%(im.shape, self.shape))
+        return im.ravel()[self.idx] - np.float64(bias)
+
+    def counts(self, im, bias=0):
+        """Return an array of the weighted sum of im - bias in each ROI,
+        the same as np.sum((im - bias) * mask) for each mask."""
+        return self._reduce(self._gather(im, bias) * self.w)
+
+    def stats(self, im, bias=0):
+        """Return arrays of the counts in each ROI, and the mean and standard
+        deviation of the background, found as from (im - bias)*(1 - mask)."""
+        v = self._gather(im, bias)
+        counts = self._reduce(v * self.w)
+        sq = self._reduce(v*v * self.w2) # sum of the squares removed by the mask
+        im = np.asarray(im)
+        n = im.size
+        s1 = im.sum(dtype=np.float64) # buffered: an int image isn't copied to float
+        s2 = np.einsum('ij,ij->', im, im, dtype=np.float64) # sum of squares without making a new image
+        total = s1 - n*bias               # sum of (im - bias)
+        total2 = s2 - 2*bias*s1 + n*bias**2 # sum of (im - bias)^2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            N = n - self.wsum # sum(1 - mask)
+            mean = (total - counts) / N
+            # as in im*(1-mask), pixels inside the ROI are zeros in the s.d.
+            var = np.maximum((total2 - sq) - 2*mean*(total - counts) + n*mean**2, 0)
+            sd = np.sqrt(var / (N - 1))
+        return counts, mean, sd
+
+if __name__ == "__main__":
+    # ROI counts and background per image: full image masks vs the sparse ROIs
+    import time
+    import sys
+    if '..' not in sys.path: sys.path.append('..')
+    from saveimages.imwriter import synthetic_frames
+    shape, bias, n = (512, 512), 1000, 200
+    frames = synthetic_frames(20, shape, bias)
+    rng = np.random.default_rng(1)
+    masks = []
+    for x, y in rng.integers(10, 500, (25, 2)): # rect and Gaussian masks
+        m = np.zeros(shape)
+        if len(masks) % 2:
+            xy = np.meshgrid(range(x-3, x+3), range(y-3, y+3), indexing='ij')
+            m[x-3:x+3, y-3:y+3] = np.exp(-2*(xy[0]-x)**2/4 - 2*(xy[1]-y)**2/9)
+            m /= m.sum()
+        else:
+            m[x-2:x+3, y-2:y+3] = 1
+        masks.append(m)
+    t0 = time.perf_counter()
+    for i in range(n):
+        im = frames[i%len(frames)]
+        old = []
+        for m in masks:
+            full_im = im - bias
+            not_roi = full_im * (1-m)
+            N = np.sum(1-m)
+            mean = np.sum(not_roi) / N
+            old.append((np.sum(full_im * m), mean, np.sqrt(np.sum((not_roi - mean)**2) / (N - 1))))
+    t1 = time.perf_counter()
+    rois = sparse_rois()
+    for i in range(n):
+        new = rois.update(masks, shape).stats(frames[i%len(frames)], bias)
+    t2 = time.perf_counter()
+    for i in range(n):
+        c = rois.update(masks, shape).counts(frames[i%len(frames)], bias)
+    t3 = time.perf_counter()
+    print('%s ROIs on %s images: full masks %.2f ms, sparse stats %.3f ms, sparse counts %.3f ms per image'%(
+        len(masks), shape, (t1-t0)/n*1e3, (t2-t1)/n*1e3, (t3-t2)/n*1e3))
+    print('same results:', np.allclose(np.array(old), np.array(new).T, rtol=1e-9, atol=1e-6))
@@ -0,0 +1,323 @@
+"""Single Atom Image Analysis - statistics store
+
+ - Each statistic is a column: a preallocated numpy array that is doubled
+   in size when it's full, so appending a value for each shot is O(1).
+   Columns behave like the lists they replace (append, extend, +=,
+   indexing, len, iteration) and can be used as numpy arrays
+ - Optionally only the last window values are kept. The oldest values are
+   dropped from the front and the array is compacted when half of it is
+   unused, so windowed columns don't grow
+ - running_histogram keeps fine bins of counts that are updated for each
+   shot, so refreshing the displayed histogram costs the number of bins
+   rather than the number of shots
+"""
+import math
+import numpy as np
+from collections import OrderedDict
+import sys
+if '..' not in sys.path: sys.path.append('..')
+from strtypes import BOOL
+
+def numpy_type(t):
+    """The numpy dtype to store values of the Analysis type t in."""
+    return {int: np.int64, float: np.float64, BOOL: np.bool_, bool: np.bool_}.get(t, object)
+
+class column:
+    """A growable numpy array of one statistic that is appended to like a list.
+    values -- initial values
+    dtype  -- numpy type of the values
+    window -- keep only the last window values, or 0 to keep them all
+    size   -- initial length of the array"""
+    def __init__(self, values=(), dtype=float, window=0, size=64):
+        self.dtype = np.dtype(dtype)
+        self._window = window
+        self._a = np.zeros(max(size, np.size(values)), self.dtype)
+        self._i0 = 0 # index of the first value in the array
+        self._n = 0  # number of values stored
+        self.extend(values)
+
+    def view(self):
+        """Return the stored values as a numpy array without copying."""
+        return self._a[self._i0:self._i0+self._n]
+
+    def _reserve(self, n):
+        """Make room to add n values at the end of the array."""
+        if self._i0 + self._n + n <= len(self._a):
+            return
+        if self._i0 and self._n + n <= len(self._a)//2: # move to the front
+            self._a[:self._n] = self.view()
+        else: # double the array
+            a = np.zeros(max(2*len(self._a), self._n + n), self.dtype)
+            a[:self._n] = self.view()
+            self._a = a
+        self._i0 = 0
+
+    def _trim(self):
+        """Drop the oldest values outside the window and return them."""
+        k = self._n - self._window if self._window else 0
+        if k <= 0:
+            return self._a[:0]
+        old = self._a[self._i0:self._i0+k].copy()
+        self._i0 += k
+        self._n -= k
+        return old
+
+    def append(self, x):
+        """Add a value. Return the array of values dropped from the window."""
+        self._reserve(1)
+        self._a[self._i0 + self._n] = x
+        self._n += 1
+        return self._trim()
+
+    def extend(self, values):
+        """Add the values. Return the array of values dropped from the window."""
+        values = np.asarray(values)
+        if values.dtype.kind in 'US' and self.dtype.kind == 'b': # 'False' is not empty
+            values = np.array([BOOL(x) for x in values.ravel()], dtype=bool)
+        values = values.ravel()
+        self._reserve(len(values))
+        self._a[self._i0+self._n:self._i0+self._n+len(values)] = values
+        self._n += len(values)
+        return self._trim()
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    @property
+    def window(self):
+        """The number of values to keep, or 0 for all of them."""
+        return self._window
+
+    @window.setter
+    def window(self, n):
+        self._window = n
+        self._trim()
+
+    @property
+    def size(self):
+        return self._n
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, key):
+        return self.view()[key]
+
+    def __setitem__(self, key, value):
+        self.view()[key] = value
+
+    def __iter__(self):
+        return iter(self.view())
+
+    def __array__(self, dtype=None, copy=None):
+        v = self.view()
+        return v.astype(dtype or v.dtype, copy=bool(copy))
+
+    def __repr__(self):
+        return 'column(%s)'%self.view()
+
+class stats_dict(OrderedDict):
+    """An OrderedDict of columns for the statistics of an Analysis.
+    Lists or arrays assigned to it are stored in columns with the dtype
+    given by the Analysis type for their key.
+    types  -- OrderedDict of {key: type}, e.g. Analysis.types
+    window -- keep only the last window values in each column, or 0 for all"""
+    def __init__(self, types, window=0):
+        self.dtypes = {key: numpy_type(t) for key, t in types.items()}
+        self._window = window
+        super().__init__((key, []) for key in types.keys())
+
+    def __setitem__(self, key, value):
+        if not isinstance(value, column):
+            value = column(value, self.dtypes.get(key, object), self._window)
+        super().__setitem__(key, value)
+
+    def copy(self):
+        """Return a shallow copy as an OrderedDict."""
+        return OrderedDict(self)
+
+    @property
+    def window(self):
+        """The number of values kept in each column, or 0 for all of them."""
+        return self._window
+
+    @window.setter
+    def window(self, n):
+        self._window = n
+        for col in self.values():
+            col.window = n
+
+class running_histogram:
+    """Histogram of counts in fine bins that is updated one value at a time.
+    The bins have equal width. Bins are added geometrically at either end
+    when a value falls outside them, and when there are more than max_bins
+    neighbouring bins are merged in pairs, doubling the width. So the cost
+    of a refresh depends on max_bins, not the number of values.
+    Each bin also keeps the sum and sum of squares of its values, so that
+    the mean and standard deviation either side of a threshold are exact
+    apart from the bin that the threshold is in.
+    width    -- initial width of the fine bins
+    max_bins -- the maximum number of fine bins"""
+    def __init__(self, width=1.0, max_bins=4096):
+        self.width = float(width)
+        self.max_bins = max_bins
+        self.reset()
+
+    def reset(self):
+        """Remove all of the values."""
+        self.lo = None # lower edge of the first bin
+        self.occ = np.zeros(0, dtype=np.int64) # number of values in each bin
+        self.s1 = np.zeros(0) # sum of the values in each bin
+        self.s2 = np.zeros(0) # sum of the squares of the values in each bin
+        self.n = 0 # number of values in the histogram
+
+    def _pad(self, before, after):
+        """Add empty bins to the start and end."""
+        self.occ = np.pad(self.occ, (before, after))
+        self.s1 = np.pad(self.s1, (before, after))
+        self.s2 = np.pad(self.s2, (before, after))
+        self.lo -= before * self.width
+
+    def _merge(self):
+        """Merge neighbouring bins in pairs until there are at most max_bins."""
+        while len(self.occ) > self.max_bins:
+            if len(self.occ) % 2:
+                self._pad(0, 1)
+            self.occ = self.occ.reshape(-1, 2).sum(axis=1)
+            self.s1 = self.s1.reshape(-1, 2).sum(axis=1)
+            self.s2 = self.s2.reshape(-1, 2).sum(axis=1)
+            self.width *= 2
+
+    def _index(self, x):
+        """Index of the bin containing x, adding bins if it's outside them."""
+        if self.lo is None:
+            self.lo = np.floor(x / self.width) * self.width
+            self._pad(0, 1)
+        i = math.floor((x - self.lo) / self.width)
+        if i < 0:
+            self._pad(max(-i, len(self.occ)), 0)
+        elif i >= len(self.occ):
+            self._pad(0, max(i - len(self.occ) + 1, len(self.occ)))
+        else: return i
+        self._merge()
+        return math.floor((x - self.lo) / self.width)
+
+    def add(self, x, k=1):
+        """Add the value x to the histogram, or remove it if k = -1.
+        Values that aren't finite are ignored."""
+        if not math.isfinite(x):
+            return
+        i = self._index(x)
+        self.occ[i] += k
+        self.s1[i] += k*x
+        self.s2[i] += k*x*x
+        self.n += k
+
+    def remove(self, x):
+        """Remove a value that was added."""
+        self.add(x, -1)
+
+    def update(self, values):
+        """Add an array of values, e.g. when the histogram is remade."""
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        if not values.size:
+            return
+        self._index(values.min())
+        self._index(values.max())
+        i = np.floor((values - self.lo) / self.width).astype(np.intp)
+        self.occ += np.bincount(i, minlength=len(self.occ))
+        self.s1 += np.bincount(i, values, len(self.occ))
+        self.s2 += np.bincount(i, values*values, len(self.occ))
+        self.n += values.size
+
+    def edges(self):
+        """The edges of the fine bins."""
+        return self.lo + self.width * np.arange(len(self.occ) + 1)
+
+    def centres(self):
+        """The centres of the fine bins."""
+        return self.lo + self.width * (np.arange(len(self.occ)) + 0.5)
+
+    def range(self):
+        """The lower edge of the first and the upper edge of the last bins
+        with values in them."""
+        used = np.flatnonzero(self.occ)
+        if not used.size:
+            return 0.0, 1.0
+        return self.lo + self.width*used[0], self.lo + self.width*(used[-1]+1)
+
+    def histogram(self, edges):
+        """Return (occupancies, edges) of the histogram in the given bins.
+        Each fine bin is put in the bin that its centre is in."""
+        edges = np.asarray(edges, dtype=float)
+        c = self.centres()
+        i = np.searchsorted(edges, c, 'right') - 1
+        i[c == edges[-1]] = len(edges) - 2 # the last bin includes its upper edge
+        keep = (i >= 0) & (i < len(edges) - 1)
+        return np.bincount(i[keep], self.occ[keep], len(edges) - 1).astype(int), edges
+
+    def split(self, thresh):
+        """Return the number, mean, and standard deviation (ddof=1) of the
+        values below and above the threshold, as [n0, n1], [mean0, mean1],
+        [s.d.0, s.d.1]. The mean and s.d. are nan if there are too few values."""
+        below = self.centres() < thresh
+        out = []
+        for part in [below, ~below]:
+            n, s1, s2 = self.occ[part].sum(), self.s1[part].sum(), self.s2[part].sum()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mean = s1 / n
+                sd = np.sqrt(max(s2 - s1*mean, 0) / (n - 1)) if n > 1 else np.nan
+            out.append((int(n), mean, sd))
+        return [list(x) for x in zip(*out)]
+
+    def quantile(self, q):
+        """Estimate the q quantile from the bin it's in."""
+        if not self.n:
+            return np.nan
+        i = np.searchsorted(np.cumsum(self.occ), q*self.n)
+        return self.lo + self.width*(i + 0.5)
+
+if __name__ == "__main__":
+    # per-shot cost of appending to the stats and refreshing the histogram,
+    # as lists with np.histogram over all counts vs columns and fine bins
+    import time
+    from collections import OrderedDict
+    rng = np.random.default_rng(0)
+    n = 20000
+    counts = np.where(rng.random(n) < 0.5, rng.normal(2000, 200, n), rng.normal(8000, 600, n))
+    types = OrderedDict([('File ID', int), ('Counts', float), ('Include', BOOL)])
+    for total in [2000, 20000]:
+        stats = OrderedDict([(key, []) for key in types])
+        t0 = time.perf_counter()
+        for i in range(total):
+            stats['File ID'].append(i)
+            stats['Counts'].append(counts[i])
+            stats['Include'].append(True)
+            occ, edges = np.histogram(stats['Counts'], 30)
+        t1 = time.perf_counter()
+        store, hist = stats_dict(types), running_histogram()
+        for i in range(total):
+            store['File ID'].append(i)
+            store['Counts'].append(counts[i])
+            store['Include'].append(True)
+            hist.add(counts[i])
+            lo, hi = hist.range()
+            occ2, edges2 = hist.histogram(np.linspace(lo, hi, 31))
+        t2 = time.perf_counter()
+        print('%s shots: lists %.1f us per shot, columns %.1f us per shot'%(
+            total, (t1-t0)/total*1e6, (t2-t1)/total*1e6))
+    c = counts[:total]
+    print('%s fine bins of width %.3g, %s values, stored %s' % (len(hist.occ), hist.width, hist.n, len(store['Counts'])))
+    (n0, n1), (m0, m1), (s0, s1) = hist.split(5000)
+    print('split at 5000: means %.2f, %.2f (exact %.2f, %.2f), s.d. %.2f, %.2f (exact %.2f, %.2f)'%(
+        m0, m1, c[c<5000].mean(), c[c>5000].mean(), s0, s1, c[c<5000].std(ddof=1), c[c>5000].std(ddof=1)))
+    window = column(dtype=float, window=1000)
+    hist = running_histogram()
+    for x in counts:
+        hist.add(x)
+        for old in window.append(x):
+            hist.remove(old)
+    print('window of %s: %s values in histogram, same as the last %s: %s'%(
+        window.window, hist.n, len(window), np.array_equal(window, counts[-1000:])))
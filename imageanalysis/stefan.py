@@ -41,7 +41,8 @@ import pyqtgraph as pg
 from datetime import datetime
 import time
 from roi_colors import get_group_roi_color
-from dataanalysis import Analyser
+from dataanalysis import IncrementalAnalyser
+import threading
 import pickle
 
 double_validator = QDoubleValidator() # floats
@@ -79,6 +80,10 @@ class StefanGUI(QMainWindow):
         self.threadpool = QThreadPool()
         print("Multithreading with maximum %d threads" % self.threadpool.maxThreadCount())
 
+        self.analyser = IncrementalAnalyser() # keeps the data between updates so only new data is analysed
+        self.analyser_lock = threading.Lock() # only one worker can use the analyser at a time
+        self.worker_signals = None # keep the worker signals until the next update so that results aren't lost
+
         # self.init_stefan_thread()
 
     def init_UI(self):
@@ -250,9 +255,11 @@ class StefanGUI(QMainWindow):
         self.setWindowTitle(self.name)
 
         worker = StefanWorker(maia_data,mode=self.mode,xmode=self.xmode,image=self.image,roi=self.roi,
-                              post_selection=self.post_selection, condition=self.condition)
+                              post_selection=self.post_selection, condition=self.condition,
+                              analyser=self.analyser, lock=self.analyser_lock)
         worker.signals.status_bar.connect(self.status_bar_message)
         worker.signals.return_data.connect(self.plot_data)
+        self.worker_signals = worker.signals # the signals must outlive the worker for the data to arrive
         self.threadpool.start(worker)
         # worker.signals.result.connect(self.print_output)
         # worker.signals.finished.connect(self.thread_complete)
@@ -304,7 +311,8 @@ class StefanWorker(QRunnable):
 
     Inherits from QRunnable to handler worker thread setup, signals and wrap-up.
     """
-    def __init__(self,maia_data,mode='counts',xmode='file_id',image=0,roi=0,post_selection=None,condition=None):
+    def __init__(self,maia_data,mode='counts',xmode='file_id',image=0,roi=0,post_selection=None,condition=None,
+                 analyser=None,lock=None):
         """Initialise the worker object.
 
         Parameters
@@ -314,10 +322,12 @@ class StefanWorker(QRunnable):
             data is in the raw MAIA data format that data is stored in 
             mid-run; it has not yet been formatted in a DataFrame.
 
-            The list should be of the format [counts,threshold_data] where 
-            counts is the list returned by maia.get_roi_counts() and the 
+            The list should be of the format [counts,threshold_data,roi_coords] 
+            where counts is the list returned by maia.get_roi_counts() and the 
             threshold_data is the list returned by maia.get_roi_thresholds() 
-            (this list also includes the Autothresh information).
+            (this list also includes the Autothresh information). Updates 
+            from the MAIA instead have counts None followed by the images 
+            processed since the last update, see IncrementalAnalyser.
 
             As this is the mid-run MAIA data format, counts data has not yet 
             been converted into occupancy data. If this is needed then the 
@@ -349,9 +359,16 @@ class StefanWorker(QRunnable):
             StefanWorker. Only used if the mode is 'occupancy'. By default None
             None, which will apply no condition criteria (i.e. all events will
             match the condition).
+        analyser : IncrementalAnalyser or None, optional
+            The analyser holding the data from previous updates, which the 
+            new data is added to. By default None, which makes a new one.
+        lock : threading.Lock or None, optional
+            Lock to hold while using the analyser.
         """
         super().__init__()
         self.data = maia_data
+        self.analyser = IncrementalAnalyser() if analyser is None else analyser
+        self.lock = threading.Lock() if lock is None else lock
         self.mode = mode
         self.xmode = xmode
         self.image = image
@@ -367,16 +384,19 @@ class StefanWorker(QRunnable):
     @pyqtSlot()
     def run(self):
         self.signals.status_bar.emit('STEFANWorker beginning analysis')
-        analysed_data, analysis_string, analysis_mode, analysis_xmode = self.analysis()
+        with self.lock:
+            self.analyser.set_criteria(self.post_selection,self.condition)
+            self.analyser.update(self.data)
+            analysed_data, analysis_string, analysis_mode, analysis_xmode = self.analysis()
         self.signals.return_data.emit(analysed_data,analysis_string,analysis_mode,analysis_xmode)
-        time.sleep(0.5) # prevents the thread being closed before data has been sent
 
     def analysis(self):
         """Returns data to the STEFAN to be plotted. The val is what should be
         shown in the STEFAN statistics pane.
         
         The data list is set when the worker class is initialised; for details
-        of its format see the `self.__init__()` docstring.
+        of its format see the `self.__init__()` docstring. It must have been
+        added to the analyser, which keeps running totals of the statistics.
 
         Returns
         -------
@@ -385,15 +405,18 @@ class StefanWorker(QRunnable):
                passed to the Stefan by passing multiple datasets in the list.
         str : string that should be displayed in the STEFAN stats page.
         """
-        counts, thresholds_and_autothreshs, roi_coords = self.data
+        analyser = self.analyser
         data = [[[[],[]]]]
         string = ''
         if self.mode == 'counts':
             try:
-                group_dicts = [group[self.roi][self.image] for group in counts]
-                counts_data = [list(zip(*sorted(group.items()))) for group in group_dicts] # sort to make sure plot is in order
-                counts_data = [np.asarray(x) for x in counts_data]
-                thresholds = [group[self.roi][self.image][0] for group in thresholds_and_autothreshs]
+                if not analyser.n_images[self.image]:
+                    raise IndexError('no images yet')
+                counts_data = analyser.get_counts_data(self.roi,self.image)
+                order = np.argsort(counts_data[0][0]) # sort to make sure plot is in order
+                counts_data = [[x[order],y[order]] for x, y in counts_data]
+                thresholds = analyser.thresholds[:,self.roi,self.image]
+                loading_probs = analyser.get_loading_probs(self.image)
                 threshold_plotting_data = []
                 for group_num, (group, threshold) in enumerate(zip(counts_data,thresholds)):
                     xmin = min(group[0])
@@ -401,7 +424,7 @@ class StefanWorker(QRunnable):
                     thresholdx = [xmin,xmax]
                     thresholdy = [threshold,threshold]
                     threshold_plotting_data.append([thresholdx,thresholdy])
-                    loading_prob = (group[1] > threshold).sum()/len(group[1])
+                    loading_prob = loading_probs[group_num][self.roi]['probability']
                     string += 'Group {} LP = {:.3f}\n'.format(group_num,loading_prob)
                 data = [counts_data,threshold_plotting_data]
                 self.signals.status_bar.emit('STEFANWorker analysis complete')
@@ -412,10 +435,9 @@ class StefanWorker(QRunnable):
             print('Post selection', self.post_selection)
             print('Condition', self.condition)
 
-            analyser = Analyser(self.data)
-            post_select_probs_errs = analyser.apply_post_selection_criteria(self.post_selection)
-            condition_probs_errs = analyser.apply_condition_criteria(self.condition)
-            data[0] = np.array(analyser.get_condition_met_plotting_data())
+            post_select_probs_errs = analyser.get_post_selection_probs()
+            condition_probs_errs = analyser.get_condition_met_probs()
+            data[0] = analyser.get_condition_met_plotting_data()
             for group_num, (post_select_prob_err,condition_prob_err) in enumerate(zip(post_select_probs_errs,condition_probs_errs)):
                 post_select_prob_err_string = analyser.uncert_to_str(post_select_prob_err['probability'],post_select_prob_err['error in probability']) 
                 condition_prob_err_string = analyser.uncert_to_str(condition_prob_err['probability'],condition_prob_err['error in probability']) 
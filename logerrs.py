@@ -7,10 +7,21 @@ Exceptions for use in experimental controll software.
 """
 __author__ = 'Martin Lichtman'
 
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import pickle
+import struct
 import logging
 import logging.handlers
 
-import colorlog
+try:
+    import colorlog
+except ImportError:
+    colorlog = None # only needed for setup_log
 
 class PauseError(Exception):
     """This class is defined so we can raise an exception to have the experiment pause immediately.
@@ -75,4 +86,173 @@ def setup_log():
 
     #put the handlers to use
     logger.addHandler(sh)
-    # logger.addHandler(fh)
\ No newline at end of file
+    # logger.addHandler(fh)
+
+
+#### asynchronous logging ####
+# Records are put on a queue by the thread that logs them and a background
+# thread formats and writes them, so that hot threads don't wait on the
+# console or files. Pass arguments to the logger rather than formatting the
+# message, e.g. logger.debug('image %s', n), so that nothing is formatted
+# if the level is disabled.
+
+COLOURS = {'DEBUG': '\033[37m', 'INFO': '\033[36m', 'WARNING': '\033[33m',
+    'ERROR': '\033[31m', 'CRITICAL': '\033[41m'}
+
+class consoleFormatter(logging.Formatter):
+    """Coloured output in the same style as strtypes.error/warning/info."""
+    def format(self, record):
+        msg = ('%s####\t%s\t%s\t%s\n\t%s\n'%(COLOURS.get(record.levelname, ''),
+            record.levelname, time.strftime('%d.%m.%Y\t%H:%M:%S', time.localtime(record.created)),
+            record.name, record.getMessage()))
+        if getattr(record, 'suppressed', 0):
+            msg += '\t(%s repeats of this message were suppressed)\n'%record.suppressed
+        if record.exc_info:
+            msg += self.formatException(record.exc_info) + '\n'
+        return msg + '\033[m'
+
+class jsonFormatter(logging.Formatter):
+    """One JSON object per record, with the fields of the record."""
+    def format(self, record):
+        d = {'time': record.created, 'level': record.levelname, 'name': record.name,
+            'thread': record.threadName, 'file': record.filename, 'line': record.lineno,
+            'function': record.funcName, 'msg': record.getMessage()}
+        if getattr(record, 'suppressed', 0):
+            d['suppressed'] = record.suppressed
+        if record.exc_info:
+            d['exception'] = self.formatException(record.exc_info)
+        return json.dumps(d)
+
+class binaryLogHandler(logging.handlers.RotatingFileHandler):
+    """Rotating log file of length-prefixed pickled record dicts, the same
+    format that logging.handlers.SocketHandler sends. Read it with
+    read_binary_log()."""
+    def __init__(self, filename, maxBytes=0, backupCount=0):
+        super().__init__(filename, 'ab', maxBytes, backupCount, delay=True)
+
+    def _open(self):
+        return open(self.baseFilename, 'ab') # RotatingFileHandler opens text if maxBytes > 0
+
+    def emit(self, record):
+        try:
+            d = dict(record.__dict__)
+            d['msg'] = record.getMessage()
+            d['args'] = None
+            if record.exc_info:
+                d['exc_text'] = logging.Formatter().formatException(record.exc_info)
+            d['exc_info'] = None
+            d.pop('message', None)
+            data = pickle.dumps(d, 1)
+            data = struct.pack('>L', len(data)) + data
+            if self.stream is None:
+                self.stream = self._open()
+            if self.maxBytes and self.stream.tell() + len(data) >= self.maxBytes:
+                self.doRollover()
+                if self.stream is None:
+                    self.stream = self._open()
+            self.stream.write(data)
+            self.flush()
+        except Exception:
+            self.handleError(record)
+
+def read_binary_log(file_name):
+    """Yield the LogRecords saved by a binaryLogHandler."""
+    with open(file_name, 'rb') as f:
+        while True:
+            size = f.read(4)
+            if len(size) < 4:
+                break
+            yield logging.makeLogRecord(pickle.loads(f.read(struct.unpack('>L', size)[0])))
+
+class repeatFilter(logging.Filter):
+    """Only allow burst records with the same logger, level, and message
+    in each period of seconds. The first record after a period
+    with dropped records says how many were suppressed.
+    Records at level or above are always allowed, so errors aren't lost."""
+    def __init__(self, period=1.0, burst=5, level=logging.ERROR):
+        super().__init__()
+        self.period = period
+        self.burst = burst
+        self.level = level
+        self._seen = {} # (name, level, msg, args): [period start, count, dropped]
+
+    def filter(self, record):
+        if record.levelno >= self.level:
+            return True
+        key = (record.name, record.levelno, str(record.msg), record.args)
+        try:
+            seen = self._seen.get(key)
+        except TypeError: # unhashable args
+            key = key[:3] + (repr(record.args),)
+            seen = self._seen.get(key)
+        if seen is None or record.created - seen[0] > self.period:
+            if len(self._seen) > 10000: # don't grow forever with unique messages
+                self._seen.clear()
+            if seen is not None and seen[2]:
+                record.suppressed = seen[2]
+            self._seen[key] = [record.created, 1, 0]
+            return True
+        seen[1] += 1
+        if seen[1] > self.burst:
+            seen[2] += 1
+            return False
+        return True
+
+class lazyQueueHandler(logging.handlers.QueueHandler):
+    """Put records on the queue without formatting them. The listener
+    formats them in its own thread. Only for queues in the same process."""
+    def prepare(self, record):
+        return record
+
+def setup_async_log(levels={}, console_level=logging.INFO, file_name='',
+        file_format='json', file_level=logging.INFO, max_bytes=10*2**20,
+        backup_count=5, period=1.0, burst=5):
+    """Send all log records through a queue to a background thread that
+    writes them to the console and, optionally, a rotating log file.
+    Replaces any handlers on the root logger.
+    levels        -- dict of {logger name: level} for per-module levels
+    console_level -- minimum level to print
+    file_name     -- log file name, or '' for no file
+    file_format   -- 'json' for a line of JSON per record or 'binary' for
+                     pickled records, see read_binary_log()
+    file_level    -- minimum level to save to the file. DEBUG records from
+                     the hot threads are costly, so only ask for them when
+                     debugging
+    max_bytes     -- size at which the file rotates
+    backup_count  -- number of rotated files to keep
+    period, burst -- allow only burst repeats of a message per period (s)
+    Return the QueueListener, which is stopped when Python exits."""
+    handlers = [logging.StreamHandler(sys.stdout)]
+    handlers[0].setFormatter(consoleFormatter())
+    handlers[0].setLevel(console_level)
+    if file_name:
+        if os.path.dirname(file_name):
+            os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        if file_format == 'binary':
+            fh = binaryLogHandler(file_name, max_bytes, backup_count)
+        else:
+            fh = logging.handlers.RotatingFileHandler(file_name, 'a', max_bytes, backup_count, delay=True)
+            fh.setFormatter(jsonFormatter())
+        fh.setLevel(file_level)
+        handlers.append(fh)
+    q = queue.SimpleQueue()
+    qh = lazyQueueHandler(q)
+    qh.addFilter(repeatFilter(period, burst))
+    root = logging.getLogger()
+    for h in root.handlers[:]:
+        root.removeHandler(h)
+    root.addHandler(qh)
+    # records below every handler's level are dropped before they're created
+    root.setLevel(min(h.level for h in handlers))
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+    listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_log, listener)
+    return listener
+
+def stop_log(listener):
+    """Write the records left in the queue and stop the listener thread."""
+    try:
+        listener.stop()
+    except AttributeError: pass # already stopped
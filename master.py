@@ -42,9 +42,16 @@ from sequences.sequencePreviewer import Previewer
 sys.path.append('./dds')
 from dds.DDScoms import DDSComWindow
 from strtypes import intstrlist, error, warning, info
+from shottrace import TRACE
+from metrics import METRICS
 
 import logging
-logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s', level=logging.DEBUG)
+from logerrs import setup_async_log
+# print and save log records on a background thread so they don't block the hot threads
+# set PYDEX_LOG_LEVEL=DEBUG to save debug records to the file as well
+setup_async_log(levels={'PyQt5': logging.WARNING}, console_level=logging.INFO,
+    file_name=os.path.join('logs', 'pydex.log'), file_format='json',
+    file_level=os.environ.get('PYDEX_LOG_LEVEL', 'INFO').upper())
 
 ####    ####    ####    ####
 
@@ -144,6 +151,8 @@ class Master(QMainWindow):
         
         self.rn.server.dxnum.connect(self.Dx_label.setText) # synchronise run number
         self.rn.server.textin.connect(self.respond) # read TCP messages
+        self.rn.seq.mr.registry.status_changed.connect(self.mr_status_changed) # start queued multiruns
+        self.rn.seq.mr.QueueWindow.closed.connect(self.check_mr_queue)
         self.status_label.setText('Initialising...')
         QTimer.singleShot(0, self.idle_state) # takes a while for other windows to load
 
@@ -164,6 +173,15 @@ class Master(QMainWindow):
         self.date_reset = 0 # whether the dates are waiting to be reset or not
         QTimer.singleShot((29*3600 - 3600*t0[3] - 60*t0[4] - t0[5])*1e3, 
             self.reset_dates)
+        # display the queue depths and throughput, and serve all of the metrics over HTTP
+        self.metrics_timer = QTimer(self)
+        self.metrics_timer.timeout.connect(self.update_metrics)
+        self.metrics_timer.start(1000)
+        try:
+            port = METRICS.serve(port=8640)
+            info('Metrics available at http://localhost:%s/ (JSON at /json)'%port)
+        except OSError as e:
+            warning('Could not start metrics server:\n' + str(e))
         
         self.restore_state(file_name=state_config)
 
@@ -315,6 +333,10 @@ class Master(QMainWindow):
         check_sizes = QAction('Print stored data size', sync_menu, checkable=False)
         check_sizes.triggered.connect(self.check_sizes)
         sync_menu.addAction(check_sizes)
+
+        export_trace = QAction('Export shot timing trace', sync_menu, checkable=False)
+        export_trace.triggered.connect(self.export_trace)
+        sync_menu.addAction(export_trace)
         
         #### status of the master program ####
         self.status_label = QLabel('Initiating...', self)
@@ -365,6 +387,10 @@ class Master(QMainWindow):
         self.sync_label = QLabel('')
         self.centre_widget.layout.addWidget(self.sync_label, 3,0, 1,3)
 
+        self.metrics_label = QLabel('') # queue depths and throughput, hover for all metrics
+        self.metrics_label.setWordWrap(True)
+        self.centre_widget.layout.addWidget(self.metrics_label, 4,0, 1,3)
+
         #### choose main window position, dimensions: (xpos,ypos,width,height)
         self.setWindowTitle('PyDex controller')
         self.setWindowIcon(QIcon('docs/pydexicon.png'))
@@ -517,6 +543,7 @@ class Master(QMainWindow):
         except: warning('Andor camera safe shutdown failed') # probably not initialised
         self.rn.cam = camera(config_file=ancam_config) # Andor camera
         reset_slot(self.rn.cam.AcquireEnd, self.rn.receive, True) # connect signal
+        TRACE.clear_marks() # marks from the old camera
         self.status_label.setText('Camera settings config: '+ancam_config)
         self.stats['CameraConfig'] = ancam_config
 
@@ -635,6 +662,7 @@ class Master(QMainWindow):
         reset_slot(self.rn.cam.AcquireEnd, self.rn.receive, not self.rn.seq.mr.multirun) # send images to analysis
         reset_slot(self.rn.cam.AcquireEnd, self.rn.mr_receive, self.rn.seq.mr.multirun)
         reset_slot(self.rn.cam.AcquireEnd, self.rn.check_receive, False)
+        TRACE.clear_marks() # for images taken before the switch
         reset_slot(self.rn.trigger.dxnum, self.reset_cam_signals, False) # only trigger once
         self.rn.trigger.add_message(TCPENUM['TCP read'], 'Go!'*600) # flush TCP
             
@@ -676,7 +704,14 @@ class Master(QMainWindow):
                 self.rn.seq.mr.multirun = True
                 self.rn.server.add_message(TCPENUM['TCP read'], # send the first multirun to DExTer
                     'start measure %s'%(self.rn.seq.mr.mr_param['measure'] + num_mrs - 1)+'\n'+'0'*2000)
-            else: QTimer.singleShot(10e3, self.check_mr_queue) # check again in 10s.
+            # otherwise the queue is checked again when the multirun ends or the queue window closes
+
+    def mr_status_changed(self, measure_prefix, status):
+        """When a multirun finishes or one is queued (e.g. resuming an
+        interrupted multirun), start the next one in the queue. Wait
+        for the current event to finish so the multirun can end cleanly."""
+        if status in ['saved', 'cancelled', 'queued']:
+            QTimer.singleShot(0, self.check_mr_queue)
             
     def respond(self, msg=''):
         """Read the text from a TCP message and then execute the appropriate function."""
@@ -793,12 +828,32 @@ class Master(QMainWindow):
                     self.rn.slmtcp, self.rn.mwgtcp_wftk, self.rn.mwgtcp_anritsu]):
             print(label, ': %s messages'%len(tcp.get_queue()))
         print("Mutlirun queue length: ", len(self.rn.seq.mr.mr_queue))
+        print("Metrics:")
+        print(METRICS.text())
         if reset:
             pass
             # for mw in self.rn.sw.mw + self.rn.sw.rw:
             #     mw.image_handler.reset_arrays()
             #     mw.histo_handler.reset_arrays()
 
+    def update_metrics(self):
+        """Show the main queue depths and rates in the status panel, and
+        all of the metrics in its tooltip."""
+        snap = METRICS.snapshot('panel')
+        self.metrics_label.setText(METRICS.status(snap, names=['images received', 'images saved',
+            'images analysed', 'saver queue', 'MAIA queue', 'DExTer TCP queue', 'multirun queue']))
+        self.metrics_label.setToolTip(METRICS.text(snap).strip())
+
+    def export_trace(self, toggle=True):
+        """Print the latency of each stage after image acquisition and save
+        the per-shot timelines and histograms to the results path."""
+        print(TRACE.summary())
+        try:
+            files = TRACE.export(self.rn.sv.results_path)
+            info('Shot timing trace saved to ' + ', '.join(files))
+        except OSError as e:
+            error('Could not save shot timing trace:\n' + str(e))
+
     def save_state(self, file_name=''):
         """Save the file number and date and config file paths so that they
         can be loaded again when the program is next started."""
@@ -869,6 +924,8 @@ class Master(QMainWindow):
                         self.rn.mwgtcp_anritsu, self.rn.check, self.mon_win, 
                         self.dds_win, self.rn.seq.mr.QueueWindow]:
                 obj.close()
+            self.metrics_timer.stop()
+            METRICS.close()
             event.accept()
         
 ####    ####    ####    #### 
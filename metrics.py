@@ -0,0 +1,211 @@
+"""PyDex - live metrics
+
+ - Counters, gauges and histograms for the queues and throughput of the
+   image saver, image analysis, and network servers
+ - Updating a metric is a few attribute operations, so it can be called
+   for every image. Gauges of queue depths can instead be given a function
+   that is only called when the metrics are read
+ - Rates per second are found from the change in the counters between
+   snapshots. Each reader (e.g. the status panel and HTTP) keeps its own
+   previous snapshot so that they don't change each other's rates
+ - METRICS.serve() gives the metrics as text at http://localhost:port/
+   and as JSON at /json, and METRICS.status() gives a one line summary
+"""
+import json
+import time
+import bisect
+import threading
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+def number(value):
+    """Format integers in full, e.g. counters, and other values to 4 s.f."""
+    if isinstance(value, (int, np.integer)):
+        return '%d'%value
+    return '%.4g'%value
+
+class counter:
+    """A count of events, e.g. images saved."""
+    def __init__(self, name, help=''):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def read(self):
+        return self.value
+
+class gauge:
+    """A value that goes up and down, e.g. a queue length.
+    fn -- function returning the value when it is read, or None to use set()"""
+    def __init__(self, name, help='', fn=None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def read(self):
+        if self.fn is not None:
+            try:
+                return self.fn()
+            except Exception: # the object being measured may have been removed
+                return float('nan')
+        return self.value
+
+class histogram:
+    """Counts of observations in buckets, e.g. analysis time per image.
+    bounds -- upper bounds of the buckets. The last bucket has no bound."""
+    def __init__(self, name, help='', bounds=(1e-3, 2e-3, 5e-3, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5)):
+        self.name = name
+        self.help = help
+        self.bounds = list(bounds)
+        self.counts = [0]*(len(self.bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, x):
+        self.counts[bisect.bisect_left(self.bounds, x)] += 1
+        self.sum += x
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate the q quantile as the upper bound of the bucket it is in."""
+        if not self.count:
+            return float('nan')
+        i = bisect.bisect_left(np.cumsum(self.counts), q*self.count)
+        return self.bounds[i] if i < len(self.bounds) else float('inf')
+
+    def read(self):
+        return {'count': self.count, 'sum': self.sum, 'p50': self.quantile(0.5), 'p90': self.quantile(0.9)}
+
+class metricsRegistry:
+    """Collection of metrics with rates calculated between snapshots."""
+    def __init__(self):
+        self.metrics = {}     # name: metric
+        self._last = {}       # reader: {counter name: (time, value) at its last snapshot}
+        self._lock = threading.Lock() # for registering metrics and taking snapshots
+        self.server = None
+
+    def _get(self, kind, name, **kwargs):
+        try:
+            return self.metrics[name]
+        except KeyError:
+            with self._lock:
+                if name not in self.metrics:
+                    self.metrics[name] = kind(name, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name, help=''):
+        """Return the counter with this name, making it if it doesn't exist."""
+        return self._get(counter, name, help=help)
+
+    def gauge(self, name, help='', fn=None):
+        """Return the gauge with this name, making it if it doesn't exist.
+        If fn is given it replaces the gauge's function."""
+        g = self._get(gauge, name, help=help)
+        if fn is not None:
+            g.fn = fn
+        return g
+
+    def histogram(self, name, help='', **kwargs):
+        """Return the histogram with this name, making it if it doesn't exist."""
+        return self._get(histogram, name, help=help, **kwargs)
+
+    def snapshot(self, reader=''):
+        """Return a dict of the current value of each metric. Counters also
+        have '<name> rate', the rate per second since the reader's last snapshot."""
+        with self._lock:
+            now = time.perf_counter()
+            last = self._last.setdefault(reader, {})
+            snap = {}
+            for name, m in list(self.metrics.items()):
+                snap[name] = m.read()
+                if isinstance(m, counter):
+                    t, v = last.get(name, (now, snap[name]))
+                    snap[name + ' rate'] = (snap[name] - v) / (now - t) if now > t else 0.0
+                    last[name] = (now, snap[name])
+            return snap
+
+    def text(self, snap=None):
+        """Return the metrics as lines of 'name value'."""
+        snap = self.snapshot('text') if snap is None else snap
+        out = []
+        for name, value in snap.items():
+            if isinstance(value, dict):
+                out += ['%s %s %s'%(name, key, number(v)) for key, v in value.items()]
+            else:
+                out.append('%s %s'%(name, number(value)))
+        return '\n'.join(out) + '\n'
+
+    def status(self, snap=None, names=None):
+        """Return a compact summary of the queue depths and rates.
+        names -- only include these metrics, default all."""
+        snap = self.snapshot('status') if snap is None else snap
+        parts = []
+        for name, value in snap.items():
+            m = self.metrics.get(name)
+            if names is not None and name not in names and name[:-5] not in names:
+                continue
+            if isinstance(m, gauge):
+                parts.append('%s: %.4g'%(name, value))
+            elif name.endswith(' rate'):
+                parts.append('%s: %.3g/s'%(name[:-5], value))
+            elif isinstance(m, histogram) and value['count']:
+                parts.append('%s p90: %.3g s'%(name, value['p90']))
+        return ' | '.join(parts)
+
+    def serve(self, port=8640, host='localhost'):
+        """Serve the metrics over HTTP on a daemon thread: text at / and
+        JSON at /json. The rates are since the previous request."""
+        registry = self
+        class handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                snap = registry.snapshot('http')
+                if self.path.startswith('/json'):
+                    body, ctype = json.dumps(snap).encode(), 'application/json'
+                else:
+                    body, ctype = registry.text(snap).encode(), 'text/plain'
+                self.send_response(200)
+                self.send_header('Content-Type', ctype)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args): pass # don't log every request
+        self.server = ThreadingHTTPServer((host, port), handler)
+        threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True).start()
+        return self.server.server_address[1]
+
+    def close(self):
+        """Stop the HTTP server."""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+METRICS = metricsRegistry() # shared by all of the modules in this process
+
+if __name__ == "__main__":
+    # cost of updating metrics on the hot path, and reading them over HTTP
+    from urllib.request import urlopen
+    n = 100000
+    c, h = METRICS.counter('images saved'), METRICS.histogram('analysis time')
+    queue = list(range(7))
+    METRICS.gauge('saver queue', fn=lambda: len(queue))
+    t0 = time.perf_counter()
+    for i in range(n):
+        c.inc()
+    t1 = time.perf_counter()
+    for i in range(n):
+        h.observe(i*1e-7)
+    t2 = time.perf_counter()
+    print('counter.inc: %.3f us, histogram.observe: %.3f us'%((t1-t0)/n*1e6, (t2-t1)/n*1e6))
+    port = METRICS.serve(port=0)
+    c.inc(50)
+    print(urlopen('http://localhost:%s/'%port).read().decode())
+    print(METRICS.status())
+    METRICS.close()
@@ -4,6 +4,9 @@ Stefan Spence 01/06/20
  - Take a trace acquired by the DAQ
  - Choose slices to take an average and std dev of.
  - Accumulate a slice for every trace taken
+ - The statistics of all slices are calculated together from cumulative
+   sums of the trace, and stored in preallocated ring arrays
+ - Run this file to benchmark the analysis
 """
 import os
 import re
@@ -18,7 +21,7 @@ except ImportError:
     from PyQt5.QtCore import pyqtSignal, QThread
 from collections import OrderedDict
 from strtypes import strlist, listlist, BOOL, error, warning, info
-from networking.client import simple_msg
+from networking.influxWriter import influxWriter, line_protocol
 import sys
 
 def channel_stats(text):
@@ -38,77 +41,105 @@ def channel_stats(text):
 ####    ####    ####    ####
 
 class daqSlice:
-    """Analyse the data from part of a DAQ measurement.
+    """Settings for the analysis of part of a DAQ measurement.
     Slice properties: name, indexes, channels to apply to.
-    For each trace, take the run number, mean, and std dev."""
-    def __init__(self, name='', start=0, end=1, channels=OrderedDict([('Dev4/ai0',0)])):
+    The mean and std dev for each trace are stored by the daqCollection,
+    stats gives them as arrays in the order that the traces were taken."""
+    def __init__(self, name='', start=0, end=1, channels=OrderedDict([('Dev4/ai0',0)]),
+            collection=None):
         self.name = name
         self.i0   = start
         self.i1   = end
         self.inds = slice(start, end+1) # the indices to use for the slice
         self.size = end - start
         self.channels = channels # dict of channelname, index
-        self.stats = OrderedDict([(chan, OrderedDict([
-            ('mean',[]), ('stdv',[])])) for chan in channels.keys()])
-
-        self.blurbstr = "POST /write?db=arduino HTTP/1.1\nHost: 129.234.190.191\n"
-        self.blurbstr += "User-Agent: PyDex\nConnection: close\n"
-        self.blurbstr += "Content-Type: application/x-www-form-urlencoded\n"
-        self.blurbstr += "Content-Length: %s\n\n"
-        self.datastr = 'Experiment,SOURCE=DAQmonitor,name="%s",channel0="%s" '%(name, list(self.channels.keys())[0])
-                
-    def process(self, data, ind, send_data=False):
-        """Apply the slice to the given data, extract the mean and std dev.
-        Note that the data must have shape to match the expected # channels.
-        data -- measured voltages [[measurement] * # channels].
-        ind  -- index of the channel to assign the data to."""
-        for chan, i in self.channels.items():
-            if i == ind:
-                try:
-                    row = data[0] # i if multiple channels are being measured simultaneously
-                    self.stats[chan]['mean'].append(np.mean(row[self.inds]))
-                    self.stats[chan]['stdv'].append(np.std(row[self.inds], ddof=1))
-                    if send_data:
-                        try: # send results via TCP to influxdb
-                            datastr = self.datastr + "mean_V=%.6f,stdv_V=%.6f "%(self.stats[chan]['mean'][-1], self.stats[chan]['stdv'][-1])
-                            datastr += str(int(time.time()*1e9)) + '\n'
-                            msg = self.blurbstr%len(datastr) + datastr
-                            _ = simple_msg('129.234.190.191', 8086, msg)
-                        except Exception as e:
-                            error("DAQ analysis failed to send results to influxdb\n"+str(e))
-                except IndexError as e:
-                    error('Data wrong shape to take slice at %s.\n'%i + str(e))
-            else: # just to keep them all the same length
-                self.stats[chan]['mean'].append(np.nan) 
-                self.stats[chan]['stdv'].append(np.nan)
+        self.collection = collection
+        self.tags = OrderedDict([('SOURCE', 'DAQmonitor'), ('name', '"%s"'%name), # for influxdb
+            ('channel0', '"%s"'%list(self.channels.keys())[0])])
+
+    @property
+    def stats(self):
+        """OrderedDict of {channel: {'mean':array, 'stdv':array}}"""
+        return OrderedDict([(chan, OrderedDict([(key, self.collection.column(key, self, chan))
+            for key in ['mean', 'stdv']])) for chan in self.channels.keys()])
 
-        
 ####    ####    ####    ####
             
 class daqCollection(QThread):
     """Handle a collection of daqSlice classes.
     param -- list of parameters to create daqSlice: [name,start,end,channels].
     channels -- list of channels used in the measurement.
+    size  -- number of traces to keep. Once full, the oldest are overwritten.
+    Each column of the results is a channel of a slice. The statistics for
+    all columns are calculated at once from cumulative sums of the trace.
+    Results are sent to influxdb in batches by the influxWriter thread.
     """
     acq_settings = pyqtSignal(str, str) # emit loaded DAQ acquisition settings
 
     def __init__(self, param=[['Slice0',0,1,OrderedDict([('Dev4/ai0',0)])]],
-            channels=['Dev4/ai0']):
+            channels=['Dev4/ai0'], size=100000):
         super().__init__()
-        self.slices = [daqSlice(*p) for p in param]
+        self.influx = influxWriter()
+        self.slices = [daqSlice(*p, collection=self) for p in param]
         self.channels = channels
-        self.ind = 0 # number of shots processed
-        self.runs = [] # run number for identifying the trace
-        self.times = [] # time the run was taken
+        self.size = size
+        self.reset_arrays()
+
+    def layout(self):
+        """The columns of the results: a (slice, channel name, channel index)
+        for each channel of each slice."""
+        return [(s, chan, i) for s in self.slices for chan, i in s.channels.items()]
+
+    def set_bounds(self):
+        """Precompute the index boundaries of the columns."""
+        cols = self.layout()
+        self._key = [(id(s), chan, i, s.i0, s.i1) for s, chan, i in cols]
+        self._cols = {(id(s), chan): j for j, (s, chan, i) in enumerate(cols)}
+        self._start = np.array([max(s.i0, 0) for s, chan, i in cols], dtype=int)
+        self._stop  = np.array([max(s.i1 + 1, 0) for s, chan, i in cols], dtype=int)
+        self._chan  = np.array([i for s, chan, i in cols], dtype=int)
+        self._tags = [s.tags for s, chan, i in cols]
 
     def reset_arrays(self, *args):
         """Reset all of the data to empty"""
-        self.runs = []
-        self.times = []
-        for s in self.slices:
-            for c in s.stats.keys():
-                s.stats[c] = OrderedDict([('mean',[]), ('stdv',[])])
-        self.ind = 0   
+        self.set_bounds()
+        n = len(self._key)
+        self.ind = 0 # number of shots processed
+        self._runs  = np.zeros(self.size, dtype=int)    # run number for identifying the trace
+        self._times = np.zeros(self.size, dtype=float)  # time the run was taken
+        self._mean  = np.full((self.size, n), np.nan)
+        self._stdv  = np.full((self.size, n), np.nan)
+
+    def ordered(self, arr):
+        """Return the stored rows of the ring array, oldest first.
+        Before the ring is full this is a view without copying."""
+        if self.ind <= self.size:
+            return arr[:self.ind]
+        i = self.ind % self.size
+        return np.concatenate((arr[i:], arr[:i]))
+
+    @property
+    def runs(self):
+        """run numbers of the stored traces"""
+        return self.ordered(self._runs)
+
+    @property
+    def times(self):
+        """time since epoch that the stored traces were taken"""
+        return self.ordered(self._times)
+
+    def latest(self):
+        """Return the run number, means, and std devs of the newest trace."""
+        i = (self.ind - 1) % self.size
+        return self._runs[i], self._mean[i], self._stdv[i]
+
+    def column(self, key, s, chan):
+        """Return the stored 'mean' or 'stdv' results for a channel of a slice."""
+        arr = self._mean if key == 'mean' else self._stdv
+        j = self._cols.get((id(s), chan))
+        if j is None or j >= arr.shape[1]: # slice changed since the arrays were reset
+            return np.full(len(self.runs), np.nan)
+        return self.ordered(arr[:, j])
 
     def add_slice(self, name, start, end, channels):
         """Add another slice to the set. Also empties lists.
@@ -116,50 +147,103 @@ class daqCollection(QThread):
         start    -- first index
         end      -- last index
         channels -- OrderedDict of channel names and indexes"""
-        self.slices.append(daqSlice(name, start, end, channels))
+        self.slices.append(daqSlice(name, start, end, channels, self))
         self.reset_arrays() # make sure they're the same length
-        
+
+    def reduce(self, data, ind):
+        """Return the mean and std dev of every column for one trace.
+        data -- measured voltages [[measurement] * # channels]. Row r is
+            the channel with index ind + r.
+        ind  -- index of the channel in the first row of the data."""
+        data = np.asarray(data, dtype=float)
+        if data.ndim < 2:
+            data = data.reshape(1, -1)
+        rows = self._chan - ind
+        valid = (rows >= 0) & (rows < len(data))
+        mean = np.full(len(rows), np.nan)
+        stdv = np.full(len(rows), np.nan)
+        if not np.any(valid) or not data.shape[1]:
+            return mean, stdv, valid
+        # subtracting the trace mean stops the sum of squares losing precision
+        x = data - data.mean(axis=1, keepdims=True)
+        c1 = np.zeros((len(data), data.shape[1] + 1))
+        c2 = np.zeros((len(data), data.shape[1] + 1))
+        np.cumsum(x, axis=1, out=c1[:, 1:])
+        np.cumsum(x*x, axis=1, out=c2[:, 1:])
+        r = rows[valid]
+        i0 = np.minimum(self._start[valid], data.shape[1])
+        i1 = np.minimum(self._stop[valid], data.shape[1])
+        n = (i1 - i0).astype(float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            s1 = c1[r, i1] - c1[r, i0]
+            m = s1 / n
+            mean[valid] = m + data.mean(axis=1)[r]
+            stdv[valid] = np.sqrt(np.maximum(c2[r, i1] - c2[r, i0] - s1*m, 0) / (n - 1))
+        return mean, stdv, valid
+
     def process(self, data, n, ind, send_data=False):
-        """Send the data to all of the slices. It must have the right shape."""
-        self.runs.append(n)
-        self.times.append(time.time())
-        for s in self.slices:
-            s.process(data, ind, send_data)
+        """Take the statistics of all of the slices for a trace and store them.
+        data      -- measured voltages [[measurement] * # channels].
+        n         -- run number
+        ind       -- index of the channel to assign the data to.
+        send_data -- whether to send the results to influxdb"""
+        if [(id(s), chan, i, s.i0, s.i1) for s, chan, i in self.layout()] != self._key:
+            if len(self.layout()) != self._mean.shape[1]:
+                self.reset_arrays() # columns changed
+            else: self.set_bounds() # slice indexes changed
+        mean, stdv, valid = self.reduce(data, ind)
+        i = self.ind % self.size
+        self._runs[i] = n
+        self._times[i] = time.time()
+        self._mean[i] = mean
+        self._stdv[i] = stdv
         self.ind += 1
+        if send_data: # queue results for influxdb
+            for j in np.flatnonzero(valid):
+                self.influx.add(line_protocol('Experiment', self._tags[j],
+                    {'mean_V':mean[j], 'stdv_V':stdv[j]}, self._times[i]))
             
     def load(self, file_name):
-        """Load back data stored in csv. Metadata for the DAQ 
+        """Load back data stored in csv or npz. Metadata for the DAQ 
         acquisition and the slices are stored in the header. 
         Then data follows."""
-        head = [[],[],[],[],[]] # get metadata
-        with open(file_name, 'r') as f:
-            for i in range(5):
-                row = f.readline()
-                if row[:2] == '# ':
-                    head[i] = row[2:].replace('\n','')
+        if file_name.endswith('.npz'):
+            with np.load(file_name) as f:
+                head = [str(x) for x in f['header']]
+                runs, times, mean, stdv = f['runs'], f['times'], f['mean'], f['stdv']
+        else:
+            head = [[],[],[],[],[]] # get metadata
+            with open(file_name, 'r') as f:
+                for i in range(5):
+                    row = f.readline()
+                    if row[:2] == '# ':
+                        head[i] = row[2:].replace('\n','')
+            data = np.genfromtxt(file_name, delimiter=',', ndmin=2)
+            runs, times = data[:,0], data[:,-1]
+            nchans = (len(data[0]) - 2) // 2 # number of columns
+            mean, stdv = data[:,1:1+nchans], data[:,1+nchans:1+2*nchans]
         self.acq_settings.emit(head[0], head[1]) # acquisition settings
         self.slices = []
         self.channels = list(channel_stats(head[1]).keys())
         for sstr in head[3].split('; '): # slice settings
             str1, chanstr = sstr.split('[')
-            name, si0, si1 = str1.split(', ')
-            chans = chanstr.replace(']','').split(', ')
-            self.add_slice(name, int(si0), int(si1), chans)
-        data = np.genfromtxt(file_name, delimiter=',')
-        if np.size(data) > 1: # load data into lists
-            self.runs = list(map(int, data[:,0]))
-            self.times = list(map(float, data[:,-1]))
-            nchans = (len(data[0]) - 1) // 2 # number of channels
-            i = 1
-            for s in self.slices:
-                for chan, stats in s.stats.items():
-                    stats['mean'] = list(data[:,i])
-                    stats['stdv'] = list(data[:,i+nchans])
-                    i += 1
-
+            name, si0, si1 = str1.rstrip(', ').split(', ')
+            chans = [c.strip("' ") for c in chanstr.replace(']','').split(', ')]
+            self.slices.append(daqSlice(name, int(si0), int(si1), OrderedDict(
+                [(c, self.channels.index(c) if c in self.channels else i) 
+                    for i, c in enumerate(chans)]), self))
+        self.size = max(self.size, len(runs))
+        self.reset_arrays()
+        if np.size(runs) and np.shape(mean)[1] == self._mean.shape[1]: # load data into arrays
+            self.ind = len(runs)
+            self._runs[:self.ind] = runs
+            self._times[:self.ind] = times
+            self._mean[:self.ind] = mean
+            self._stdv[:self.ind] = stdv
         
     def save(self, file_name, meta_head=[], meta_vals=[]):
-        """Save the processed data to csv. 
+        """Save the processed data to csv, or to a binary npz file if the
+        file name ends in .npz, which is much quicker for long histories.
         First row is metadata column headings as list
         Second row is metadata values as list
         Third row is slice settings column headings
@@ -167,18 +251,59 @@ class daqCollection(QThread):
         Fifth row is data column headings
         Then data follows.
         """
-        header = ', '.join(meta_head) + '\n'
-        header += ', '.join(meta_vals) + '\n'
-        header += 'name, start index, end index, [channels]; ...\n'
-        header += '; '.join([s.name+", %s, %s, ['"%(s.i0, s.i1)
-            + "', '".join(self.channels) + "']" for s in self.slices]) +'\n'
-        header += 'Run, ' + ', '.join([s.name + '//' + chan + val for val in [
-            ' mean', ' stdv'] for s in self.slices for chan in s.stats.keys()]
-            ) + ', Time since epoch (s)'
+        header = [', '.join(meta_head), ', '.join(meta_vals), 
+            'name, start index, end index, [channels]; ...',
+            '; '.join([s.name+", %s, %s, ['"%(s.i0, s.i1)
+                + "', '".join(s.channels.keys()) + "']" for s in self.slices]),
+            'Run, ' + ', '.join([s.name + '//' + chan + val for val in [
+                ' mean', ' stdv'] for s, chan, i in self.layout()]
+                ) + ', Time since epoch (s)']
         try:
-            out_arr = np.array([self.runs] + [s.stats[chan][val] for val in 
-                ['mean', 'stdv'] for s in self.slices for chan in 
-                s.stats.keys()] + [self.times]).T
-            np.savetxt(file_name, out_arr, delimiter=',', fmt='%s', header=header)
+            if file_name.endswith('.npz'):
+                np.savez(file_name, header=np.array(header), runs=self.runs, times=self.times,
+                    mean=self.ordered(self._mean), stdv=self.ordered(self._stdv))
+            else:
+                out_arr = np.column_stack((self.runs, self.ordered(self._mean), 
+                    self.ordered(self._stdv), self.times))
+                np.savetxt(file_name, out_arr, delimiter=',', fmt='%s', header='\n'.join(header))
         except (PermissionError, FileNotFoundError) as e:
-            error('DAQ Analysis denied permission to save file: \n'+str(e))
\ No newline at end of file
+            error('DAQ Analysis denied permission to save file: \n'+str(e))
+
+if __name__ == "__main__":
+    # compare the vectorised statistics with taking each slice separately
+    import tempfile
+    rng = np.random.default_rng(0)
+    nslices, nchans, nsamples, ntraces = 20, 4, 5000, 500
+    chans = ['Dev4/ai%s'%i for i in range(nchans)]
+    param = []
+    for k in range(nslices):
+        i0 = int(rng.integers(0, nsamples-10))
+        param.append(['Slice%s'%k, i0, int(rng.integers(i0+1, nsamples)),
+            OrderedDict([(c, i) for i, c in enumerate(chans)])])
+    dc = daqCollection(param, chans, size=ntraces//2)
+    traces = rng.normal(3, 0.01, (ntraces, nchans, nsamples)) + np.linspace(0, 1, nsamples)
+    t0 = time.perf_counter()
+    ref = []
+    for trace in traces: # the old way: a separate mean and std for each slice
+        ref.append([[np.mean(trace[i][s.inds]) for s, c, i in dc.layout()],
+            [np.std(trace[i][s.inds], ddof=1) for s, c, i in dc.layout()]])
+    t1 = time.perf_counter()
+    for n, trace in enumerate(traces):
+        dc.process(trace, n, 0)
+    t2 = time.perf_counter()
+    ref = np.array(ref[-dc.size:])
+    print('%s traces x %s channels x %s slices: per slice %.0f traces/s, vectorised %.0f traces/s'%(
+        ntraces, nchans, nslices, ntraces/(t1-t0), ntraces/(t2-t1)))
+    print('max difference: mean %.3g, stdv %.3g'%(np.max(abs(dc.ordered(dc._mean) - ref[:,0])),
+        np.max(abs(dc.ordered(dc._stdv) - ref[:,1]))))
+    print('ring keeps the last %s runs: %s'%(dc.size, dc.runs[[0,-1]].tolist()))
+    for ext in ['.csv', '.npz']:
+        fname = os.path.join(tempfile.gettempdir(), 'daq_graph' + ext)
+        t0 = time.perf_counter()
+        dc.save(fname, ['a'], ['1'])
+        t1 = time.perf_counter()
+        dc2 = daqCollection([], chans)
+        dc2.load(fname)
+        t2 = time.perf_counter()
+        print('%s: save %.3g s, load %.3g s, %.0f kB, same: %s'%(ext, t1-t0, t2-t1, 
+            os.path.getsize(fname)/1e3, np.allclose(dc2.ordered(dc2._mean), dc.ordered(dc._mean))))
@@ -28,12 +28,17 @@ except ImportError:
     from PyQt5.QtWidgets import QApplication
 from strtypes import strlist, BOOL, error, warning, info
 from mythread import reset_slot
+from daqTrigger import triggerDetector
 
 class worker(QThread):
     """Acquire data from the NI USB-6211 DAQ.
     When running, start a task to read from all of the selected channels. 
-    It waits for the analogue trigger channel to surpass the trigger level, 
-    then acquires in a loop. To break the loop, set worker.stop = True.
+    With an analogue trigger, samples are read continuously in blocks and
+    each block is searched for the trigger edge. If reference_trigger is
+    set and the device supports it, DAQmx triggers the acquisition instead.
+    The latency of the software trigger is kept for the worker's lifetime
+    and summarised by timing().
+    To break the loop, set worker.stop = True.
     
     Arguments:
     rate         -- sampling rate in samples/second
@@ -42,20 +47,29 @@ class worker(QThread):
     trigger_lvl  -- voltage threshold for analogue trigger
     trigger_edge -- rising or falling edge to trigger on
     channels     -- which channels to acquire
-    ranges       -- max voltage the channel can measure (0.2, 1, 5, 10)"""
+    ranges       -- max voltage the channel can measure (0.2, 1, 5, 10)
+    block        -- duration of the blocks read with an analogue trigger (s)
+    reference_trigger -- use the DAQmx analogue reference trigger if available
+    device       -- object with a read(n) function returning n samples of
+        each channel, used instead of the DAQ, e.g. daqTrigger.simDAQ"""
     acquired = pyqtSignal(np.ndarray) # acquired data
     vrs = [0.2, 1.0, 5.0, 10.0] # allowed voltage ranges
 
     def __init__(self, rate, duration, trigger_chan='Dev4/ai0', 
             trigger_lvl=1.0, trigger_edge='rising', 
-            channels=['Dev4/ai0'], ranges=[5]):
+            channels=['Dev4/ai0'], ranges=[5], block=0.01, reference_trigger=False, device=None):
         super().__init__()
         self.stop = False # Used to ensure only 1 data aquisition per pulse
         self.sample_rate = rate 
         self.time = duration
         self.n_samples = int(rate * duration) # number of samples to acquire
         self.lvl  = trigger_lvl
-        self.edge = const.Edge.RISING if 'rising' in trigger_edge else const.Edge.FALLING
+        self.rising = 'rising' in trigger_edge
+        self.edge = const.Edge.RISING if self.rising else const.Edge.FALLING
+        self.block = max(int(rate * block), 2) # number of samples per block
+        self.device = device
+        self.reference_trigger = reference_trigger
+        self.latency = [] # time from the end of each trace until it was emitted
         self.trig_chan = trigger_chan
         if 'ai' in trigger_chan: # if triggering off analogue input
             try: # then we want the trigger channel to be in the list of channels
@@ -92,8 +106,8 @@ class worker(QThread):
         return 1
 
     def run(self):
-        """Start a continuous acquisition, either with a digital trigger, or a
-        fudged analogue trigger that reads continuously until the input is > TTL."""
+        """Start a continuous acquisition, either with a digital trigger, or an
+        analogue trigger found in blocks read continuously from the buffer."""
         try:
             if 'PFI' in self.trig_chan or 'port' in self.trig_chan: # digital trigger
                 try:
@@ -125,35 +139,82 @@ class worker(QThread):
                 except Exception as e: 
                     if not "Some or all of the samples requested have not yet been acquired" in str(e): 
                         error("DAQ task setup failed\n"+str(e))
-            elif 'ai' in self.trig_chan: # fudged analogue trigger
-                with nidaqmx.Task() as self.task:
-                    for v, chan in zip(self.vranges, self.channels):
-                        c = self.task.ai_channels.add_ai_voltage_chan(chan, terminal_config=const.TerminalConfiguration.DIFFERENTIAL) 
-                        c.ai_rng_high = v # set voltage range
-                        c.ai_rng_low = -v
-                    self.task.timing.cfg_samp_clk_timing(self.sample_rate, sample_mode=const.AcquisitionType.CONTINUOUS, 
-                        samps_per_chan=self.n_samples+10000) # set sample rate and number of samples
-                    while not self.check_stop():
-                        self.app.processEvents()
-                        try:
-                            TTL = self.task.read()[self.trig] # read a single value from the trigger channel
-                        except TypeError:
-                            TTL = self.task.read() # if there is only one channel
-                        if TTL > self.lvl: 
-                            data = self.task.read(number_of_samples_per_channel=self.n_samples)
-                            if np.size(np.shape(data)) == 1:
-                                data = [data] # if there's only one channel, still make it a 2D array
-                            self.acquired.emit(np.array(data))
+            elif 'ai' in self.trig_chan: # analogue trigger
+                if self.device is not None: # simulated DAQ
+                    self.stream(self.device.read)
+                elif not (self.reference_trigger and self.reference_acquisition()):
+                    with nidaqmx.Task() as self.task:
+                        self.add_channels()
+                        self.task.timing.cfg_samp_clk_timing(self.sample_rate, sample_mode=const.AcquisitionType.CONTINUOUS, 
+                            samps_per_chan=10*max(self.n_samples, self.block)) # buffer size
+                        reader = stream_readers.AnalogMultiChannelReader(self.task.in_stream)
+                        buf = np.zeros((len(self.channels), self.block))
+                        def read(n):
+                            reader.read_many_sample(buf, n, timeout=10)
+                            return buf
+                        self.task.start()
+                        self.stream(read)
         except Exception as e: error("DAQ acquisition stopped.\n"+str(e))
 
+    def add_channels(self):
+        """Add the AI channels to the task with their voltage ranges."""
+        for v, chan in zip(self.vranges, self.channels):
+            c = self.task.ai_channels.add_ai_voltage_chan(chan, terminal_config=const.TerminalConfiguration.DIFFERENTIAL) 
+            c.ai_rng_high = v # set voltage range
+            c.ai_rng_low = -v
+
+    def stream(self, read):
+        """Read blocks of samples continuously and emit a trace for each
+        trigger edge found, until stopped.
+        read -- function that returns the next n samples of each channel"""
+        det = triggerDetector(self.n_samples, self.trig, self.lvl, self.rising)
+        t0 = None # time of the first sample
+        while not self.check_stop():
+            block = read(self.block)
+            if t0 is None:
+                t0 = time.perf_counter() - self.block / self.sample_rate
+            for k, trace in det.push(block):
+                self.acquired.emit(trace)
+                self.latency.append(time.perf_counter() - t0 - (k + self.n_samples) / self.sample_rate)
+
+    def reference_acquisition(self):
+        """Acquire a trace each time the DAQmx analogue reference trigger
+        fires, until stopped. Return False if the device doesn't support it."""
+        pre = 2 # the reference trigger needs at least 2 pretrigger samples
+        with nidaqmx.Task() as self.task:
+            self.add_channels()
+            try:
+                self.task.timing.cfg_samp_clk_timing(self.sample_rate, sample_mode=const.AcquisitionType.FINITE, 
+                    samps_per_chan=self.n_samples + pre)
+                self.task.triggers.reference_trigger.cfg_anlg_edge_ref_trig(self.trig_chan,
+                    pretrigger_samples=pre, trigger_level=self.lvl,
+                    trigger_slope=const.Slope.RISING if self.rising else const.Slope.FALLING)
+                self.task.start()
+            except errors.DaqError as e:
+                warning('DAQ reference trigger not available, using software trigger.\n'+str(e))
+                return False
+            while not self.check_stop():
+                try:
+                    data = self.task.read(number_of_samples_per_channel=self.n_samples + pre, timeout=1)
+                    self.acquired.emit(np.array(data, ndmin=2)[:, pre:])
+                except errors.DaqError: pass # timeout waiting for a trigger
+                self.task.stop()
+                self.task.start() # rearm
+        return True
+
+    def timing(self):
+        """Return a message with the latency between the end of each trace
+        and it being emitted."""
+        if not len(self.latency):
+            return 'No triggered traces yet.'
+        return '%s traces, latency %.3g +/- %.3g ms'%(len(self.latency), 
+            np.mean(self.latency)*1e3, np.std(self.latency)*1e3)
+
     def analogue_acquisition(self):
         """Take a single acquisition on the specified channels."""
         try:
             with nidaqmx.Task() as self.task:
-                for v, chan in zip(self.vranges, self.channels):
-                    c = self.task.ai_channels.add_ai_voltage_chan(chan, terminal_config=const.TerminalConfiguration.DIFFERENTIAL) 
-                    c.ai_rng_high = v # set voltage range
-                    c.ai_rng_low = -v
+                self.add_channels()
                 self.task.timing.cfg_samp_clk_timing(self.sample_rate, sample_mode=const.AcquisitionType.CONTINUOUS, 
                     samps_per_chan=self.n_samples+1000)
                 data = self.task.read(number_of_samples_per_channel=self.n_samples)
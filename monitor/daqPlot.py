@@ -0,0 +1,169 @@
+"""PyDex Monitoring - streaming plots
+
+ - The graphs of slice statistics gain a point for every trace, so
+   resetting the full arrays of each curve gets slower as history grows
+ - decimatedCurve keeps the points in bins and only plots the min and max
+   of each bin, so a curve never has more than a few points per pixel
+ - Points are appended to the last bin. When there are twice as many bins
+   as pixels, neighbouring bins are merged. The oldest bins are dropped
+   once the history is full. So each trace costs the same to plot
+ - Run this file to benchmark redrawing the graphs with a long history
+"""
+import numpy as np
+
+class decimatedCurve:
+    """Min/max decimation of a curve that grows one point at a time.
+    Consecutive points are grouped into bins of up to per_bin points and
+    only the min and max of each bin are plotted, which keeps the spikes.
+    item    -- the pyqtgraph PlotDataItem to draw on, or None
+    width   -- number of pixels across the plot
+    history -- number of points to keep. The oldest bins are dropped."""
+    def __init__(self, item=None, width=1000, history=100000):
+        self.item = item
+        self.width = max(int(width), 1)
+        self.history = history
+        self.reset()
+
+    def reset(self):
+        """Remove all of the points."""
+        n = 4*self.width # space to append bins before moving them to the start
+        self._x = np.zeros((n, 2))  # x of the min and max of each bin
+        self._y = np.zeros((n, 2))  # the min and max of each bin
+        self._n = np.zeros(n, dtype=int) # number of points in each bin
+        self._first = 0   # index of the oldest bin
+        self._end = 0     # index after the newest bin
+        self.per_bin = 1  # max number of points in a bin
+        self.count = 0    # number of points kept
+        self.changed = True
+
+    def _compact(self):
+        """Move the bins to the start of the arrays."""
+        k = self._end - self._first
+        for arr in [self._x, self._y, self._n]:
+            arr[:k] = arr[self._first:self._end]
+        self._first, self._end = 0, k
+
+    def _merge(self):
+        """Merge pairs of neighbouring bins, doubling the points per bin."""
+        self._compact()
+        k = self._end // 2 # number of pairs. An odd bin at the end stays alone
+        x = self._x[:2*k].reshape(k, 2, 2) # (pair, bin, min/max)
+        y = self._y[:2*k].reshape(k, 2, 2)
+        r = np.arange(k)
+        lo, hi = y[:,:,0].argmin(axis=1), y[:,:,1].argmax(axis=1)
+        x, y = np.stack((x[r,lo,0], x[r,hi,1]), axis=1), np.stack((y[r,lo,0], y[r,hi,1]), axis=1)
+        self._x[:k], self._y[:k] = x, y
+        self._n[:k] = self._n[:2*k].reshape(k, 2).sum(axis=1)
+        if self._end % 2:
+            self._x[k], self._y[k], self._n[k] = self._x[2*k], self._y[2*k], self._n[2*k]
+            k += 1
+        self._end = k
+        self.per_bin *= 2
+
+    def append(self, x, y):
+        """Add a point to the end of the curve. NaN values are skipped."""
+        if not np.isfinite(y):
+            return
+        b = self._end - 1 # the newest bin
+        if self._end > self._first and self._n[b] < self.per_bin:
+            if y < self._y[b,0]:
+                self._x[b,0], self._y[b,0] = x, y
+            if y > self._y[b,1]:
+                self._x[b,1], self._y[b,1] = x, y
+            self._n[b] += 1
+        else:
+            if self._end - self._first >= 2*self.width:
+                self._merge()
+                return self.append(x, y)
+            if self._end == len(self._n):
+                self._compact()
+            b = self._end
+            self._x[b], self._y[b], self._n[b] = x, y, 1
+            self._end += 1
+        self.count += 1
+        while self.count - self._n[self._first] >= self.history: # drop the oldest bins
+            self.count -= self._n[self._first]
+            self._first += 1
+        self.changed = True
+
+    def set(self, x, y):
+        """Replace the points of the curve with the arrays x and y."""
+        self.reset()
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        keep = np.isfinite(y)
+        x, y = x[keep][-self.history:], y[keep][-self.history:]
+        n = len(y)
+        if not n:
+            return
+        while -(-n // self.per_bin) > 2*self.width:
+            self.per_bin *= 2
+        k = -(-n // self.per_bin) # number of bins
+        pad = k*self.per_bin - n
+        ylo = np.concatenate((y, np.full(pad, np.inf))).reshape(k, self.per_bin)
+        yhi = np.concatenate((y, np.full(pad, -np.inf))).reshape(k, self.per_bin)
+        xs = np.concatenate((x, np.zeros(pad))).reshape(k, self.per_bin)
+        r = np.arange(k)
+        lo, hi = ylo.argmin(axis=1), yhi.argmax(axis=1)
+        self._x[:k] = np.stack((xs[r,lo], xs[r,hi]), axis=1)
+        self._y[:k] = np.stack((ylo[r,lo], yhi[r,hi]), axis=1)
+        self._n[:k] = self.per_bin
+        self._n[k-1] -= pad
+        self._end = k
+        self.count = n
+
+    def data(self):
+        """Return the x and y arrays of the decimated curve, with the min
+        and max of each bin in order of x."""
+        x = self._x[self._first:self._end].copy()
+        y = self._y[self._first:self._end].copy()
+        swap = x[:,0] > x[:,1]
+        x[swap], y[swap] = x[swap,::-1], y[swap,::-1]
+        keep = np.ones(x.shape, dtype=bool)
+        keep[:,1] = self._n[self._first:self._end] > 1 # don't repeat single points
+        return x[keep], y[keep]
+
+    def draw(self):
+        """Update the plot item if points have been added since the last draw."""
+        if self.item is not None and self.changed:
+            self.item.setData(*self.data())
+            self.changed = False
+
+if __name__ == "__main__":
+    # worst-case redraw time per trace of the mean and stdv graphs
+    import sys
+    import time
+    import pyqtgraph as pg
+    try:
+        from PyQt4.QtGui import QApplication
+    except ImportError:
+        from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication(sys.argv)
+    ncurves, history = 16, 100000 # 8 channels in 2 slices
+    rng = np.random.default_rng(0)
+    win = pg.PlotWidget()
+    win.resize(1000, 400)
+    win.show()
+    items = [win.plot([1], pen=None, symbol='o') for i in range(ncurves)]
+    runs = np.arange(history)
+    ys = rng.normal(0, 1, (ncurves, history))
+    for n in [1000, 10000, 100000]:
+        old = []
+        for i in range(n-20, n): # the old way: reset the full arrays
+            t0 = time.perf_counter()
+            for item, y in zip(items, ys):
+                item.setData(runs[:i], y[:i])
+            app.processEvents()
+            old.append(time.perf_counter() - t0)
+        curves = [decimatedCurve(item, win.width(), history) for item in items]
+        for c, y in zip(curves, ys):
+            c.set(runs[:n-20], y[:n-20])
+        new = []
+        for i in range(n-20, n):
+            t0 = time.perf_counter()
+            for c, y in zip(curves, ys):
+                c.append(runs[i], y[i])
+                c.draw()
+            app.processEvents()
+            new.append(time.perf_counter() - t0)
+        print('%s traces: full arrays mean %.3g ms, max %.3g ms; decimated mean %.3g ms, max %.3g ms'%(
+            n, np.mean(old)*1e3, np.max(old)*1e3, np.mean(new)*1e3, np.max(new)*1e3))
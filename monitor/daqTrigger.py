@@ -0,0 +1,159 @@
+"""PyDex Monitoring - software triggering
+
+ - Find trigger edges in whole blocks of samples from a continuous
+   buffered acquisition, instead of reading one sample at a time until
+   the level is crossed
+ - Cut out a trace of n samples after each trigger, even if it spans
+   several blocks
+ - simDAQ streams simulated pulses at the sample rate so that the
+   triggering can be tested without the DAQ
+ - Run this file to compare the latency, jitter, and CPU use of block
+   triggering with polling single samples
+"""
+import time
+import numpy as np
+
+def edge_indices(x, level, rising=True):
+    """Return the indices i where x crosses level between x[i-1] and x[i]."""
+    if rising:
+        return np.flatnonzero((x[:-1] < level) & (x[1:] >= level)) + 1
+    return np.flatnonzero((x[:-1] > level) & (x[1:] <= level)) + 1
+
+class triggerDetector:
+    """Find triggers in a stream of blocks and return the traces.
+    After a trigger, the next n_samples are taken as a trace and the
+    detector rearms once they have all arrived.
+    n_samples -- number of samples per channel in a trace
+    trig      -- row of the block that has the trigger channel
+    level     -- voltage threshold for the trigger
+    rising    -- trigger on the rising edge, otherwise falling"""
+    def __init__(self, n_samples, trig=0, level=1.0, rising=True):
+        self.n_samples = n_samples
+        self.trig = trig
+        self.level = level
+        self.rising = rising
+        self.reset()
+
+    def reset(self):
+        """Forget any samples that have been pushed."""
+        self._tail = None    # samples kept from the previous blocks
+        self._start = 0      # sample index of the first sample in the tail
+        self._armed = True   # whether the tail starts with a trigger
+        self.count = 0       # number of samples pushed
+
+    def push(self, block):
+        """Add a block of samples with shape (# channels, # samples).
+        Return a list of (trigger sample index, trace) for the traces
+        that were completed."""
+        block = np.asarray(block)
+        data = block if self._tail is None else np.concatenate((self._tail, block), axis=1)
+        self.count += block.shape[1]
+        traces = []
+        i = 0 # where to search from
+        while True:
+            if self._armed:
+                edges = edge_indices(data[self.trig, max(i-1, 0):], self.level, self.rising)
+                if not len(edges):
+                    i = data.shape[1] - 1 # keep the last sample to find edges across blocks
+                    break
+                i += edges[0] - (1 if i else 0)
+                self._armed = False
+            if data.shape[1] - i < self.n_samples:
+                break # wait for the rest of the trace
+            traces.append((self._start + i, data[:, i:i+self.n_samples].copy()))
+            i += self.n_samples
+            self._armed = True
+        self._tail = data[:, i:].copy() # the block might be reused by the reader
+        self._start += i
+        return traces
+
+class simDAQ:
+    """Simulate a DAQ streaming samples in real time. The trigger
+    channel has pulses at random intervals and the others have noise.
+    rate     -- samples per second
+    channels -- number of channels
+    trig     -- index of the trigger channel
+    period   -- mean time between trigger pulses in seconds
+    width    -- duration of the trigger pulses in seconds
+    high     -- voltage of the trigger pulses"""
+    def __init__(self, rate=1e5, channels=2, trig=0, period=0.05, width=0.005,
+            high=3.3, noise=0.02, seed=0):
+        self.rate = rate
+        self.channels = channels
+        self.trig = trig
+        self.period = period
+        self.width = int(width * rate)
+        self.high = high
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.edges = [] # sample indices of the rising edges
+        self._next = int(self.rng.uniform(0.5, 1.5) * period * rate) # the next edge
+        self.count = 0  # number of samples read
+        self.t0 = None  # time of the first sample
+
+    def time_of(self, i):
+        """The time that sample i was acquired."""
+        return self.t0 + i / self.rate
+
+    def read(self, n):
+        """Wait until n more samples have been acquired, then return
+        them with shape (# channels, n)."""
+        if self.t0 is None:
+            self.t0 = time.perf_counter()
+        wait = self.time_of(self.count + n) - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        data = self.rng.normal(0, self.noise, (self.channels, n))
+        i = self.count
+        while self._next < i + n: # add the trigger pulses
+            self.edges.append(self._next)
+            self._next += int(self.rng.uniform(0.5, 1.5) * self.period * self.rate)
+        for e in self.edges[-3:]: # the pulses that could overlap this read
+            a, b = max(e - i, 0), min(e + self.width - i, n)
+            if a < b:
+                data[self.trig, a:b] += self.high
+        self.count += n
+        return data
+
+def timing_report(sim, triggers, times, n_samples):
+    """Compare the triggers that were found with the simulated edges.
+    triggers -- sample index of each trigger found
+    times    -- perf_counter time that each trace was ready
+    Return a message with the latency after the end of the trace and
+    the error in the trigger timing."""
+    edges = np.array(sim.edges)
+    trig = np.array(triggers)
+    if not len(trig):
+        return 'no triggers found'
+    err = (trig - edges[np.abs(edges[None,:] - trig[:,None]).argmin(axis=1)]) / sim.rate
+    latency = np.array(times) - sim.time_of(trig + n_samples)
+    return ('%s triggers: latency after trace %.3g +/- %.3g ms, timing error %.3g +/- %.3g us'%(
+        len(trig), np.mean(latency)*1e3, np.std(latency)*1e3, np.mean(err)*1e6, np.std(err)*1e6))
+
+if __name__ == "__main__":
+    rate, duration, n = 1e5, 3, 1000
+    # the old way: read single samples until the level is crossed
+    sim = simDAQ(rate)
+    triggers, times = [], []
+    c0, t0 = time.process_time(), time.perf_counter()
+    while time.perf_counter() - t0 < duration:
+        if sim.read(1)[0, 0] > 1.0:
+            triggers.append(sim.count - 1)
+            sim.read(n)
+            times.append(time.perf_counter())
+    cpu = (time.process_time() - c0) / (time.perf_counter() - t0)
+    print('polling single samples, CPU %.0f%%, '%(cpu*100) + timing_report(sim, triggers, times, n))
+    # read blocks of 10 ms and search them for edges
+    sim = simDAQ(rate)
+    det = triggerDetector(n, level=1.0)
+    triggers, times = [], []
+    c0, t0 = time.process_time(), time.perf_counter()
+    while time.perf_counter() - t0 < duration:
+        for k, trace in det.push(sim.read(int(rate*0.01))):
+            triggers.append(k)
+            times.append(time.perf_counter())
+    cpu = (time.process_time() - c0) / (time.perf_counter() - t0)
+    print('block triggering, CPU %.0f%%, '%(cpu*100) + timing_report(sim, triggers, times, n))
+    missed = len([e for e in sim.edges if e + n < sim.count]) - len(triggers)
+    print('traces: %s, missed: %s, all start at the edge: %s'%(len(triggers), missed,
+        all(k in sim.edges for k in triggers)))
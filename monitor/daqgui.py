@@ -41,6 +41,7 @@ warnings.filterwarnings('ignore') # not interested in RuntimeWarning from mean o
 from strtypes import strlist, BOOL, error, warning, info
 from daqController import worker, reset_slot
 from daqAnalysis import daqCollection
+from daqPlot import decimatedCurve
 from networking.client import PyClient
 
 double_validator = QDoubleValidator() # floats
@@ -95,11 +96,12 @@ class daq_window(QMainWindow):
         self.types = OrderedDict([('n', int), ('config_file', str), ('trace_file', str), ('graph_file', str),
             ('save_dir', str), ('Sample Rate (kS/s)',float), 
             ('Duration (ms)', float), ('Trigger Channel', str), ('Trigger Level (V)', float), 
-            ('Trigger Edge', str), ('channels',channel_stats)])
+            ('Trigger Edge', str), ('Reference Trigger', BOOL), ('channels',channel_stats)])
         self.stats = OrderedDict([('n', n), ('config_file', config_file), ('trace_file', 'DAQtrace.csv'), 
             ('graph_file', 'DAQgraph.csv'),('save_dir', '.'), ('Sample Rate (kS/s)', rate), 
             ('Duration (ms)', dt), ('Trigger Channel', 'Dev4/ai1'), # /Dev4/PFI0
             ('Trigger Level (V)', 1.0), ('Trigger Edge', 'rising'), 
+            ('Reference Trigger', False), # DAQmx analogue reference trigger, not on the USB-6211
             ('channels', channel_stats("[['Dev4/ai0', '0', '1.0', '0.0', '5', '1', '1']]"))])
         self.trigger_toggle = True       # whether to trigger acquisition or just take a measurement
         self.slaveind = 0 # index of the current slave in the list
@@ -156,16 +158,16 @@ class daq_window(QMainWindow):
         settings_tab.setLayout(settings_grid)
         self.tabs.addTab(settings_tab, "Settings")
 
-        self.settings = QTableWidget(1, 6)
+        self.settings = QTableWidget(1, 7)
         self.settings.setHorizontalHeaderLabels(['Duration (ms)', 
             'Sample Rate (kS/s)', 'Trigger Channel', 'Trigger Level (V)', 
-            'Trigger Edge', 'Use Trigger?'])
+            'Trigger Edge', 'Use Trigger?', 'Reference Trigger'])
         settings_grid.addWidget(self.settings, 0,0, 1,1)
         defaults = [str(self.stats['Duration (ms)']), str(self.stats['Sample Rate (kS/s)']), 
             self.stats['Trigger Channel'], str(self.stats['Trigger Level (V)']), 
-            self.stats['Trigger Edge'], '1']
-        validators = [double_validator, double_validator, None, double_validator, None, bool_validator]
-        for i in range(6):
+            self.stats['Trigger Edge'], '1', str(int(self.stats['Reference Trigger']))]
+        validators = [double_validator, double_validator, None, double_validator, None, bool_validator, bool_validator]
+        for i in range(7):
             table_item = QLineEdit(defaults[i]) # user can edit text to change the setting
             if defaults[i] == 'Sample Rate (kS/s)': table_item.setEnabled(False)
             table_item.setValidator(validators[i]) # validator limits the values that can be entered
@@ -377,6 +379,7 @@ class daq_window(QMainWindow):
         self.stats['Trigger Level (V)'] = float(self.settings.cellWidget(0,3).text())
         self.stats['Trigger Edge'] = self.settings.cellWidget(0,4).text()
         self.trigger_toggle = BOOL(self.settings.cellWidget(0,5).text())
+        self.stats['Reference Trigger'] = BOOL(self.settings.cellWidget(0,6).text())
         
         
     def set_table(self):
@@ -385,6 +388,7 @@ class daq_window(QMainWindow):
         for i in range(5):
             self.settings.cellWidget(0,i).setText(str(x[
                 self.settings.horizontalHeaderItem(i).text()]))
+        self.settings.cellWidget(0,6).setText(str(int(x['Reference Trigger'])))
         for i in range(8):
             ch = self.channels.cellWidget(i,0).text()
             if ch in x['channels']:
@@ -481,8 +485,6 @@ class daq_window(QMainWindow):
                 x.i1 = np.argmin(np.abs(t-float(w.text())))
             elif j == 3:
                 x.channels = OrderedDict([(x.text(), w.row(x)) for x in w.selectedItems()])
-                x.stats = OrderedDict([(chan, OrderedDict([
-                    ('mean',[]), ('stdv',[])])) for chan in x.channels.keys()])
                 self.reset_lines()
                 self.reset_graph()
             x.inds = slice(x.i0, x.i1+1)
@@ -565,7 +567,8 @@ class daq_window(QMainWindow):
                 slave.quit()
             self.slaves = [worker(self.stats['Sample Rate (kS/s)']*1e3, self.stats['Duration (ms)']/1e3, self.stats['Trigger Channel'], 
                 self.stats['Trigger Level (V)'], self.stats['Trigger Edge'], [chankey], 
-                [chan['range']]) for chankey, chan in self.stats['channels'].items()]
+                [chan['range']], reference_trigger=self.stats['Reference Trigger']
+                ) for chankey, chan in self.stats['channels'].items()]
             for slave in self.slaves:
                 reset_slot(slave.acquired, self.update_trace, True)
                 reset_slot(slave.acquired, self.update_graph, True)
@@ -587,6 +590,9 @@ class daq_window(QMainWindow):
             for slave in self.slaves:
                 slave.stop = True
                 slave.quit()
+            for slave in self.slaves:
+                if slave.latency: info('DAQ %s: %s'%(', '.join(slave.channels), slave.timing()))
+            self.dc.influx.finish() # send the waiting results to influxdb
             self.toggle.setText('Start')
 
     def slave_acquire(self):
@@ -647,7 +653,8 @@ class daq_window(QMainWindow):
         
     def reset_lines(self):
         """Clear the mean and stdv graphs, reset the legends, then make new 
-        lines for each of the slice channels."""
+        lines for each of the slice channels. The lines are drawn from
+        curves decimated to the screen resolution."""
         for legend in self.graph_legends: # reset the legends
             try:
                 legend.scene().removeItem(legend)
@@ -663,24 +670,46 @@ class daq_window(QMainWindow):
                         pen=None, symbol='o', symbolPen=pg.mkPen(pg.intColor(i)),
                         symbolBrush=pg.intColor(i)) 
                     i += 1
+        width = QApplication.desktop().screenGeometry().width() # pixels
+        self.graph_key = [(id(s), chan) for s, chan, i in self.dc.layout()]
+        self.curves = [[decimatedCurve(g.lines[s.name+'/'+chan], width, self.dc.size) 
+            for g in [self.mean_graph, self.stdv_graph]] for s, chan, i in self.dc.layout()]
 
     def reset_graph(self):
         """Reset the collection of slice data, then replot the graph."""
         self.dc.reset_arrays()
-        self.update_graph()
+        self.redraw_graph()
+
+    def redraw_graph(self):
+        """Replot all of the stored data accumulated from averages in 
+        slices of the measurements."""
+        if self.graph_key != [(id(s), chan) for s, chan, i in self.dc.layout()]:
+            self.reset_lines() # slices changed
+        runs = self.dc.runs
+        for (m, sd), (s, chan, i) in zip(self.curves, self.dc.layout()):
+            m.set(runs, self.dc.column('mean', s, chan))
+            sd.set(runs, self.dc.column('stdv', s, chan))
+            m.draw()
+            sd.draw()
 
     def update_graph(self, data=[]):
-        """Extract averages from slices of the data.
-        Replot the stored data accumulated from averages in slices
-        of the measurements."""
+        """Extract averages from slices of the data, then append them
+        to the graphs. Only the new points are added to the curves."""
         if np.size(data):
             if self.unsync_toggle.isChecked():
                 self.set_n(self.stats['n'] + 1)
+            ind = self.dc.ind
             self.dc.process(data, self.stats['n'], self.slaveind, self.send_data.isChecked())
-        for s in self.dc.slices:
-            for chan, val in s.stats.items():
-                self.mean_graph.lines[s.name+'/'+chan].setData(self.dc.runs, val['mean'])
-                self.stdv_graph.lines[s.name+'/'+chan].setData(self.dc.runs, val['stdv'])
+            if self.dc.ind == ind + 1 and self.graph_key == [
+                    (id(s), chan) for s, chan, i in self.dc.layout()]:
+                run, mean, stdv = self.dc.latest()
+                for (m, sd), ym, ys in zip(self.curves, mean, stdv):
+                    m.append(run, ym)
+                    sd.append(run, ys)
+                    m.draw()
+                    sd.draw()
+                return
+        self.redraw_graph()
                 
     def add_horizontal(self, toggle=True):
         """Display a horizontal line on the trace"""
@@ -817,9 +846,9 @@ class daq_window(QMainWindow):
 
     def save_graph(self, file_name=''):
         """Save the data accumulated from several runs that's displayed in the
-        graph into a csv file."""
+        graph into a csv file, or a binary npz file."""
         file_name = file_name if file_name else self.try_browse(
-                'Save File', 'csv (*.csv);;all (*)', QFileDialog.getSaveFileName)
+                'Save File', 'csv (*.csv);;binary (*.npz);;all (*)', QFileDialog.getSaveFileName)
         if file_name:
             self.dc.save(file_name, list(self.stats.keys()), 
                 list(map(str, self.stats.values()))[:-1]
@@ -835,6 +864,7 @@ class daq_window(QMainWindow):
         self.stats['channels'] = channel_stats(statstr[:-2] + ']')
         # add all channels to stats
         self.save_config(self.stats['config_file'])
+        self.dc.influx.close() # send the remaining results to influxdb
         event.accept()
                 
 ####    ####    ####    #### 
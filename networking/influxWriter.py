@@ -0,0 +1,251 @@
+"""PyDex - batched writer for influxdb
+
+ - Collect measurement points in influxdb line protocol and send them
+   from a background thread, so that analysis doesn't wait on the network
+ - Points are sent in one HTTP request per batch, when the batch is full
+   or when the oldest point has waited for the flush interval
+ - Failed requests are retried with increasing delay. If the database
+   still can't be reached, or too many points are waiting, points are
+   spilled to a file and sent once the database is back
+ - Run this file to test against a local stand-in HTTP server
+"""
+import os
+import sys
+import time
+import tempfile
+import threading
+import http.client
+from collections import deque
+from PyQt5.QtCore import QThread
+if '..' not in sys.path: sys.path.append('..')
+from strtypes import error, warning, info
+
+def line_protocol(measurement, tags, fields, t=None):
+    """Format a point in influxdb line protocol:
+    measurement,tag1=a,tag2=b field1=1.0,field2=2.0 timestamp
+    measurement -- str name of the measurement
+    tags        -- dict of tag names and str values
+    fields      -- dict of field names and values
+    t           -- time since epoch in s, default now. Sent in ns."""
+    head = ','.join([measurement] + ['%s=%s'%(key, val) for key, val in tags.items()])
+    body = ','.join('%s=%s'%(key, '%.6f'%val if isinstance(val, float) else val)
+        for key, val in fields.items())
+    return '%s %s %s'%(head, body, int((time.time() if t is None else t)*1e9))
+
+class influxWriter(QThread):
+    """Send points to influxdb in batches from a background thread.
+    host       -- address of the influxdb server
+    port       -- port of the influxdb HTTP API
+    db         -- name of the database to write to
+    batch_size -- send when this many points are waiting
+    interval   -- send when the oldest point has waited this long (s)
+    max_points -- spill points to file when more than this are waiting
+    retries    -- number of times to retry a failed request
+    spill_file -- file to store points that couldn't be sent"""
+    def __init__(self, host='129.234.190.191', port=8086, db='arduino',
+            batch_size=500, interval=1.0, max_points=20000, retries=3,
+            spill_file=os.path.join(tempfile.gettempdir(), 'pydex_influx_spill.txt'),
+            timeout=2.0):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.db = db
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_points = max_points
+        self.retries = retries
+        self.spill_file = spill_file
+        self.timeout = timeout
+        self.stop = False
+        self._points = deque() # lines waiting to be sent
+        self._t0 = 0           # time that the oldest waiting point was added
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._down_until = 0   # don't try to send before this time
+        self.sent    = 0 # number of points sent
+        self.spilled = 0 # number of points written to the spill file
+        self.dropped = 0 # number of points rejected by the database
+        self.requests = 0 # number of HTTP requests made
+
+    def add(self, line):
+        """Queue a point given in line protocol. Doesn't block: if too many
+        points are waiting then the oldest are spilled to file."""
+        with self._lock:
+            if not self._points:
+                self._t0 = time.time()
+            self._points.append(line)
+            n = len(self._points) - self.max_points
+            spill = [self._points.popleft() for i in range(n)] if n > 0 else []
+        if spill:
+            self.spill(spill)
+        if len(self._points) >= self.batch_size:
+            self._wake.set()
+        if not self.isRunning():
+            self.stop = False
+            self.start()
+
+    def pending(self):
+        """Number of points waiting to be sent, not counting the spill file."""
+        return len(self._points)
+
+    def stats(self):
+        """Return a message summarising the points sent."""
+        return '%s points sent in %s requests, %s waiting, %s spilled to file, %s rejected'%(
+            self.sent, self.requests, self.pending(), self.spilled, self.dropped)
+
+    def post(self, lines):
+        """Send the lines in one request. Return True if they were accepted
+        or rejected as bad data, False if they should be sent again."""
+        body = '\n'.join(lines).encode('utf-8')
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            conn.request('POST', '/write?db=%s'%self.db, body=body, headers={
+                'User-Agent': 'PyDex', 'Content-Type': 'application/x-www-form-urlencoded'})
+            resp = conn.getresponse()
+            msg = resp.read()
+        finally:
+            conn.close()
+            self.requests += 1
+        if resp.status < 300:
+            self.sent += len(lines)
+            return True
+        elif resp.status < 500 and resp.status != 429: # the data was bad, don't resend
+            error('influxdb rejected %s points: %s %s\n'%(len(lines), resp.status, msg[:200]))
+            self.dropped += len(lines)
+            return True
+        return False
+
+    def send(self, lines):
+        """Send the lines, retrying with increasing delay. Return True if sent."""
+        for i in range(self.retries + 1):
+            try:
+                if self.post(lines):
+                    return True
+            except OSError as e: # includes socket timeout and connection refused
+                if i == self.retries:
+                    warning('Could not reach influxdb at %s:%s\n'%(self.host, self.port)+str(e))
+            if i < self.retries and not self.stop:
+                time.sleep(0.1 * 2**i)
+        return False
+
+    def spill(self, lines):
+        """Append the lines to the spill file."""
+        try:
+            with self._spill_lock, open(self.spill_file, 'a') as f:
+                f.write('\n'.join(lines) + '\n')
+            self.spilled += len(lines)
+        except OSError as e:
+            error('influx writer could not spill %s points to %s\n'%(len(lines), self.spill_file)+str(e))
+
+    def replay(self):
+        """Send the points from the spill file in batches. Points that
+        can't be sent go back in the file. Return True if all were sent."""
+        try:
+            with self._spill_lock:
+                with open(self.spill_file) as f:
+                    lines = [l for l in f.read().split('\n') if l]
+                os.remove(self.spill_file)
+        except OSError: return True # nothing to send
+        for i in range(0, len(lines), self.batch_size):
+            if not self.send(lines[i:i+self.batch_size]):
+                self.spilled -= len(lines) - i
+                self.spill(lines[i:]) # keep the rest for later
+                return False
+        info('Sent %s points from influx spill file %s'%(len(lines), self.spill_file))
+        return True
+
+    def flush(self):
+        """Send all of the waiting points in batches. If the database can't
+        be reached, spill them to file and wait before trying again."""
+        if time.time() < self._down_until:
+            return
+        if os.path.exists(self.spill_file) and not self.replay():
+            self._down_until = time.time() + self.interval * 10
+        while self._points:
+            with self._lock:
+                batch = [self._points.popleft() for i in range(min(self.batch_size, len(self._points)))]
+                self._t0 = time.time()
+            if time.time() < self._down_until or not self.send(batch):
+                self.spill(batch)
+                self._down_until = time.time() + self.interval * 10
+
+    def run(self):
+        """Send batches when they're full or have waited long enough."""
+        while not self.stop:
+            self._wake.wait(self.interval / 4)
+            self._wake.clear()
+            if self._points and (len(self._points) >= self.batch_size or
+                    time.time() - self._t0 >= self.interval):
+                self.flush()
+        self._down_until = 0
+        self.flush() # try to send what's left before stopping
+
+    def finish(self):
+        """Send the waiting points and then stop the thread, without waiting
+        for it. The thread starts again when another point is added."""
+        self.stop = True
+        self._wake.set()
+
+    def close(self):
+        """Stop the thread after sending the waiting points."""
+        self.stop = True
+        self._wake.set()
+        self.wait()
+        self.stop = False
+
+if __name__ == "__main__":
+    # test against a stand-in server that can be switched off
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from client import simple_msg
+    received = []
+    class standIn(BaseHTTPRequestHandler):
+        down = False
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            if standIn.down:
+                self.send_response(503)
+            else:
+                time.sleep(0.002) # a slow database
+                received.extend(body.decode('utf-8').split('\n'))
+                self.send_response(204)
+            self.end_headers()
+        def log_message(self, *args): pass
+    server = HTTPServer(('localhost', 0), standIn)
+    port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    points = [line_protocol('Experiment', {'SOURCE':'DAQmonitor', 'name':'"Slice0"'},
+        {'mean_V':float(i), 'stdv_V':0.1}) for i in range(4000)]
+    # the old way: one synchronous POST per point
+    t0 = time.perf_counter()
+    for p in points[:200]:
+        msg = "POST /write?db=arduino HTTP/1.1\nHost: localhost\nConnection: close\n"
+        msg += "Content-Length: %s\n\n"%len(p) + p
+        simple_msg('localhost', port, msg, encoding='utf-8', recv_buff_size=1024)
+    t_sync = (time.perf_counter() - t0) / 200
+    received.clear()
+    spill = os.path.join(tempfile.gettempdir(), 'influx_test_spill.txt')
+    if os.path.exists(spill): os.remove(spill)
+    writer = influxWriter('localhost', port, batch_size=500, interval=0.2, max_points=1500,
+        retries=1, spill_file=spill)
+    t0 = time.perf_counter()
+    for p in points[:2000]:
+        writer.add(p)
+    t_add = (time.perf_counter() - t0) / 2000
+    time.sleep(0.5)
+    print('per point: synchronous POST %.3g ms, queueing %.3g ms'%(t_sync*1e3, t_add*1e3))
+    print('sent while up:', len(received), writer.stats())
+    standIn.down = True # the database goes down
+    for p in points[2000:]:
+        writer.add(p)
+    time.sleep(1)
+    print('while down:', writer.stats())
+    standIn.down = False
+    writer._down_until = 0 # don't wait for the back-off in the test
+    points.append(line_protocol('Experiment', {'SOURCE':'DAQmonitor'}, {'mean_V':-1.0}))
+    writer.add(points[-1])
+    writer.close()
+    print('after recovery:', writer.stats())
+    print('all points received once:', sorted(l for l in received if l) == sorted(points),
+        'spill file removed:', not os.path.exists(spill))
+    server.shutdown()
@@ -13,12 +13,17 @@ Stefan Spence 21/10/19
 import socket
 import struct
 import time
+import logging
+from collections import deque
 from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot, QCoreApplication
 from PyQt5.QtWidgets import QApplication 
 import sys
 if '..' not in sys.path: sys.path.append('..')
 from strtypes import error, warning, info
 from mythread import enco
+from shottrace import TRACE
+from metrics import METRICS
+logger = logging.getLogger(__name__)
 
 TCPENUM = { # enum for DExTer's producer-consumer loop cases
 'Initialise': 0,
@@ -83,9 +88,10 @@ class PyServer(QThread):
         self.__mq = []
         self.__lock  = False # message queue is locked
         self.paused = False # message queue does not start paused
-        self.ts = {label:[time.time()] for label in ['start', 'connect', 'waiting', 
-            'sent', 'received', 'disconnect']}
+        self.ts = {label:deque([time.time()], maxlen=1000) for label in ['start', 'connect', 'waiting', 
+            'sent', 'received', 'disconnect']} # only keep recent times, see shottrace for per-shot timing
         self.app = QApplication.instance() # the main application that's running
+        self.n_sent = METRICS.counter('%s messages sent'%name)
         if verbosity:
             self.warn = warning
         else:
@@ -141,12 +147,15 @@ class PyServer(QThread):
         self.__mq.append([struct.pack("!L", int(enum)), # enum 
                             struct.pack("!L", len(bytes(text, encoding))), # msg length 
                             bytes(text, encoding)]) # message
-        print('added message len',len(bytes(text, encoding)))
-        print('message read',text)
+        logger.debug('%s server added message of length %s: %s', self._name, len(text), text)
 
     def get_queue(self):
         """Return a list of the queued messages."""
         return [(str(int.from_bytes(enum, 'big')), str(text, enco)) for enum, tlen, text in self.__mq]
+
+    def queue_length(self):
+        """Return the number of queued messages without decoding them."""
+        return len(self.__mq)
                         
     def clear_queue(self):
         """Remove all of the messages from the queue."""
@@ -196,6 +205,9 @@ class PyServer(QThread):
                                 conn.sendall(enum) # send enum
                                 conn.sendall(mes_len) # send text length
                                 conn.sendall(message) # send text
+                                if message.startswith(b'rearrange='): # the enum is the file ID
+                                    TRACE.stamp('rearr upload', int.from_bytes(enum, 'big'))
+                                self.n_sent.inc()
                             except (ConnectionResetError, ConnectionAbortedError) as e:
                                 self.__mq.insert(0, [enum, mes_len, message]) # check this doesn't infinitely add the message back
                                 error('Python server %s: client terminated connection before message was sent.'%self._name +
@@ -16,7 +16,11 @@ from client import PyClient
 import sys
 if '..' not in sys.path: sys.path.append('..')
 from strtypes import error, warning, info
+from shottrace import TRACE
+from metrics import METRICS
+from framepool import FRAMES
 from imageanalysis.imagerGUI import ImagerGUI
+logger = logging.getLogger(__name__)
 
 class runnum(QThread):
     """Take ownership of the run number that is
@@ -78,6 +82,8 @@ class runnum(QThread):
         reset_slot(self.server.dxnum,self.set_n,True) # signal gives run number (this is deactivated during a MR)
 
         self.iGUI.maia.signal_finished_saving.connect(self.server.unpause) # lets MAIA unlock multirun after it has finished saving
+        self.mr_step = None # (params, results path, row) of the multirun histogram being saved
+        self.iGUI.maia.signal_finished_saving.connect(self.multirun_step_saved)
         self.server.start()
         if self.server.isRunning():
             self.server.add_message(TCPENUM['TCP read'], 'Sync DExTer run number\n'+'0'*2000)
@@ -133,6 +139,12 @@ class runnum(QThread):
         self.server_list = [self.server, self.trigger, self.monitor, self.awgtcp1, self.ddstcp1, 
                 self.slmtcp, self.seqtcp, self.awgtcp2, self.awgtcp3, self.ddstcp2, self.mwgtcp_wftk, self.ddstcp3,
                 self.mwgtcp_anritsu]
+        # queue depths are only read when the metrics are displayed
+        self.n_received = METRICS.counter('images received')
+        METRICS.gauge('saver queue', fn=lambda: len(self.sv.queue))
+        METRICS.gauge('multirun queue', fn=lambda: len(self.seq.mr.mr_queue))
+        for s in self.server_list:
+            METRICS.gauge('%s TCP queue'%s._name, fn=s.queue_length)
         
     def reset_server(self, force=False):
         """Check if the server is running. If it is, don't do anything, unless 
@@ -180,19 +192,19 @@ class runnum(QThread):
         that is used to decide which images are sent to the rearrangement
         handler."""
         self.rearr_images = rearr_images
-        logging.debug('Controller: set rearrangement images to {}'.format(rearr_images))
+        logger.debug('Controller: set rearrangement images to %s', rearr_images)
 
     @pyqtSlot(int)
     def update_emccd_bias(self,emccd_bias):
         """Sets the EMCCD bias from MAIA that should be subtracted from all 
         recieved images."""
         self.emccd_bias = emccd_bias
-        logging.debug('Controller recieved new EMCCD bias of {} from MAIA'.format(self.emccd_bias))
+        logger.debug('Controller recieved new EMCCD bias of %s from MAIA', self.emccd_bias)
 
     def receive(self, im=0):
         """Update the Dexter file number in all associated modules,
         then send the image array to be saved and analysed."""
-        logging.debug('Controller recieved image outside of a multirun')
+        logger.debug('Controller recieved image outside of a multirun')
         im, imn = self.process_image_pre_iGUI(im)
         self.iGUI.recieve_image(im,self._n,imn) # the images File ID and image num are specified here when added to the MAIA queue.
         self._k += 1 # another image was taken
@@ -210,7 +222,7 @@ class runnum(QThread):
         """Receive an image as part of a multirun.
         Update the Dexter file number in all associated modules,
         then send the image array to be saved and analysed."""
-        logging.debug('Controller recieved image as part of a multirun')
+        logger.debug('Controller recieved image as part of a multirun')
         im, imn = self.process_image_pre_iGUI(im)
         if self.seq.mr.ind % (self.seq.mr.mr_param['# omitted'] + self.seq.mr.mr_param['# in hist']) >= self.seq.mr.mr_param['# omitted']:
             self.iGUI.recieve_image(im,self._n,imn) # the images File ID and image num are specified here when added to the MAIA queue. Pass imn to compensate for rearrangement.
@@ -222,23 +234,28 @@ class runnum(QThread):
         """Helper function that processes the images before sending to the
         iGUI. This combines two functions that were previously redefined
         for image processing inside/outside a multirun."""
-        im = im - self.emccd_bias # don't edit in place because this seemed to cause an issue with images not showing in GUI. Maybe not thread safe?
-        self.sv.dfn = str(self._n) # Dexter file number     
         imn = self._k % self._m # ID number of image in sequence
-        logging.debug('Image ID numbers are: k = {}, n = {}, m  = {}, imn {}:'.format(
-                self._k,self._n,self._m,imn))
+        TRACE.tag('acquire', self._n, imn)
+        TRACE.stamp('controller', self._n, imn)
+        self.n_received.inc()
+        im = FRAMES.correct(im, self.emccd_bias) # in place if the camera read into a pooled frame. The saver, MAIA and ALEX share the read-only result
+        self.sv.dfn = str(self._n) # Dexter file number     
+        logger.debug('Image ID numbers are: k = %s, n = %s, m  = %s, imn %s:',
+                self._k,self._n,self._m,imn)
         if imn in self.rearr_images: # if this image is a rearrangement image then send it to ALEX asap
-            logging.debug('This is a rearrangement image so sending to ALEX.')
+            logger.debug('This is a rearrangement image so sending to ALEX.')
             ih_num = self.rearr_images.index(imn)
-            logging.debug('ALEX image handler ID is {}'.format(ih_num))
+            logger.debug('ALEX image handler ID is %s', ih_num)
             self.check.recieve_image(im,ih_num,self._n)
+            TRACE.stamp('alex', self._n, imn)
         self.sv.imn = str(imn)
-        logging.debug('Passing image to image saver.')
+        logger.debug('Passing image to image saver.')
         self.im_save.emit([im,self._n,imn])
         return im, imn
 
     def check_receive(self, im=0):
         """Receive image for atom checker, don't save but just pass on"""
+        TRACE.discard('acquire') # the image isn't traced
         self.check.event_im.emit(im)
 
     def reset_dates(self, t0):
@@ -256,6 +273,7 @@ class runnum(QThread):
         the AWG consoles."""
         for awgtcp, msg in zip([self.awgtcp1,self.awgtcp2, self.awgtcp3],messages):
             awgtcp.priority_messages([(self._n, 'rearrange='+msg+'#'*2000)])
+        TRACE.stamp('rearr queued', self._n, self._k % self._m) # called by ALEX before the image is counted
         
     def atomcheck_go(self, toggle=True):
         """Disconnect camera images from analysis, start the camera
@@ -267,6 +285,7 @@ class runnum(QThread):
             reset_slot(self.cam.AcquireEnd, self.receive, False)
             reset_slot(self.cam.AcquireEnd, self.mr_receive, False)
             reset_slot(self.cam.AcquireEnd, self.check_receive, True)
+            TRACE.clear_marks() # for images taken before the switch
             # still in external exposure trigger - DExTer will send the trigger pulses
             self.cam.start() # run till abort keeps taking images
             if self.check.timer.t0 > 0: # if timeout is set, set a timer
@@ -362,11 +381,14 @@ class runnum(QThread):
         else: msg += ']'
         return msg
     
-    def multirun_go(self, toggle, stillrunning=False):
+    def multirun_go(self, toggle, stillrunning=False, final_status=None):
         """Initiate the multi-run: omit N files, save a histogram of M files, and
         repeat for the user variables in the list. A new sequence is generated for 
         each multirun run. These are sent via TCP and then run. Once the multirun
-        has started it"""
+        has started it
+        final_status -- status to record in the registry when the multirun is
+            stopped: by default 'paused' or 'cancelled', or '' to leave it to
+            the caller, e.g. multirun_end sets 'saved'."""
         r = self.seq.mr.ind % (self.seq.mr.mr_param['# omitted'] + self.seq.mr.mr_param['# in hist']) # ID of run in repetition cycle
         if toggle: # and self.sw.check_reset() < now will auto reset (so you can queue up multiruns)
             try: # take the multirun parameters from the queue (they're added to the queue in master.py)
@@ -375,10 +397,12 @@ class runnum(QThread):
                 error('runid.py could not start multirun because no multirun was queued.\n'+str(e))
                 return 0
             
+            self.seq.mr.registry.set_status(self.seq.mr.mr_param, self.sv.results_path, 'running')
             self.iGUI.add_request_to_queue('clear') # clear the MAIA data before another MR begins. The clear command will be added to the queue so no images are skipped.
             results_path = os.path.join(self.sv.results_path, self.seq.mr.mr_param['measure_prefix'])
             reset_slot(self.cam.AcquireEnd, self.receive, False) # only receive if not in '# omit'
             reset_slot(self.cam.AcquireEnd, self.mr_receive, True)
+            TRACE.clear_marks() # for images taken before the switch
             self.seq.mr.ind = 0 # counter for how far through the multirun we are
             self._k = 0 # reset image per run count
             try:
@@ -487,6 +511,10 @@ class runnum(QThread):
                 self._k = 0
                 # for mw in self.sw.mw + self.sw.rw:
                 #     mw.multirun = ''
+            if final_status is None:
+                final_status = 'paused' if stillrunning else 'cancelled'
+            if final_status:
+                self.seq.mr.registry.set_status(self.seq.mr.mr_param, self.sv.results_path, final_status)
             status = ' paused.' if stillrunning else ' ended.'
             self.mr_paused = stillrunning
             text = 'STOPPED. Multirun measure %s: %s is'%(self.seq.mr.mr_param['measure'], self.seq.mr.mr_param['Variable label'])
@@ -580,19 +608,27 @@ class runnum(QThread):
             error('Multirun step could not extract user variable from table at row %s.\n'%v+str(e))
             prv = ''
 
+        self.mr_step = (self.seq.mr.mr_param, self.sv.results_path, v) # can resume after this step once it's saved
         # save data
         self.seq.mr.progress.emit('Waiting for MAIA to finish processing queue...')
         self.server.pause() # server is paused to allow MAIA to go through the queue and finish analysing all the images before continuing
         self.iGUI.save(self.hist_id) # server will be unpaused at the end of a successful save (see self.iGUI.maia.save())
         self.iGUI.update_all_stefans() # update all the open STEFANs at the end of a multirun before the data is cleared. This command sends requests to MAIA that will be handled before it clears data.
         
+    def multirun_step_saved(self):
+        """When MAIA has saved the histograms for a multirun step, record it
+        in the registry so that an interrupted multirun resumes after it."""
+        if self.mr_step:
+            self.seq.mr.registry.step_done(*self.mr_step)
+            self.mr_step = None
+        
     def multirun_end(self, msg):
         """At the end of the multirun, save the plot data and reset"""
         self.monitor.add_message(self._n, 'DAQtrace.csv=trace_file')
         self.monitor.add_message(self._n, 'save trace') # get the monitor to save the last acquired trace
         self.monitor.add_message(self._n, 'save graph') # get the monitor to save the graph  
         self.monitor.add_message(self._n, 'stop') # stop monitoring
-        self.multirun_go(False) # reconnect signals
+        self.multirun_go(False, final_status='') # reconnect signals, the status is 'saved' below
         self.seq.mr.ind = 0
         # save over log file with the parameters used for this multirun (now including run numbers):
         self.seq.mr.save_mr_params(os.path.join(self.sv.results_path, os.path.join(self.seq.mr.mr_param['measure_prefix'],
@@ -600,5 +636,6 @@ class runnum(QThread):
         self.seq.mr.progress.emit(       # update progress label
             'Finished measure %s: %s.'%(self.seq.mr.mr_param['measure'], self.seq.mr.mr_param['Variable label']))
         self.seq.mr.multirun = False
+        self.seq.mr.registry.set_status(self.seq.mr.mr_param, self.sv.results_path, 'saved')
         for server in self.server_list[2:]:
                 server.clear_queue() # otherwise messages to save params build up
\ No newline at end of file
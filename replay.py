@@ -0,0 +1,430 @@
+"""PyDex - replay benchmark
+
+ - Replay recorded or synthetic images and DExTer run numbers through
+   the controller (runnum), image saver, MAIA, ALEX, and a simulated AWG
+ - The images are emitted at a fixed shot rate from a thread in place of
+   the Andor camera, and the run number is emitted before each shot in
+   place of DExTer's TCP reply
+ - Record when each image reaches each stage and report the latency
+   percentiles and the highest shot rate that PyDex keeps up with
+ - Results are appended to a JSON lines file with the git commit so
+   that runs can be compared across commits
+ - The network servers use the 'mbcs' encoding so this runs on Windows
+
+Run from the PyDex directory, e.g. to replay saved images at 2 and 5 Hz:
+    python replay.py --images path/to/images --rates 2 5
+then compare the last two runs:
+    python replay.py --compare
+"""
+import os
+import re
+import sys
+import time
+import json
+import glob
+import shutil
+import tempfile
+import platform
+import subprocess
+import numpy as np
+from PyQt5.QtCore import QThread, pyqtSignal, Qt
+from PyQt5.QtWidgets import QApplication
+os.chdir(os.path.dirname(os.path.realpath(__file__)))
+for path in ['./imageanalysis', './saveimages', './networking', './sequences']:
+    if path not in sys.path: sys.path.append(path)
+from strtypes import error, warning, info
+from shottrace import TRACE
+from metrics import METRICS
+from saveimages.imwriter import load_image, EXT
+
+STAGES = ['controller', 'saved', 'maia', 'alex', 'awg'] # in the order an image passes through them
+
+def load_images(source, limit=None):
+    """Load recorded images to replay.
+    source -- a .npy file with an array of shape (# images, x, y), or a
+        directory of images saved by the image saver. These are
+        sorted by file ID and then image number.
+    limit  -- maximum number of images to load.
+    Return the array of images and the number of images per shot."""
+    if source.endswith('.npy'):
+        images = np.load(source)[:limit]
+        return images, 1
+    files = []
+    for fname in glob.glob(os.path.join(source, '*.asc')) + glob.glob(os.path.join(source, '*'+EXT)):
+        try: # [label]_[date]_[file ID]_[image number](_[nfn]).pdi
+            file_id, imn = map(int, os.path.basename(fname)[:-4].split('_')[2:4])
+            files.append((file_id, imn, fname))
+        except ValueError: pass # not saved by the image saver
+    if not files:
+        raise FileNotFoundError('No images found in ' + source)
+    files = sorted(files)[:limit]
+    images = np.array([load_image(fname) for file_id, imn, fname in files])
+    return images, max(imn for file_id, imn, fname in files) + 1
+
+def synthetic_images(n, shape=(100,100), roi_coords=[], fill=0.5,
+        background=100, signal=1000, seed=0):
+    """Make n images with Poisson background counts and a chance of an
+    atom's signal in each ROI.
+    roi_coords -- list of [x, y, w, h] for the ROIs
+    fill       -- probability of an atom in each ROI."""
+    rng = np.random.default_rng(seed)
+    images = rng.poisson(background, (n,)+tuple(shape)).astype(float)
+    for x, y, w, h in roi_coords:
+        atoms = rng.random(n) < fill
+        images[atoms, x:x+w, y:y+h] += signal / max(w*h, 1)
+    return images
+
+def percentiles(latencies):
+    """Summarise a list of latencies in seconds as a dict in ms."""
+    x = np.array(latencies) * 1e3
+    if not len(x):
+        return {'count': 0}
+    p50, p90, p99 = np.percentile(x, [50, 90, 99])
+    return {'count': len(x), 'p50': p50, 'p90': p90, 'p99': p99, 'max': x.max()}
+
+def git_commit():
+    """The short hash of the current git commit, with '+' if there are
+    uncommitted changes."""
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL, text=True).strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '-uno'],
+            stderr=subprocess.DEVNULL, text=True).strip()
+        return commit + ('+' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+####    ####    ####    ####
+
+class replaySource(QThread):
+    """Emit images at a fixed shot rate in place of the camera, and the
+    run number before each shot in place of DExTer.
+    images -- array of images, replayed in order and repeated if needed
+    m      -- number of images per shot
+    gap    -- time between the images in a shot in seconds"""
+    AcquireEnd = pyqtSignal(np.ndarray) # same signal as the camera
+    dxnum = pyqtSignal(str) # same signal as the DExTer server
+
+    def __init__(self, images, m=2, gap=0.01):
+        super().__init__()
+        self.images = images
+        self.m = m
+        self.gap = gap
+        self.rate = 1    # shots per second
+        self.shots = 0   # number of shots to replay
+        self.n0 = 0      # run number of the first shot
+        self.times = {}  # (run number, image number): time the image was emitted
+        self.last = 0    # time that the last image was emitted
+
+    def replay(self, rate, shots, n0):
+        """Start replaying shots at the given rate from run number n0."""
+        self.rate, self.shots, self.n0 = rate, shots, n0
+        self.times = {}
+        self.start()
+
+    def run(self):
+        t0 = time.perf_counter()
+        for i in range(self.shots):
+            wait = t0 + i / self.rate - time.perf_counter()
+            if wait > 0: time.sleep(wait)
+            self.dxnum.emit(str(self.n0 + i))
+            for imn in range(self.m):
+                if imn: time.sleep(self.gap)
+                self.times[(self.n0 + i, imn)] = time.perf_counter()
+                TRACE.mark('acquire')
+                self.AcquireEnd.emit(self.images[(i*self.m + imn) % len(self.images)])
+        self.last = time.perf_counter()
+
+class stageRecorder:
+    """Record when each image reaches each stage of PyDex by connecting
+    directly to the signals emitted at the end of the stages, so that the
+    time is taken in the thread that emitted the signal.
+    rn  -- the runnum controller
+    awg -- PyClient simulating the AWG, or None"""
+    def __init__(self, rn, awg=None):
+        self.rn = rn
+        self.reset()
+        rn.im_save.connect(self.controller, Qt.DirectConnection)
+        rn.sv.event_path.connect(self.saved, Qt.DirectConnection)
+        rn.iGUI.maia.signal_status_message.connect(self.maia, Qt.DirectConnection)
+        rn.check.signal_rearr_strings.connect(self.alex, Qt.DirectConnection)
+        if awg is not None:
+            awg.textin.connect(self.awg, Qt.DirectConnection)
+
+    def reset(self):
+        self.times = {stage: {} for stage in STAGES} # stage: {(run number, image number): time}
+        self.alex_keys = [] # order of the images sent to ALEX, to match with the AWG messages
+        self.awg_count = 0
+
+    def controller(self, im_data):
+        self.times['controller'][(im_data[1], im_data[2])] = time.perf_counter()
+
+    def saved(self, file_name):
+        try: # [label]_[date]_[file ID]_[image number](_[nfn]).pdi
+            file_id, imn = map(int, os.path.basename(file_name)[:-4].split('_')[2:4])
+            self.times['saved'][(file_id, imn)] = time.perf_counter()
+        except ValueError: pass
+
+    def maia(self, msg):
+        match = re.match(r'Finished processing ID (\d+) Im (\d+)', msg)
+        if match:
+            self.times['maia'][tuple(map(int, match.groups()))] = time.perf_counter()
+
+    def alex(self, rearr_strings):
+        key = (self.rn._n, self.rn._k % self.rn._m) # emitted before the controller counts the image
+        self.times['alex'][key] = time.perf_counter()
+        self.alex_keys.append(key)
+
+    def awg(self, msg):
+        if 'rearrange=' in msg and self.awg_count < len(self.alex_keys):
+            self.times['awg'][self.alex_keys[self.awg_count]] = time.perf_counter()
+            self.awg_count += 1
+
+class replayBenchmark:
+    """Build the controller, saver, MAIA, ALEX and a simulated AWG, then
+    replay shots through them at a range of rates.
+    images       -- array of images to replay, or None for synthetic images
+    m            -- number of images per shot
+    rearr_images -- the image numbers that are sent to ALEX
+    awg_pause    -- time the simulated AWG takes to reply in seconds"""
+    def __init__(self, images=None, m=2, rearr_images=[0], awg_pause=0, gap=0.01):
+        from networking.runid import runnum
+        from networking.client import PyClient
+        from saveimages.imsaver import event_handler
+        from imageanalysis.alex import alex
+        from sequences.sequencePreviewer import Previewer
+        self.app = QApplication.instance() or QApplication(sys.argv)
+        self.dir = tempfile.mkdtemp(prefix='pydex_replay_')
+        dirs = {'Image Storage Path: ': self.dir, 'Dexter Sync File: ': '',
+                'Results Path: ': self.dir, 'Sequences path: ': self.dir}
+        self.config = {'m': m, 'rearr_images': rearr_images, 'awg_pause': awg_pause,
+            'gap': gap, 'images': 'synthetic' if images is None else len(images)}
+        self.source = replaySource(None, m, gap)
+        self.rn = runnum(self.source, event_handler(dirs), alex(), Previewer(),
+            n=0, m=m, k=0, dev_mode=True)
+        self.source.dxnum.connect(self.rn.server.dxnum)
+        self.rn.update_emccd_bias(0)
+        self.rn.iGUI.update_num_images(m)
+        self.rn.iGUI.update_rearr_images(str(rearr_images))
+        self.rn.check.box_num_images.setText(str(max(len(rearr_images), 1)))
+        self.rn.check.set_num_images()
+        self.rn.iGUI.set_results_path(self.dir)
+        self.awg = PyClient(port=8623, name='AWG1 sim', pause=awg_pause)
+        self.awg.start()
+        self.recorder = stageRecorder(self.rn, self.awg)
+        if images is None:
+            self.process_events(0.5) # wait for the MAIA to send its ROIs
+            coords = [roi for group in self.rn.iGUI.maia.get_roi_coords() for roi in group]
+            images = synthetic_images(max(m, 1)*50, roi_coords=coords)
+        self.source.images = images
+        self.n = 1 # run number of the next shot
+
+    def process_events(self, duration):
+        """Keep the GUI event loop running for duration seconds."""
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            self.app.processEvents()
+            time.sleep(0.001)
+
+    def expected(self, stage, shots):
+        """The (run number, image number) of the images that should reach a stage."""
+        images = range(self.source.m) if stage in ['controller', 'saved', 'maia'] else [
+            i for i in self.rn.rearr_images if i < self.source.m]
+        if stage == 'awg' and not any(ih.roi_groups for ih in self.rn.check.ihs):
+            return []
+        return [(n, i) for n in range(self.n, self.n + shots) for i in images]
+
+    def trial(self, rate, shots=100, timeout=30):
+        """Replay shots at the given rate (shots per second) and wait for
+        all of the images to pass through every stage, or for timeout
+        seconds after the last image. Return a dict of the results."""
+        self.rn.iGUI.clear_data_and_queue()
+        self.process_events(0.2)
+        self.recorder.reset()
+        self.source.replay(rate, shots, self.n)
+        while self.source.isRunning():
+            self.process_events(0.01)
+        expected = {stage: self.expected(stage, shots) for stage in STAGES}
+        end = time.perf_counter() + timeout
+        while time.perf_counter() < end and any(
+                len(self.recorder.times[stage]) < len(keys) for stage, keys in expected.items()):
+            self.process_events(0.01)
+        acquired = self.source.times
+        result = {'rate': rate, 'shots': shots, 'stages': {}}
+        done = [] # time each image finished every stage
+        for stage in STAGES:
+            t = self.recorder.times[stage]
+            result['stages'][stage] = percentiles([t[k] - acquired[k] for k in expected[stage] if k in t])
+            result['stages'][stage]['missed'] = len([k for k in expected[stage] if k not in t])
+        for key in acquired:
+            done.append(max([self.recorder.times[stage].get(key, np.inf)
+                for stage in STAGES if key in expected[stage]] + [acquired[key]]))
+        first = min(acquired.values())
+        complete = np.isfinite(done).all()
+        result['throughput'] = shots / (max(done) - first) if complete else 0
+        # a backlog builds up if the latency at the end is much longer than at the start
+        latency = np.array(done) - np.array(list(acquired.values()))
+        start = np.median(latency[:max(len(latency)//4, 1)]) if complete else np.inf
+        result['backlog'] = max(done) - self.source.last if complete else np.inf
+        result['sustained'] = bool(complete and result['backlog'] <= max(2*start, start + 2/rate))
+        self.n += shots
+        return result
+
+    def run(self, rates=[1, 2, 5, 10], shots=100):
+        """Replay shots at each rate and return a dict with the results of
+        each trial and the highest rate that was sustained."""
+        results = {'commit': git_commit(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'platform': platform.platform(), 'python': platform.python_version(),
+            'config': self.config, 'trials': []}
+        for rate in rates:
+            result = self.trial(rate, shots)
+            results['trials'].append(result)
+            info('Replayed %s shots at %s Hz: '%(shots, rate) + ('sustained' if result['sustained']
+                else 'not sustained, backlog %.3g s'%result['backlog']))
+        sustained = [t['rate'] for t in results['trials'] if t['sustained']]
+        results['sustainable_rate'] = max(sustained) if sustained else 0
+        return results
+
+    def close(self):
+        """Stop the threads and remove the saved images."""
+        self.awg.close()
+        self.rn.sv.close()
+        for server in self.rn.server_list:
+            server.close()
+        self.rn.iGUI.cleanup()
+        self.process_events(0.5)
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def resume_check(self, steps=3, done=1, timeout=60):
+        """Check that an interrupted multirun resumes and runs to the end.
+        A multirun of steps histograms is recorded as running with done
+        steps saved, then the registry is reopened as after a crash and the
+        run is resumed. DExTer is simulated by a client that echoes the
+        messages back, which are handled as in master.py, and the queue is
+        started when a multirun is queued, as in Master.mr_status_changed.
+        Return True if the remaining steps were run, saved, and recorded."""
+        from PyQt5.QtCore import QTimer
+        from networking.client import PyClient
+        from networking.networker import TCPENUM
+        from sequences.multirunRegistry import multirunRegistry, multirunQueue
+        from sequences.translator import translate
+        mr, rn = self.rn.seq.mr, self.rn
+        tr = translate(os.path.join('sequences', 'SequenceFiles', 'testing', 'MOT load.xml'))
+        db = os.path.join(self.dir, 'multirun_registry.db')
+        params = dict(mr.ui_param, measure=0, measure_prefix='Measure0', **{
+            '1st hist ID':0, '# omitted':0, '# in hist':1, 'Variable label':'resume check'})
+        vals = [[str(i)] + ['']*(len(params['Type'])-1) for i in range(steps)]
+        registry = multirunRegistry(db)
+        registry.add_run(params, steps, rn.sv.results_path, status='running', tr=tr, vals=vals)
+        for v in range(done):
+            registry.step_done(params, rn.sv.results_path, v)
+        registry.close() # PyDex stops during the multirun
+        mr.registry = multirunRegistry(db)
+        mr.mr_queue = mr.queue_ui.mr_queue = multirunQueue(mr.registry)
+        def check_queue():
+            if len(mr.mr_queue) and not mr.multirun:
+                mr.multirun = True
+                rn.server.add_message(TCPENUM['TCP read'], 'start measure 0\n'+'0'*2000)
+        def respond(msg):
+            if 'start measure' in msg: rn.multirun_go(msg)
+            elif 'multirun run' in msg: rn.multirun_step(msg)
+            elif 'save and reset histogram' in msg: rn.multirun_save(msg)
+            elif 'end multirun' in msg: rn.multirun_end(msg)
+        mr.registry.status_changed.connect(lambda prefix, status: 
+            status in ['saved', 'cancelled', 'queued'] and QTimer.singleShot(0, check_queue))
+        rn.server.textin.connect(respond)
+        dexter = PyClient(port=8620, name='DExTer sim')
+        dexter.start()
+        try:
+            mr.resume_interrupted()
+            end = time.perf_counter() + timeout
+            while time.perf_counter() < end and mr.registry.history(1)[0]['status'] != 'saved':
+                self.process_events(0.01)
+            run = mr.registry.query("SELECT * FROM runs ORDER BY id DESC LIMIT 1")[0]
+            info('Resumed multirun from histogram %s: status %s, %s of %s remaining steps saved.'%(
+                run['first_id'], run['status'], run['steps_done'], steps - done))
+            return run['status'] == 'saved' and run['first_id'] == done and run['steps_done'] == steps - done
+        finally:
+            rn.server.textin.disconnect(respond)
+            dexter.close()
+            mr.registry.close()
+
+####    ####    ####    ####
+
+def report(results):
+    """Return a table of the latency percentiles of each stage."""
+    out = 'commit %s, %s\n'%(results['commit'], results['date'])
+    for trial in results['trials']:
+        out += '%s Hz: %s, throughput %.3g shots/s\n'%(trial['rate'],
+            'sustained' if trial['sustained'] else 'not sustained', trial['throughput'])
+        for stage, p in trial['stages'].items():
+            if p['count']:
+                out += '    %-10s p50 %8.2f ms  p90 %8.2f ms  p99 %8.2f ms  max %8.2f ms  missed %s\n'%(
+                    stage, p['p50'], p['p90'], p['p99'], p['max'], p['missed'])
+    return out + 'sustainable rate: %s Hz\n'%results['sustainable_rate']
+
+def save_results(results, file_name='replay_results.jsonl'):
+    """Append the results to a JSON lines file."""
+    with open(file_name, 'a') as f:
+        f.write(json.dumps(results) + '\n')
+
+def compare_results(file_name='replay_results.jsonl', n=2):
+    """Return a table comparing the p50 and p99 latency of each stage for
+    the last n runs saved in file_name, at the rates they have in common."""
+    with open(file_name) as f:
+        runs = [json.loads(line) for line in f if line.strip()][-n:]
+    rates = set.intersection(*[set(t['rate'] for t in r['trials']) for r in runs])
+    out = 'sustainable rate: ' + ', '.join('%s %s Hz'%(r['commit'], r['sustainable_rate']) for r in runs) + '\n'
+    for rate in sorted(rates):
+        out += '%s Hz p50 / p99 latency (ms):\n'%rate
+        out += '    %-10s'%'' + ''.join('%22s'%r['commit'] for r in runs) + '\n'
+        for stage in STAGES:
+            row = []
+            for r in runs:
+                p = [t for t in r['trials'] if t['rate'] == rate][0]['stages'].get(stage, {})
+                row.append('%10.2f / %9.2f'%(p['p50'], p['p99']) if p.get('count') else '%22s'%'-')
+            out += '    %-10s'%stage + ''.join('%22s'%x for x in row) + '\n'
+    return out
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Replay images through PyDex to benchmark it')
+    parser.add_argument('-i', '--images', default='', help='.npy file or directory of .asc images to replay. Default synthetic')
+    parser.add_argument('-m', default=2, type=int, help='number of images per shot')
+    parser.add_argument('-r', '--rates', default=[1, 2, 5, 10], type=float, nargs='+', help='shot rates to replay in Hz')
+    parser.add_argument('-n', '--shots', default=100, type=int, help='number of shots per rate')
+    parser.add_argument('--rearr', default=[0], type=int, nargs='*', help='image numbers sent to ALEX')
+    parser.add_argument('--awg-pause', default=0, type=float, help='time the simulated AWG takes to reply in seconds')
+    parser.add_argument('-o', '--output', default='replay_results.jsonl', help='file to append the results to')
+    parser.add_argument('-t', '--trace', default='', help='directory to export the shot timing trace to')
+    parser.add_argument('--resume', action='store_true', help='check that an interrupted multirun resumes')
+    parser.add_argument('--compare', default=0, type=int, nargs='?', const=2, help='compare the last N saved runs')
+    args = parser.parse_args()
+    import logging
+    from logerrs import setup_async_log
+    setup_async_log(levels={'PyQt5': logging.WARNING}, console_level=logging.INFO) # as in master.py
+    if args.compare:
+        print(compare_results(args.output, args.compare))
+        sys.exit()
+    images, m = None, args.m
+    if args.images:
+        images, m = load_images(args.images)
+        m = args.m if args.images.endswith('.npy') else m
+    bench = replayBenchmark(images, m, args.rearr, args.awg_pause)
+    if args.resume:
+        try:
+            print('resumed multirun ran to the end:', bench.resume_check())
+        finally:
+            bench.close()
+        sys.exit()
+    try:
+        results = bench.run(args.rates, args.shots)
+    finally:
+        bench.close()
+    print(report(results))
+    print(METRICS.text())
+    if args.trace:
+        print(TRACE.summary())
+        TRACE.export(args.trace)
+    save_results(results, args.output)
+    info('Results saved to ' + args.output)
@@ -2,8 +2,11 @@
 Stefan Spence 12/04/19
 
  - watch the image_read_path directory for new images
- - save the new image with label into a dated subdirectory under image_storage_path
- - delete the original file so that a new file with the same name can be created
+ - wait for the close event that shows a new image has been written (Linux),
+   or else for its size to stop changing
+ - move the new image with label into a dated subdirectory under image_storage_path
+   by linking it there and deleting the original (without copying on the same
+   drive), so that a new file with the same name can be created
  
 Assuming that image files are ASCII
 
@@ -15,6 +18,7 @@ import numpy as np
 import os
 import time
 import shutil
+import threading
 try:
     from PyQt4.QtCore import QThread, pyqtSignal, QEvent
 except ImportError:
@@ -22,6 +26,10 @@ except ImportError:
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
+# inotify reports when a file that was open for writing is closed, so the
+# file is complete. Other observers only report creation and modification.
+CLOSE_EVENTS = Observer.__name__ == 'InotifyObserver'
+
 ####    ####    ####    ####
     
 # set up an event handler that is also a QObject through inheritance of QThread
@@ -29,11 +37,13 @@ class system_event_handler(FileSystemEventHandler, QThread):
     """Define how the watchdog should respond to events.
     
     The event handler responds to file creation events and emits the path
-    to the file as a signal. When a file creation event is noticed, the
-    on_created() function should be triggered, which waits for a file to
-    finishing being written to, produces a synchronised label for it, copies
-    it to a new directory, deletes the old file, and then emits the new file
-    name as a signal.
+    to the file as a signal. A new file is in flight until it has finished
+    being written: on Linux this is when the writer closes it, otherwise
+    the file size is polled until it stops changing. A file that is moved
+    into the directory is already complete. Then it produces a synchronised
+    label for the file, moves it into the image storage directory (copying
+    only if it is on another drive), and then emits the new file name as a
+    signal. Events for the DExTer sync file update the cached file number.
     Keyword arguments:
     image_storage_path    -- the directory to save the new images to
     dexter_sync_file_name -- the absolute path to the file with the DExTer sync number
@@ -44,6 +54,7 @@ class system_event_handler(FileSystemEventHandler, QThread):
     def __init__(self, image_storage_path, dexter_sync_file_name, date):
         super().__init__()
         self.dfn = ""              # dexter file number
+        self.sync_text = ""        # latest contents of the DExTer sync file, updated by events
         self.last_event_path = ""  # last event processed 
         self.image_storage_path = image_storage_path  # directory where we copy images to
         self.dexter_sync_file_name = dexter_sync_file_name # path to file where dexter syncs its file #
@@ -56,6 +67,13 @@ class system_event_handler(FileSystemEventHandler, QThread):
         self.copy_t  = 0           # time taken to watch a file being copied 
         self.nfn     = 0           # number to append to file so as not to overwrite
         self.species = 'Cs-133'    # atomic species to label files with
+        self.in_flight = {}        # path: creation time of files that are still being written
+        self.sync_dir = None       # the sync file's directory if it's also watched, ignore its other files
+        self.lock = threading.Lock() # the observer and check_in_flight() can both finish files
+        self.check_t = 0.5         # seconds between checks for files in flight without a close event
+        self.stop_event = threading.Event() # set to stop checking files in flight
+        if CLOSE_EVENTS: # a file moved in from an unwatched directory has no close event
+            threading.Thread(target=self.poll_in_flight, daemon=True).start()
         
     def wait_for_file(self, file_name, dt=0.01):
         """Make sure that the file has finished being written by waiting until
@@ -66,52 +84,149 @@ class system_event_handler(FileSystemEventHandler, QThread):
             time.sleep(dt) # deliberately add pause so we don't loop too many times
             
     def sync_dexter(self, dt=1e-3):
-        """Get the Dexter file number from the dexter_sync_file_name file
-        Check if the file is empty (usually means it's being written)
-        and wait until it's finished being written to"""
-        new_dfn = '' # sometimes Dexter hasn't finished writing to file, we should wait til it has.
+        """Get the Dexter file number from the dexter_sync_file_name file.
+        Use the contents cached from the last sync file event if there are
+        any, otherwise read the file and if it's empty (usually means it's 
+        being written) wait until it's finished being written to"""
+        new_dfn = self.sync_text # sometimes Dexter hasn't finished writing to file, we should wait til it has.
         while new_dfn == '': # note: this usually takes about 10 ms.
             with open(self.dexter_sync_file_name, 'r') as sync_file:
                 new_dfn = sync_file.read()
-            if new_dfn != '':
-                if self.dfn != str(int(new_dfn)):
-                    self.dfn = str(int(new_dfn))
-                else: # sometimes Dexter hasn't updated the file number yet
-                    self.dfn = str(int(new_dfn)+1)
-                break
-            time.sleep(dt) # deliberately add pause so we don't loop too many times
-    
-    def on_created(self, event):
-        """On a new image being written, save the file with a synced label into the 
-        image storage dir"""
-        t0 = time.time()
-        self.idle_t = t0 - self.end_t   # duration between end of last event and start of current event
-        self.wait_for_file(event.src_path) # wait until file has been written        
-        self.write_t = time.time() - t0
-        # get Dexter file number  
-        self.sync_dexter()
-        # copy file with labeling: [species]_[date]_[Dexter file #] ---- this will overwrite if file already exists
-        new_file_name = os.path.join(self.image_storage_path, self.species)+'_'+self.date+'_'+self.dfn+'.'+event.src_path.split(".")[-1]
-        self.copy_t = time.time()
-        if os.path.isfile(new_file_name): # don't overwrite files
-            new_file_name = os.path.join(self.image_storage_path, self.species)+'_'+self.date+'_'+self.dfn+'_'+str(self.nfn)+'.'+event.src_path.split(".")[-1]
-            self.nfn += 1 # always a unique number
+            if new_dfn == '':
+                time.sleep(dt) # deliberately add pause so we don't loop too many times
+        if self.dfn != str(int(new_dfn)):
+            self.dfn = str(int(new_dfn))
+        else: # sometimes Dexter hasn't updated the file number yet
+            self.dfn = str(int(new_dfn)+1)
+
+    def read_sync_file(self):
+        """Cache the contents of the sync file if it has been written."""
         try:
-            shutil.copyfile(event.src_path, new_file_name)
-        except PermissionError:
-            print("WARNING: added a pause because python tried to access the file before the other program had let go")
-            time.sleep(0.2)
-            shutil.copyfile(event.src_path, new_file_name)
+            with open(self.dexter_sync_file_name, 'r') as sync_file:
+                text = sync_file.read()
+            if text.strip():
+                self.sync_text = text
+        except OSError: pass # DExTer is still writing, so wait for the next event
 
-        self.wait_for_file(new_file_name) # wait until file has been copied
-        self.copy_t = time.time() - self.copy_t
+    def is_sync_file(self, path):
+        """Whether the path is the DExTer sync file."""
+        return os.path.normcase(os.path.abspath(path)) == os.path.normcase(
+            os.path.abspath(self.dexter_sync_file_name))
+
+    def ignore(self, path):
+        """Whether the path is in the sync file's directory but isn't the sync file."""
+        return self.sync_dir is not None and os.path.dirname(os.path.abspath(path)
+            ) == self.sync_dir and not self.is_sync_file(path)
+
+    def on_created(self, event):
+        """A new file is in flight until it has been written. Without close
+        events, wait for the file size to stop changing."""
+        if event.is_directory or self.ignore(event.src_path):
+            return
+        if self.is_sync_file(event.src_path):
+            return self.read_sync_file()
+        self.in_flight[event.src_path] = time.time()
+        if not CLOSE_EVENTS:
+            self.wait_for_file(event.src_path) # wait until file has been written
+            self.finish(event.src_path)
+        else:
+            self.check_in_flight()
+
+    def on_closed(self, event):
+        """The writer closed the file, so it's complete."""
+        if self.is_sync_file(event.src_path):
+            self.read_sync_file()
+        else:
+            self.finish(event.src_path)
+
+    def on_modified(self, event):
+        """The sync file only gives close events on Linux."""
+        if not CLOSE_EVENTS and not event.is_directory and self.is_sync_file(event.src_path):
+            self.read_sync_file()
+
+    def on_moved(self, event):
+        """A file renamed into the directory is already complete."""
+        if event.is_directory or self.ignore(event.dest_path):
+            return
+        if self.is_sync_file(event.dest_path):
+            self.read_sync_file()
+        else:
+            self.in_flight.pop(event.src_path, None)
+            self.in_flight[event.dest_path] = time.time()
+            self.finish(event.dest_path)
+
+    def check_in_flight(self, timeout=1):
+        """Finish files that have been in flight for longer than timeout (s)
+        without a close event, e.g. if they were moved in from another drive."""
+        for path, t in list(self.in_flight.items()):
+            if time.time() - t > timeout:
+                try:
+                    self.wait_for_file(path)
+                    self.finish(path)
+                except FileNotFoundError:
+                    self.in_flight.pop(path, None)
+
+    def poll_in_flight(self):
+        """Check the files in flight every check_t seconds until stop_checks(),
+        so that they're finished even if no other files are created."""
+        while not self.stop_event.wait(self.check_t):
+            try:
+                self.check_in_flight()
+            except OSError as e:
+                print('WARNING: failed to finish a file in flight: %s'%e)
+
+    def stop_checks(self):
+        """Stop checking the files in flight, e.g. when the observer stops."""
+        self.stop_event.set()
+
+    def finish(self, src_path):
+        """If the file is in flight, it has finished being written, so take it.
+        If it has since been renamed, the moved event will finish it instead."""
+        with self.lock:
+            t0 = self.in_flight.pop(src_path, None)
+            if t0 is not None and os.path.isfile(src_path):
+                self.idle_t = t0 - self.end_t   # duration between end of last event and start of current event
+                self.write_t = time.time() - t0
+                try:
+                    self.process(src_path, t0)
+                except FileNotFoundError: pass # renamed or deleted while being processed
+
+    def move_file(self, src_path, new_file_name):
+        """Link the file into the new directory and delete the original, so
+        it is moved without copying if it's on the same drive. A rename would
+        do the same, but inotify holds back all of the events after a file is 
+        renamed out of the directory for 0.5 s to look for the other half.
+        On another drive, copy to a temporary name and then rename it so 
+        that the new file appears complete."""
         try:
-            os.remove(event.src_path)  # delete the old file so that we can see a new created file event
+            os.link(src_path, new_file_name)
+        except OSError: # different drive, or the file system doesn't have links
+            try:
+                shutil.copyfile(src_path, new_file_name + '.part')
+            except PermissionError:
+                print("WARNING: added a pause because python tried to access the file before the other program had let go")
+                time.sleep(0.2)
+                shutil.copyfile(src_path, new_file_name + '.part')
+            os.replace(new_file_name + '.part', new_file_name)
+        try:
+            os.remove(src_path)  # delete the old file so that we can see a new created file event
         except PermissionError:
             print("WARNING: added a pause because python tried to access the file before the other program had let go")
             time.sleep(0.5)
-            os.remove(event.src_path)
+            os.remove(src_path)
 
+    def process(self, src_path, t0):
+        """Save the file with a synced label into the image storage dir"""
+        # get Dexter file number  
+        self.sync_dexter()
+        # move file with labeling: [species]_[date]_[Dexter file #]
+        new_file_name = os.path.join(self.image_storage_path, self.species)+'_'+self.date+'_'+self.dfn+'.'+src_path.split(".")[-1]
+        self.copy_t = time.time()
+        if os.path.isfile(new_file_name): # don't overwrite files
+            new_file_name = os.path.join(self.image_storage_path, self.species)+'_'+self.date+'_'+self.dfn+'_'+str(self.nfn)+'.'+src_path.split(".")[-1]
+            self.nfn += 1 # always a unique number
+        self.move_file(src_path, new_file_name)
+        self.copy_t = time.time() - self.copy_t
         self.last_event_path = new_file_name  # update last event path
         self.event_path.emit(new_file_name)  # emit signal
         self.end_t = time.time()       # time at end of current event
@@ -124,8 +239,8 @@ class silent_event_handler(system_event_handler):
     """Define how the watchdog should respond to events.
     
     The event handler responds to file creation events and emits the path
-    to the file as a signal. This silent event handler does not copy or delete
-    files, merely emit the event path.
+    to the file as a signal once it has been written. This silent event 
+    handler does not copy or delete files, merely emit the event path.
     Keyword arguments:
     image_storage_path    -- the directory to save the new images to
     dexter_sync_file_name -- the absolute path to the file with the DExTer sync number
@@ -137,15 +252,10 @@ class silent_event_handler(system_event_handler):
         # same init as the base system event handler
         system_event_handler.__init__(self, image_storage_path, dexter_sync_file_name, date)   
     
-    def on_created(self, event):
-        """On a new image being written, save the file with a synced label into the 
-        image storage dir"""
-        t0 = time.time()
-        self.idle_t = t0 - self.end_t # duration between end of last event and start of current event
-        self.wait_for_file(event.src_path) # wait until file has been written        
-        self.write_t = time.time() - t0
-        self.last_event_path = event.src_path  # update last event path
-        self.event_path.emit(event.src_path)  # emit signal
+    def process(self, src_path, t0):
+        """Emit the path of the new image once it has been written"""
+        self.last_event_path = src_path  # update last event path
+        self.event_path.emit(src_path)  # emit signal
         self.end_t = time.time()       # time at end of current event
         self.event_t = self.end_t - t0 # duration of event
 
@@ -196,7 +306,25 @@ class dir_watcher(QThread):
             os.makedirs(self.image_storage_path, exist_ok=True) # requies version > 3.2
             # initiate observer, don't recursively search directories within the image_read_path
             self.observer.schedule(self.event_handler, self.image_read_path, recursive=False)
-            self.observer.start()
+            sync_dir = os.path.dirname(os.path.abspath(self.dexter_sync_file_name))
+            if os.path.isdir(sync_dir) and sync_dir != os.path.abspath(self.image_read_path):
+                self.event_handler.sync_dir = sync_dir
+                self.observer.schedule(self.event_handler, sync_dir, recursive=False) # cache the DExTer file number
+            try:
+                self.observer.start()
+            except OSError as e: # e.g. image_read_path doesn't exist
+                self.event_handler.stop_checks() # don't leave the poll_in_flight thread running
+                raise e
+
+    def stop_watching(self):
+        """Stop the observer, then stop the event handler checking files
+        in flight. Call this before the dir_watcher or its event handler
+        is replaced, otherwise the poll_in_flight thread keeps running."""
+        if self.image_storage_path:
+            self.observer.stop()
+            if self.observer.is_alive():
+                self.observer.join()
+            self.event_handler.stop_checks()
     
     @staticmethod # static method can be accessed without making an instance of the class
     def get_dirs(config_file='./config/config.dat'):
@@ -249,3 +377,50 @@ class dir_watcher(QThread):
         with open(config_file, 'w+') as config_file:
             config_file.write(outstr)
   
+
+if __name__ == "__main__":
+    # a synthetic camera writes images slowly while DExTer updates the sync file.
+    # Check each image arrives once and complete, and time from the last write to signal.
+    import tempfile
+    from PyQt5.QtCore import Qt
+    n, chunks = 50, 5
+    for close_events in sorted({CLOSE_EVENTS, False}, reverse=True):
+        CLOSE_EVENTS = close_events
+        with tempfile.TemporaryDirectory() as tmp:
+            read, store, dx = [os.path.join(tmp, d) for d in ['read', 'store', 'dexter']]
+            for d in [read, store, dx]:
+                os.makedirs(d)
+            sync_file = os.path.join(dx, 'currentfile.txt')
+            handler = system_event_handler(store, sync_file, 'date')
+            handler.sync_dir = dx
+            done, closed = [], {}
+            handler.event_path.connect(lambda path: done.append((time.perf_counter(), path)),
+                Qt.DirectConnection) # no event loop here
+            observer = Observer()
+            observer.schedule(handler, read, recursive=False)
+            observer.schedule(handler, dx, recursive=False)
+            observer.start()
+            data = np.arange(512*32).reshape(512, 32)
+            for i in range(n):
+                with open(sync_file, 'w') as f:
+                    f.write(str(i))
+                time.sleep(0.01)
+                with open(os.path.join(read, 'im.asc'), 'w') as f:
+                    for rows in np.array_split(data + i, chunks):
+                        np.savetxt(f, rows, fmt='%d')
+                        f.flush()
+                        time.sleep(0.005) # partly written
+                    closed[i] = time.perf_counter() # the file closes after this
+                while os.path.exists(os.path.join(read, 'im.asc')) and time.perf_counter() - closed[i] < 2:
+                    time.sleep(1e-3) # the camera waits for the file to be taken
+            time.sleep(0.2)
+            observer.stop()
+            observer.join()
+            handler.stop_checks()
+            ok = all(np.array_equal(np.loadtxt(path), data + int(path.split('_')[-1].split('.')[0]))
+                     for t, path in done)
+            ids = sorted(int(path.split('_')[-1].split('.')[0]) for t, path in done)
+            lat = np.array([t - closed[int(path.split('_')[-1].split('.')[0])] for t, path in done])*1e3
+            print('%s: %s/%s images, complete and labelled: %s, last write to signal p50 %.2f ms, max %.2f ms'%(
+                'close events' if close_events else 'polling', len(done), n, ok and ids == list(range(n)),
+                np.median(lat), lat.max()))
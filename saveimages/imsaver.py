@@ -3,20 +3,26 @@ Stefan Spence 09/09/19
 
  - receive an image array through a signal
  - add the received image array to a list to save
- - run a thread saving images from the list into a dated 
-    subdirectory under image_storage_path
+ - run a thread passing images from the list to a pool of writers
+    that compress and save them into a dated subdirectory under 
+    image_storage_path (see imwriter.py)
+ - emit the file names in the order the images were received
  
-Assuming that image files are ASCII.
 This runs as a QThread in parallel to other tasks
 """
 import numpy as np
 import os
 import sys
 import time
+import logging
 from PyQt5.QtCore import pyqtSignal
 if '..' not in sys.path: sys.path.append('..')
 from mythread import PyDexThread
 from strtypes import error, warning, info
+from shottrace import TRACE
+from metrics import METRICS
+from saveimages.imwriter import writerPool, EXT
+logger = logging.getLogger(__name__)
 
 def checkdir(text):
     """Shorthand for extracting a directory from the config file"""
@@ -31,9 +37,10 @@ class event_handler(PyDexThread):
     
     The event handler responds to a signal by appending the array to a
     list. When the thread is running it will pop images from the list
-    and save the image array to a new directory, and then emit a 
-    signal to confirm the saving has finished. The Dexter file number 
-    and image number should be synced externally.
+    and pass the image array to a pool of writers that save it to a new
+    directory. When each image has been saved, in the order they were
+    received, emit a signal to confirm the saving has finished. The 
+    Dexter file number and image number should be synced externally.
     Use a config file to load the directories.
     Wait for events and process them with the event_handler.
     Keyword arguments:
@@ -57,7 +64,10 @@ class event_handler(PyDexThread):
         self.event_t = 0           # time taken to process the last event
         self.end_t   = time.time() # time at end of event
         self.idle_t  = 0           # time between events
-        self.write_t = 0           # time taken to watch a file being written
+        self.write_t = 0           # time taken to pass an image to the writers
+        self.writers = writerPool(workers=4) # compress and save images in parallel
+        self.reserved = set()      # file names that are waiting to be written
+        self.n_saved = METRICS.counter('images saved')
         self.set_dirs(config_dict) # create the required directories
 
     def reset_dates(self,date=time.strftime("%d %b %B %Y", time.localtime()).split(" ")):
@@ -146,33 +156,58 @@ class event_handler(PyDexThread):
             time.sleep(dt) # deliberately add pause so we don't loop too many times
 
     def process(self, im_data, label='Im'):
-        """On a new image signal being emitted, save it to a file with a 
-        synced label into the image storage dir. File name format:
-        [label]_[date]_[Dexter file #].asc
+        """On a new image signal being emitted, pass it to the writers to 
+        save to a file with a synced label into the image storage dir. 
+        File name format: [label]_[date]_[Dexter file #]_[image #].pdi
         """
         [im_array, file_id, im_num] = im_data
-        print('ImSaver saving file_id, im_num:',file_id,im_num)
+        logger.debug('ImSaver saving file_id, im_num: %s %s',file_id,im_num)
         self.t0 = time.time()
         self.idle_t = self.t0 - self.end_t   # duration between end of last event and start of current event
         # copy file with labeling: [label]_[date]_[Dexter file #]
         new_file_name = os.path.join(self.image_storage_path, 
                 '_'.join([label, 
                         self.date[0]+self.date[1]+self.date[3], 
-                        str(file_id), str(im_num)]) + '.asc')
-        self.write_t = time.time()
-        if os.path.isfile(new_file_name): # don't overwrite files
+                        str(file_id), str(im_num)]) + EXT)
+        if os.path.isfile(new_file_name) or new_file_name in self.reserved: # don't overwrite files
             new_file_name = os.path.join(self.image_storage_path, 
                 '_'.join([label, 
                         self.date[0]+self.date[1]+self.date[3], 
-                        str(file_id), str(im_num), str(self.nfn)]) + '.asc')
+                        str(file_id), str(im_num), str(self.nfn)]) + EXT)
             self.nfn += 1 # always a unique number
-        out_arr = np.empty((im_array.shape[0],im_array.shape[1]+1))
-        out_arr[:,1:] = im_array
-        out_arr[:,0]  = np.arange(im_array.shape[0])
-        np.savetxt(new_file_name, out_arr, fmt='%s', delimiter=' ')
+        self.reserved.add(new_file_name)
+        self.writers.submit(new_file_name, im_array, file_id, im_num)
+        self.write_t = time.time() - self.t0
 
-        self.write_t = time.time() - self.write_t
-        self.last_event_path = new_file_name  # update last event path
-        self.event_path.emit(new_file_name)  # emit signal
-        self.end_t = time.time()       # time at end of current event
-        self.event_t = self.end_t - self.t0 # duration of event
+    def emit_saved(self, wait=False):
+        """Emit the names of the files that have been saved, in the order
+        that the images were received. 
+        wait -- wait until all of the images have been saved."""
+        saved, failed = self.writers.done(wait)
+        for new_file_name, file_id, im_num, e in failed:
+            self.reserved.discard(new_file_name)
+            error('Image saver failed to save image %s_%s to %s:\n'%(
+                file_id, im_num, new_file_name) + str(e))
+        for new_file_name, file_id, im_num in saved:
+            self.reserved.discard(new_file_name)
+            try:
+                self.last_event_path = new_file_name  # update last event path
+                TRACE.stamp('saved', file_id, im_num)
+                self.n_saved.inc()
+                self.event_path.emit(new_file_name)  # emit signal
+                self.end_t = time.time()       # time at end of current event
+                self.event_t = self.end_t - self.t0 # duration of event
+            except Exception as e: # keep the saver thread running for the other images
+                error('Image saver failed to report saved image %s:\n'%new_file_name + str(e))
+
+    def run(self):
+        """Pass images from the queue to the writers and emit the names of
+        the saved files until the stop bool is toggled."""
+        while True:
+            self.app.processEvents() # avoids GUI lag but can cause events to be missed
+            if self.check_stop():
+                break # stop the thread running
+            elif len(self.queue):
+                self.process(self.queue.pop(0))
+            self.emit_saved()
+        self.emit_saved(wait=True) # don't lose images that were already received
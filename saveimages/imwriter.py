@@ -0,0 +1,215 @@
+"""Image Writer
+ - encode images losslessly: integer counts are stored as offsets from
+    the image minimum in the narrowest integer type that fits (or as
+    differences along each row, which suits smooth images better than
+    noisy EMCCD images), byte-shuffled so that the high bytes are together
+    as in blosc, then compressed with zstd if it's installed or zlib
+ - a pool of threads encodes and writes images in parallel. zlib and zstd
+    release the GIL so the threads compress at the same time
+ - each file is written to a temporary name, flushed to disk, and then
+    renamed so that it only appears once it is complete
+ - finished files are given back in the order they were submitted so
+    that the images of a run stay in order
+
+The file format is b'PDXI', the length of the header as uint32, the JSON
+header, then the compressed data. Use load_image to read these or .asc files.
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+import threading
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+if '..' not in sys.path: sys.path.append('..')
+from metrics import METRICS
+
+MAGIC = b'PDXI'
+EXT = '.pdi' # PyDex image
+
+def encode_image(im, delta=False, level=1):
+    """Return the bytes of the compressed image file for the array im.
+    delta -- store the differences along each row instead of offsets from
+        the minimum. Noisy images compress better with delta=False.
+    level -- compression level. Low levels are much faster."""
+    im = np.asarray(im)
+    header = {'shape': im.shape, 'dtype': im.dtype.str, 'delta': False, 'offset': 0}
+    data = im
+    if im.size and (im.dtype.kind in 'iub' or (im.dtype.kind == 'f' and
+            np.isfinite(im).all() and (im == np.round(im)).all())):
+        data = im.astype(np.int64)
+        if delta and im.ndim > 1:
+            data = np.diff(data, axis=-1, prepend=0)
+            header['delta'] = True
+        offset = int(data.min())
+        data = data - offset
+        header['offset'] = offset
+        data = data.astype(np.min_scalar_type(int(data.max())))
+    header['stored'] = data.dtype.str
+    raw = np.ascontiguousarray(data).view(np.uint8).reshape(-1, data.dtype.itemsize).T.tobytes() # shuffle
+    if zstandard is not None:
+        header['codec'] = 'zstd'
+        payload = zstandard.ZstdCompressor(level=level).compress(raw)
+    else:
+        header['codec'] = 'zlib'
+        payload = zlib.compress(raw, level)
+    head = json.dumps(header).encode()
+    return MAGIC + struct.pack('<I', len(head)) + head + payload
+
+def decode_image(buf):
+    """Return the image array from the bytes of a compressed image file."""
+    if buf[:4] != MAGIC:
+        raise ValueError('Not a PyDex image file')
+    n = struct.unpack('<I', buf[4:8])[0]
+    header = json.loads(buf[8:8+n])
+    payload = buf[8+n:]
+    if header['codec'] == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstandard is needed to read this image')
+        raw = zstandard.ZstdDecompressor().decompress(payload)
+    else:
+        raw = zlib.decompress(payload)
+    stored = np.dtype(header['stored'])
+    data = np.frombuffer(raw, np.uint8).reshape(stored.itemsize, -1).T.copy().view(stored).ravel()
+    data = data.reshape(header['shape'])
+    if stored != np.dtype(header['dtype']) or header['offset'] or header['delta']:
+        data = data.astype(np.int64) + header['offset']
+        if header['delta']:
+            data = np.cumsum(data, axis=-1)
+    return data.astype(header['dtype'])
+
+def load_image(file_name, delim=' '):
+    """Load an image saved by the image saver, either compressed or as
+    ASCII where the first column gives the row number."""
+    with open(file_name, 'rb') as f:
+        buf = f.read()
+    if buf[:4] == MAGIC:
+        return decode_image(buf)
+    return np.loadtxt(file_name, delimiter=delim)[:,1:]
+
+def write_durable(file_name, data):
+    """Write data to a temporary file, flush it to disk, then rename it so
+    the file only appears when it's complete."""
+    tmp = file_name + '.part'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, file_name)
+
+class writerPool:
+    """Encode and write images on several threads.
+    workers -- number of threads
+    delta, level -- passed to encode_image
+    Use submit() to add an image and done() to get the file names that
+    have finished, in the order they were submitted, and the images that
+    failed to save."""
+    def __init__(self, workers=4, delta=False, level=1):
+        self.workers = workers
+        self.delta = delta
+        self.level = level
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='imwriter')
+        self.pending = deque() # (future, file name, info) in the order they were submitted
+        self.lock = threading.Lock() # for the totals, which are updated by the workers
+        self.raw_bytes = 0     # size of the images in memory
+        self.written_bytes = 0 # size of the files
+        self.start_t = None    # time of the first image submitted
+        self.end_t = None      # time the last image was written
+        self.save_time = METRICS.histogram('save time')
+        METRICS.gauge('writer pool queue', fn=lambda: len(self.pending))
+        METRICS.gauge('compression ratio', fn=self.ratio)
+        METRICS.gauge('writer MB/s', fn=self.rate)
+
+    def write(self, file_name, im, *info):
+        """Encode and save the image, return the file name and info."""
+        t0 = time.perf_counter()
+        buf = encode_image(im, self.delta, self.level)
+        write_durable(file_name, buf)
+        self.end_t = time.perf_counter()
+        with self.lock:
+            self.raw_bytes += im.nbytes
+            self.written_bytes += len(buf)
+        self.save_time.observe(self.end_t - t0)
+        return (file_name,) + info
+
+    def submit(self, file_name, im, *info):
+        """Add an image to be written to file_name. info is returned with
+        the file name when it's done, e.g. the file ID and image number."""
+        if self.start_t is None:
+            self.start_t = time.perf_counter()
+        self.pending.append((self.pool.submit(self.write, file_name, im, *info), file_name, info))
+
+    def done(self, wait=False):
+        """Return a list of (file name, *info) for the images that have been
+        written, stopping at the first that hasn't so that they stay in order,
+        and a list of (file name, *info, exception) for the images that failed.
+        wait -- wait for all of the pending images to be written."""
+        saved, failed = [], []
+        while self.pending and (wait or self.pending[0][0].done()):
+            future, file_name, info = self.pending.popleft()
+            try:
+                saved.append(future.result())
+            except Exception as e:
+                failed.append((file_name,) + info + (e,))
+        return saved, failed
+
+    def ratio(self):
+        """Compression ratio of the images written so far."""
+        return self.raw_bytes / self.written_bytes if self.written_bytes else float('nan')
+
+    def rate(self):
+        """Sustained rate in MB/s of image data from the first image
+        submitted to the last written."""
+        if self.end_t is None or self.end_t <= self.start_t:
+            return float('nan')
+        return self.raw_bytes / (self.end_t - self.start_t) / 1e6
+
+    def close(self):
+        """Finish writing the pending images and stop the threads."""
+        self.pool.shutdown(wait=True)
+
+def synthetic_frames(n, shape=(512,512), bias=1000, atoms=10, seed=0):
+    """Return n EMCCD-like int32 frames: a bias level with readout noise,
+    amplified spurious charge, and Gaussian atom signals."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:shape[0],:shape[1]]
+    frames = np.empty((n,) + shape, dtype=np.int32)
+    for i in range(n):
+        e = rng.poisson(0.05, shape).astype(float)
+        for cy, cx in rng.integers(20, min(shape)-20, (atoms,2)):
+            e += rng.poisson(30*np.exp(-((xx-cx)**2+(yy-cy)**2)/4))
+        frames[i] = bias + rng.gamma(np.maximum(e, 1e-9), 50)*(e > 0) + rng.normal(0, 10, shape)
+    return frames
+
+if __name__ == "__main__":
+    # compression ratio and sustained MB/s on synthetic EMCCD frames
+    import tempfile
+    frames = synthetic_frames(200)
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        for i, im in enumerate(frames[:20]):
+            out = np.empty((im.shape[0],im.shape[1]+1))
+            out[:,1:], out[:,0] = im, np.arange(im.shape[0])
+            np.savetxt(os.path.join(tmp, '%s.asc'%i), out, fmt='%s', delimiter=' ')
+        dt = time.perf_counter() - t0
+        asc = sum(os.path.getsize(os.path.join(tmp, '%s.asc'%i)) for i in range(20))
+        print('ASCII (savetxt):      %7.1f MB/s, %5.2f MB per frame'%(frames[:20].nbytes/1e6/dt, asc/20e6))
+        for delta in [False, True]:
+            for workers in [1, 2, 4, 8]:
+                pool = writerPool(workers, delta=delta)
+                for i, im in enumerate(frames):
+                    pool.submit(os.path.join(tmp, '%s_%s_%s%s'%(delta, workers, i, EXT)), im, i)
+                names, failed = pool.done(wait=True)
+                pool.close()
+                assert [x[1] for x in names] == list(range(len(frames))) and not failed # in order
+                ok = all(np.array_equal(load_image(f), frames[i]) for f, i in names[::20])
+                print('%-5s %s worker(s): %7.1f MB/s, ratio %.2f (%.2f vs ASCII), lossless: %s'%(
+                    'delta' if delta else 'min', workers, pool.rate(), pool.ratio(),
+                    asc/20/(pool.written_bytes/len(frames)), ok))
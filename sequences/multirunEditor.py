@@ -24,60 +24,52 @@ if '..' not in sys.path: sys.path.append('..')
 from mythread import reset_slot # for dis- and re-connecting slots
 from strtypes import strlist, intstrlist, listlist, error, warning, info
 from translator import translate
+from sequenceArchive import write_archive, multirun_edits, apply_edits, routine_name
 from mrunq import Ui_QueueWindow
+from multirunRegistry import multirunRegistry, multirunQueue
 
 ####    ####    ####    ####
 
 class sequenceSaver(QThread):
     """Saving DExTer sequences can sometimes take a long time.
     Save them on this thread so that they don't make the GUI lag.
+    The sequences are stored in one compressed archive as the base
+    sequence plus the changes made at each step, see sequenceArchive.
     mrtr    -- translator instance for the multirun sequence
     mrvals  -- table of values to change in the multirun
     mrparam -- multirun parameters; which channels to change etc.
     savedir -- directory to save sequences into."""
     def __init__(self, mrtr, mrvals, mrparam, savedir):
         super().__init__()
-        self.mrtr = mrtr 
-        self.mr_vals = mrvals
-        self.mr_param = mrparam
+        self.mrtr = mrtr.copy() # copy so that the multirun can carry on editing
+        self.mr_vals = copy.deepcopy(mrvals)
+        self.mr_param = copy.deepcopy(mrparam)
         self.savedir = savedir
-        self.app = QApplication.instance()
     
     def run(self):
-        """Use the values in the multirun array to make the next
-        sequence to run in the multirun. Uses saved mr_param not UI"""
+        """Write the archive of sequences for the multirun. Uses saved mr_param not UI"""
         if self.savedir:
-            for i in range(len(self.mr_vals)):
-                self.app.processEvents()  # avoids GUI lag but slows this task down
-                esc = self.mrtr.get_esc() # shorthand for experimental sequence cluster
-                num_s = len(esc[2]) - 2 # number of steps
-                try:
-                    for col in range(len(self.mr_vals[i])): # edit the sequence
-                        try:
-                            val = float(self.mr_vals[i][col])
-                            if self.mr_param['Type'][col] == 'Time step length':
-                                for head in [2, 9]:
-                                    for t in self.mr_param['Time step name'][col]:
-                                       esc[head][t+2][3][1].text = str(val) # time step length
-                            elif self.mr_param['Type'][col] == 'Analogue voltage':
-                                for t in self.mr_param['Time step name'][col]:
-                                    for c in self.mr_param['Analogue channel'][col]:
-                                        if 'Fast' in self.mr_param['Analogue type'][col]:
-                                            esc[6][t + c*num_s + 3][3][1].text = str(val)
-                                        else:
-                                            esc[11][t + c*num_s + 3][3][1].text = str(val)
-                        except ValueError: pass
-                    self.mrtr.set_routine_name('Multirun ' + self.mr_param['Variable label'] + \
-                            ': ' + self.mr_vals[i][0] + ' (%s / %s)'%(i+1, len(self.mr_vals)))
-                    # self.mrtr.write_to_file(os.path.join(self.savedir, self.mr_param['measure_prefix'] + '_' +  # 22/04/24 don't save every MR to file
-                    #     str(i + self.mr_param['1st hist ID']) + '.xml'))
-                except IndexError as e:
-                    error('Multirun failed to edit sequence at ' + self.mr_param['Variable label']
-                        + ' = ' + self.mr_vals[i][0] + '\n' + str(e))
+            fname = os.path.join(self.savedir, self.mr_param['measure_prefix'] + '_' + 
+                str(self.mr_param['1st hist ID']) + '_sequences.zip')
+            try:
+                write_archive(fname, self.mrtr, self.mr_param, self.mr_vals)
+            except (IndexError, OSError) as e:
+                error('Multirun failed to save sequence archive ' + fname + '\n' + str(e))
 
 
 ####    ####    ####    ####
 
+class queueWindow(QMainWindow):
+    """Window for editing the multirun queue. Emits a signal when it's
+    closed so that the queue can be checked again."""
+    closed = pyqtSignal()
+
+    def closeEvent(self, event):
+        self.closed.emit()
+        event.accept()
+
+####    ####    ####    ####
+
 class multirun_widget(QWidget):
     """Widget for editing multirun values.
 
@@ -146,10 +138,11 @@ class multirun_widget(QWidget):
         self.COM3 = ['Name0','Name1','HFImage','Name3','Name4']
         self.mr_param = copy.deepcopy(self.ui_param) # parameters used for current multirun
         self.mr_vals  = [] # multirun values for the current multirun
-        self.mr_queue = [] # list of parameters, sequences, and values to queue up for future multiruns
+        self.registry = multirunRegistry() # database of queued and saved multiruns
+        self.mr_queue = multirunQueue(self.registry) # list of parameters, sequences, and values to queue up for future multiruns
         self.appending = False # whether the current multirun will be appended on to the displayed results
         self.multirun = False # whether a multirun is running or not
-        self.QueueWindow = QMainWindow() # window for editing mr queue
+        self.QueueWindow = queueWindow() # window for editing mr queue
         self.QueueWindow.setStyleSheet("background-color: cyan;")
         self.queue_ui = Ui_QueueWindow(self.mr_queue)
         self.queue_ui.setupUi(self.QueueWindow)
@@ -652,26 +645,10 @@ class multirun_widget(QWidget):
         """Use the values in the multirun array to make the next
         sequence to run in the multirun. Uses saved mr_param not UI"""
         if i == None: i = self.ind # row index
-        esc = self.mrtr.get_esc() # shorthand
-        num_s = len(esc[2]) - 2 # number of steps
+        num_s = len(self.mrtr.get_esc()[2]) - 2 # number of steps
         try:
-            for col in range(len(self.mr_vals[i])): # edit the sequence
-                try:
-                    val = float(self.mr_vals[i][col])
-                    if self.mr_param['Type'][col] == 'Time step length':
-                        for head in [2, 9]:
-                            for t in self.mr_param['Time step name'][col]:
-                                esc[head][t+2][3][1].text = str(val)
-                    elif self.mr_param['Type'][col] == 'Analogue voltage':
-                        for t in self.mr_param['Time step name'][col]:
-                            for c in self.mr_param['Analogue channel'][col]:
-                                if 'Fast' in self.mr_param['Analogue type'][col]:
-                                    esc[6][t + c*num_s + 3][3][1].text = str(val)
-                                else:
-                                    esc[11][t + c*num_s + 3][3][1].text = str(val)
-                except ValueError as e: pass # non-float variable
-            self.mrtr.set_routine_name('Multirun ' + self.mr_param['Variable label'] + \
-                    ': ' + self.mr_vals[i][0] + ' (%s / %s)'%(i+1, len(self.mr_vals)))
+            apply_edits(self.mrtr.seq_tree, multirun_edits(self.mr_param, self.mr_vals[i], num_s))
+            self.mrtr.set_routine_name(routine_name(self.mr_param, self.mr_vals, i))
         except IndexError as e:
             error('Multirun failed to edit sequence at ' + self.mr_param['Variable label']
                 + ' = ' + self.mr_vals[i][0] + '\n' + str(e))
@@ -681,15 +658,15 @@ class multirun_widget(QWidget):
         """Use the multirun array vals to make all of
         the sequences that will be used in the multirun, then
         store these as a list of XML strings."""
-        self.msglist = []
-        for i in range(len(self.mr_vals)):
-            self.msglist.append(self.get_next_sequence(i))
-        if not self.ss.isRunning():
+        if not self.ss.isRunning(): # copy the base sequence before it's edited
             self.ss = sequenceSaver(self.mrtr, self.mr_vals, self.mr_param, save_dir)
             self.ss.start(self.ss.LowestPriority) # save the sequences
         else: # a backup if the first is busy saving sequences
             self.s2 = sequenceSaver(self.mrtr, self.mr_vals, self.mr_param, save_dir)
             self.s2.start(self.s2.LowestPriority)
+        self.msglist = []
+        for i in range(len(self.mr_vals)):
+            self.msglist.append(self.get_next_sequence(i))
 
     #### save and load parameters ####
 
@@ -701,6 +678,18 @@ class multirun_widget(QWidget):
         QTimer.singleShot(int(1e3*10*60), self.QueueWindow.close)
         
 
+    def resume_interrupted(self):
+        """Queue the remaining steps of multiruns that were interrupted, e.g.
+        if PyDex crashed. The histogram IDs continue from the last one saved."""
+        for run in self.registry.interrupted():
+            resumed = self.registry.resume(run['id'])
+            if resumed:
+                results_path, entry = resumed
+                self.mr_queue.push(entry, results_path)
+                info('Multirun %s: %s resumed from histogram %s of %s.'%(run['measure_prefix'], 
+                    run['label'], run['steps_done'], run['last_id'] - run['first_id'] + 1))
+        self.queue_ui.updateList()
+
     def try_browse(self, title='Select a File', file_type='all (*)', 
                 open_func=QFileDialog.getOpenFileName):
         """Open a file dialog and retrieve a file name from the browser.
@@ -792,32 +781,15 @@ class multirun_widget(QWidget):
             return 0
         results_path = os.path.join(save_results_path, self.ui_param['measure_prefix'])
         self.appending = False
-        # first check if the measure folder already exists with some files in
-        imax = -1
-        try: 
-            filelist = os.listdir(results_path)
-            for fname in filelist:
-                if 'params' in fname:
-                    try: # look for multirun parameters file
-                        with open(os.path.join(results_path, fname), 'r') as f:
-                            _ = f.readline()
-                            vals = f.readline().replace('\n','').split(';')
-                            header = f.readline().replace('\n','').split(';')
-                            params = f.readline().split(';')
-                            imax = max(imax, len(vals) + int(params[header.index('1st hist ID')]) - 1)
-                    except: pass
-        except (FileNotFoundError, PermissionError): pass
-        # then check the multirun queue
-        for m in self.mr_queue:
-            if self.ui_param['measure_prefix'] == m[0]['measure_prefix']:
-                imax = max(imax, len(m[2]) + m[0]['1st hist ID'] - 1)
+        # check for multiruns with this measure that are saved in the folder or still queued
+        imax = self.registry.max_hist_id(save_results_path, self.ui_param['measure_prefix'])
         
         if self.ui_param['1st hist ID'] == -1: # append at the end 
             self.appending = True
             self.ui_param['1st hist ID'] = imax + 1 if imax>=0 else 0
             
-        if (os.path.isdir(results_path) or self.ui_param['measure_prefix'] in [
-            x[0]['measure_prefix'] for x in self.mr_queue]) and imax >= self.ui_param['1st hist ID']:
+        if (os.path.isdir(results_path) or self.registry.in_queue(save_results_path, 
+            self.ui_param['measure_prefix'])) and imax >= self.ui_param['1st hist ID']:
             # this measure exists, check if user wants to overwrite
             reply = QMessageBox.question(self, 'Confirm Overwrite',
                 "Results path already exists, do you want to overwrite the csv and dat files?\n"+results_path,
@@ -836,7 +808,8 @@ class multirun_widget(QWidget):
             #         warning('Multirun could not remove files from '+results_dir+'\n'+str(e))
         
         # parameters are valid, add to queue
-        self.mr_queue.append([copy.deepcopy(self.ui_param), self.tr.copy(), self.get_table(), self.appending]) 
+        self.mr_queue.push([copy.deepcopy(self.ui_param), self.tr.copy(), self.get_table(), self.appending],
+            save_results_path) 
         if self.appending: # if appending, reset ui_param to -1. Also happens at end of multirun in runid.py
             self.measures['1st hist ID'].setText('') 
             self.measures['1st hist ID'].setText('-1') 
@@ -0,0 +1,332 @@
+"""PyDex Multirun Registry
+
+ - Keep an index of multiruns, their parameters and status in a local
+   SQLite database
+ - Updated in a transaction when a multirun is queued, started, and saved
+ - Existing multirun parameter files are indexed by their modification
+   time so that they are only parsed once
+ - Emit a signal when the status of a multirun changes so that the
+   queue can be checked without polling
+ - Store the multirun queue with its sequences so that it survives a
+   restart, and record each completed histogram so that an interrupted
+   multirun can be resumed from the last completed step
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+from lxml import etree
+from PyQt5.QtCore import QObject, pyqtSignal
+if '.' not in sys.path: sys.path.append('.')
+if '..' not in sys.path: sys.path.append('..')
+from strtypes import error, warning, info
+from translator import translate
+
+schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    results_path TEXT NOT NULL,  -- directory containing the measure folders
+    measure_prefix TEXT NOT NULL,
+    measure INTEGER,
+    first_id INTEGER NOT NULL,   -- '1st hist ID'
+    last_id INTEGER NOT NULL,    -- '1st hist ID' + # rows - 1
+    label TEXT,                  -- 'Variable label'
+    status TEXT NOT NULL,        -- queued, running, paused, saved, cancelled, removed,
+                                 -- interrupted, resumed
+    params TEXT,                 -- JSON of the multirun parameters
+    queued REAL, started REAL, finished REAL,
+    priority INTEGER DEFAULT 0,
+    position INTEGER,            -- index in the multirun queue
+    steps_done INTEGER DEFAULT 0, -- number of completed histograms
+    sequence BLOB,               -- XML of the multirun base sequence
+    vals TEXT,                   -- JSON of the multirun values table
+    appending INTEGER DEFAULT 0);
+CREATE INDEX IF NOT EXISTS runs_measure ON runs (results_path, measure_prefix);
+CREATE INDEX IF NOT EXISTS runs_status ON runs (status);
+CREATE TABLE IF NOT EXISTS params_files (
+    path TEXT PRIMARY KEY,
+    results_path TEXT NOT NULL,
+    measure_prefix TEXT NOT NULL,
+    last_id INTEGER NOT NULL,
+    mtime REAL);
+CREATE INDEX IF NOT EXISTS params_measure ON params_files (results_path, measure_prefix);
+"""
+
+def read_params_file(fname):
+    """Return the last histogram ID used by a multirun parameters file."""
+    with open(fname, 'r') as f:
+        _ = f.readline()
+        vals = f.readline().replace('\n','').split(';')
+        header = f.readline().replace('\n','').split(';')
+        params = f.readline().split(';')
+    return len(vals) + int(params[header.index('1st hist ID')]) - 1
+
+class multirunRegistry(QObject):
+    """Persistent index of multiruns stored in an SQLite database.
+    Multiruns are identified by results path, measure prefix, and
+    1st hist ID. The connection is shared between threads with a lock.
+    db_file -- the file name of the database, kept with config.dat."""
+    status_changed = pyqtSignal(str, str) # measure prefix, new status
+    active = ('queued', 'running', 'paused')
+
+    def __init__(self, db_file='./config/multirun_registry.db'):
+        super().__init__()
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+        self.db = sqlite3.connect(db_file, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            self.db.executescript(schema)
+            # runs that were active when PyDex last closed have been interrupted
+            self.db.execute("UPDATE runs SET status='interrupted' WHERE status IN ('running', 'paused')")
+
+    def query(self, sql, args=()):
+        """Return all rows for an SQL query."""
+        with self.lock:
+            return self.db.execute(sql, args).fetchall()
+
+    def add_run(self, params, nrows, results_path, status='queued', 
+            priority=0, tr=None, vals=None, appending=False):
+        """Add a new multirun to the registry. Return its ID.
+        params       -- the multirun parameters (ui_param)
+        nrows        -- number of rows in the multirun values table
+        results_path -- directory where the measure folder is made
+        priority     -- higher priority multiruns are queued first
+        tr           -- translator with the multirun sequence
+        vals         -- the multirun values table
+        appending    -- whether the multirun appends to the measure"""
+        with self.lock, self.db:
+            cur = self.db.execute("""INSERT INTO runs (results_path, measure_prefix, measure,
+                first_id, last_id, label, status, params, queued, priority, sequence, vals, 
+                appending) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)""",
+                (os.path.abspath(results_path), params['measure_prefix'], params['measure'],
+                params['1st hist ID'], params['1st hist ID'] + nrows - 1, params['Variable label'],
+                status, json.dumps(params), time.time(), priority, 
+                etree.tostring(tr.seq_tree, encoding='cp1252', method='html') if tr else None,
+                json.dumps(vals), int(appending)))
+        self.status_changed.emit(params['measure_prefix'], status)
+        return cur.lastrowid
+
+    def set_status(self, params, results_path, status):
+        """Update the status of the most recent matching multirun."""
+        col = {'running':'started', 'saved':'finished', 'cancelled':'finished'}.get(status, '')
+        with self.lock, self.db:
+            self.db.execute("UPDATE runs SET status=?" + (", %s=?"%col if col else '') +
+                """ WHERE id = (SELECT MAX(id) FROM runs WHERE results_path=?
+                AND measure_prefix=? AND first_id=?)""", (status,) + ((time.time(),) if col else ()) +
+                (os.path.abspath(results_path), params['measure_prefix'], params['1st hist ID']))
+        self.status_changed.emit(params['measure_prefix'], status)
+
+    def step_done(self, params, results_path, v):
+        """Record that the histogram for row v of the multirun has been saved."""
+        with self.lock, self.db:
+            self.db.execute("""UPDATE runs SET steps_done=MAX(steps_done, ?) WHERE id = (SELECT MAX(id) 
+                FROM runs WHERE results_path=? AND measure_prefix=? AND first_id=?)""",
+                (v+1, os.path.abspath(results_path), params['measure_prefix'], params['1st hist ID']))
+
+    def index_params_files(self, results_path, measure_prefix):
+        """Index the multirun parameters files in the measure folder,
+        only reading files that are new or have been modified."""
+        folder = os.path.join(results_path, measure_prefix)
+        path = os.path.abspath(results_path)
+        try:
+            entries = [e for e in os.scandir(folder) if 'params' in e.name]
+        except (FileNotFoundError, PermissionError): return
+        with self.lock:
+            known = dict(self.db.execute("SELECT path, mtime FROM params_files WHERE results_path=? AND measure_prefix=?",
+                (path, measure_prefix)).fetchall())
+        new = []
+        for e in entries:
+            mtime = e.stat().st_mtime
+            if known.get(e.path) != mtime:
+                try: new.append((e.path, path, measure_prefix, read_params_file(e.path), mtime))
+                except Exception: pass # not a valid multirun parameters file
+        if new:
+            with self.lock, self.db:
+                self.db.executemany("INSERT OR REPLACE INTO params_files VALUES (?,?,?,?,?)", new)
+
+    def max_hist_id(self, results_path, measure_prefix):
+        """Return the largest histogram ID used by multiruns with this measure
+        prefix, either saved to file or still active. -1 if there are none."""
+        self.index_params_files(results_path, measure_prefix)
+        path = os.path.abspath(results_path)
+        rows = self.query("""SELECT MAX(last_id) FROM (
+            SELECT last_id FROM params_files WHERE results_path=? AND measure_prefix=? UNION ALL
+            SELECT last_id FROM runs WHERE results_path=? AND measure_prefix=?
+                AND status IN ('queued', 'running', 'paused'))""", (path, measure_prefix, path, measure_prefix))
+        return rows[0][0] if rows[0][0] is not None else -1
+
+    def in_queue(self, results_path, measure_prefix):
+        """Whether a multirun with this measure prefix is queued or running."""
+        return bool(self.query("""SELECT 1 FROM runs WHERE results_path=? AND measure_prefix=?
+            AND status IN ('queued', 'running', 'paused') LIMIT 1""",
+            (os.path.abspath(results_path), measure_prefix)))
+
+    def history(self, n=20):
+        """Return the most recent n multiruns as a list of dicts."""
+        return [dict(r) for r in self.query("""SELECT id, measure_prefix, first_id, last_id, label,
+            status, queued, started, finished FROM runs ORDER BY id DESC LIMIT ?""", (n,))]
+
+    #### #### scheduling #### ####
+
+    def set_positions(self, ids):
+        """Store the order of the multirun queue given a list of run IDs."""
+        with self.lock, self.db:
+            self.db.executemany("UPDATE runs SET position=? WHERE id=?", 
+                [(i, run_id) for i, run_id in enumerate(ids)])
+
+    def set_removed(self, ids):
+        """Mark multiruns that the user removed from the queue."""
+        with self.lock, self.db:
+            self.db.executemany("UPDATE runs SET status='removed' WHERE id=?", [(i,) for i in ids])
+
+    def get_priority(self, run_id):
+        rows = self.query("SELECT priority FROM runs WHERE id=?", (run_id,))
+        return rows[0][0] if rows else 0
+
+    def get_entry(self, row, first_step=0):
+        """Rebuild a multirun queue entry [params, translator, values, appending]
+        from a row of the runs table, starting at the given step."""
+        params = json.loads(row['params'])
+        params.pop('run_id', None) # the run ID is set when it's queued
+        vals = json.loads(row['vals'])[first_step:]
+        params['1st hist ID'] += first_step
+        params['runs included'] = [[] for v in vals]
+        tr = translate()
+        tr.load_xml_str(row['sequence'])
+        return [params, tr, vals, bool(row['appending']) or first_step > 0]
+
+    def load_queue(self):
+        """Return the list of (run ID, entry) for multiruns that were
+        still queued when PyDex closed, in queue order."""
+        return [(row['id'], self.get_entry(row)) for row in self.query(
+            """SELECT * FROM runs WHERE status='queued' AND sequence IS NOT NULL 
+            ORDER BY position, id""")]
+
+    def interrupted(self):
+        """Return a list of dicts describing multiruns that were interrupted
+        before all of their histograms were saved."""
+        return [dict(r) for r in self.query("""SELECT id, measure_prefix, first_id, last_id, label, 
+            steps_done FROM runs WHERE status='interrupted' AND sequence IS NOT NULL
+            AND first_id + steps_done <= last_id ORDER BY id""")]
+
+    def resume(self, run_id):
+        """Make a queue entry for the remaining steps of an interrupted
+        multirun, starting after the last completed step. Return the
+        results path and entry, or None if the run can't be resumed."""
+        rows = self.query("SELECT * FROM runs WHERE id=? AND sequence IS NOT NULL", (run_id,))
+        if not rows: return None
+        entry = self.get_entry(rows[0], rows[0]['steps_done'])
+        if not entry[2]: return None # all steps were completed
+        with self.lock, self.db:
+            self.db.execute("UPDATE runs SET status='resumed' WHERE id=?", (run_id,))
+        return rows[0]['results_path'], entry
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+####    ####    ####    ####
+
+class multirunQueue(list):
+    """The list of queued multiruns, where each entry is 
+    [params, translator, values, appending]. The queue is stored in the
+    registry whenever it changes, so that it is restored after a restart.
+    New multiruns are inserted before any multiruns with lower priority.
+    Each entry's registry run ID is stored in its params as 'run_id'.
+    registry -- the multirunRegistry instance to store the queue in"""
+    def __init__(self, registry):
+        super().__init__()
+        self.registry = registry
+        self.results_path = '.' # default directory for the measure folders
+        for run_id, entry in registry.load_queue():
+            entry[0]['run_id'] = run_id
+            super().append(entry)
+        
+    @staticmethod
+    def run_ids(entries):
+        """The registry run IDs of the entries that have one."""
+        return [e[0]['run_id'] for e in entries if e[0].get('run_id') is not None]
+
+    def save_order(self):
+        self.registry.set_positions(self.run_ids(self))
+
+    def push(self, entry, results_path, priority=0):
+        """Add a multirun to the registry and insert it in the queue
+        before the first multirun with a lower priority."""
+        self.results_path = results_path
+        run_id = self.registry.add_run(entry[0], len(entry[2]), results_path,
+            priority=priority, tr=entry[1], vals=entry[2], appending=entry[3])
+        i = len(self)
+        for j, e in enumerate(self):
+            if self.registry.get_priority(e[0].get('run_id')) < priority:
+                i = j
+                break
+        entry[0]['run_id'] = run_id
+        super().insert(i, entry)
+        self.save_order()
+
+    def append(self, entry):
+        self.push(entry, self.results_path)
+
+    def insert(self, i, entry):
+        self.push(entry, self.results_path)
+        self.move(self.index(entry), i)
+
+    def move(self, i, j):
+        """Move the entry at index i to index j."""
+        super().insert(j, super().pop(i))
+        self.save_order()
+
+    def pop(self, i=-1):
+        """Take a multirun from the queue to run it."""
+        entry = super().pop(i)
+        self.save_order()
+        return entry
+
+    def __setitem__(self, i, entry):
+        super().__setitem__(i, entry)
+        self.save_order()
+
+    def __delitem__(self, i):
+        removed = self[i] if isinstance(i, slice) else [self[i]]
+        super().__delitem__(i)
+        self.registry.set_removed(self.run_ids(removed))
+        self.save_order()
+
+    def remove(self, entry):
+        del self[self.index(entry)]
+
+    def clear(self):
+        del self[:]
+
+if __name__ == "__main__":
+    # check that the queue survives a restart and an interrupted multirun resumes
+    import tempfile
+    db = os.path.join(tempfile.mkdtemp(), 'test_registry.db')
+    tr = translate(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'SequenceFiles', 'testing', 'MOT load.xml'))
+    def entry(n, first_id=0, rows=4):
+        return [{'measure':n, 'measure_prefix':'Measure%s'%n, '1st hist ID':first_id, 
+            'Variable label':'var%s'%n, 'runs included':[[] for i in range(rows)]},
+            tr.copy(), [[str(i)] for i in range(rows)], False]
+    q = multirunQueue(multirunRegistry(db))
+    q.push(entry(0), '.')
+    q.push(entry(1), '.')
+    q.push(entry(2), '.', priority=1) # goes to the front
+    q[0], q[1] = q[1], q[0] # user moves it down
+    print('queue:', [e[0]['measure_prefix'] for e in q])
+    q[1] = [dict(q[1][0])] + q[1][1:] # rebuilt params keep their run ID
+    del q[1] # user removes Measure2
+    print('removed:', q.registry.query("SELECT status FROM runs WHERE measure_prefix='Measure2'")[0][0])
+    params = q.pop(0)[0] # start Measure0
+    q.registry.set_status(params, '.', 'running')
+    q.registry.step_done(params, '.', 0)
+    q.registry.step_done(params, '.', 1)
+    q.registry.close() # crash
+    q = multirunQueue(multirunRegistry(db))
+    print('restored queue:', [e[0]['measure_prefix'] for e in q])
+    print('interrupted:', q.registry.interrupted())
+    path, resumed = q.registry.resume(q.registry.interrupted()[0]['id'])
+    print('resume from hist ID %s with values %s'%(resumed[0]['1st hist ID'], resumed[2]))
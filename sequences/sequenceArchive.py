@@ -0,0 +1,113 @@
+"""Sequence Archive
+
+ - Store the sequences of a multirun in a single compressed archive
+ - The base sequence is stored once. Each multirun step only stores
+   the elements of the sequence that it changes (a delta)
+ - Deltas are stored by their hash, so that repeated values are only
+   stored once
+ - Any step of the multirun can be reconstructed from the archive
+
+The archive is a zip file containing:
+    base.xml           -- the base sequence
+    index.json         -- for each step, the delta hash and routine name
+    deltas/<hash>.json -- list of [element path, text] edits
+where the element path is the list of indices to follow from the root
+of the sequence tree.
+"""
+import os
+import sys
+import json
+import copy
+import hashlib
+import zipfile
+from lxml import etree
+if '.' not in sys.path: sys.path.append('.')
+if '..' not in sys.path: sys.path.append('..')
+from strtypes import error, warning, info
+from translator import translate, tdict
+
+esc_path = [1, tdict['Experimental sequence cluster in']] # path to the esc from the root
+
+def multirun_edits(mr_param, row, num_s):
+    """Return the list of [element path, text] edits that a row of the
+    multirun values array makes to the sequence. Uses saved mr_param.
+    num_s -- the number of time steps in the sequence."""
+    edits = []
+    for col in range(len(row)):
+        try:
+            val = float(row[col])
+        except ValueError: continue # non-float variable
+        if mr_param['Type'][col] == 'Time step length':
+            for head in [2, 9]:
+                for t in mr_param['Time step name'][col]:
+                    edits.append([esc_path + [head, t+2, 3, 1], str(val)])
+        elif mr_param['Type'][col] == 'Analogue voltage':
+            for t in mr_param['Time step name'][col]:
+                for c in mr_param['Analogue channel'][col]:
+                    arr = 6 if 'Fast' in mr_param['Analogue type'][col] else 11
+                    edits.append([esc_path + [arr, t + c*num_s + 3, 3, 1], str(val)])
+    return edits
+
+def routine_name(mr_param, mr_vals, i):
+    """The routine name that labels step i of the multirun."""
+    return 'Multirun ' + mr_param['Variable label'] + ': ' + mr_vals[i][0] + ' (%s / %s)'%(i+1, len(mr_vals))
+
+def apply_edits(tree, edits):
+    """Set the text of the elements in the sequence tree given by the
+    list of [element path, text] edits."""
+    for path, text in edits:
+        e = tree
+        for i in path:
+            e = e[i]
+        e.text = text
+
+#### #### read/write archives #### ####
+
+def write_archive(fname, tr, mr_param, mr_vals):
+    """Write the sequences for a multirun to a compressed archive.
+    fname    -- file name of the archive
+    tr       -- translator containing the base sequence
+    mr_param -- multirun parameters; which channels to change etc.
+    mr_vals  -- table of values to change in the multirun
+    Return the number of unique deltas stored.
+    The multirun edits one copy of the sequence for each step, so the
+    edits accumulate: a step keeps the values set by previous steps
+    unless it changes them (e.g. a non-float value is skipped)."""
+    num_s = len(tr.get_esc()[2]) - 2 # number of steps
+    index, deltas = [], {}
+    state = {} # element path: text after the edits of all steps so far
+    for i in range(len(mr_vals)):
+        for path, text in multirun_edits(mr_param, mr_vals[i], num_s):
+            state[tuple(path)] = text
+        text = json.dumps([[list(path), t] for path, t in state.items()])
+        key = hashlib.sha1(text.encode()).hexdigest()
+        deltas[key] = text
+        index.append({'delta':key, 'Routine name':routine_name(mr_param, mr_vals, i)})
+    with zipfile.ZipFile(fname, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+        z.writestr('base.xml', etree.tostring(tr.seq_tree, encoding='cp1252', method='html'))
+        for key, text in deltas.items():
+            z.writestr('deltas/%s.json'%key, text)
+        z.writestr('index.json', json.dumps(index)) # written last to mark the archive complete
+    return len(deltas)
+
+def num_steps(fname):
+    """Return the number of multirun steps stored in the archive."""
+    with zipfile.ZipFile(fname, 'r') as z:
+        return len(json.loads(z.read('index.json')))
+
+def load_step(fname, i):
+    """Reconstruct the sequence for step i of the multirun from the
+    archive. Return a translate instance containing the sequence."""
+    tr = translate()
+    with zipfile.ZipFile(fname, 'r') as z:
+        step = json.loads(z.read('index.json'))[i]
+        tr.load_xml_str(z.read('base.xml'))
+        apply_edits(tr.seq_tree, json.loads(z.read('deltas/%s.json'%step['delta'])))
+    tr.set_routine_name(step['Routine name'])
+    return tr
+
+def extract_steps(fname, save_dir, prefix='', first_id=0):
+    """Write out all of the sequences stored in the archive as XML files
+    named prefix_ID.xml in save_dir."""
+    for i in range(num_steps(fname)):
+        load_step(fname, i).write_to_file(os.path.join(save_dir, prefix + '_' + str(i + first_id) + '.xml'))
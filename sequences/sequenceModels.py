@@ -0,0 +1,266 @@
+"""Sequence Table Models
+
+ - Table models for displaying DExTer sequences in a QTableView
+ - The view only requests the cells that are visible, so a cell
+   is only formatted when it is scrolled into view
+ - When a new sequence is set, only the cells that changed are updated
+"""
+import os
+import sys
+import time
+import numpy as np
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+from PyQt5.QtGui import QBrush
+if '.' not in sys.path: sys.path.append('.')
+if '..' not in sys.path: sys.path.append('..')
+from translator import translate
+from traceBuilder import sequenceTraces
+
+def fmt(val, p):
+    """Reformat the string so that it is displayed better.
+    with p=5, converts '5.11111111e-2' -> '0.051'
+    val: the value to convert
+    p:   number of s.f. to include (warning: includes leading zeros) """
+    try:
+        return str(float(val))[:p]
+    except ValueError:
+        return str(val)[:p]
+
+#### #### base model #### ####
+
+class sequenceModel(QAbstractTableModel):
+    """Read-only table model with row and column labels.
+    Subclasses implement cell(i, j) to return the data for a cell."""
+    def __init__(self, precision=5):
+        super().__init__()
+        self.p = precision # number of s.f. for floating points
+        self.rlabels = [] # vertical header labels
+        self.clabels = [] # horizontal header labels
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rlabels)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.clabels)
+
+    def flags(self, index):
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable # not editable
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole:
+            try:
+                return self.rlabels[section] if orientation == Qt.Vertical else self.clabels[section]
+            except IndexError: pass
+        return None
+
+    def set_labels(self, rlabels, clabels):
+        """Update the header labels, notifying the view if they changed."""
+        if rlabels != self.rlabels:
+            self.rlabels = rlabels
+            self.headerDataChanged.emit(Qt.Vertical, 0, len(rlabels)-1)
+        if clabels != self.clabels:
+            self.clabels = clabels
+            self.headerDataChanged.emit(Qt.Horizontal, 0, len(clabels)-1)
+
+    def refresh(self):
+        """Tell the view that all cells might have changed. The view
+        only requests the data again for the visible cells."""
+        if self.rowCount() and self.columnCount():
+            self.dataChanged.emit(self.index(0, 0),
+                self.index(self.rowCount()-1, self.columnCount()-1))
+
+    def clear(self):
+        """Remove all of the rows and columns."""
+        self.beginResetModel()
+        self.rlabels, self.clabels = [], []
+        self.endResetModel()
+
+#### #### models for the sequence header and event list #### ####
+
+class headerModel(sequenceModel):
+    """Display the time step properties in the sequence header.
+    The text is taken from the XML elements when the cell is shown."""
+    labels = ['Event name ', 'Time step length ', 'Analogue voltage (V) ',
+        'D/A trigger? ', 'Channel ', 'Trigger this time step? ', 'GPIB event name ',
+        'GPIB on/off? ','Time step name ', 'Hide event steps ', 'Populate multirun ',
+        'Time unit ', 'Event ID ', 'Skip Step ']
+    def __init__(self, precision=5):
+        super().__init__(precision)
+        self.steps = [] # list of time step etree elements
+
+    def set_steps(self, steps):
+        """Set the list of time step elements from the sequence header."""
+        if len(steps) != len(self.steps) or self.rlabels != self.labels:
+            self.beginResetModel()
+            self.steps = steps
+            self.rlabels = self.labels
+            self.clabels = list(map(str, range(len(steps))))
+            self.endResetModel()
+        else:
+            self.steps = steps
+            self.refresh()
+
+    def clear(self):
+        self.steps = []
+        super().clear()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        step, j = self.steps[index.column()], index.row()
+        try:
+            if j == 0:   # event name
+                return step[2][1].text
+            elif j == 1: # time step length
+                return fmt(step[3][1].text, self.p)
+            elif j == 2: # analogue voltage
+                return fmt(step[4][2][1].text, self.p)
+            elif j < 8:  # trigger and GPIB details
+                return step[4+j//6][j%6+2*(j//6)][1].text
+            elif j == 11: # time step unit
+                return step[9][int(step[9][-1].text)+1].text
+            else:
+                return step[j-2][1].text
+        except (IndexError, ValueError): return ''
+
+class eventModel(sequenceModel):
+    """Display the list of event descriptions."""
+    labels = ['Event name: ', 'Routine specific event? ',
+        'Event indices: ', 'Event path: ']
+    def __init__(self, precision=5):
+        super().__init__(precision)
+        self.events = [] # list of event etree elements
+        self.rlabels = self.labels
+
+    def set_events(self, events):
+        """Set the list of event elements from the event list array."""
+        if len(events) != len(self.events) or self.rlabels != self.labels:
+            self.beginResetModel()
+            self.events = events
+            self.rlabels = self.labels
+            self.clabels = list(map(str, range(len(events))))
+            self.endResetModel()
+        else:
+            self.events = events
+            self.refresh()
+
+    def clear(self):
+        self.events = []
+        super().clear()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        event, j = self.events[index.column()], index.row()
+        try:
+            if j == 0: return event[2][1].text # 'Event name'
+            elif j == 1: return event[5][1].text # 'Routine specific event?'
+            elif j == 2: return ','.join([x[1].text for x in # 'Event indices'
+                event[3].iter(tag='{http://www.ni.com/LVData}I32')])
+            else: return event[4][1].text # 'Event path'
+        except IndexError: return ''
+
+#### #### models for the channel values #### ####
+
+class channelModel(sequenceModel):
+    """Display the values of digital or analogue channels.
+    Digital channels have one column per time step, coloured green for
+    on and red for off. Analogue channels have two columns per time step:
+    the voltage and whether it ramps.
+    digital   -- whether the channels are digital or analogue
+    precision -- number of s.f. for floating point values displayed"""
+    def __init__(self, digital=True, precision=5):
+        super().__init__(precision)
+        self.digital = digital
+        self.ncol = 1 if digital else 2 # columns per time step
+        self.vals  = np.zeros((0,0), dtype=bool if digital else float)
+        self.ramps = np.zeros((0,0), dtype=bool)
+
+    def set_values(self, vals, ramps=None, rlabels=[], clabels=[]):
+        """Set the arrays of channel values, shape (channels, time steps).
+        If the shape and number of labels are unchanged then only the
+        changed cells are updated."""
+        if ramps is None: ramps = np.zeros(np.shape(vals), dtype=bool)
+        if (np.shape(vals) != self.vals.shape or len(rlabels) != len(self.rlabels)
+                or len(clabels) != len(self.clabels)):
+            self.beginResetModel()
+            self.vals, self.ramps = vals, ramps
+            self.rlabels, self.clabels = rlabels, clabels
+            self.endResetModel()
+            return
+        changed = np.argwhere((self.vals != vals) | (self.ramps != ramps))
+        self.vals, self.ramps = vals, ramps
+        self.set_labels(rlabels, clabels)
+        if len(changed) > 100: # view only updates visible cells anyway
+            self.refresh()
+        else:
+            for i, j in changed:
+                self.dataChanged.emit(self.index(i, j*self.ncol),
+                    self.index(i, j*self.ncol + self.ncol-1))
+
+    def clear(self):
+        self.vals = np.zeros((0,0), dtype=self.vals.dtype)
+        self.ramps = np.zeros((0,0), dtype=bool)
+        super().clear()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        i, j = index.row(), index.column()
+        if self.digital:
+            if role == Qt.BackgroundRole:
+                return QBrush(Qt.green if self.vals[i, j] else Qt.red)
+        elif role == Qt.DisplayRole:
+            if j % 2:
+                return 'Ramp' if self.ramps[i, j//2] else ''
+            return fmt(self.vals[i, j//2], self.p)
+        return None
+
+####    ####    ####    ####
+
+def table_load_times(fname, p=5):
+    """Compare the time to display a sequence by filling a QTableWidget
+    for every cell against setting the table model."""
+    from PyQt5.QtWidgets import QTableWidget, QTableWidgetItem, QTableView
+    tr = translate(fname)
+    esc = tr.get_esc()
+    num_s = len(esc[2]) - 2
+    t0 = time.perf_counter()
+    tables = [QTableWidget(n, num_s*k) for n, k in [
+        [tr.nfd, 1], [tr.nfa, 2], [tr.nsd, 1], [tr.nsa, 2]]]
+    for table, arr, dig in zip(tables, [3, 6, 7, 11], [1, 0, 1, 0]):
+        for j in range(table.rowCount()):
+            for i in range(num_s):
+                if dig:
+                    item = QTableWidgetItem()
+                    item.setBackground(Qt.green if esc[arr][i + j*num_s + 3][1].text in ['1', 'true'] else Qt.red)
+                    table.setItem(j, i, item)
+                else:
+                    item = QTableWidgetItem(fmt(esc[arr][i + j*num_s + 3][3][1].text, p))
+                    table.setItem(j, 2*i, item)
+                    table.setItem(j, 2*i+1, QTableWidgetItem('Ramp' if
+                        esc[arr][i + j*num_s + 3][2][1].text in ['1', 'true'] else ''))
+    t1 = time.perf_counter()
+    models = [channelModel(dig, p) for dig in [1, 0, 1, 0]]
+    views = [QTableView() for m in models]
+    for view, model in zip(views, models):
+        view.setModel(model)
+    st = sequenceTraces(tr)
+    for model, vals, ramps in zip(models, [st.fd, st.fa, st.sd, st.sa], [None, st.far, None, st.sar]):
+        model.set_values(vals, ramps, list(map(str, range(len(vals)))),
+            list(map(str, range(num_s*model.ncol))))
+    t2 = time.perf_counter()
+    fa = st.fa.copy()
+    fa[0,0] += 1 # a multirun changing one value
+    models[1].set_values(fa, st.far, models[1].rlabels, models[1].clabels)
+    t3 = time.perf_counter()
+    return num_s, t1-t0, t2-t1, t3-t2
+
+if __name__ == "__main__":
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication(sys.argv)
+    seqdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'SequenceFiles', 'testing')
+    for fname in sorted(os.listdir(seqdir)):
+        num_s, t_items, t_model, t_update = table_load_times(os.path.join(seqdir, fname))
+        print('%-40s %3s steps: table items %7.1f ms, model %6.1f ms, update one value %5.2f ms'%(
+            fname, num_s, t_items*1e3, t_model*1e3, t_update*1e3))
@@ -11,6 +11,7 @@ sys.path.append(r'Z:\Tweezer\Code\Python 3.5\PyDex')
 from lxml import etree
 sys.path.append('') # otherwise cwd isn't in sys.path 
 from translator import translate, tdict
+from traceBuilder import sequenceTraces, ramp_ends
 from sequencePreviewer import Previewer
 try:
     from PyQt4.QtGui import QApplication
@@ -23,83 +24,37 @@ import time
 
 plt.style.use('default')
 
-def check_timestep_skipped(timestep):
-    position = 2
-    return bool(int(esc[position][timestep+2][tdict.get('Skip Step')][1].text))
-
 def remove_skipped_timesteps(timesteps):
-    skipped = np.array([check_timestep_skipped(timestep) for timestep in timesteps])
-    # print(skipped)
-    timesteps = timesteps[~skipped]
-    return timesteps
+    return timesteps[~st.skip[timesteps]]
 
 def get_time_unit(timestep):
     units = ['us','ms','s']
     multiplier_ms = [0.001,1,1000]
-    position = 2
-    index = int(esc[position][timestep+2][tdict.get('Time unit')][4].text)
-    return units[index], multiplier_ms[index]
+    return units[multiplier_ms.index(st.units[timestep])], st.units[timestep]
 
 def get_time_float(timestep):
-    position = 2
-    return float(esc[position][timestep+2][tdict.get('Time step length')][1].text)
+    return st.lengths[timestep]
 
 def get_time_ms(timestep):
     """Returns in the time in ms of a timestep."""
-    return get_time_float(timestep)*get_time_unit(timestep)[1]
-
-def get_fdo_val(channel,timestep):
-    num_s = len(esc[tdict.get('Sequence header top')]) - 2 # total number of timesteps
-    start = int(esc[tdict.get('Fast digital channels')][timestep + channel*num_s + 3][1].text)
-    end = start
-        
-    return [start,end]
-
-def get_sdo_val(channel,timestep):
-    num_s = len(esc[tdict.get('Sequence header top')]) - 2 # total number of timesteps
-    start = int(esc[tdict.get('Slow digital channels')][timestep + channel*num_s + 3][1].text)
-    end = start
-        
-    return [start,end]
-
-def get_fao_val(channel,timestep):
-    num_s = len(esc[tdict.get('Sequence header top')]) - 2 # total number of timesteps
-    ramp = bool(int(esc[tdict.get('Fast analogue array')][timestep + channel*num_s + 3][2][1].text))
-    start = float(esc[tdict.get('Fast analogue array')][timestep + channel*num_s + 3][3][1].text)
-    
-    if ramp:
-        end = float(esc[tdict.get('Fast analogue array')][timestep+1 + channel*num_s + 3][3][1].text)
-    else:
-        end = start
-        
-    return [start,end]
-
-def get_sao_val(channel,timestep):
-    num_s = len(esc[tdict.get('Sequence header top')]) - 2 # total number of timesteps
-    ramp = bool(int(esc[tdict.get('Slow analogue array')][timestep + channel*num_s + 3][2][1].text))
-    start = float(esc[tdict.get('Slow analogue array')][timestep + channel*num_s + 3][3][1].text)
-    
-    if ramp:
-        end = float(esc[tdict.get('Slow analogue array')][timestep+1 + channel*num_s + 3][3][1].text)
-    else:
-        end = start
-        
-    return [start,end]
+    return st.durations()[timestep]
 
 def get_times_ms(timesteps):
-    return np.array([get_time_ms(timestep) for timestep in timesteps])
+    return st.durations()[timesteps]
 
+# the traces of all channels are built in one pass by sequenceTraces. These
+# functions return an array of [start, end] values for each timestep.
 def get_fdo_vals(channel,timesteps):
-    return np.array([get_fdo_val(channel,timestep) for timestep in timesteps],dtype=bool)
+    return np.stack([st.fd[channel,timesteps]]*2, axis=1)
 
 def get_sdo_vals(channel,timesteps):
-    return np.array([get_sdo_val(channel,timestep) for timestep in timesteps],dtype=bool)
+    return np.stack([st.sd[channel,timesteps]]*2, axis=1)
 
 def get_fao_vals(channel,timesteps):
-    return np.array([get_fao_val(channel,timestep) for timestep in timesteps])
+    return np.stack([st.fa[channel,timesteps], ramp_ends(st.fa, st.far)[channel,timesteps]], axis=1)
 
 def get_sao_vals(channel,timesteps):
-    return np.array([get_sao_val(channel,timestep) for timestep in timesteps])
+    return np.stack([st.sa[channel,timesteps], ramp_ends(st.sa, st.sar)[channel,timesteps]], axis=1)
 
 def plot_times_channel(durations,channel,**kwargs):
     times = np.cumsum(durations)
@@ -112,6 +67,7 @@ def plot_times_channel(durations,channel,**kwargs):
 t = translate()
 t.load_xml(r"Z:\Tweezer\Experimental Results\2023\May\03\Measure15\sequences\Measure15_3.xml")
 esc = t.get_esc() # shorthand
+st = sequenceTraces(t) # arrays of all channel values
 
 #%%
 timesteps = np.arange(1035,1056)
@@ -19,8 +19,10 @@ from PyQt5.QtGui import QFont, QIcon
 from PyQt5.QtWidgets import (QApplication, QPushButton, QWidget, 
         QTabWidget, QAction, QMainWindow, QLabel, QInputDialog, QGridLayout,
         QMessageBox, QLineEdit, QFileDialog, QComboBox, QActionGroup, QMenu,
-        QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem, QScrollArea)
+        QVBoxLayout, QHBoxLayout, QTableView, QScrollArea)
 from translator import translate
+from traceBuilder import sequenceTraces
+from sequenceModels import fmt, headerModel, eventModel, channelModel
 from multirunEditor import multirun_widget
 import logging
 logger = logging.getLogger(__name__)
@@ -28,16 +30,6 @@ if '.' not in sys.path: sys.path.append('.')
 if '..' not in sys.path: sys.path.append('..')
 from strtypes import BOOL
 
-def fmt(val, p):
-    """Reformat the string so that it is displayed better.
-    with p=5, converts '5.11111111e-2' -> '0.051'
-    val: the value to convert
-    p:   number of s.f. to include (warning: includes leading zeros) """
-    try:
-        return str(float(val))[:p]
-    except ValueError:
-        return str(val)[:p]
-
 #### #### Preview sequences #### ####
 
 class Previewer(QMainWindow):
@@ -52,21 +44,6 @@ class Previewer(QMainWindow):
         self.init_UI()
         # self.set_sequence()
     
-    def reset_table(self, table, digital=1):
-        """Set empty table items in all of the cells of the
-        given table. The items are not editable.
-        digital -- 1: Set the background colour red
-                -- 0: Set the text as ''."""
-        for i in range(table.rowCount()):
-            for j in range(table.columnCount()):
-                item = QTableWidgetItem()
-                item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-                table.setItem(i, j, item)
-                if digital:
-                    table.item(i, j).setBackground(Qt.red)
-                else:
-                    table.item(i, j).setText('')
-
     def init_UI(self):
         """Create all of the widget objects required"""
         self.centre_widget = QWidget()
@@ -76,12 +53,6 @@ class Previewer(QMainWindow):
         self.centre_widget.setLayout(self.centre_widget.layout)
         self.setCentralWidget(self.centre_widget)
         
-        try:
-            num_e = len(self.tr.get_evl()) - 2    # 'Event list array in'
-            num_s = len(self.tr.get_esc()[2]) - 2 # 'Sequence header top'
-        except TypeError:
-            num_e = 1
-            num_s = 1
         menubar = self.menuBar()
 
         # save/load a sequence file
@@ -123,68 +94,24 @@ class Previewer(QMainWindow):
             layout.addWidget(label)
             prv_vbox.addLayout(layout)
 
-        # list of event descriptions
-        self.e_list = QTableWidget(4, num_e)
-        self.e_list.setVerticalHeaderLabels(['Event name: ', 
-            'Routine specific event? ', 'Event indices: ', 'Event path: '])
-        self.e_list.setFixedHeight(150)
-        self.reset_table(self.e_list, 0)
-        prv_vbox.addWidget(self.e_list)
-        
-        # event header top 
-        self.head_top = QTableWidget(14, num_s)
-        self.head_top.setVerticalHeaderLabels(['Event name ', 'Time step length ', 
-        'Analogue voltage (V) ', 'D/A trigger? ', 'Channel ', 
-        'Trigger this time step? ', 'GPIB event name ', 'GPIB on/off? ','Time step name ', 
-        'Hide event steps ', 'Populate multirun ', 'Time unit ', 'Event ID ', 'Skip Step '])
-        self.head_top.setFixedHeight(450)
-        self.reset_table(self.head_top, 0)
-        prv_vbox.addWidget(self.head_top)
-          
-        # fast digital channels
-        fd_head = QLabel('Fast Digital', self) 
-        prv_vbox.addWidget(fd_head)
-
-        self.fd_chans = QTableWidget(self.tr.nfd, num_s)
-        self.fd_chans.setFixedHeight(400)
-        self.reset_table(self.fd_chans, 1)
-        prv_vbox.addWidget(self.fd_chans)
-          
-        # fast analogue channels
-        fa_head = QLabel('Fast Analogue', self) 
-        prv_vbox.addWidget(fa_head)
-        self.fa_chans = QTableWidget(self.tr.nfa, num_s*2)
-        self.fa_chans.setFixedHeight(260)
-        self.reset_table(self.fa_chans, 0)
-        prv_vbox.addWidget(self.fa_chans)
-        
-        # event header middle
-        self.head_mid = QTableWidget(14, num_s)
-        self.head_mid.setVerticalHeaderLabels(['Event name ', 'Time step length ', 
-        'Analogue voltage (V) ', 'D/A trigger? ', 'Channel ', 
-        'Trigger this time step? ', 'GPIB event name ', 'GPIB on/off? ','Time step name ', 
-        'Hide event steps ', 'Populate multirun ', 'Time unit ', 'Event ID ', 'Skip Step '])
-        self.head_mid.setFixedHeight(450)
-        self.reset_table(self.head_mid, 0)
-        prv_vbox.addWidget(self.head_mid)
-        
-        # slow digital channels
-        sd_head = QLabel('Slow Digital', self) 
-        prv_vbox.addWidget(sd_head)
-
-        self.sd_chans = QTableWidget(self.tr.nsd, num_s)
-        self.sd_chans.setFixedHeight(400)
-        self.reset_table(self.sd_chans, 1)
-        prv_vbox.addWidget(self.sd_chans)
-        
-        # slow analogue channels
-        sa_head = QLabel('Slow Analogue', self) 
-        prv_vbox.addWidget(sa_head)
-
-        self.sa_chans = QTableWidget(self.tr.nsa, num_s*2)
-        self.sa_chans.setFixedHeight(400)
-        self.reset_table(self.sa_chans, 0)
-        prv_vbox.addWidget(self.sa_chans)
+        # the tables are views of models that only format the visible cells
+        self.models = {}
+        for key, model, label, height in [
+                ['e_list', eventModel(self.p), '', 150], # list of event descriptions
+                ['head_top', headerModel(self.p), '', 450], # event header top 
+                ['fd_chans', channelModel(True, self.p), 'Fast Digital', 400],
+                ['fa_chans', channelModel(False, self.p), 'Fast Analogue', 260],
+                ['head_mid', headerModel(self.p), '', 450], # event header middle
+                ['sd_chans', channelModel(True, self.p), 'Slow Digital', 400],
+                ['sa_chans', channelModel(False, self.p), 'Slow Analogue', 400]]:
+            if label:
+                prv_vbox.addWidget(QLabel(label, self))
+            self.models[key] = model
+            table = QTableView(self)
+            table.setModel(model)
+            table.setFixedHeight(height)
+            setattr(self, key, table)
+            prv_vbox.addWidget(table)
         
         # place scroll bars if the contents of the window are too large
         scroll = QScrollArea(self)
@@ -207,6 +134,9 @@ class Previewer(QMainWindow):
         mrqueue = QAction('View Queue', self)
         mrqueue.triggered.connect(self.mr.view_mr_queue)
         mr_menu.addAction(mrqueue)
+        mrresume = QAction('Resume Interrupted', self)
+        mrresume.triggered.connect(self.mr.resume_interrupted)
+        mr_menu.addAction(mrresume)
         
         # choose main window position and dimensions: (xpos,ypos,width,height)
         self.setWindowTitle('Multirun Editor and Sequence Preview')
@@ -214,18 +144,12 @@ class Previewer(QMainWindow):
 
 
     def reset_UI(self):
-        """After loading in a new sequence, adjust the UI
-        so that the tables have the right number of rows and columns. """
-        num_e = len(self.tr.get_evl()) - 2    # 'Event list array in'
-        num_s = len(self.tr.get_esc()[2]) - 2 # 'Sequence header top'
-        for table, rows, cols, dig in [[self.e_list, 4, num_e, 0], [self.head_top, 14, num_s, 0],
-            [self.fd_chans, self.tr.nfd, num_s, 1], [self.fa_chans, self.tr.nfa, num_s*2, 0],
-            [self.head_mid, 14, num_s, 0], [self.sd_chans, self.tr.nsd, num_s, 1],
-            [self.sa_chans, self.tr.nsa, num_s*2, 0]]:
-            table.setRowCount(rows)
-            table.setColumnCount(cols)
-            self.reset_table(table, dig)
-        
+        """After loading in a new sequence, update the multirun editor and
+        clear the tables if the sequence isn't displayed. The tables are
+        resized when the sequence is set."""
+        if not self.display_toggle.isChecked(): 
+            for model in self.models.values():
+                model.clear() # don't display an old sequence
         self.mr.reset_sequence(self.tr)
         
     def redisplay_sequence(self):
@@ -268,62 +192,26 @@ class Previewer(QMainWindow):
             self.tr.write_to_file(fname)
 
     def set_sequence(self):
-        """Fill the labels with the values from the sequence"""
+        """Fill the labels with the values from the sequence. The table
+        models only update the cells that have changed."""
         self.routine_name.setText(self.tr.get_routine_name()) # 'Routine name'
         self.routine_desc.setText(self.tr.get_routine_description()) # 'Routine description'
         try:
-            ela = self.tr.get_evl()[2:] # 'Event list array in'
             esc = self.tr.get_esc()[2:] # 'Experimental sequence cluster in'
-            num_s = len(esc[0]) - 2 # number of steps
-            self.fd_chans.setVerticalHeaderLabels([esc[2][i+2][2][1].text + # Fast digital
-                ': ' + esc[2][i+2][3][1].text for i in range(len(esc[2])-2)])
-            self.fa_chans.setVerticalHeaderLabels([esc[3][i+2][2][1].text + # Fast analogue
-                ': ' + esc[3][i+2][3][1].text for i in range(len(esc[3])-2)])
-            self.sd_chans.setVerticalHeaderLabels([esc[6][i+2][2][1].text + # Slow digital
-                ': ' + esc[6][i+2][3][1].text for i in range(len(esc[6])-2)])
-            self.sa_chans.setVerticalHeaderLabels([esc[8][i+2][2][1].text + # Slow analogue
-                ': ' + esc[8][i+2][3][1].text for i in range(len(esc[8])-2)])
-            for i in range(len(ela)):
-                self.e_list.item(0, i).setText(ela[i][2][1].text) # 'Event name'
-                self.e_list.item(1, i).setText(ela[i][5][1].text) # 'Routine specific event?'
-                self.e_list.item(2, i).setText(','.join([x[1].text for x in ela[i][3].iter(tag='{http://www.ni.com/LVData}I32')])) # 'Event indices'
-                self.e_list.item(3, i).setText(ela[i][4][1].text) # 'Event path'
-            for i in range(num_s): # 'Sequence header top'
-                for j in range(14):
-                    if j == 0: # event name
-                        self.head_top.item(j, i).setText(esc[0][i+2][j+2][1].text)  # top
-                        self.head_mid.item(j, i).setText(esc[7][i+2][j+2][1].text)  # middle
-                    if j == 1: # time step length
-                        self.head_top.item(j, i).setText(fmt(esc[0][i+2][j+2][1].text, self.p)) # to 'p' s.f.
-                        self.head_mid.item(j, i).setText(fmt(esc[7][i+2][j+2][1].text, self.p))
-                    elif j == 2: # analogue voltage
-                        self.head_top.item(j, i).setText(fmt(esc[0][i+2][4][j][1].text, self.p))
-                        self.head_mid.item(j, i).setText(fmt(esc[7][i+2][4][j][1].text, self.p))
-                    elif j > 2 and j < 8: # trigger and GPIB details
-                        self.head_top.item(j, i).setText(esc[0][i+2][4+j//6][j%6+2*(j//6)][1].text)
-                        self.head_mid.item(j, i).setText(esc[7][i+2][4+j//6][j%6+2*(j//6)][1].text)
-                    elif j == 11: # time step unit
-                        self.head_top.item(j, i).setText(esc[0][i+2][9][int(esc[0][i+2][9][-1].text)+1].text)
-                        self.head_mid.item(j, i).setText(esc[7][i+2][9][int(esc[0][i+2][9][-1].text)+1].text)
-                    elif j > 7:
-                        self.head_top.item(j, i).setText(esc[0][i+2][j-2][1].text)  # top
-                        self.head_mid.item(j, i).setText(esc[7][i+2][j-2][1].text)  # middle
-                    
-                self.fd_chans.setHorizontalHeaderLabels([h[6][1].text for h in esc[0][2:]]) # time step names
-                for j in range(self.tr.nfd): # fast digital channels
-                    self.fd_chans.item(j, i).setBackground(Qt.green if BOOL(esc[1][i + j*num_s + 3][1].text) else Qt.red)
-                self.fa_chans.setHorizontalHeaderLabels([h[6][1].text for h in esc[0][2:] for j in range(2)]) # time step names
-                for j in range(self.tr.nfa): # fast analogue channels
-                    self.fa_chans.item(j, 2*i).setText(fmt(esc[4][i + j*num_s + 3][3][1].text, self.p))
-                    self.fa_chans.item(j, 2*i+1).setText('Ramp' if BOOL(esc[4][i + j*num_s + 3][2][1].text) else '')
-                self.sd_chans.setHorizontalHeaderLabels([h[6][1].text for h in esc[7][2:]]) # time step names
-                for j in range(self.tr.nsd): # slow digital channels
-                    self.sd_chans.item(j, i).setBackground(Qt.green if BOOL(esc[5][i + j*num_s + 3][1].text) else Qt.red)
-                self.sa_chans.setHorizontalHeaderLabels([h[6][1].text for h in esc[7][2:] for j in range(2)]) # time step names
-                for j in range(self.tr.nsa):
-                    self.sa_chans.item(j, 2*i).setText(fmt(esc[9][i + j*num_s + 3][3][1].text, self.p))
-                    self.sa_chans.item(j, 2*i+1).setText('Ramp' if BOOL(esc[9][i + j*num_s + 3][2][1].text) else '')
-        except IndexError as e: logger.error('Could not display sequence.\n'+str(e))
+            st = sequenceTraces(self.tr) # arrays of the channel values
+            self.models['e_list'].set_events(self.tr.get_evl()[2:]) # 'Event list array in'
+            self.models['head_top'].set_steps(esc[0][2:]) # 'Sequence header top'
+            self.models['head_mid'].set_steps(esc[7][2:]) # 'Sequence header middle'
+            top_names = [h[6][1].text for h in esc[0][2:]] # time step names
+            mid_names = [h[6][1].text for h in esc[7][2:]]
+            for key, vals, ramps, names, steps in [
+                    ['fd_chans', st.fd, None, esc[2], top_names], # Fast digital
+                    ['fa_chans', st.fa, st.far, esc[3], [n for n in top_names for j in range(2)]], # Fast analogue
+                    ['sd_chans', st.sd, None, esc[6], mid_names], # Slow digital
+                    ['sa_chans', st.sa, st.sar, esc[8], [n for n in mid_names for j in range(2)]]]: # Slow analogue
+                self.models[key].set_values(vals, ramps, 
+                    [c[2][1].text + ': ' + c[3][1].text for c in names[2:]], steps)
+        except (IndexError, ValueError) as e: logger.error('Could not display sequence.\n'+str(e))
 
 
     def choose_multirun_dir(self):
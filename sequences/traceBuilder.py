@@ -0,0 +1,209 @@
+"""Sequence Trace Builder
+
+ - Build the time/value traces of every channel in a DExTer sequence
+ - Parse each channel array of the XML tree once, then work on numpy arrays
+ - Apply multirun values directly to the arrays so that the variants
+   of a multirun can be compared without rebuilding each sequence
+
+The traces are stored channel x time step, following the layout of the
+sequence where the element for time step i of channel j is found at
+esc[array][i + j*num_s + 3].
+"""
+import os
+import sys
+import time
+import numpy as np
+if '.' not in sys.path: sys.path.append('.')
+if '..' not in sys.path: sys.path.append('..')
+from translator import translate, tdict
+from strtypes import BOOL
+
+units_ms = np.array([1e-3, 1, 1e3]) # us, ms, s in ms
+
+#### #### parse the sequence into arrays #### ####
+
+def to_bool(texts):
+    """Convert a list of LabVIEW boolean strings ('0', '1', 'false', 'true')
+    into a boolean array."""
+    texts = np.char.lower(np.array(texts, dtype=str))
+    return (texts == '1') | (texts == 'true')
+
+def get_timing(esc):
+    """Return arrays of the time step lengths, the time step units in ms,
+    and whether each time step is skipped, from the 'Sequence header top'."""
+    sht = esc[tdict['Sequence header top']][2:]
+    lengths = np.array([float(s[3][1].text) for s in sht])
+    units = units_ms[np.array([int(s[9][-1].text) for s in sht], dtype=int)]
+    skip = to_bool([s[11][1].text for s in sht])
+    return lengths, units, skip
+
+def get_digital(esc, key, nchan, num_s):
+    """Return a boolean array (nchan, num_s) of the digital channel states."""
+    arr = esc[tdict[key]][3:3+nchan*num_s]
+    return to_bool([e[1].text for e in arr]).reshape(nchan, num_s)
+
+def get_analogue(esc, key, nchan, num_s):
+    """Return arrays (nchan, num_s) of the analogue voltages and ramp toggles."""
+    arr = esc[tdict[key]][3:3+nchan*num_s]
+    volts = np.array([e[3][1].text for e in arr], dtype=float).reshape(nchan, num_s)
+    ramps = to_bool([e[2][1].text for e in arr]).reshape(nchan, num_s)
+    return volts, ramps
+
+def ramp_ends(volts, ramps):
+    """A ramp goes from the voltage of this time step to the voltage of the
+    next time step. Return the voltage at the end of each time step.
+    The last time step has nothing to ramp to, so it is held constant."""
+    ends = volts.copy()
+    ends[:,:-1] = np.where(ramps[:,:-1], volts[:,1:], volts[:,:-1])
+    return ends
+
+class sequenceTraces:
+    """Store the channel values of a sequence as arrays.
+    tr   -- a translate instance containing the sequence
+    Attributes:
+    lengths   -- time step lengths in their own units, shape (num_s,)
+    units     -- time step units in ms, shape (num_s,)
+    skip      -- whether the time step is skipped, shape (num_s,)
+    fd, sd    -- fast/slow digital states, shape (nfd/nsd, num_s)
+    fa, sa    -- fast/slow analogue voltages at the start of each step
+    far, sar  -- fast/slow analogue ramp toggles."""
+    def __init__(self, tr=None):
+        self.lengths = np.zeros(0)
+        self.units = np.ones(0)
+        self.skip = np.zeros(0, dtype=bool)
+        if tr is not None:
+            self.load(tr)
+
+    def load(self, tr):
+        """Parse all of the channels of the sequence in tr."""
+        esc = tr.get_esc()
+        self.num_s = len(esc[tdict['Sequence header top']]) - 2
+        self.lengths, self.units, self.skip = get_timing(esc)
+        self.fd = get_digital(esc, 'Fast digital channels', tr.nfd, self.num_s)
+        self.sd = get_digital(esc, 'Slow digital channels', tr.nsd, self.num_s)
+        self.fa, self.far = get_analogue(esc, 'Fast analogue array', tr.nfa, self.num_s)
+        self.sa, self.sar = get_analogue(esc, 'Slow analogue array', tr.nsa, self.num_s)
+
+    def copy(self):
+        """Return an independent copy of the arrays."""
+        c = sequenceTraces()
+        for key, val in self.__dict__.items():
+            setattr(c, key, val.copy() if isinstance(val, np.ndarray) else val)
+        return c
+
+    def durations(self):
+        """Return the time step lengths in ms."""
+        return self.lengths * self.units
+
+    def step_mask(self, timesteps=None, include_skipped=False):
+        """Boolean mask of the time steps to include in a trace."""
+        mask = np.zeros(self.num_s, dtype=bool)
+        mask[timesteps if timesteps is not None else slice(None)] = True
+        if not include_skipped:
+            mask &= ~self.skip
+        return mask
+
+    def get_traces(self, timesteps=None, include_skipped=False):
+        """Return the step traces of all channels as a dictionary of arrays.
+        Each time step contributes two points, at its start and end, so that
+        digital steps are square and analogue ramps are linear.
+        'times' -- shape (2*n,) time in ms from the start of the first step
+        'fd', 'sd', 'fa', 'sa' -- shape (nchan, 2*n)
+        Note: ramps go to the next time step even if that step is skipped."""
+        mask = self.step_mask(timesteps, include_skipped)
+        durations = self.durations()[mask]
+        ends = np.cumsum(durations)
+        times = np.empty(2*len(ends))
+        times[0::2] = ends - durations
+        times[1::2] = ends
+        traces = {'times': times}
+        for key, start, end in [['fd', self.fd, self.fd], ['sd', self.sd, self.sd],
+                ['fa', self.fa, ramp_ends(self.fa, self.far)],
+                ['sa', self.sa, ramp_ends(self.sa, self.sar)]]:
+            trace = np.empty((len(start), 2*len(ends)), dtype=start.dtype)
+            trace[:,0::2] = start[:,mask]
+            trace[:,1::2] = end[:,mask]
+            traces[key] = trace
+        return traces
+
+    def apply_multirun(self, mr_param, row):
+        """Return a copy of these traces with the values from a row of the
+        multirun array applied, in the same way as
+        multirun_widget.get_next_sequence edits the sequence. Note that
+        time step lengths are given in the time step's own unit."""
+        new = self.copy()
+        for col, val in enumerate(row):
+            try: val = float(val)
+            except ValueError: continue # non-float variable
+            steps = np.array(mr_param['Time step name'][col], dtype=int)
+            if mr_param['Type'][col] == 'Time step length':
+                new.lengths[steps] = val
+            elif mr_param['Type'][col] == 'Analogue voltage':
+                chans = np.array(mr_param['Analogue channel'][col], dtype=int)
+                arr = new.fa if 'Fast' in mr_param['Analogue type'][col] else new.sa
+                arr[np.ix_(chans, steps)] = val
+        return new
+
+def diff_traces(a, b, atol=1e-9):
+    """Compare two trace dictionaries made by sequenceTraces.get_traces.
+    Return a dictionary of the indices of the channels that differ.
+    If the timings differ then 'times' is True."""
+    diff = {'times': len(a['times']) != len(b['times']) or
+                not np.allclose(a['times'], b['times'], atol=atol)}
+    for key in ['fd', 'sd', 'fa', 'sa']:
+        if a[key].shape != b[key].shape:
+            diff[key] = np.arange(max(len(a[key]), len(b[key])))
+        elif a[key].dtype == bool:
+            diff[key] = np.flatnonzero((a[key] != b[key]).any(axis=1))
+        else:
+            diff[key] = np.flatnonzero((abs(a[key] - b[key]) > atol).any(axis=1))
+    return diff
+
+def multirun_traces(tr, mr_param, mr_vals, timesteps=None):
+    """Build the traces for each row of the multirun values array.
+    The sequence is only parsed once. Return a list of trace dictionaries."""
+    base = sequenceTraces(tr)
+    return [base.apply_multirun(mr_param, row).get_traces(timesteps) for row in mr_vals]
+
+#### #### benchmark against the per-timestep lookup #### ####
+
+def loop_traces(esc, nchan, key, num_s):
+    """Reference: look up each time step of each channel separately,
+    as in sequencePlotter's get_*_val functions."""
+    vals = []
+    for c in range(nchan):
+        for t in range(num_s):
+            e = esc[tdict[key]][t + c*num_s + 3]
+            if 'analogue' in key:
+                start = float(e[3][1].text)
+                end = float(esc[tdict[key]][t+1 + c*num_s + 3][3][1].text) if (
+                    BOOL(e[2][1].text) and t < num_s-1) else start
+            else:
+                start = end = BOOL(e[1].text)
+            vals.append([start, end])
+    return np.array(vals).reshape(nchan, 2*num_s)
+
+if __name__ == "__main__":
+    seqdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'SequenceFiles', 'testing')
+    tr = translate()
+    for fname in sorted(os.listdir(seqdir)):
+        tr.load_xml(os.path.join(seqdir, fname))
+        esc = tr.get_esc()
+        num_s = len(esc[tdict['Sequence header top']]) - 2
+        t0 = time.perf_counter()
+        ref = {key: loop_traces(esc, n, name, num_s) for key, n, name in [
+            ['fd', tr.nfd, 'Fast digital channels'], ['sd', tr.nsd, 'Slow digital channels'],
+            ['fa', tr.nfa, 'Fast analogue array'], ['sa', tr.nsa, 'Slow analogue array']]}
+        t1 = time.perf_counter()
+        st = sequenceTraces(tr)
+        traces = st.get_traces(include_skipped=True)
+        t2 = time.perf_counter()
+        match = all(np.array_equal(ref[key].astype(traces[key].dtype), traces[key]) for key in ref)
+        # compare multirun variants that change the first analogue channel
+        mr_param = {'Type':['Analogue voltage'], 'Time step name':[[0]], 
+            'Analogue type':['Fast analogue'], 'Analogue channel':[[0]]}
+        variants = multirun_traces(tr, mr_param, [['%s'%v] for v in np.linspace(0,1,20)])
+        t3 = time.perf_counter()
+        changed = diff_traces(variants[0], variants[-1])['fa']
+        print('%-40s %3s steps: loop %7.1f ms, arrays %6.1f ms, 20 variants %6.1f ms, match: %s, diff chans: %s'%(
+            fname, num_s, (t1-t0)*1e3, (t2-t1)*1e3, (t3-t2)*1e3, match, changed.tolist()))
@@ -0,0 +1,211 @@
+"""PyDex - per-shot timing trace
+
+ - Stamp the stages that each image passes through (acquisition, the
+   controller, ALEX, rearrangement upload, saving, MAIA) with its file ID
+   and image number, and a monotonic time in ns
+ - Stamps go into a fixed size ring of numpy arrays. Each stamp claims a
+   slot from an itertools counter, which is atomic under the GIL, so the
+   threads never wait on a lock and old stamps are overwritten
+ - The camera doesn't know the file ID, so it marks the acquisition time
+   and the controller tags the oldest mark with the ID when it receives
+   the image, since images arrive in order. Images that aren't traced
+   discard their mark, and the marks are cleared when images are redirected
+ - Export per-shot timelines and histograms of the latency of each stage
+   after acquisition
+
+Use the module-level TRACE:
+    from shottrace import TRACE
+    TRACE.stamp('saved', file_id, image_num)
+"""
+import os
+import time
+import itertools
+import threading
+import numpy as np
+from collections import deque
+
+class shotTrace:
+    """Bounded buffer of timestamps for each stage of each image.
+    size    -- number of stamps to keep before overwriting the oldest
+    enabled -- whether stamps are recorded. Disabled stamps return at once."""
+    def __init__(self, size=65536, enabled=True):
+        self.size = size
+        self.enabled = enabled
+        self.stages = [] # stage names in the order they were first stamped
+        self._codes = {} # stage name: index in self.stages
+        self._lock = threading.Lock() # only used to register a new stage
+        self.reset()
+
+    def reset(self):
+        """Remove all of the stamps."""
+        self.t = np.zeros(self.size, dtype=np.int64) # perf_counter_ns of each stamp, 0 is empty
+        self.stage = np.zeros(self.size, dtype=np.int16)
+        self.file_id = np.zeros(self.size, dtype=np.int64)
+        self.image = np.zeros(self.size, dtype=np.int16) # -1 for stamps of the whole shot
+        self._slot = itertools.count()
+        self._marks = {} # stage: deque of times waiting for an ID
+
+    def code(self, stage):
+        """The index of the stage name, registering it if it's new."""
+        try:
+            return self._codes[stage]
+        except KeyError:
+            with self._lock:
+                if stage not in self._codes:
+                    self.stages.append(stage)
+                    self._codes[stage] = len(self.stages) - 1
+            return self._codes[stage]
+
+    def stamp(self, stage, file_id, image=-1, t=None):
+        """Record that the image reached the stage at time t (ns from
+        time.perf_counter_ns, default now). image=-1 applies to the shot."""
+        if not self.enabled:
+            return
+        if t is None:
+            t = time.perf_counter_ns()
+        i = next(self._slot) % self.size
+        self.t[i] = 0 # mark the slot as being written
+        self.stage[i] = self.code(stage)
+        self.file_id[i] = file_id
+        self.image[i] = image
+        self.t[i] = t
+
+    def mark(self, stage):
+        """Record the time of a stage before the image has an ID."""
+        if self.enabled:
+            self._marks.setdefault(stage, deque(maxlen=1000)).append(time.perf_counter_ns())
+
+    def tag(self, stage, file_id, image=-1):
+        """Stamp the oldest time marked for the stage with the ID."""
+        try:
+            self.stamp(stage, file_id, image, self._marks[stage].popleft())
+        except (KeyError, IndexError): pass # nothing was marked
+
+    def discard(self, stage):
+        """Drop the oldest time marked for the stage, for an image that
+        isn't tagged, so that the next image is tagged with its own time."""
+        try:
+            self._marks[stage].popleft()
+        except (KeyError, IndexError): pass
+
+    def clear_marks(self):
+        """Drop all of the times waiting for an ID, e.g. when images are
+        sent somewhere else and the marks no longer match them."""
+        for marks in list(self._marks.values()):
+            marks.clear()
+
+    def records(self):
+        """Return arrays of (time in s, stage index, file ID, image) for
+        the stamps in the buffer, sorted by time."""
+        keep = np.flatnonzero(self.t)
+        order = keep[np.argsort(self.t[keep], kind='stable')]
+        return self.t[order]*1e-9, self.stage[order], self.file_id[order], self.image[order]
+
+    def timelines(self):
+        """Return a dict of {(file ID, image): {stage: time in s}}. Stamps
+        for the whole shot are added to the shot's first image."""
+        lines, shots = {}, {}
+        for t, s, f, im in zip(*self.records()):
+            if im < 0:
+                shots.setdefault(int(f), {})[self.stages[s]] = t
+            else:
+                lines.setdefault((int(f), int(im)), {})[self.stages[s]] = t
+        first = {} # file ID: (time, image) of the first image in the shot
+        for (f, im), line in lines.items():
+            first[f] = min(first.get(f, (np.inf, im)), (min(line.values()), im))
+        for f, stamps in shots.items():
+            line = lines.setdefault((f, first.get(f, (0, 0))[1]), {})
+            for stage, t in stamps.items():
+                line.setdefault(stage, t)
+        return lines
+
+    def latencies(self, start='acquire'):
+        """Return a dict of {stage: array of latencies in s after the
+        start stage}, for the images that have both stamps. If an image
+        doesn't have the start stage, its earliest stamp is used."""
+        lat = {}
+        for line in self.timelines().values():
+            t0 = line.get(start, min(line.values()))
+            for stage, t in line.items():
+                if stage != start:
+                    lat.setdefault(stage, []).append(t - t0)
+        return {stage: np.array(x) for stage, x in lat.items()}
+
+    def histograms(self, bins=50, start='acquire'):
+        """Return a dict of {stage: (counts, bin edges in ms)} of the
+        latency after the start stage."""
+        return {stage: np.histogram(x*1e3, bins=bins) for stage, x in self.latencies(start).items()}
+
+    def summary(self, start='acquire'):
+        """Return a string with the latency percentiles of each stage."""
+        out = 'Latency after %s (ms):\n'%start
+        for stage, x in self.latencies(start).items():
+            p50, p90, p99 = np.percentile(x*1e3, [50, 90, 99])
+            out += '    %-14s n = %-6s p50 %8.2f  p90 %8.2f  p99 %8.2f  max %8.2f\n'%(
+                stage, len(x), p50, p90, p99, x.max()*1e3)
+        return out
+
+    def export(self, directory='.', bins=50, start='acquire'):
+        """Save the timelines and histograms as csv files in directory.
+        The timelines have a row for each image and a column for each
+        stage, with times in ms after the image's first stamp.
+        Return the names of the files."""
+        lines = self.timelines()
+        stages = [s for s in self.stages if any(s in line for line in lines.values())]
+        fname = os.path.join(directory, 'trace_timelines.csv')
+        with open(fname, 'w') as f:
+            f.write(','.join(['File ID', 'Image'] + stages) + '\n')
+            for (file_id, image), line in sorted(lines.items()):
+                t0 = min(line.values())
+                f.write(','.join([str(file_id), str(image)] + ['%.3f'%((line[s] - t0)*1e3)
+                    if s in line else '' for s in stages]) + '\n')
+        hname = os.path.join(directory, 'trace_histograms.csv')
+        with open(hname, 'w') as f:
+            f.write('Stage,Bin start (ms),Bin end (ms),Count\n')
+            for stage, (counts, edges) in self.histograms(bins, start).items():
+                for c, lo, hi in zip(counts, edges[:-1], edges[1:]):
+                    f.write('%s,%.3f,%.3f,%s\n'%(stage, lo, hi, c))
+        return fname, hname
+
+TRACE = shotTrace() # shared by all of the modules in this process
+
+if __name__ == "__main__":
+    # cost of a stamp from several threads at once
+    trace = shotTrace(size=2**16)
+    n, threads = 100000, 4
+    def work(k):
+        for i in range(n):
+            trace.stamp('stage%s'%k, i, 0)
+    t0 = time.perf_counter()
+    ts = [threading.Thread(target=work, args=(k,)) for k in range(threads)]
+    [t.start() for t in ts]
+    [t.join() for t in ts]
+    dt = time.perf_counter() - t0
+    print('%s stamps from %s threads: %.2f us per stamp'%(n*threads, threads, dt/n/threads*1e6))
+    trace.enabled = False
+    t0 = time.perf_counter()
+    for i in range(n):
+        trace.stamp('stage0', i, 0)
+    print('disabled: %.3f us per stamp'%((time.perf_counter() - t0)/n*1e6))
+    # a simulated shot: acquisition is marked, then tagged with the ID
+    trace = shotTrace()
+    for shot in range(200):
+        for image in range(2):
+            trace.mark('acquire')
+            time.sleep(1e-4)
+            trace.tag('acquire', shot, image)
+            trace.stamp('saved', shot, image)
+        trace.stamp('rearr upload', shot)
+    print(trace.summary())
+    # images for the atom checker discard their marks, so the next
+    # traced image is tagged with its own acquisition time
+    trace.reset()
+    for i in range(3):
+        trace.mark('acquire')
+        trace.discard('acquire')
+    trace.mark('acquire') # taken while switching, never received
+    trace.clear_marks()
+    trace.mark('acquire')
+    t = trace._marks['acquire'][0]
+    trace.tag('acquire', 0, 0)
+    print('tagged with its own mark:', trace.records()[0][0] == t*1e-9)
@@ -4,8 +4,10 @@ Stefan Spence 13/04/20
 Collection of functions for converting types
 """
 import re
-from distutils.util import strtobool
+import sys
 import time
+import logging
+from distutils.util import strtobool
 
 def BOOL(x):
     """Fix the conversion from string to Boolean.
@@ -34,14 +36,22 @@ def listlist(text):
 
 
 #### custom logging functions
-def warning(msg=''):
-    print('\033[33m' + '####\tWARNING\t' + time.strftime('%d.%m.%Y\t%H:%M:%S'))
-    print('\t' + msg + '\n', '\033[m')
-
-def error(msg=''):
-    print('\033[31m' + '####\tERROR\t' + time.strftime('%d.%m.%Y\t%H:%M:%S'))
-    print('\t' + msg + '\n', '\033[m')
-
-def info(msg=''):
-    print('\033[36m' + '####\tINFO\t' + time.strftime('%d.%m.%Y\t%H:%M:%S'))
-    print('\t' + msg + '\n', '\033[m')
\ No newline at end of file
+# If logging has been set up (e.g. logerrs.setup_async_log) these send a
+# record to the logger of the calling module, otherwise they print.
+# Extra args are %-formatted into msg only if the message is shown.
+def _log(level, colour, msg, args):
+    logger = logging.getLogger(sys._getframe(2).f_globals.get('__name__', 'pydex'))
+    if logging.getLogger().handlers:
+        logger.log(level, msg, *args, stacklevel=3)
+    else:
+        print(colour + '####\t' + logging.getLevelName(level) + '\t' + time.strftime('%d.%m.%Y\t%H:%M:%S'))
+        print('\t' + (msg % args if args else msg) + '\n', '\033[m')
+
+def warning(msg='', *args):
+    _log(logging.WARNING, '\033[33m', msg, args)
+
+def error(msg='', *args):
+    _log(logging.ERROR, '\033[31m', msg, args)
+
+def info(msg='', *args):
+    _log(logging.INFO, '\033[36m', msg, args)